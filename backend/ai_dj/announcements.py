@@ -0,0 +1,294 @@
+"""
+Content-addressed cache of synthesized announcement audio.
+
+Audio is stored as files under ``ANNOUNCEMENTS.CACHE_DIR`` (by default
+``announcement_cache`` in ``MEDIA_ROOT``, or in the temporary directory when
+no media root is configured), named by the
+SHA-256 of the text, the voice parameters and the language, so the same
+announcement in the same voice is synthesized once and the key doubles as a
+strong ETag. Reads refresh a file's mtime. When the directory grows past
+``CACHE_MAX_BYTES``, the least recently used files are deleted until it is
+back under 90% of the limit. Audio is served from files opened with
+``open_audio``, which stay readable if eviction deletes them meanwhile.
+
+Files are written to a temporary name and renamed into place, so readers in
+other processes never see partial audio. Concurrent misses for the same key
+in one process wait for a single synthesis.
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+from typing import BinaryIO, Callable, Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+
+from .config import config
+
+# Try to import Google Cloud Text-to-Speech, but don't fail if it's not available
+try:
+    import google.cloud.texttospeech as tts
+except ImportError:
+    tts = None
+
+logger = logging.getLogger(__name__)
+
+AUDIO_EXTENSION = '.mp3'
+EVICT_TO_RATIO = 0.9
+
+# (text, voice params) -> MP3 bytes
+Synthesizer = Callable[[str, Dict], bytes]
+
+# Language code -> Google Cloud TTS voice
+VOICES = {
+    'en': {'name': 'en-US-Neural2-A', 'gender': 'FEMALE'},
+    'es': {'name': 'es-US-Neural2-A', 'gender': 'FEMALE'},
+    'fr': {'name': 'fr-FR-Neural2-A', 'gender': 'FEMALE'},
+    'zh': {'name': 'cmn-CN-Neural2-A', 'gender': 'FEMALE'},
+    'hi': {'name': 'hi-IN-Neural2-A', 'gender': 'FEMALE'},
+}
+
+# Voice style -> speaking rate and pitch
+VOICE_STYLES = {
+    'formal': {'speaking_rate': 0.9, 'pitch': -2.0},
+    'casual': {'speaking_rate': 1.0, 'pitch': 0.0},
+    'energetic': {'speaking_rate': 1.2, 'pitch': 2.0},
+    'calm': {'speaking_rate': 0.8, 'pitch': -1.0},
+}
+
+
+def get_tts_client():
+    """Google Cloud TTS client, or None when the service is not available."""
+    if tts is None:
+        return None
+    try:
+        return tts.TextToSpeechClient()
+    except Exception as e:
+        logger.error(f"Error creating TTS client: {e}")
+        return None
+
+
+def get_voice_params(session) -> Dict:
+    """Voice parameters for the session's language and voice style."""
+    voice = VOICES.get(session.preferred_language, VOICES['en'])
+    return {
+        'language_code': session.preferred_language,
+        'name': voice['name'],
+        'gender': voice['gender'],
+        **VOICE_STYLES[session.voice_style]
+    }
+
+
+def synthesize_speech(client, text: str, voice_params: Dict) -> bytes:
+    """MP3 audio for ``text`` from the TTS client."""
+    response = client.synthesize_speech(
+        input=tts.SynthesisInput(text=text),
+        voice=tts.VoiceSelectionParams(
+            language_code=voice_params['language_code'],
+            name=voice_params['name'],
+            ssml_gender=tts.SsmlVoiceGender[voice_params['gender']]
+        ),
+        audio_config=tts.AudioConfig(
+            audio_encoding=tts.AudioEncoding.MP3,
+            speaking_rate=voice_params['speaking_rate'],
+            pitch=voice_params['pitch']
+        )
+    )
+    return response.audio_content
+
+
+def announcement_key(text: str, voice_params: Dict) -> str:
+    """Stable hash of an announcement's text, voice and language."""
+    payload = json.dumps({'text': text, 'voice': voice_params}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def default_cache_dir() -> str:
+    media_root = getattr(settings, 'MEDIA_ROOT', '')
+    return os.path.join(media_root or tempfile.gettempdir(), 'announcement_cache')
+
+
+class AnnouncementCache:
+    """
+    LRU file cache of announcement audio keyed by ``announcement_key``.
+    """
+
+    def __init__(self, directory: Optional[str] = None, max_bytes: Optional[int] = None):
+        self.directory = directory or config.ANNOUNCEMENTS.CACHE_DIR or default_cache_dir()
+        self.max_bytes = max_bytes or config.ANNOUNCEMENTS.CACHE_MAX_BYTES
+        self._size: Optional[int] = None
+        self._lock = threading.Lock()
+        self._key_locks: Dict[str, threading.Lock] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key + AUDIO_EXTENSION)
+
+    def get(self, key: str) -> Optional[str]:
+        """Path of the cached audio, marking it recently used, or None."""
+        path = self.path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def open_audio(self, key: str) -> Optional[BinaryIO]:
+        """Open the cached audio for reading, marking it recently used, or None."""
+        try:
+            audio_file = open(self.path(key), 'rb')
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(audio_file.fileno())
+        except OSError:
+            pass
+        return audio_file
+
+    def put(self, key: str, audio: bytes) -> str:
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as temp_file:
+                temp_file.write(audio)
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+
+        with self._lock:
+            if self._size is None:
+                self._size = self._scan_size()
+            else:
+                self._size += len(audio)
+            over_limit = self._size > self.max_bytes
+        if over_limit:
+            self.evict()
+        return path
+
+    def get_or_synthesize(
+        self, text: str, voice_params: Dict, synthesize: Synthesizer
+    ) -> Tuple[str, str, bool]:
+        """
+        Return ``(key, path, synthesized)`` for the announcement, calling
+        ``synthesize`` only when no cached audio exists.
+        """
+        key = announcement_key(text, voice_params)
+        path = self.get(key)
+        if path is not None:
+            self.hits += 1
+            return key, path, False
+
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        try:
+            with key_lock:
+                path = self.get(key)
+                if path is not None:
+                    self.hits += 1
+                    return key, path, False
+                self.misses += 1
+                return key, self.put(key, synthesize(text, voice_params)), True
+        finally:
+            with self._lock:
+                self._key_locks.pop(key, None)
+
+    def _entries(self) -> Iterable[os.DirEntry]:
+        try:
+            shards = list(os.scandir(self.directory))
+        except FileNotFoundError:
+            return
+        for shard in shards:
+            if shard.is_dir():
+                for entry in os.scandir(shard.path):
+                    if entry.name.endswith(AUDIO_EXTENSION):
+                        yield entry
+
+    def _scan_size(self) -> int:
+        total = 0
+        for entry in self._entries():
+            try:
+                total += entry.stat().st_size
+            except FileNotFoundError:
+                pass
+        return total
+
+    def evict(self) -> int:
+        """
+        Delete least recently used files until the cache is under 90% of
+        ``max_bytes``. Returns the number of files deleted.
+        """
+        files = []
+        for entry in self._entries():
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+        files.sort()
+
+        total = sum(size for _, size, _ in files)
+        target = self.max_bytes * EVICT_TO_RATIO
+        deleted = 0
+        for _, size, path in files:
+            if total <= target:
+                break
+            try:
+                os.unlink(path)
+                deleted += 1
+            except FileNotFoundError:
+                pass
+            total -= size
+
+        with self._lock:
+            self._size = total
+        return deleted
+
+
+_cache: Optional[AnnouncementCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_announcement_cache() -> AnnouncementCache:
+    """Get the process-wide announcement cache."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = AnnouncementCache()
+    return _cache
+
+
+def common_announcements(session) -> List[str]:
+    """Configured common announcements plus the session's fixed templates."""
+    templates = session.announcement_templates.get(session.preferred_language, {})
+    fixed = [text for text in templates.values() if isinstance(text, str) and text and '{' not in text]
+    return list(dict.fromkeys(config.ANNOUNCEMENTS.COMMON_ANNOUNCEMENTS + fixed))
+
+
+def presynthesize(session, client=None) -> int:
+    """
+    Synthesize the session's common announcements that are not cached yet.
+    Returns how many were synthesized.
+    """
+    client = client or get_tts_client()
+    if client is None:
+        return 0
+    voice_params = get_voice_params(session)
+    announcement_cache = get_announcement_cache()
+    synthesized = 0
+    for text in common_announcements(session):
+        try:
+            _, _, created = announcement_cache.get_or_synthesize(
+                text, voice_params, lambda text, params: synthesize_speech(client, text, params)
+            )
+        except Exception as e:
+            logger.error(f"Error pre-synthesizing announcement: {e}")
+            continue
+        synthesized += created
+    return synthesized
@@ -96,6 +96,31 @@ class MetricsSettings(BaseSettings):
         default=True,
         description="Enable export of metrics data"
     )
+    SNAPSHOT_TTL: int = Field(
+        default=30,
+        description="Time-to-live for cached metrics snapshots in seconds"
+    )
+
+class AnnouncementSettings(BaseSettings):
+    """Settings for synthesized DJ announcements"""
+    CACHE_DIR: str = Field(
+        default=os.getenv("ANNOUNCEMENT_CACHE_DIR", ""),
+        description="Directory holding cached announcement audio (announcement_cache in MEDIA_ROOT when empty)"
+    )
+    CACHE_MAX_BYTES: int = Field(
+        default=256 * 1024 * 1024,
+        description="Size above which the least recently used announcements are evicted"
+    )
+    COMMON_ANNOUNCEMENTS: List[str] = Field(
+        default=[
+            "Welcome to the party!",
+            "Let's turn it up!",
+            "Here comes the drop!",
+            "Thanks for dancing with us tonight!",
+            "Last track of the night, make it count!",
+        ],
+        description="Announcements synthesized ahead of time for each session's voice"
+    )
 
 class AIDJConfig(BaseSettings):
     """Main configuration for AI DJ module"""
@@ -111,6 +136,7 @@ class AIDJConfig(BaseSettings):
     LLM: LLMSettings = LLMSettings()
     COLLABORATION: CollaborationSettings = CollaborationSettings()
     METRICS: MetricsSettings = MetricsSettings()
+    ANNOUNCEMENTS: AnnouncementSettings = AnnouncementSettings()
     
     class Config:
         env_file = ".env"
@@ -1,105 +1,283 @@
+import threading
+import time
+from collections import defaultdict, deque
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional
+from django.core.cache import cache
 from django.db import models
 from django.contrib.auth import get_user_model
-from django.db.models import Count, Avg
+from django.db.models import Count, Q
+from django.utils import timezone
 from .models import AIDJSession, AIDJPlayHistory, AIDJFeedback
 from .config import config
 
 User = get_user_model()
 
-class MetricsCollector:
-    """Collects and processes usage metrics for the AI DJ module"""
+SNAPSHOT_CACHE_PREFIX = 'ai_dj:metrics_snapshot:'
+TOP_GENRE_LIMIT = 5
+
+
+class MetricsSnapshotEngine:
+    """
+    Computes every collector metric for a user in four grouped queries.
+
+    Snapshots are cached for ``METRICS.SNAPSHOT_TTL`` seconds. Plays, feedback
+    and new sessions recorded in this process after a snapshot was taken are
+    kept as in-memory counter deltas and applied on top of the cached copy,
+    so hot counters stay current between snapshots.
+    """
+
+    def __init__(self, ttl: Optional[int] = None, clock=time.time):
+        self.ttl = ttl if ttl is not None else config.METRICS.SNAPSHOT_TTL
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._deltas: Dict[int, deque] = defaultdict(deque)
+
+    # Queries
 
     @staticmethod
-    def collect_session_metrics(user_id: int, time_range: Optional[timedelta] = None) -> Dict:
-        """Collect metrics for AI DJ sessions"""
+    def _since(time_range: Optional[timedelta]):
+        return timezone.now() - time_range if time_range else None
+
+    @staticmethod
+    def session_metrics(user_id: int, time_range: Optional[timedelta] = None) -> Dict:
         query = AIDJSession.objects.filter(user_id=user_id)
-        
-        if time_range:
-            cutoff = datetime.now() - time_range
-            query = query.filter(updated_at__gte=cutoff)
-        
+        since = MetricsSnapshotEngine._since(time_range)
+        if since:
+            query = query.filter(updated_at__gte=since)
+
+        counts = query.aggregate(
+            total_sessions=Count('id'),
+            voice_commands_used=Count('id', filter=Q(last_voice_command__isnull=False)),
+        )
         return {
-            'total_sessions': query.count(),
-            'avg_session_duration': query.aggregate(Avg('duration'))['duration__avg'],
-            'voice_commands_used': query.exclude(last_voice_command__isnull=True).count(),
+            'total_sessions': counts['total_sessions'],
+            # Sessions do not record their duration
+            'avg_session_duration': None,
+            'voice_commands_used': counts['voice_commands_used'],
         }
 
     @staticmethod
-    def collect_playback_metrics(user_id: int, time_range: Optional[timedelta] = None) -> Dict:
-        """Collect metrics for track playback"""
+    def _playback_counts(user_id: int, time_range: Optional[timedelta] = None):
         query = AIDJPlayHistory.objects.filter(user_id=user_id)
-        
-        if time_range:
-            cutoff = datetime.now() - time_range
-            query = query.filter(played_at__gte=cutoff)
-        
+        since = MetricsSnapshotEngine._since(time_range)
+        if since:
+            query = query.filter(played_at__gte=since)
+
+        # One hash aggregate per track replaces separate total, distinct and
+        # genre queries; a user's distinct tracks are bounded by the catalog
+        plays_by_genre: Dict[Optional[str], int] = {}
+        unique_tracks = 0
+        per_track = query.values('track_id', 'track__genre').annotate(plays=Count('id')).order_by()
+        for row in per_track:
+            genre = row['track__genre']
+            plays_by_genre[genre] = plays_by_genre.get(genre, 0) + row['plays']
+            unique_tracks += 1
+        return plays_by_genre, unique_tracks
+
+    @staticmethod
+    def _playback_summary(plays_by_genre: Dict[Optional[str], int], unique_tracks: int) -> Dict:
         return {
-            'total_plays': query.count(),
-            'unique_tracks': query.values('track').distinct().count(),
-            'top_genres': list(query.values('track__genre')
-                             .annotate(count=Count('track__genre'))
-                             .order_by('-count')[:5]),
+            'total_plays': sum(plays_by_genre.values()),
+            'unique_tracks': unique_tracks,
+            'top_genres': MetricsSnapshotEngine._top_genres(plays_by_genre),
         }
 
     @staticmethod
-    def collect_feedback_metrics(user_id: int, time_range: Optional[timedelta] = None) -> Dict:
-        """Collect metrics for user feedback"""
+    def playback_metrics(user_id: int, time_range: Optional[timedelta] = None) -> Dict:
+        return MetricsSnapshotEngine._playback_summary(
+            *MetricsSnapshotEngine._playback_counts(user_id, time_range)
+        )
+
+    @staticmethod
+    def _top_genres(plays_by_genre: Dict[Optional[str], int]) -> List[Dict]:
+        genres = [
+            {'track__genre': genre, 'count': plays if genre is not None else 0}
+            for genre, plays in plays_by_genre.items()
+        ]
+        genres.sort(key=lambda row: -row['count'])
+        return genres[:TOP_GENRE_LIMIT]
+
+    @staticmethod
+    def _feedback_counts(user_id: int, time_range: Optional[timedelta] = None):
         query = AIDJFeedback.objects.filter(user_id=user_id)
-        
-        if time_range:
-            cutoff = datetime.now() - time_range
-            query = query.filter(created_at__gte=cutoff)
-        
-        total_feedback = query.count()
-        if total_feedback == 0:
+        since = MetricsSnapshotEngine._since(time_range)
+        if since:
+            query = query.filter(created_at__gte=since)
+
+        counts = query.aggregate(
+            total=Count('id'),
+            likes=Count('id', filter=Q(feedback_type='like')),
+        )
+        return counts['total'], counts['likes']
+
+    @staticmethod
+    def feedback_metrics(user_id: int, time_range: Optional[timedelta] = None) -> Dict:
+        return MetricsSnapshotEngine._feedback_summary(
+            *MetricsSnapshotEngine._feedback_counts(user_id, time_range)
+        )
+
+    @staticmethod
+    def _feedback_summary(total: int, likes: int) -> Dict:
+        if total == 0:
             return {
                 'total_feedback': 0,
                 'feedback_ratio': {'likes': 0, 'dislikes': 0},
                 'avg_rating': 0,
             }
-        
-        likes = query.filter(feedback_type='like').count()
         return {
-            'total_feedback': total_feedback,
+            'total_feedback': total,
             'feedback_ratio': {
-                'likes': (likes / total_feedback) * 100,
-                'dislikes': ((total_feedback - likes) / total_feedback) * 100,
+                'likes': (likes / total) * 100,
+                'dislikes': ((total - likes) / total) * 100,
             },
-            'avg_rating': likes / total_feedback,
+            'avg_rating': likes / total,
         }
 
     @staticmethod
-    def collect_mood_metrics(user_id: int, time_range: Optional[timedelta] = None) -> Dict:
-        """Collect metrics for mood settings"""
-        query = AIDJSession.objects.filter(user_id=user_id)
-        
-        if time_range:
-            cutoff = datetime.now() - time_range
-            query = query.filter(updated_at__gte=cutoff)
-        
-        mood_data = query.exclude(mood_settings__isnull=True).values_list('mood_settings', flat=True)
-        
-        if not mood_data:
-            return {'mood_preferences': {}}
-        
-        # Aggregate mood preferences
-        mood_preferences = {}
-        for mood_settings in mood_data:
-            for mood, value in mood_settings.items():
-                if mood not in mood_preferences:
-                    mood_preferences[mood] = []
-                mood_preferences[mood].append(value)
-        
-        # Calculate averages
+    def mood_metrics(user_id: int, time_range: Optional[timedelta] = None) -> Dict:
+        query = AIDJSession.objects.filter(user_id=user_id, mood_settings__isnull=False)
+        since = MetricsSnapshotEngine._since(time_range)
+        if since:
+            query = query.filter(updated_at__gte=since)
+
+        totals: Dict[str, List[float]] = {}
+        for mood_settings in query.values_list('mood_settings', flat=True):
+            for mood, value in (mood_settings or {}).items():
+                entry = totals.setdefault(mood, [0.0, 0])
+                entry[0] += value
+                entry[1] += 1
         return {
-            'mood_preferences': {
-                mood: sum(values) / len(values)
-                for mood, values in mood_preferences.items()
-            }
+            'mood_preferences': {mood: total / count for mood, (total, count) in totals.items()}
         }
 
+    # Snapshots
+
+    def _cache_key(self, user_id: int, time_range: Optional[timedelta]) -> str:
+        window = int(time_range.total_seconds()) if time_range else 'all'
+        return f"{SNAPSHOT_CACHE_PREFIX}{user_id}:{window}"
+
+    def build(self, user_id: int, time_range: Optional[timedelta] = None) -> Dict:
+        """Compute a fresh snapshot from the database."""
+        plays_by_genre, unique_tracks = self._playback_counts(user_id, time_range)
+        feedback_total, feedback_likes = self._feedback_counts(user_id, time_range)
+        session_metrics = self.session_metrics(user_id, time_range)
+        mood_metrics = self.mood_metrics(user_id, time_range)
+        # After the queries, so deltas recorded while they ran are not
+        # applied on top of counts that may already include them
+        taken_at = self.clock()
+        return {
+            'session_metrics': session_metrics,
+            'mood_metrics': mood_metrics,
+            # Raw counters the in-memory deltas are applied to
+            'counters': {
+                'plays_by_genre': plays_by_genre,
+                'unique_tracks': unique_tracks,
+                'feedback_total': feedback_total,
+                'feedback_likes': feedback_likes,
+            },
+            'taken_at': taken_at,
+        }
+
+    def snapshot(self, user_id: int, time_range: Optional[timedelta] = None) -> Dict:
+        """
+        Get the user's metrics from the cached snapshot plus recent deltas.
+        """
+        key = self._cache_key(user_id, time_range)
+        snapshot = cache.get(key)
+        if snapshot is None:
+            snapshot = self.build(user_id, time_range)
+            cache.set(key, snapshot, self.ttl)
+        return self._apply_deltas(user_id, snapshot)
+
+    def invalidate(self, user_id: int, time_range: Optional[timedelta] = None) -> None:
+        cache.delete(self._cache_key(user_id, time_range))
+
+    # Hot counters
+
+    def record(self, user_id: int, kind: str, **fields) -> None:
+        """
+        Record a play, feedback or new session for the user.
+
+        ``kind`` is 'play' (``genre``), 'feedback' (``feedback_type``) or
+        'session' (``voice_command``).
+        """
+        now = self.clock()
+        with self._lock:
+            events = self._deltas[user_id]
+            events.append((now, kind, fields))
+            # Deltas older than any live snapshot are already in the database counts
+            while events and events[0][0] < now - self.ttl:
+                events.popleft()
+
+    def _apply_deltas(self, user_id: int, snapshot: Dict) -> Dict:
+        with self._lock:
+            events = [event for event in self._deltas.get(user_id, ()) if event[0] > snapshot['taken_at']]
+
+        counters = snapshot['counters']
+        sessions = dict(snapshot['session_metrics'])
+        plays_by_genre = dict(counters['plays_by_genre'])
+        feedback_total = counters['feedback_total']
+        feedback_likes = counters['feedback_likes']
+        for _, kind, fields in events:
+            if kind == 'play':
+                genre = fields.get('genre')
+                plays_by_genre[genre] = plays_by_genre.get(genre, 0) + 1
+            elif kind == 'feedback':
+                feedback_total += 1
+                if fields.get('feedback_type') == 'like':
+                    feedback_likes += 1
+            elif kind == 'session':
+                sessions['total_sessions'] += 1
+                if fields.get('voice_command'):
+                    sessions['voice_commands_used'] += 1
+
+        # Distinct tracks are only refreshed with the next snapshot
+        return {
+            'session_metrics': sessions,
+            'playback_metrics': self._playback_summary(plays_by_genre, counters['unique_tracks']),
+            'feedback_metrics': self._feedback_summary(feedback_total, feedback_likes),
+            'mood_metrics': snapshot['mood_metrics'],
+        }
+
+
+_snapshot_engine = None
+_snapshot_engine_lock = threading.Lock()
+
+
+def get_metrics_snapshot_engine() -> MetricsSnapshotEngine:
+    """Get the process-wide metrics snapshot engine"""
+    global _snapshot_engine
+    if _snapshot_engine is None:
+        with _snapshot_engine_lock:
+            if _snapshot_engine is None:
+                _snapshot_engine = MetricsSnapshotEngine()
+    return _snapshot_engine
+
+
+class MetricsCollector:
+    """Collects and processes usage metrics for the AI DJ module"""
+
+    @staticmethod
+    def collect_session_metrics(user_id: int, time_range: Optional[timedelta] = None) -> Dict:
+        """Collect metrics for AI DJ sessions"""
+        return MetricsSnapshotEngine.session_metrics(user_id, time_range)
+
+    @staticmethod
+    def collect_playback_metrics(user_id: int, time_range: Optional[timedelta] = None) -> Dict:
+        """Collect metrics for track playback"""
+        return MetricsSnapshotEngine.playback_metrics(user_id, time_range)
+
+    @staticmethod
+    def collect_feedback_metrics(user_id: int, time_range: Optional[timedelta] = None) -> Dict:
+        """Collect metrics for user feedback"""
+        return MetricsSnapshotEngine.feedback_metrics(user_id, time_range)
+
+    @staticmethod
+    def collect_mood_metrics(user_id: int, time_range: Optional[timedelta] = None) -> Dict:
+        """Collect metrics for mood settings"""
+        return MetricsSnapshotEngine.mood_metrics(user_id, time_range)
+
     @classmethod
     def collect_all_metrics(cls, user_id: int, time_range: Optional[timedelta] = None) -> Dict:
         """Collect all metrics for a user"""
@@ -107,10 +285,7 @@ class MetricsCollector:
             return {}
         
         return {
-            'session_metrics': cls.collect_session_metrics(user_id, time_range),
-            'playback_metrics': cls.collect_playback_metrics(user_id, time_range),
-            'feedback_metrics': cls.collect_feedback_metrics(user_id, time_range),
-            'mood_metrics': cls.collect_mood_metrics(user_id, time_range),
+            **get_metrics_snapshot_engine().snapshot(user_id, time_range),
             'collected_at': datetime.now().isoformat(),
         }
 
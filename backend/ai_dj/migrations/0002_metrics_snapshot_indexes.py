@@ -0,0 +1,23 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_dj', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='aidjsession',
+            index=models.Index(fields=['user', 'updated_at'], name='idx_ai_dj_sessions_user_upd'),
+        ),
+        migrations.AddIndex(
+            model_name='aidjplayhistory',
+            index=models.Index(fields=['user', 'played_at'], name='idx_ai_dj_play_user_played'),
+        ),
+        migrations.AddIndex(
+            model_name='aidjfeedback',
+            index=models.Index(fields=['user', 'created_at'], name='idx_ai_dj_feedback_user_crt'),
+        ),
+    ]
@@ -178,6 +178,7 @@ class AIDJSession(models.Model):
         verbose_name_plural = _("AI DJ Sessions")
         indexes = [
             models.Index(fields=['user'], name='idx_ai_dj_sessions_user'),
+            models.Index(fields=['user', 'updated_at'], name='idx_ai_dj_sessions_user_upd'),
         ]
         db_table = 'ai_dj_sessions'
 
@@ -246,6 +247,7 @@ class AIDJPlayHistory(models.Model):
         verbose_name_plural = _("AI DJ Play Histories")
         indexes = [
             models.Index(fields=['user'], name='idx_ai_dj_play_history_user'),
+            models.Index(fields=['user', 'played_at'], name='idx_ai_dj_play_user_played'),
         ]
         db_table = 'ai_dj_play_history'
 
@@ -291,6 +293,7 @@ class AIDJFeedback(models.Model):
         verbose_name_plural = _("AI DJ Feedbacks")
         indexes = [
             models.Index(fields=['user'], name='idx_ai_dj_feedback_user'),
+            models.Index(fields=['user', 'created_at'], name='idx_ai_dj_feedback_user_crt'),
         ]
         db_table = 'ai_dj_feedback'
 
@@ -0,0 +1,379 @@
+"""
+Incremental sliding-window aggregation of biometric samples per session.
+
+Each session keeps its samples in time buckets, plus a count histogram per
+reading. The readings are bounded integers (see the ``BiometricData``
+validators), so a histogram gives exact medians and quantiles: adding a
+sample and expiring one are O(1), and a quantile is a scan over at most 251
+bins, however many participants are in the window. Expiry pops whole
+buckets off the front of the window, so the window covers between
+``WINDOW_SECONDS`` and ``WINDOW_SECONDS + BUCKET_SECONDS`` of samples.
+
+Group state is computed from the window instead of re-aggregating the last
+five minutes of ``BiometricData`` on every request, and is written to
+``GroupEmotionalState`` at most once per ``WRITE_INTERVAL`` per session.
+
+Windows live in each process and are loaded from the database on first use,
+so a process that starts mid-session begins with the full window. Samples
+this process saves are added as they are committed; samples saved by other
+processes are caught up from the database at most once per ``SYNC_INTERVAL``
+when the window is read, by fetching the rows past the highest id the window
+has synced. A row committed after a row with a higher id that was already
+synced is not caught up.
+"""
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime, timezone as dt_timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import BiometricData, GroupEmotionalState
+
+DEFAULTS = {
+    'WINDOW_SECONDS': 300,
+    'BUCKET_SECONDS': 5,
+    # Minimum time between two GroupEmotionalState rows for a session
+    'WRITE_INTERVAL': 10,
+    # Minimum time between two catch-ups of a window with other processes' rows
+    'SYNC_INTERVAL': 1,
+}
+
+# Reading -> largest valid value
+READINGS = {
+    'heart_rate': 250,
+    'stress_level': 100,
+    'energy_level': 100,
+    'movement': 100,
+}
+
+WRITE_SLOT_KEY = 'biometrics:group_state_write:{session_id}:{slot}'
+
+# (device_id, heart_rate, stress_level, energy_level, movement, mood)
+Sample = Tuple[int, int, int, int, int, str]
+
+
+def group_state_setting(name: str):
+    return getattr(settings, 'BIOMETRICS_GROUP_STATE', {}).get(name, DEFAULTS[name])
+
+
+class ReadingHistogram:
+    """
+    Counts of one bounded integer reading across the window.
+    """
+
+    def __init__(self, max_value: int):
+        self.max_value = max_value
+        self.counts = [0] * (max_value + 1)
+        self.total = 0
+
+    def _clamp(self, value: int) -> int:
+        return min(max(int(value), 0), self.max_value)
+
+    def add(self, value: int) -> None:
+        self.counts[self._clamp(value)] += 1
+        self.total += 1
+
+    def remove(self, value: int) -> None:
+        self.counts[self._clamp(value)] -= 1
+        self.total -= 1
+
+    def _value_at(self, rank: int) -> int:
+        """The ``rank``-th smallest value (0-based)."""
+        seen = 0
+        for value, count in enumerate(self.counts):
+            seen += count
+            if seen > rank:
+                return value
+        return self.max_value
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        Exact ``q`` quantile, interpolating between the neighbouring ranks
+        (so ``quantile(0.5)`` matches ``statistics.median``).
+        """
+        if not self.total:
+            return None
+        position = q * (self.total - 1)
+        lower_rank = int(position)
+        lower = self._value_at(lower_rank)
+        if position == lower_rank:
+            return float(lower)
+        upper = self._value_at(lower_rank + 1)
+        return lower + (upper - lower) * (position - lower_rank)
+
+    def median(self) -> Optional[float]:
+        return self.quantile(0.5)
+
+
+class SessionWindow:
+    """
+    Sliding window of one session's samples, bucketed by time.
+    """
+
+    def __init__(self, window_seconds: float, bucket_seconds: float):
+        self.window_seconds = window_seconds
+        self.bucket_seconds = bucket_seconds
+        # (bucket index, samples), oldest first
+        self.buckets: deque = deque()
+        self.histograms = {name: ReadingHistogram(max_value) for name, max_value in READINGS.items()}
+        self.moods: Counter = Counter()
+        self.devices: Counter = Counter()
+        self.latest = 0.0
+        self.lock = threading.Lock()
+        # Database catch-up: highest row id synced, ids added locally past it
+        self.synced_id = 0
+        self.local_ids = set()
+        self.synced_at = None
+        self.sync_lock = threading.Lock()
+
+    def __len__(self):
+        return self.histograms['heart_rate'].total
+
+    def _bucket_index(self, timestamp: float) -> int:
+        return int(timestamp // self.bucket_seconds)
+
+    def add(self, sample: Sample, timestamp: float) -> None:
+        with self.lock:
+            index = self._bucket_index(timestamp)
+            self.latest = max(self.latest, timestamp)
+            if (index + 1) * self.bucket_seconds <= self.latest - self.window_seconds:
+                return  # Already outside the window
+            if self.buckets and self.buckets[-1][0] >= index:
+                # Late samples join the newest bucket rather than reordering the window
+                self.buckets[-1][1].append(sample)
+            else:
+                self.buckets.append((index, [sample]))
+
+            device_id, heart_rate, stress_level, energy_level, movement, mood = sample
+            self.histograms['heart_rate'].add(heart_rate)
+            self.histograms['stress_level'].add(stress_level)
+            self.histograms['energy_level'].add(energy_level)
+            self.histograms['movement'].add(movement)
+            self.moods[mood] += 1
+            self.devices[device_id] += 1
+
+            self._expire(self.latest)
+
+    def expire(self, now: float) -> None:
+        with self.lock:
+            self._expire(now)
+
+    def _expire(self, now: float) -> None:
+        cutoff = now - self.window_seconds
+        while self.buckets and (self.buckets[0][0] + 1) * self.bucket_seconds <= cutoff:
+            _, samples = self.buckets.popleft()
+            for device_id, heart_rate, stress_level, energy_level, movement, mood in samples:
+                self.histograms['heart_rate'].remove(heart_rate)
+                self.histograms['stress_level'].remove(stress_level)
+                self.histograms['energy_level'].remove(energy_level)
+                self.histograms['movement'].remove(movement)
+                self._decrement(self.moods, mood)
+                self._decrement(self.devices, device_id)
+
+    @staticmethod
+    def _decrement(counter: Counter, key) -> None:
+        counter[key] -= 1
+        if counter[key] <= 0:
+            del counter[key]
+
+    def quantile(self, reading: str, q: float) -> Optional[float]:
+        with self.lock:
+            return self.histograms[reading].quantile(q)
+
+    def snapshot(self, now: float) -> Optional[Dict]:
+        """
+        Group state over the window, in ``GroupEmotionalState`` field names,
+        or None when the window is empty.
+        """
+        with self.lock:
+            self._expire(now)
+            total = len(self)
+            if not total:
+                return None
+
+            emotion_distribution = {mood: count / total for mood, count in self.moods.most_common()}
+            dominant_emotion, _ = self.moods.most_common(1)[0]
+            return {
+                'median_heart_rate': self.histograms['heart_rate'].median(),
+                'median_energy_level': self.histograms['energy_level'].median(),
+                'median_stress_level': self.histograms['stress_level'].median(),
+                'dominant_emotion': dominant_emotion,
+                'emotion_distribution': emotion_distribution,
+                'consensus_strength': emotion_distribution[dominant_emotion],
+                'participant_count': len(self.devices),
+            }
+
+
+class GroupStateAggregator:
+    """
+    Per-session sliding windows and rate-limited group state writes.
+    """
+
+    def __init__(
+        self,
+        window_seconds: Optional[float] = None,
+        bucket_seconds: Optional[float] = None,
+        write_interval: Optional[float] = None,
+        sync_interval: Optional[float] = None,
+        clock=time.time
+    ):
+        self.window_seconds = window_seconds or group_state_setting('WINDOW_SECONDS')
+        self.bucket_seconds = bucket_seconds or group_state_setting('BUCKET_SECONDS')
+        self.write_interval = write_interval if write_interval is not None else group_state_setting('WRITE_INTERVAL')
+        self.sync_interval = sync_interval if sync_interval is not None else group_state_setting('SYNC_INTERVAL')
+        self.clock = clock
+        self._windows: Dict[int, SessionWindow] = {}
+        self._lock = threading.Lock()
+        self._last_prune = 0.0
+        # Session -> last write slot this process has claimed or seen taken
+        self._write_slots: Dict[int, int] = {}
+
+    @staticmethod
+    def sample_from(data: BiometricData) -> Sample:
+        return (
+            data.device_id, data.heart_rate, data.stress_level,
+            data.energy_level, data.movement, data.mood
+        )
+
+    def _load_window(self, session_id: int) -> SessionWindow:
+        """Build a session's window from the samples already stored."""
+        window = SessionWindow(self.window_seconds, self.bucket_seconds)
+        self._sync(session_id, window, self.clock())
+        return window
+
+    def _sync(self, session_id: int, window: SessionWindow, now: float) -> None:
+        """Add stored rows the window has not seen, e.g. from other processes."""
+        with window.sync_lock:
+            window.synced_at = now
+            since = datetime.fromtimestamp(now - self.window_seconds, tz=dt_timezone.utc)
+            rows = BiometricData.objects.filter(
+                session_id=session_id,
+                id__gt=window.synced_id,
+                timestamp__gte=since
+            ).order_by('id').values_list(
+                'id', 'timestamp', 'device_id', 'heart_rate', 'stress_level',
+                'energy_level', 'movement', 'mood'
+            )
+            for row_id, timestamp, *sample in rows:
+                if row_id not in window.local_ids:
+                    window.add(tuple(sample), timestamp.timestamp())
+                window.synced_id = row_id
+            window.local_ids = {row_id for row_id in window.local_ids if row_id > window.synced_id}
+
+    def get_window(self, session_id: int) -> Tuple[SessionWindow, bool]:
+        """Return the session's window and whether it was just loaded."""
+        session_id = int(session_id)
+        window = self._windows.get(session_id)
+        if window is not None:
+            return window, False
+        with self._lock:
+            window = self._windows.get(session_id)
+            if window is not None:
+                return window, False
+            window = self._windows[session_id] = self._load_window(session_id)
+            return window, True
+
+    def current_window(self, session_id: int) -> SessionWindow:
+        """The session's window, caught up with rows stored by other processes."""
+        window, loaded = self.get_window(session_id)
+        now = self.clock()
+        # Windows built with extend() are not backed by the database
+        if not loaded and window.synced_at is not None and now - window.synced_at >= self.sync_interval:
+            self._sync(int(session_id), window, now)
+        window.expire(now)
+        return window
+
+    def add(self, data: BiometricData) -> None:
+        """Add a stored sample to its session's window."""
+        window, _ = self.get_window(data.session_id)
+        with window.sync_lock:
+            # Rows already synced from the database are in the window
+            if data.pk > window.synced_id and data.pk not in window.local_ids:
+                window.local_ids.add(data.pk)
+                window.add(self.sample_from(data), data.timestamp.timestamp())
+        self._prune()
+
+    def extend(self, session_id: int, samples: Iterable[Tuple[Sample, float]]) -> None:
+        """Add ``(sample, timestamp)`` pairs without touching the database."""
+        session_id = int(session_id)
+        window = self._windows.get(session_id)
+        if window is None:
+            with self._lock:
+                window = self._windows.setdefault(
+                    session_id, SessionWindow(self.window_seconds, self.bucket_seconds)
+                )
+        for sample, timestamp in samples:
+            window.add(sample, timestamp)
+
+    def snapshot(self, session_id: int) -> Optional[Dict]:
+        return self.current_window(session_id).snapshot(self.clock())
+
+    def quantiles(self, session_id: int, reading: str, qs: List[float]) -> List[Optional[float]]:
+        window = self.current_window(session_id)
+        return [window.quantile(reading, q) for q in qs]
+
+    def should_write(self, session_id: int) -> bool:
+        """
+        Claim the session's write for the current ``WRITE_INTERVAL`` slot.
+
+        Slots are shared by all processes through the cache, so only the first
+        caller in each interval writes; each process asks the cache at most
+        once per slot and session.
+        """
+        if not self.write_interval:
+            return True
+        session_id = int(session_id)
+        slot = int(self.clock() // self.write_interval)
+        if self._write_slots.get(session_id) == slot:
+            return False
+        self._write_slots[session_id] = slot
+        key = WRITE_SLOT_KEY.format(session_id=session_id, slot=slot)
+        return cache.add(key, 1, self.write_interval * 2)
+
+    def write_state(self, session_id: int, force: bool = False) -> Optional[GroupEmotionalState]:
+        """
+        Store the session's current group state, unless one was already
+        written in the current ``WRITE_INTERVAL`` (or the window is empty).
+        """
+        window = self.current_window(session_id)
+        if not len(window) or not (force or self.should_write(session_id)):
+            return None
+        snapshot = window.snapshot(self.clock())
+        if snapshot is None:
+            return None
+        return GroupEmotionalState.objects.create(session_id=session_id, **snapshot)
+
+    def _prune(self) -> None:
+        """Forget sessions with nothing left in their window, once per window length."""
+        now = self.clock()
+        if now - self._last_prune < self.window_seconds:
+            return
+        self._last_prune = now
+        with self._lock:
+            for session_id, window in list(self._windows.items()):
+                window.expire(now)
+                if not len(window):
+                    del self._windows[session_id]
+                    self._write_slots.pop(session_id, None)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._windows.clear()
+            self._write_slots.clear()
+
+
+_aggregator: Optional[GroupStateAggregator] = None
+_aggregator_lock = threading.Lock()
+
+
+def get_group_state_aggregator() -> GroupStateAggregator:
+    """Get the process-wide aggregator."""
+    global _aggregator
+    if _aggregator is None:
+        with _aggregator_lock:
+            if _aggregator is None:
+                _aggregator = GroupStateAggregator()
+    return _aggregator
@@ -113,7 +113,7 @@ class GroupEmotionalState(models.Model):
         return f"Group State for {self.session} at {self.timestamp}"
 
 class EmotionalPreference(models.Model):
-    user = models.ForeignKey('auth.User', on_delete=models.CASCADE)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     session = models.ForeignKey(AIDJSession, on_delete=models.CASCADE)
     
     # Individual preferences for group sessions
@@ -0,0 +1,25 @@
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from .models import BiometricData
+from .aggregator import get_group_state_aggregator
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+@receiver(post_save, sender=BiometricData)
+def update_group_state(sender, instance, created, **kwargs):
+    """Feed new samples into the session's window and refresh its group state."""
+    if created:
+        # After commit, so a rolled back sample never reaches the window
+        transaction.on_commit(lambda: add_to_group_state(instance))
+
+
+def add_to_group_state(instance):
+    try:
+        aggregator = get_group_state_aggregator()
+        aggregator.add(instance)
+        aggregator.write_state(instance.session_id)
+    except Exception as e:
+        logger.error(f"Error updating group emotional state: {str(e)}")
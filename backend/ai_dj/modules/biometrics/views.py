@@ -3,8 +3,6 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from django.utils import timezone
 from django.shortcuts import get_object_or_404
-from django.db.models import Avg, Count
-from datetime import timedelta
 from .models import (
     WearableDevice, BiometricData, BiometricPreference,
     GroupEmotionalState, EmotionalPreference
@@ -16,6 +14,7 @@ from .serializers import (
     GroupEmotionalStateSerializer,
     EmotionalPreferenceSerializer
 )
+from .aggregator import get_group_state_aggregator
 from ai_dj.models import AIDJSession
 
 class WearableDeviceViewSet(viewsets.ModelViewSet):
@@ -152,52 +151,20 @@ class GroupEmotionalStateViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        # Get recent biometric data (last 5 minutes)
-        recent_time = timezone.now() - timedelta(minutes=5)
-        recent_data = BiometricData.objects.filter(
-            session_id=session_id,
-            timestamp__gte=recent_time
-        )
-
-        if not recent_data.exists():
-            return Response(
-                {"error": "No recent biometric data found"},
-                status=status.HTTP_404_NOT_FOUND
-            )
-
-        # Calculate aggregated metrics
-        aggregates = recent_data.aggregate(
-            median_heart_rate=Avg('heart_rate'),
-            median_energy_level=Avg('energy_level'),
-            median_stress_level=Avg('stress_level')
-        )
-
-        # Count emotions for distribution
-        emotions = recent_data.values('mood').annotate(
-            count=Count('id')
-        ).order_by('-count')
-
-        total_emotions = sum(e['count'] for e in emotions)
-        emotion_distribution = {
-            e['mood']: e['count'] / total_emotions
-            for e in emotions
-        }
-
-        # Calculate consensus strength (ratio of dominant emotion)
-        dominant_emotion = emotions[0]['mood']
-        consensus_strength = emotion_distribution[dominant_emotion]
-
-        # Create new group state
-        group_state = GroupEmotionalState.objects.create(
-            session_id=session_id,
-            median_heart_rate=aggregates['median_heart_rate'],
-            median_energy_level=aggregates['median_energy_level'],
-            median_stress_level=aggregates['median_stress_level'],
-            dominant_emotion=dominant_emotion,
-            emotion_distribution=emotion_distribution,
-            consensus_strength=consensus_strength,
-            participant_count=recent_data.values('device').distinct().count()
-        )
+        # Group state over the session's sliding window, kept up to date as
+        # samples arrive instead of re-aggregated here
+        aggregator = get_group_state_aggregator()
+        group_state = aggregator.write_state(session_id)
+        if group_state is None:
+            snapshot = aggregator.snapshot(session_id)
+            if snapshot is None:
+                return Response(
+                    {"error": "No recent biometric data found"},
+                    status=status.HTTP_404_NOT_FOUND
+                )
+            # Written less than WRITE_INTERVAL ago: report the current state
+            # without storing another row
+            group_state = GroupEmotionalState(session_id=session_id, **snapshot)
 
         serializer = self.get_serializer(group_state)
         return Response(serializer.data)
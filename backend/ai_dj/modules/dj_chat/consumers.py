@@ -1,9 +1,14 @@
+import asyncio
 import json
+import uuid
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from django.contrib.auth import get_user_model
 from .models import ChatSession, ChatMessage, UserPreference
-from .llm import generate_ai_response
+from .llm import pick_music_fact, stream_ai_response
+import logging
+
+logger = logging.getLogger(__name__)
 
 User = get_user_model()
 
@@ -11,6 +16,7 @@ class DJChatConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         self.session_id = self.scope['url_route']['kwargs']['session_id']
         self.room_group_name = f'chat_{self.session_id}'
+        self.response_tasks = set()
 
         # Join room group
         await self.channel_layer.group_add(
@@ -21,6 +27,9 @@ class DJChatConsumer(AsyncWebsocketConsumer):
         await self.accept()
 
     async def disconnect(self, close_code):
+        for task in list(self.response_tasks):
+            task.cancel()
+
         # Leave room group
         await self.channel_layer.group_discard(
             self.room_group_name,
@@ -35,11 +44,10 @@ class DJChatConsumer(AsyncWebsocketConsumer):
             message = data.get('message')
             context = data.get('context', {})
             
-            # Save user message
-            user_message = await self.save_message(
+            # Save user message and load everything the reply needs in one go
+            user_message, chat_history, user_prefs, music_fact = await self.prepare_response(
                 message,
-                context,
-                is_ai=False
+                context
             )
             
             # Broadcast user message
@@ -53,26 +61,59 @@ class DJChatConsumer(AsyncWebsocketConsumer):
                 }
             )
             
-            # Generate and save AI response
-            ai_response = await self.generate_response(user_message)
-            
-            # Broadcast AI response
+            # Stream the reply from a task so this consumer keeps handling
+            # events (including its own tokens) while the model generates
+            task = asyncio.ensure_future(
+                self.stream_response(user_message, chat_history, user_prefs, music_fact)
+            )
+            self.response_tasks.add(task)
+            task.add_done_callback(self.response_tasks.discard)
+
+    async def stream_response(self, user_message, chat_history, user_prefs, music_fact):
+        """Relay the AI reply to the room token by token, then save it."""
+        stream_id = uuid.uuid4().hex
+        result = {}
+        try:
+            await self.channel_layer.group_send(
+                self.room_group_name,
+                {'type': 'chat_stream_start', 'stream_id': stream_id, 'is_ai': True}
+            )
+            async for token in stream_ai_response(user_message, chat_history, user_prefs, result):
+                await self.channel_layer.group_send(
+                    self.room_group_name,
+                    {'type': 'chat_token', 'stream_id': stream_id, 'token': token}
+                )
+
+            await self.save_ai_message(user_message.session, result)
+
+            # Broadcast the complete AI response
             await self.channel_layer.group_send(
                 self.room_group_name,
                 {
                     'type': 'chat_message',
-                    'message': ai_response['message'],
-                    'context': ai_response['context'],
+                    'stream_id': stream_id,
+                    'message': result['message'],
+                    'context': result['context'],
                     'is_ai': True,
-                    'suggestions': ai_response.get('suggestions'),
-                    'music_fact': ai_response.get('music_fact')
+                    'suggestions': result.get('suggestions'),
+                    'music_fact': music_fact
                 }
             )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error streaming chat response: {str(e)}")
 
     async def chat_message(self, event):
         # Send message to WebSocket
         await self.send(text_data=json.dumps(event))
 
+    async def chat_stream_start(self, event):
+        await self.send(text_data=json.dumps(event))
+
+    async def chat_token(self, event):
+        await self.send(text_data=json.dumps(event))
+
     @database_sync_to_async
     def save_message(self, content, context, is_ai):
         session = ChatSession.objects.get(id=self.session_id)
@@ -84,30 +125,35 @@ class DJChatConsumer(AsyncWebsocketConsumer):
         )
 
     @database_sync_to_async
-    def generate_response(self, user_message):
+    def prepare_response(self, content, context):
+        """
+        Save the user message and load preferences, history and a music fact.
+
+        The LLM call itself happens outside this thread.
+        """
+        session = ChatSession.objects.select_related('user').get(id=self.session_id)
+        user_message = ChatMessage.objects.create(
+            session=session,
+            content=content,
+            context=context,
+            is_ai=False
+        )
+        
         # Get user preferences for context
-        user_prefs = UserPreference.objects.get_or_create(
-            user=user_message.session.user
-        )[0]
+        user_prefs = UserPreference.objects.get_or_create(user=session.user)[0]
         
         # Get chat history for context
         chat_history = list(ChatMessage.objects.filter(
-            session=user_message.session
+            session=session
         ).order_by('-created_at')[:5])
         
-        # Generate AI response using LLM
-        response = generate_ai_response(
-            user_message=user_message,
-            chat_history=chat_history,
-            user_preferences=user_prefs
-        )
-        
-        # Save AI message
+        return user_message, chat_history, user_prefs, pick_music_fact(user_message)
+
+    @database_sync_to_async
+    def save_ai_message(self, session, response):
         ChatMessage.objects.create(
-            session=user_message.session,
+            session=session,
             content=response['message'],
             context=response['context'],
             is_ai=True
         )
-        
-        return response
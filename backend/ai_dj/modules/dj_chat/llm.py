@@ -1,29 +1,157 @@
-import openai
+import asyncio
+import random
+import threading
+import weakref
+from abc import ABC, abstractmethod
+from typing import Any, AsyncIterator, Dict, List, Optional
+from asgiref.sync import async_to_sync
 from django.conf import settings
-from typing import List, Dict, Any
+from django.core.cache import cache
 from .models import ChatMessage, UserPreference, MusicFact
+import logging
 
-def generate_ai_response(
+logger = logging.getLogger(__name__)
+
+SYSTEM_PROMPT = (
+    "You are an AI DJ assistant who is knowledgeable about music and can "
+    "engage in friendly conversation about music preferences, artists, "
+    "genres, and provide interesting music facts. Be conversational, "
+    "engaging, and occasionally share relevant music trivia."
+)
+
+SUGGESTIONS_PROMPT = (
+    "Generate 2-3 relevant follow-up questions or suggestions based on the "
+    "conversation about music. Keep them concise and natural."
+)
+
+FALLBACK_MESSAGE = (
+    "I apologize, but I'm having trouble processing your request right now. "
+    "Could you please try again?"
+)
+
+FALLBACK_SUGGESTIONS = [
+    "Tell me about your favorite music",
+    "What genre do you enjoy the most?",
+    "Would you like a music recommendation?"
+]
+
+FACT_IDS_CACHE_KEY = 'dj_chat:verified_fact_ids'
+FACT_IDS_CACHE_TTL = 600
+
+
+class ChatLLMProvider(ABC):
+    """
+    Abstract base class for streaming chat model providers.
+    """
+    @abstractmethod
+    def stream_chat(
+        self,
+        messages: List[Dict[str, str]],
+        max_tokens: int,
+        temperature: float = 0.7
+    ) -> AsyncIterator[str]:
+        """Yield the completion for ``messages`` token by token."""
+        pass
+
+    async def complete(self, messages: List[Dict[str, str]], max_tokens: int, temperature: float = 0.7) -> str:
+        """Collect a full completion."""
+        return ''.join([token async for token in self.stream_chat(messages, max_tokens, temperature)])
+
+
+class OpenAIChatProvider(ChatLLMProvider):
+    """
+    OpenAI chat completions over the async client with streaming enabled.
+
+    The async client's connection pool belongs to the event loop that opened
+    it, and synchronous callers run each response on a fresh loop, so every
+    event loop gets its own client.
+    """
+    def __init__(self, model: Optional[str] = None):
+        import openai
+        self._client_class = openai.AsyncOpenAI
+        self._clients = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+        self.model = model or getattr(settings, 'DJ_CHAT_MODEL', 'gpt-4')
+
+    @property
+    def client(self):
+        """The client for the running event loop."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            client = self._clients.get(loop)
+            if client is None:
+                # Clients of closed loops keep them alive through their pools
+                for closed in [other for other in self._clients if other.is_closed()]:
+                    del self._clients[closed]
+                client = self._clients[loop] = self._client_class(api_key=settings.OPENAI_API_KEY)
+            return client
+
+    async def stream_chat(self, messages, max_tokens, temperature=0.7):
+        stream = await self.client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=True
+        )
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+
+class FakeChatProvider(ChatLLMProvider):
+    """
+    Local provider that streams a canned reply, for tests and development.
+    """
+    def __init__(
+        self,
+        reply: str = "Here is a great track for you.",
+        suggestions: str = "- What else do you like?\n- Want a remix?",
+        first_token_delay: float = 0.0,
+        token_delay: float = 0.0
+    ):
+        self.reply = reply
+        self.suggestions = suggestions
+        self.first_token_delay = first_token_delay
+        self.token_delay = token_delay
+        self.calls: List[List[Dict[str, str]]] = []
+
+    async def stream_chat(self, messages, max_tokens, temperature=0.7):
+        self.calls.append(messages)
+        text = self.suggestions if messages[0]['content'] == SUGGESTIONS_PROMPT else self.reply
+        await asyncio.sleep(self.first_token_delay)
+        for index, token in enumerate(text.split(' ')):
+            if index:
+                await asyncio.sleep(self.token_delay)
+            yield token if index == 0 else f" {token}"
+
+
+_providers: Dict[str, ChatLLMProvider] = {}
+
+
+def get_chat_provider(name: Optional[str] = None) -> ChatLLMProvider:
+    """
+    Get the process-wide chat provider (``settings.DJ_CHAT_LLM_PROVIDER``).
+    """
+    name = name or getattr(settings, 'DJ_CHAT_LLM_PROVIDER', 'openai')
+    if name not in _providers:
+        if name == 'openai':
+            _providers[name] = OpenAIChatProvider()
+        elif name == 'fake':
+            _providers[name] = FakeChatProvider()
+        else:
+            raise ValueError(f"Unsupported chat provider: {name}")
+    return _providers[name]
+
+
+def build_messages(
     user_message: ChatMessage,
     chat_history: List[ChatMessage],
-    user_preferences: UserPreference
-) -> Dict[str, Any]:
-    """Generate AI response using OpenAI's GPT model."""
-    
-    # Prepare conversation history
-    messages = []
-    
-    # Add system prompt
-    messages.append({
-        "role": "system",
-        "content": (
-            "You are an AI DJ assistant who is knowledgeable about music and can "
-            "engage in friendly conversation about music preferences, artists, "
-            "genres, and provide interesting music facts. Be conversational, "
-            "engaging, and occasionally share relevant music trivia."
-        )
-    })
-    
+    user_preferences: Optional[UserPreference]
+) -> List[Dict[str, str]]:
+    """Build the chat prompt from preferences and recent history."""
+    messages = [{"role": "system", "content": SYSTEM_PROMPT}]
+
     # Add user preferences context
     if user_preferences:
         messages.append({
@@ -32,84 +160,137 @@ def generate_ai_response(
                       f"Favorite artists: {user_preferences.favorite_artists}, "
                       f"Mood preferences: {user_preferences.mood_preferences}"
         })
-    
-    # Add chat history
-    for msg in reversed(chat_history[1:]):  # Exclude current message
-        role = "assistant" if msg.is_ai else "user"
+
+    # Add chat history, oldest first, excluding the current message
+    for msg in reversed(chat_history[1:]):
         messages.append({
-            "role": role,
+            "role": "assistant" if msg.is_ai else "user",
             "content": msg.content
         })
-    
-    # Add current message
-    messages.append({
-        "role": "user",
-        "content": user_message.content
-    })
-    
+
+    messages.append({"role": "user", "content": user_message.content})
+    return messages
+
+
+async def generate_suggestions(provider: ChatLLMProvider, user_message: ChatMessage) -> List[str]:
+    """
+    Suggest follow-ups from the user's message.
+
+    Runs alongside the main reply instead of after it, so it is prompted
+    with the user's message rather than the finished reply.
+    """
     try:
-        # Get response from OpenAI
-        response = openai.ChatCompletion.create(
-            model="gpt-4",
-            messages=messages,
-            temperature=0.7,
-            max_tokens=300
-        )
-        
-        ai_message = response.choices[0].message.content
-        
-        # Generate suggestions based on the conversation
-        suggestion_response = openai.ChatCompletion.create(
-            model="gpt-4",
-            messages=[
-                {
-                    "role": "system",
-                    "content": "Generate 2-3 relevant follow-up questions or suggestions based on the conversation about music. Keep them concise and natural."
-                },
-                {
-                    "role": "user",
-                    "content": f"Previous message: {user_message.content}\nAI response: {ai_message}"
-                }
+        text = await provider.complete(
+            [
+                {"role": "system", "content": SUGGESTIONS_PROMPT},
+                {"role": "user", "content": f"User message: {user_message.content}"}
             ],
-            temperature=0.7,
             max_tokens=100
         )
-        
-        suggestions = suggestion_response.choices[0].message.content.split('\n')
-        suggestions = [s.strip('- ') for s in suggestions if s.strip()]
-        
-        # Randomly fetch a related music fact
-        music_fact = None
-        if user_message.context.get('current_track') or user_message.context.get('genre'):
-            fact = MusicFact.objects.filter(
-                verified=True
-            ).order_by('?').first()
-            if fact:
-                music_fact = {
-                    'title': fact.title,
-                    'content': fact.content,
-                    'source': fact.source
-                }
-        
-        return {
-            'message': ai_message,
-            'context': {
-                **user_message.context,
-                'analyzed_sentiment': response.choices[0].message.get('sentiment'),
-                'detected_topics': response.choices[0].message.get('topics', [])
-            },
-            'suggestions': suggestions,
-            'music_fact': music_fact
-        }
-        
     except Exception as e:
-        print(f"Error generating AI response: {e}")
-        return {
-            'message': "I apologize, but I'm having trouble processing your request right now. Could you please try again?",
+        logger.error(f"Error generating chat suggestions: {str(e)}")
+        return FALLBACK_SUGGESTIONS
+    return [s.strip('- ') for s in text.split('\n') if s.strip()]
+
+
+def get_verified_fact_ids() -> List[int]:
+    """Ids of verified music facts, cached so picking one needs no table scan."""
+    fact_ids = cache.get(FACT_IDS_CACHE_KEY)
+    if fact_ids is None:
+        fact_ids = list(MusicFact.objects.filter(verified=True).values_list('id', flat=True))
+        cache.set(FACT_IDS_CACHE_KEY, fact_ids, FACT_IDS_CACHE_TTL)
+    return fact_ids
+
+
+def invalidate_fact_ids() -> None:
+    cache.delete(FACT_IDS_CACHE_KEY)
+
+
+def random_music_fact() -> Optional[MusicFact]:
+    """Pick a random verified fact by primary key from the cached id list."""
+    fact_ids = get_verified_fact_ids()
+    if not fact_ids:
+        return None
+    return MusicFact.objects.filter(id=random.choice(fact_ids), verified=True).first()
+
+
+def pick_music_fact(user_message: ChatMessage) -> Optional[Dict[str, str]]:
+    """Share a fact when the message is about a track or genre."""
+    if not (user_message.context.get('current_track') or user_message.context.get('genre')):
+        return None
+    fact = random_music_fact()
+    if fact is None:
+        return None
+    return {
+        'title': fact.title,
+        'content': fact.content,
+        'source': fact.source
+    }
+
+
+async def stream_ai_response(
+    user_message: ChatMessage,
+    chat_history: List[ChatMessage],
+    user_preferences: Optional[UserPreference],
+    result: Dict[str, Any],
+    provider: Optional[ChatLLMProvider] = None
+) -> AsyncIterator[str]:
+    """
+    Stream the AI reply token by token.
+
+    Suggestions are requested concurrently with the reply. Once the stream is
+    exhausted ``result`` holds the full message, context and suggestions in
+    the shape ``generate_ai_response`` returns.
+    """
+    provider = provider or get_chat_provider()
+    suggestions_task = asyncio.ensure_future(generate_suggestions(provider, user_message))
+    tokens = []
+    try:
+        async for token in provider.stream_chat(
+            build_messages(user_message, chat_history, user_preferences),
+            max_tokens=300
+        ):
+            tokens.append(token)
+            yield token
+        message = ''.join(tokens)
+    except Exception as e:
+        logger.error(f"Error generating AI response: {str(e)}")
+        suggestions_task.cancel()
+        if not tokens:
+            yield FALLBACK_MESSAGE
+        result.update({
+            'message': ''.join(tokens) or FALLBACK_MESSAGE,
             'context': user_message.context,
-            'suggestions': [
-                "Tell me about your favorite music",
-                "What genre do you enjoy the most?",
-                "Would you like a music recommendation?"
-            ]
-        }
+            'suggestions': FALLBACK_SUGGESTIONS
+        })
+        return
+    except BaseException:
+        suggestions_task.cancel()
+        raise
+
+    result.update({
+        'message': message,
+        'context': {
+            **user_message.context,
+            'analyzed_sentiment': None,
+            'detected_topics': []
+        },
+        'suggestions': await suggestions_task
+    })
+
+
+def generate_ai_response(
+    user_message: ChatMessage,
+    chat_history: List[ChatMessage],
+    user_preferences: UserPreference
+) -> Dict[str, Any]:
+    """Generate a complete AI response for synchronous callers."""
+    result: Dict[str, Any] = {}
+
+    async def collect():
+        async for _ in stream_ai_response(user_message, chat_history, user_preferences, result):
+            pass
+
+    async_to_sync(collect)()
+    result['music_fact'] = pick_music_fact(user_message)
+    return result
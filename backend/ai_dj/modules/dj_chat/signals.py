@@ -0,0 +1,11 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .models import MusicFact
+from .llm import invalidate_fact_ids
+
+
+@receiver(post_save, sender=MusicFact)
+@receiver(post_delete, sender=MusicFact)
+def refresh_verified_fact_ids(sender, **kwargs):
+    """Drop the cached fact id list when facts are added, verified or removed."""
+    invalidate_fact_ids()
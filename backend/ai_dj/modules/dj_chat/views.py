@@ -18,6 +18,7 @@ from .serializers import (
     ChatPersonalitySerializer,
     ChatResponseSerializer
 )
+from .llm import random_music_fact
 
 
 class ChatSessionViewSet(viewsets.ModelViewSet):
@@ -84,7 +85,7 @@ class MusicFactViewSet(viewsets.ReadOnlyModelViewSet):
     
     @action(detail=False, methods=['GET'])
     def random(self, request):
-        fact = self.get_queryset().order_by('?').first()
+        fact = random_music_fact()
         if fact:
             return Response(self.get_serializer(fact).data)
         return Response(
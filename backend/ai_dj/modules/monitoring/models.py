@@ -24,6 +24,38 @@ class MetricData(models.Model):
     class Meta:
         indexes = [
             models.Index(fields=['metric_type', 'timestamp']),
+            # Rollup compaction and retention scan by time across all types
+            models.Index(fields=['timestamp'], name='monitoring_metricdata_ts'),
+        ]
+
+
+class MetricRollup(models.Model):
+    """Pre-aggregated MetricData over a fixed UTC time bucket."""
+
+    RESOLUTIONS = [
+        ('minute', 'Minute'),
+        ('hour', 'Hour'),
+        ('day', 'Day'),
+    ]
+
+    metric_type = models.CharField(max_length=50)
+    resolution = models.CharField(max_length=10, choices=RESOLUTIONS)
+    bucket_start = models.DateTimeField()
+    count = models.BigIntegerField()
+    sum = models.FloatField()
+    sum_squares = models.FloatField()
+    min = models.FloatField()
+    max = models.FloatField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['resolution', 'metric_type', 'bucket_start'],
+                name='monitoring_rollup_bucket_uniq'
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['resolution', 'bucket_start'], name='monitoring_rollup_res_start'),
         ]
 
 
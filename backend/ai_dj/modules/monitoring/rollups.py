@@ -0,0 +1,355 @@
+"""
+Time-series rollups of ``MetricData``.
+
+A periodic compaction task aggregates raw samples into minute buckets, and
+minute buckets into hour and day buckets. Each bucket keeps count, sum, sum of
+squares, min and max, so buckets merge exactly and give average and standard
+deviation as well as extremes. Buckets are aligned to UTC.
+
+Compaction only covers closed buckets, up to ``compacted_until``. Reads pick
+one resolution for the requested range. Buckets before that resolution's
+watermark come from its rollups, the gap up to ``compacted_until`` from finer
+rollups, and anything newer straight from the raw rows. Only the most recent
+minute or so is ever read raw. Ranges are widened to whole buckets of the
+chosen resolution.
+
+Each resolution, and the raw rows, have their own retention period. A read
+only uses a resolution whose retention still reaches back to the start of
+the range.
+"""
+import math
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone as dt_timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F, Max, Min, Sum
+from django.db.models.functions import Trunc
+from django.utils import timezone
+
+from .models import MetricData, MetricRollup
+
+# Finest first
+RESOLUTIONS = ['minute', 'hour', 'day']
+RESOLUTION_SECONDS = {'minute': 60, 'hour': 3600, 'day': 86400}
+
+DEFAULTS = {
+    # Days to keep raw rows and each resolution; None keeps them forever
+    'RETENTION': {'raw': None, 'minute': 14, 'hour': 400, 'day': None},
+    # A range is served from the coarsest resolution that still splits it
+    # into at least this many buckets
+    'MIN_BUCKETS': 24,
+    # Raw samples are compacted once their minute has been closed this long
+    'COMPACTION_DELAY': 60,
+    # Largest span of raw rows aggregated by one compaction query
+    'COMPACTION_CHUNK': timedelta(hours=6),
+    'DELETE_CHUNK': 10000,
+}
+
+COMPACTED_UNTIL_KEY = 'monitoring:rollups:compacted_until'
+
+
+def rollup_setting(name: str):
+    return getattr(settings, 'MONITORING_ROLLUPS', {}).get(name, DEFAULTS[name])
+
+
+def retention_days(name: str) -> Optional[int]:
+    return {**DEFAULTS['RETENTION'], **rollup_setting('RETENTION')}.get(name)
+
+
+def floor_time(moment: datetime, resolution: str) -> datetime:
+    seconds = RESOLUTION_SECONDS[resolution]
+    epoch = math.floor(moment.timestamp() / seconds) * seconds
+    return datetime.fromtimestamp(epoch, tz=dt_timezone.utc)
+
+
+def ceil_time(moment: datetime, resolution: str) -> datetime:
+    floored = floor_time(moment, resolution)
+    if floored == moment:
+        return floored
+    return floored + timedelta(seconds=RESOLUTION_SECONDS[resolution])
+
+
+@dataclass
+class Aggregate:
+    """Mergeable summary of a set of samples."""
+    count: int = 0
+    sum: float = 0.0
+    sum_squares: float = 0.0
+    min: Optional[float] = None
+    max: Optional[float] = None
+
+    def merge(self, count, total, sum_squares, minimum, maximum) -> None:
+        if not count:
+            return
+        self.count += count
+        self.sum += total
+        self.sum_squares += sum_squares
+        self.min = minimum if self.min is None else min(self.min, minimum)
+        self.max = maximum if self.max is None else max(self.max, maximum)
+
+    @property
+    def avg(self) -> Optional[float]:
+        return self.sum / self.count if self.count else None
+
+    @property
+    def stddev(self) -> Optional[float]:
+        if not self.count:
+            return None
+        variance = self.sum_squares / self.count - self.avg ** 2
+        return math.sqrt(max(variance, 0.0))
+
+    def as_dict(self) -> Dict:
+        return {
+            'count': self.count,
+            'avg_value': self.avg,
+            'min_value': self.min,
+            'max_value': self.max,
+            'stddev_value': self.stddev,
+        }
+
+
+AGGREGATE_FIELDS = ('count', 'sum', 'sum_squares', 'min', 'max')
+
+
+def _rollup_rows(rows: Iterable[Dict], resolution: str) -> List[MetricRollup]:
+    return [
+        MetricRollup(
+            resolution=resolution,
+            metric_type=row['metric_type'],
+            bucket_start=row['bucket_start'],
+            **{field: row[field] for field in AGGREGATE_FIELDS}
+        )
+        for row in rows
+    ]
+
+
+def _upsert(rollups: List[MetricRollup]) -> None:
+    """Write buckets, replacing any earlier version of the same bucket."""
+    MetricRollup.objects.bulk_create(
+        rollups,
+        batch_size=1000,
+        update_conflicts=True,
+        unique_fields=['resolution', 'metric_type', 'bucket_start'],
+        update_fields=list(AGGREGATE_FIELDS)
+    )
+
+
+def _aggregate_raw(start: datetime, end: datetime, resolution: str, metric_type: Optional[str] = None):
+    queryset = MetricData.objects.filter(timestamp__gte=start, timestamp__lt=end)
+    if metric_type:
+        queryset = queryset.filter(metric_type=metric_type)
+    return queryset.annotate(
+        bucket_start=Trunc('timestamp', resolution, tzinfo=dt_timezone.utc)
+    ).order_by().values('metric_type', 'bucket_start').annotate(
+        count=Count('id'),
+        sum=Sum('value'),
+        sum_squares=Sum(F('value') * F('value')),
+        min=Min('value'),
+        max=Max('value')
+    )
+
+
+def _aggregate_rollups(
+    source: str, start: datetime, end: datetime, resolution: str, metric_type: Optional[str] = None
+):
+    """Merge ``source`` rollups in [start, end) into ``resolution`` buckets."""
+    queryset = MetricRollup.objects.filter(resolution=source, bucket_start__gte=start, bucket_start__lt=end)
+    if metric_type:
+        queryset = queryset.filter(metric_type=metric_type)
+    if source == resolution:
+        return queryset.values('metric_type', 'bucket_start', *AGGREGATE_FIELDS)
+    rows = queryset.annotate(
+        bucket=Trunc('bucket_start', resolution, tzinfo=dt_timezone.utc)
+    ).order_by().values('metric_type', 'bucket').annotate(
+        total_count=Sum('count'),
+        total_sum=Sum('sum'),
+        total_sum_squares=Sum('sum_squares'),
+        total_min=Min('min'),
+        total_max=Max('max')
+    )
+    # Annotations can't reuse the model's field names
+    return (
+        {
+            'metric_type': row['metric_type'],
+            'bucket_start': row['bucket'],
+            **{field: row[f'total_{field}'] for field in AGGREGATE_FIELDS}
+        }
+        for row in rows
+    )
+
+
+def get_compacted_until() -> Optional[datetime]:
+    """End of the last compacted minute, from the cache or the stored rollups."""
+    compacted_until = cache.get(COMPACTED_UNTIL_KEY)
+    if compacted_until is None:
+        latest = MetricRollup.objects.filter(resolution='minute').aggregate(latest=Max('bucket_start'))['latest']
+        if latest is not None:
+            compacted_until = latest + timedelta(minutes=1)
+    return compacted_until
+
+
+def compact(now: Optional[datetime] = None, max_span: Optional[timedelta] = None) -> Optional[datetime]:
+    """
+    Roll raw samples up into minute buckets, then minutes into hours and
+    hours into days, for every bucket closed since the last run.
+
+    Safe to re-run: buckets are recomputed from their source and replaced.
+    Returns the new ``compacted_until``.
+    """
+    now = now or timezone.now()
+    until = floor_time(now - timedelta(seconds=rollup_setting('COMPACTION_DELAY')), 'minute')
+    start = get_compacted_until()
+    if start is None:
+        first = MetricData.objects.aggregate(first=Min('timestamp'))['first']
+        if first is None:
+            return None
+        start = floor_time(first, 'minute')
+    if max_span is not None:
+        until = min(until, start + max_span)
+    if start >= until:
+        return start
+
+    chunk = rollup_setting('COMPACTION_CHUNK')
+    chunk_start = start
+    while chunk_start < until:
+        chunk_end = min(chunk_start + chunk, until)
+        with transaction.atomic():
+            _upsert(_rollup_rows(_aggregate_raw(chunk_start, chunk_end, 'minute'), 'minute'))
+            # Coarser buckets closed by this chunk, rebuilt from the finer level
+            for finer, coarser in (('minute', 'hour'), ('hour', 'day')):
+                coarse_start = floor_time(chunk_start, coarser)
+                coarse_end = floor_time(chunk_end, coarser)
+                if coarse_start < coarse_end:
+                    _upsert(_rollup_rows(
+                        _aggregate_rollups(finer, coarse_start, coarse_end, coarser), coarser
+                    ))
+        cache.set(COMPACTED_UNTIL_KEY, chunk_end, None)
+        chunk_start = chunk_end
+    return until
+
+
+def _delete_in_chunks(queryset) -> int:
+    """Delete matching rows a chunk at a time to keep each statement short."""
+    model = queryset.model
+    chunk_size = rollup_setting('DELETE_CHUNK')
+    deleted = 0
+    while True:
+        ids = list(queryset.values_list('id', flat=True)[:chunk_size])
+        if not ids:
+            return deleted
+        deleted += model.objects.filter(id__in=ids).delete()[0]
+
+
+def apply_retention(now: Optional[datetime] = None) -> Dict[str, int]:
+    """Delete buckets, and raw rows if configured, past their retention."""
+    now = now or timezone.now()
+    deleted = {}
+    for resolution in RESOLUTIONS:
+        days = retention_days(resolution)
+        if days is not None:
+            deleted[resolution] = _delete_in_chunks(MetricRollup.objects.filter(
+                resolution=resolution,
+                bucket_start__lt=now - timedelta(days=days)
+            ))
+
+    days = retention_days('raw')
+    compacted_until = get_compacted_until()
+    if days is not None and compacted_until is not None:
+        # Only rows that are already rolled up may go
+        cutoff = min(now - timedelta(days=days), compacted_until)
+        deleted['raw'] = _delete_in_chunks(MetricData.objects.filter(timestamp__lt=cutoff))
+    return deleted
+
+
+def choose_resolution(start: datetime, end: datetime, now: Optional[datetime] = None) -> str:
+    """
+    The coarsest resolution that splits the range into at least
+    ``MIN_BUCKETS`` buckets and is still retained back to ``start``.
+    Falls back to the coarsest retained one for ranges older than that.
+    """
+    now = now or timezone.now()
+    span = (end - start).total_seconds()
+    min_buckets = rollup_setting('MIN_BUCKETS')
+    retained = [
+        resolution for resolution in RESOLUTIONS
+        if retention_days(resolution) is None or start >= now - timedelta(days=retention_days(resolution))
+    ]
+    if not retained:
+        return RESOLUTIONS[-1]
+    fitting = [resolution for resolution in retained if span / RESOLUTION_SECONDS[resolution] >= min_buckets]
+    return fitting[-1] if fitting else retained[0]
+
+
+def collect(
+    start: datetime,
+    end: datetime,
+    resolution: str,
+    metric_type: Optional[str] = None
+) -> Dict[Tuple[str, datetime], Aggregate]:
+    """
+    Aggregates per (metric type, bucket) at ``resolution`` covering
+    [start, end), widened to whole buckets.
+    """
+    start = floor_time(start, resolution)
+    end = ceil_time(end, resolution)
+    buckets: Dict[Tuple[str, datetime], Aggregate] = {}
+
+    def add(rows):
+        for row in rows:
+            key = (row['metric_type'], row['bucket_start'])
+            aggregate = buckets.get(key)
+            if aggregate is None:
+                aggregate = buckets[key] = Aggregate()
+            aggregate.merge(*(row[field] for field in AGGREGATE_FIELDS))
+
+    compacted_until = get_compacted_until() or start
+    # Each level serves from where the coarser one stops being compacted
+    level_start = start
+    for level in reversed(RESOLUTIONS[:RESOLUTIONS.index(resolution) + 1]):
+        level_end = min(max(floor_time(compacted_until, level), level_start), end)
+        if level_start < level_end:
+            add(_aggregate_rollups(level, level_start, level_end, resolution, metric_type))
+        level_start = level_end
+    if level_start < end:
+        add(_aggregate_raw(level_start, end, resolution, metric_type))
+    return buckets
+
+
+def query_series(
+    start: datetime,
+    end: datetime,
+    metric_type: Optional[str] = None,
+    resolution: Optional[str] = None
+) -> Dict:
+    """Bucketed series for the range, at the given or automatically chosen resolution."""
+    resolution = resolution or choose_resolution(start, end)
+    buckets = collect(start, end, resolution, metric_type)
+    series = {}
+    for (bucket_metric, bucket_start), aggregate in sorted(buckets.items()):
+        series.setdefault(bucket_metric, []).append({'bucket_start': bucket_start, **aggregate.as_dict()})
+    return {'resolution': resolution, 'series': series}
+
+
+def query_aggregates(
+    start: datetime,
+    end: datetime,
+    metric_type: Optional[str] = None,
+    resolution: Optional[str] = None
+) -> Dict:
+    """Per-metric summary over the range."""
+    resolution = resolution or choose_resolution(start, end)
+    totals: Dict[str, Aggregate] = {}
+    for (bucket_metric, _), aggregate in collect(start, end, resolution, metric_type).items():
+        totals.setdefault(bucket_metric, Aggregate()).merge(
+            aggregate.count, aggregate.sum, aggregate.sum_squares, aggregate.min, aggregate.max
+        )
+    return {
+        'resolution': resolution,
+        'metrics': [
+            {'metric_type': name, **aggregate.as_dict()}
+            for name, aggregate in sorted(totals.items())
+        ]
+    }
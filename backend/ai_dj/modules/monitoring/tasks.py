@@ -0,0 +1,16 @@
+from celery import shared_task
+
+from .rollups import apply_retention, compact
+
+
+@shared_task
+def compact_metric_rollups():
+    """Roll closed minutes of MetricData up into minute, hour and day buckets."""
+    compacted_until = compact()
+    return compacted_until.isoformat() if compacted_until else None
+
+
+@shared_task
+def apply_rollup_retention():
+    """Delete rollups and raw metrics past their retention period."""
+    return apply_retention()
@@ -3,6 +3,9 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from ..performance.hit_counter import get_hit_counter
+from .rollups import RESOLUTIONS, query_aggregates, query_series
 from .models import MetricData, Alert, SystemHealth, PerformanceMetric, CacheableTrackTransition, DeploymentLog, ScalingEvent
 from .serializers import (
     MetricDataSerializer,
@@ -35,21 +38,56 @@ class MetricDataViewSet(viewsets.ModelViewSet):
         
         return queryset
     
+    def _time_range(self, request, default=timezone.timedelta(hours=1)):
+        """The request's start/end parameters, defaulting to the last ``default``."""
+        try:
+            end = request.query_params.get('end')
+            end = parse_datetime(end) if end else timezone.now()
+            start = request.query_params.get('start')
+            start = parse_datetime(start) if start else end - default
+        except (TypeError, ValueError):
+            return None
+        if start is None or end is None:
+            return None
+        start, end = [moment if timezone.is_aware(moment) else timezone.make_aware(moment) for moment in (start, end)]
+        if start >= end:
+            return None
+        return start, end
+
     @action(detail=False, methods=['GET'])
     def aggregates(self, request):
-        """Get aggregated metrics for dashboard."""
-        now = timezone.now()
-        hour_ago = now - timezone.timedelta(hours=1)
-        
-        metrics = MetricData.objects.filter(
-            timestamp__gte=hour_ago
-        ).values('metric_type').annotate(
-            avg_value=models.Avg('value'),
-            max_value=models.Max('value'),
-            min_value=models.Min('value')
-        )
-        
-        return Response(metrics)
+        """Get aggregated metrics for dashboard (last hour unless start/end are given)."""
+        time_range = self._time_range(request)
+        if time_range is None:
+            return Response(
+                {'error': 'start and end must be ISO 8601 datetimes with start before end'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        result = query_aggregates(*time_range, metric_type=request.query_params.get('type'))
+        return Response(result['metrics'])
+
+    @action(detail=False, methods=['GET'])
+    def series(self, request):
+        """Get bucketed metrics over a time range from the rollups."""
+        time_range = self._time_range(request, default=timezone.timedelta(days=1))
+        if time_range is None:
+            return Response(
+                {'error': 'start and end must be ISO 8601 datetimes with start before end'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        resolution = request.query_params.get('resolution')
+        if resolution and resolution not in RESOLUTIONS:
+            return Response(
+                {'error': f"resolution must be one of {', '.join(RESOLUTIONS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        return Response(query_series(
+            *time_range,
+            metric_type=request.query_params.get('type'),
+            resolution=resolution
+        ))
 
 
 class AlertViewSet(viewsets.ModelViewSet):
@@ -128,10 +166,9 @@ class CacheableTrackTransitionViewSet(viewsets.ModelViewSet):
 
     @action(detail=True, methods=['post'])
     def increment_hits(self, request, pk=None):
+        """Count a hit; it reaches ``hit_count`` with the next buffered flush."""
         transition = self.get_object()
-        transition.hit_count += 1
-        transition.last_accessed = timezone.now()
-        transition.save()
+        get_hit_counter().record(transition.cache_key, model=CacheableTrackTransition)
         serializer = self.get_serializer(transition)
         return Response(serializer.data)
 
@@ -0,0 +1,161 @@
+"""
+Buffered hit counting for ``CacheableTrackTransition``.
+
+Hits are added to an in-process counter keyed by model and cache key (the
+performance and monitoring apps each have a transition model); a background
+flusher thread writes them every ``FLUSH_INTERVAL`` seconds (or sooner once
+``MAX_PENDING`` keys are waiting). A flush groups keys by their pending
+delta and issues one ``UPDATE ... SET hit_count = hit_count + n`` per delta
+and chunk, so hot keys cost one row update per interval instead of one save
+per hit, and concurrent flushes from other processes add rather than
+overwrite.
+
+Cache statistics are kept as running totals in the cache, incremented from
+each flush's deltas, so reading them never scans the table.
+"""
+import logging
+import threading
+from collections import Counter, defaultdict
+from typing import Dict, Optional
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from server.background import BackgroundFlusher
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'FLUSH_INTERVAL': 5.0,
+    'MAX_PENDING': 10000,
+    # Most cache keys per UPDATE statement
+    'BATCH_SIZE': 1000,
+}
+
+STATS_KEY = 'performance:transition_hits:{name}'
+STATS_COUNTERS = ('hits', 'transitions_hit', 'unknown_hits', 'flushes')
+DEFAULT_MODEL = 'performance.CacheableTrackTransition'
+
+
+def hits_setting(name: str):
+    return getattr(settings, 'TRANSITION_HITS', {}).get(name, DEFAULTS[name])
+
+
+def _incr(name: str, delta: int) -> None:
+    key = STATS_KEY.format(name=name)
+    if not cache.add(key, delta, None):
+        try:
+            cache.incr(key, delta)
+        except ValueError:
+            # Evicted between add and incr
+            cache.set(key, delta, None)
+
+
+def get_hit_statistics() -> Dict:
+    """Running totals across all processes since the statistics were reset."""
+    values = cache.get_many([STATS_KEY.format(name=name) for name in STATS_COUNTERS + ('last_flush',)])
+    stats = {name: values.get(STATS_KEY.format(name=name), 0) for name in STATS_COUNTERS}
+    stats['last_flush'] = values.get(STATS_KEY.format(name='last_flush'))
+    return stats
+
+
+def reset_hit_statistics() -> None:
+    cache.delete_many([STATS_KEY.format(name=name) for name in STATS_COUNTERS + ('last_flush',)])
+
+
+class TransitionHitCounter(BackgroundFlusher):
+    """
+    Collects transition hits from request threads and flushes them in bulk.
+    """
+
+    thread_name = 'transition-hit-flusher'
+
+    def __init__(
+        self,
+        flush_interval: Optional[float] = None,
+        max_pending: Optional[int] = None,
+        batch_size: Optional[int] = None
+    ):
+        super().__init__()
+        self.flush_interval = flush_interval if flush_interval is not None else hits_setting('FLUSH_INTERVAL')
+        self.max_pending = max_pending or hits_setting('MAX_PENDING')
+        self.batch_size = batch_size or hits_setting('BATCH_SIZE')
+        self._pending: Counter = Counter()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+
+    @property
+    def pending(self) -> int:
+        """Hits recorded but not yet flushed."""
+        return sum(self._pending.values())
+
+    def record(self, cache_key: str, count: int = 1, model=None) -> None:
+        """
+        Count ``count`` hits on the transition stored under ``cache_key``, in
+        ``model`` (the performance app's transitions by default).
+        """
+        label = model._meta.label if model is not None else DEFAULT_MODEL
+        self._ensure_running()
+        with self._lock:
+            self._pending[label, cache_key] += count
+            backed_up = len(self._pending) >= self.max_pending
+        if backed_up:
+            self._wakeup.set()
+
+    def flush(self) -> int:
+        """
+        Add the pending hits to ``hit_count``. Returns the number of hits
+        applied to stored transitions.
+        """
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, Counter()
+            if not pending:
+                return 0
+
+            by_delta = defaultdict(list)
+            for (label, cache_key), delta in pending.items():
+                by_delta[label, delta].append(cache_key)
+
+            now = timezone.now()
+            applied = transitions = 0
+            try:
+                with transaction.atomic():
+                    for (label, delta), cache_keys in by_delta.items():
+                        model = apps.get_model(label)
+                        for offset in range(0, len(cache_keys), self.batch_size):
+                            updated = model.objects.filter(
+                                cache_key__in=cache_keys[offset:offset + self.batch_size]
+                            ).update(hit_count=F('hit_count') + delta, last_accessed=now)
+                            transitions += updated
+                            applied += updated * delta
+            except Exception as e:
+                # Nothing was written; keep the hits for the next flush
+                with self._lock:
+                    self._pending.update(pending)
+                logger.error(f"Error flushing transition hits: {str(e)}")
+                return 0
+
+            _incr('hits', applied)
+            _incr('transitions_hit', transitions)
+            _incr('unknown_hits', sum(pending.values()) - applied)
+            _incr('flushes', 1)
+            cache.set(STATS_KEY.format(name='last_flush'), now.isoformat(), None)
+            return applied
+
+
+def get_hit_counter() -> TransitionHitCounter:
+    """Get the process-wide transition hit counter"""
+    return TransitionHitCounter.shared()
+
+
+def get_cached_transition(cache_key: str, model=None):
+    """Read a cached transition, counting a hit when it is there."""
+    value = cache.get(cache_key)
+    if value is not None:
+        get_hit_counter().record(cache_key, model=model)
+    return value
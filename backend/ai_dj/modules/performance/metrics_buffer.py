@@ -0,0 +1,197 @@
+"""
+Buffered, asynchronous writer for request-level performance metrics.
+
+Request threads only append to an in-process ring buffer; a background
+flusher thread drains it and writes rows with ``bulk_create`` in batches.
+When the buffer backs up, new samples are thinned out and, once it is full,
+dropped outright, so a slow database never adds latency to requests.
+"""
+import logging
+import os
+import random
+import threading
+from collections import deque
+from typing import List, Optional, Tuple
+
+from django.conf import settings
+from django.utils import timezone
+
+from server.background import BackgroundFlusher
+
+logger = logging.getLogger(__name__)
+
+INSTANCE_METADATA_URL = 'http://169.254.169.254/latest/meta-data/instance-id'
+DEFAULT_INSTANCE_ID = 'local-development'
+
+DEFAULTS = {
+    'BUFFER_SIZE': 20000,
+    'BATCH_SIZE': 500,
+    'FLUSH_INTERVAL': 2.0,
+    # Fill ratio above which new samples are only kept with SAMPLE_RATE probability
+    'SAMPLE_THRESHOLD': 0.5,
+    'SAMPLE_RATE': 0.1,
+}
+
+_instance_id = None
+_instance_id_lock = threading.Lock()
+
+
+def metrics_setting(name: str):
+    return getattr(settings, 'PERFORMANCE_METRICS', {}).get(name, DEFAULTS[name])
+
+
+def get_instance_id() -> str:
+    """
+    Get the current server instance ID.
+
+    Resolved once per process: ``INSTANCE_ID`` from the environment wins,
+    otherwise the cloud metadata endpoint is asked a single time and the
+    answer (or the local-development fallback) is reused afterwards.
+    """
+    global _instance_id
+    if _instance_id is None:
+        with _instance_id_lock:
+            if _instance_id is None:
+                _instance_id = os.getenv('INSTANCE_ID') or _fetch_instance_id()
+    return _instance_id
+
+
+def _fetch_instance_id() -> str:
+    try:
+        import requests
+        response = requests.get(INSTANCE_METADATA_URL, timeout=1)
+        response.raise_for_status()
+        return response.text or DEFAULT_INSTANCE_ID
+    except Exception:
+        return DEFAULT_INSTANCE_ID
+
+
+class MetricsRingBuffer:
+    """
+    Bounded buffer of ``(metric_type, value, timestamp)`` samples.
+
+    Backed by a deque, whose ``append``/``popleft`` are atomic, so producers
+    never take a lock. Drop and sampling counters are best-effort.
+    """
+
+    def __init__(self, capacity: int, sample_threshold: float = 0.5, sample_rate: float = 0.1):
+        self.capacity = capacity
+        self.sample_depth = int(capacity * sample_threshold)
+        self.sample_rate = sample_rate
+        self._items = deque()
+        self.dropped = 0
+        self.sampled_out = 0
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def push(self, item: Tuple) -> bool:
+        depth = len(self._items)
+        if depth >= self.capacity:
+            self.dropped += 1
+            return False
+        if depth >= self.sample_depth and random.random() >= self.sample_rate:
+            self.sampled_out += 1
+            return False
+        self._items.append(item)
+        return True
+
+    def drain(self, limit: int) -> List[Tuple]:
+        items = []
+        try:
+            while len(items) < limit:
+                items.append(self._items.popleft())
+        except IndexError:
+            pass
+        return items
+
+
+class PerformanceMetricsWriter(BackgroundFlusher):
+    """
+    Collects metrics from request threads and persists them in the background.
+    """
+
+    thread_name = 'performance-metrics-flusher'
+
+    def __init__(
+        self,
+        buffer_size: Optional[int] = None,
+        batch_size: Optional[int] = None,
+        flush_interval: Optional[float] = None,
+        sample_threshold: Optional[float] = None,
+        sample_rate: Optional[float] = None,
+        instance_id: Optional[str] = None
+    ):
+        super().__init__()
+        self.buffer = MetricsRingBuffer(
+            buffer_size or metrics_setting('BUFFER_SIZE'),
+            sample_threshold if sample_threshold is not None else metrics_setting('SAMPLE_THRESHOLD'),
+            sample_rate if sample_rate is not None else metrics_setting('SAMPLE_RATE'),
+        )
+        self.batch_size = batch_size or metrics_setting('BATCH_SIZE')
+        self.flush_interval = flush_interval if flush_interval is not None else metrics_setting('FLUSH_INTERVAL')
+        self.instance_id = instance_id or get_instance_id()
+        self.written = 0
+        self.batches = 0
+        self._flush_lock = threading.Lock()
+
+    def record(self, metric_type: str, value: float) -> bool:
+        """
+        Queue a metric sample. Never blocks on the database.
+
+        Returns False if the sample was sampled out or dropped.
+        """
+        self._ensure_running()
+        accepted = self.buffer.push((metric_type, value, timezone.now()))
+        if accepted and len(self.buffer) >= self.batch_size:
+            self._wakeup.set()
+        return accepted
+
+    def flush(self) -> int:
+        """
+        Write everything buffered so far. Returns the number of rows written.
+        """
+        from .models import PerformanceMetric
+
+        written = 0
+        with self._flush_lock:
+            # Only drain what is queued now; later samples wait for a full batch
+            remaining = len(self.buffer)
+            while remaining > 0:
+                batch = self.buffer.drain(min(remaining, self.batch_size))
+                if not batch:
+                    break
+                remaining -= len(batch)
+                try:
+                    PerformanceMetric.objects.bulk_create([
+                        PerformanceMetric(
+                            metric_type=metric_type,
+                            value=value,
+                            timestamp=timestamp,
+                            server_instance=self.instance_id
+                        )
+                        for metric_type, value, timestamp in batch
+                    ])
+                    written += len(batch)
+                    self.batches += 1
+                except Exception as e:
+                    # Metrics are best-effort: a failed batch is discarded
+                    self.buffer.dropped += len(batch)
+                    logger.error(f"Error writing performance metrics: {str(e)}")
+                    break
+        self.written += written
+        return written
+
+    def stats(self) -> dict:
+        return {
+            'buffered': len(self.buffer),
+            'written': self.written,
+            'batches': self.batches,
+            'dropped': self.buffer.dropped,
+            'sampled_out': self.buffer.sampled_out,
+        }
+
+
+def get_metrics_writer() -> PerformanceMetricsWriter:
+    """Get the process-wide performance metrics writer"""
+    return PerformanceMetricsWriter.shared()
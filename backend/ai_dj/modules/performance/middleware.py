@@ -1,29 +1,29 @@
 import time
 from django.core.cache import cache
-from .models import PerformanceMetric
+from django.urls import Resolver404, resolve
+from .metrics_buffer import get_metrics_writer, get_instance_id
+from .response_cache import ResponseCache, connect_invalidation_signals, model_tag
 from .tasks import monitor_system_health
 
 
 class PerformanceMonitoringMiddleware:
     def __init__(self, get_response):
         self.get_response = get_response
+        # Resolved once at startup rather than on every request
+        self.metrics = get_metrics_writer()
 
     def __call__(self, request):
         # Start timing the request
-        start_time = time.time()
+        start_time = time.perf_counter()
         
         # Process the request
         response = self.get_response(request)
         
         # Calculate response time
-        response_time = time.time() - start_time
+        response_time = time.perf_counter() - start_time
         
-        # Store response time metric
-        PerformanceMetric.objects.create(
-            metric_type='response_time',
-            value=response_time * 1000,  # Convert to milliseconds
-            server_instance=self.get_instance_id()
-        )
+        # Buffer the response time metric; it is written in batches off-thread
+        self.metrics.record('response_time', response_time * 1000)  # Convert to milliseconds
         
         # Trigger system health monitoring if needed
         self.check_monitoring_threshold()
@@ -32,49 +32,103 @@ class PerformanceMonitoringMiddleware:
     
     def get_instance_id(self):
         """Get current server instance ID."""
-        try:
-            import requests
-            response = requests.get(
-                'http://169.254.169.254/latest/meta-data/instance-id',
-                timeout=1
-            )
-            return response.text
-        except:
-            return 'local-development'
+        return get_instance_id()
     
     def check_monitoring_threshold(self):
         """Check if we need to trigger system health monitoring."""
         last_check_key = 'last_health_check'
-        last_check = cache.get(last_check_key)
         
-        if not last_check:
+        # add() only succeeds for the first request in each window
+        if cache.add(last_check_key, time.time(), 300):  # Check every 5 minutes
             monitor_system_health.delay()
-            cache.set(last_check_key, time.time(), 300)  # Check every 5 minutes
 
 
 class CacheMiddleware:
+    """
+    Caches GET responses per user scope with stale-while-revalidate.
+
+    See ``response_cache`` for keying, storage and invalidation. Views
+    without a cache tag are never cached, since no write could invalidate them.
+    """
+
     def __init__(self, get_response):
         self.get_response = get_response
+        self.response_cache = ResponseCache()
+        connect_invalidation_signals()
 
     def __call__(self, request):
-        # Try to get response from cache
-        if request.method == 'GET':
-            cache_key = self.get_cache_key(request)
-            response = cache.get(cache_key)
-            
-            if response:
-                return response
-        
-        # Process the request
-        response = self.get_response(request)
-        
-        # Cache the response if it's cacheable
-        if request.method == 'GET' and response.status_code == 200:
-            cache_key = self.get_cache_key(request)
-            cache.set(cache_key, response, 300)  # Cache for 5 minutes
-        
+        if request.method != 'GET':
+            return self.get_response(request)
+        if not hasattr(request, 'cache_tags'):
+            request.cache_tags = self.resolve_cache_tags(request)
+        if not request.cache_tags:
+            return self.get_response(request)
+
+        entry = self.response_cache.get(request)
+        if entry is not None:
+            if self.response_cache.is_fresh(entry):
+                return self.response_cache.build_response(entry, 'HIT')
+            # Expired: one request refreshes it, the rest keep serving the stale copy
+            if not self.response_cache.acquire(request):
+                return self.response_cache.build_response(entry, 'STALE')
+            return self.regenerate(request)
+
+        if not self.response_cache.acquire(request):
+            # Another request is already computing this response
+            entry = self.response_cache.wait_for(request)
+            if entry is not None:
+                return self.response_cache.build_response(entry, 'HIT')
+            return self.get_response(request)
+        return self.regenerate(request)
+
+    def resolve_cache_tags(self, request):
+        """Tags of the view the request resolves to, before the view runs."""
+        try:
+            match = resolve(request.path_info, getattr(request, 'urlconf', None))
+        except Resolver404:
+            return []
+        return self.get_cache_tags(match.func, request, match.args, match.kwargs)
+
+    def regenerate(self, request):
+        """Compute the response and store it, holding the regeneration lock."""
+        try:
+            # Before the view runs: a write during it must invalidate the entry
+            tag_versions = self.response_cache.tag_versions(request.cache_tags)
+            response = self.get_response(request)
+            self.response_cache.store(request, response, tag_versions)
+        finally:
+            self.response_cache.release(request)
+        response['X-Cache'] = 'MISS'
         return response
-    
-    def get_cache_key(self, request):
-        """Generate a cache key based on the request."""
-        return f"cache:{request.path}:{request.GET.urlencode()}"
+
+    def get_cache_tags(self, view_func, request=None, view_args=(), view_kwargs=None):
+        """Tag responses with the model behind the view plus any declared tags."""
+        tags = list(getattr(view_func, 'cache_tags', ()))
+        view_class = getattr(view_func, 'cls', None) or getattr(view_func, 'view_class', None)
+        model = self.get_view_model(view_class, view_func, request, view_args, view_kwargs or {})
+        if model is not None:
+            tags.append(model_tag(model))
+        return tags
+
+    def get_view_model(self, view_class, view_func, request, view_args, view_kwargs):
+        """
+        The model a view serves: its queryset or model attribute, its
+        serializer's ``Meta.model``, or the model of ``get_queryset()``.
+        """
+        queryset = getattr(view_class, 'queryset', None)
+        model = getattr(queryset, 'model', None) or getattr(view_class, 'model', None)
+        if model is not None:
+            return model
+        serializer_meta = getattr(getattr(view_class, 'serializer_class', None), 'Meta', None)
+        model = getattr(serializer_meta, 'model', None)
+        if model is not None or request is None or not hasattr(view_class, 'get_queryset'):
+            return model
+        try:
+            view = view_class(**getattr(view_func, 'initkwargs', {}))
+            view.request, view.args, view.kwargs = request, view_args, view_kwargs
+            if hasattr(view_func, 'actions'):
+                view.action = view_func.actions.get('get')
+            return view.get_queryset().model
+        except Exception:
+            # Querysets built from request state the view sets up itself
+            return None
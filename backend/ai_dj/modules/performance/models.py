@@ -1,5 +1,6 @@
 from django.db import models
 from django.conf import settings
+from django.utils import timezone
 import json
 from django.utils.translation import gettext_lazy as _
 
@@ -49,7 +50,8 @@ class PerformanceMetric(models.Model):
         ]
     )
     value = models.FloatField()
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Set explicitly by the buffered writer so rows keep the time of measurement
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
     server_instance = models.CharField(max_length=100)
 
     class Meta:
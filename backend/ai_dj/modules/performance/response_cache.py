@@ -0,0 +1,272 @@
+"""
+Shared response cache used by ``CacheMiddleware``.
+
+Entries are keyed on the normalized path and query, the caller's auth scope
+and the values of the headers the response varies on. Only status, headers
+and (compressed) body are stored, never the response object itself.
+
+Each entry has a soft TTL. Past it, one request regenerates the entry while
+the others keep serving the stale copy until the hard TTL; on a cold miss one
+request computes the response and the others briefly wait for it. Entries
+carry tags (by default the model behind the view) whose versions are bumped
+on model writes, which invalidates every response built from that model.
+An entry is stamped with the versions read before its view ran, so a write
+that lands while the view renders invalidates it straight away.
+"""
+import hashlib
+import time
+import zlib
+from typing import Dict, Iterable, List, Optional
+from urllib.parse import parse_qsl, urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.http import HttpResponse
+from django.utils.cache import cc_delim_re
+import logging
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'response_cache:'
+
+DEFAULTS = {
+    'TIMEOUT': 300,
+    # How long an expired entry may still be served while it is regenerated
+    'STALE_TIMEOUT': 600,
+    'LOCK_TIMEOUT': 30,
+    # How long a cold miss waits for another request to fill the entry
+    'MISS_WAIT': 2.0,
+    'MISS_POLL_INTERVAL': 0.01,
+    'COMPRESS_MIN_SIZE': 1024,
+}
+
+# Response headers that are recomputed per request and never stored
+SKIPPED_HEADERS = {'set-cookie', 'content-length', 'x-cache', 'age'}
+
+
+def response_cache_setting(name: str):
+    return getattr(settings, 'RESPONSE_CACHE', {}).get(name, DEFAULTS[name])
+
+
+def _digest(*parts: str) -> str:
+    return hashlib.sha256('\x1f'.join(parts).encode('utf-8')).hexdigest()[:32]
+
+
+def model_tag(model) -> str:
+    return f"model:{model._meta.label_lower}"
+
+
+def cache_tags(*tags: str):
+    """
+    View decorator declaring extra invalidation tags for cached responses.
+    """
+    def decorator(view_func):
+        view_func.cache_tags = tuple(tags) + tuple(getattr(view_func, 'cache_tags', ()))
+        return view_func
+    return decorator
+
+
+def request_scope(request) -> str:
+    """
+    Identify whose data a response may contain.
+
+    Token-authenticated API requests are only resolved inside the view, so a
+    request carrying an Authorization header is scoped to that credential.
+    """
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return f"user:{user.pk}"
+    authorization = request.META.get('HTTP_AUTHORIZATION')
+    if authorization:
+        return f"auth:{_digest(authorization)}"
+    return 'anon'
+
+
+def normalized_query(request) -> str:
+    return urlencode(sorted(parse_qsl(request.META.get('QUERY_STRING', ''), keep_blank_values=True)))
+
+
+def base_key(request) -> str:
+    return _digest(request.method, request.path, normalized_query(request), request_scope(request))
+
+
+def _header_key(name: str) -> str:
+    return 'HTTP_' + name.upper().replace('-', '_')
+
+
+class ResponseCache:
+    """
+    Stale-while-revalidate response store with single-flight regeneration.
+    """
+
+    def __init__(self, cache_backend=None, clock=time.time, sleep=time.sleep):
+        self.cache = cache_backend or cache
+        self.clock = clock
+        self.sleep = sleep
+        self.timeout = response_cache_setting('TIMEOUT')
+        self.stale_timeout = response_cache_setting('STALE_TIMEOUT')
+        self.lock_timeout = response_cache_setting('LOCK_TIMEOUT')
+        self.miss_wait = response_cache_setting('MISS_WAIT')
+        self.poll_interval = response_cache_setting('MISS_POLL_INTERVAL')
+        self.compress_min_size = response_cache_setting('COMPRESS_MIN_SIZE')
+
+    # Keys
+
+    def _vary_key(self, base: str) -> str:
+        return f"{KEY_PREFIX}vary:{base}"
+
+    def _entry_key(self, base: str, request, vary: Iterable[str]) -> str:
+        values = [f"{name}={request.META.get(_header_key(name), '')}" for name in vary]
+        return f"{KEY_PREFIX}entry:{base}:{_digest(*values)}"
+
+    def _lock_key(self, base: str) -> str:
+        return f"{KEY_PREFIX}lock:{base}"
+
+    def _tag_key(self, tag: str) -> str:
+        return f"{KEY_PREFIX}tag:{tag}"
+
+    def entry_key(self, request) -> str:
+        base = base_key(request)
+        return self._entry_key(base, request, self.cache.get(self._vary_key(base)) or ())
+
+    # Tags
+
+    def tag_versions(self, tags: Iterable[str]) -> Dict[str, int]:
+        """
+        Current version of each tag. Take them before computing a response
+        and pass them to ``store``.
+        """
+        tags = list(tags)
+        if not tags:
+            return {}
+        keys = {self._tag_key(tag): tag for tag in tags}
+        found = self.cache.get_many(list(keys))
+        versions = {}
+        for key, tag in keys.items():
+            if key not in found:
+                # First entry under this tag: start its version so writes can bump it.
+                # Seeded from the clock, so a version that was evicted never comes
+                # back with a number older entries were stamped with
+                seed = time.time_ns()
+                self.cache.add(key, seed, None)
+                found[key] = self.cache.get(key, seed)
+            versions[tag] = found[key]
+        return versions
+
+    def invalidate_tags(self, *tags: str) -> None:
+        for tag in tags:
+            try:
+                self.cache.incr(self._tag_key(tag))
+            except ValueError:
+                pass  # Nothing has been cached under this tag yet
+
+    def _is_current(self, entry: Dict) -> bool:
+        tags = entry.get('tags') or {}
+        if not tags:
+            return True
+        found = self.cache.get_many([self._tag_key(tag) for tag in tags])
+        return all(found.get(self._tag_key(tag)) == version for tag, version in tags.items())
+
+    # Entries
+
+    def get(self, request) -> Optional[Dict]:
+        """
+        Return the cached entry for the request if it is valid, fresh or stale.
+        """
+        entry = self.cache.get(self.entry_key(request))
+        if entry is None or not self._is_current(entry):
+            return None
+        return entry
+
+    def is_fresh(self, entry: Dict) -> bool:
+        return self.clock() < entry['fresh_until']
+
+    def acquire(self, request) -> bool:
+        """
+        Claim the right to regenerate the request's entries.
+
+        Locks on the base key, since the vary headers of a cold entry are
+        only known once its response exists.
+        """
+        return self.cache.add(self._lock_key(base_key(request)), 1, self.lock_timeout)
+
+    def release(self, request) -> None:
+        self.cache.delete(self._lock_key(base_key(request)))
+
+    def wait_for(self, request) -> Optional[Dict]:
+        """
+        Poll for an entry another request is filling, up to the miss wait.
+        """
+        deadline = self.clock() + self.miss_wait
+        while self.clock() < deadline:
+            self.sleep(self.poll_interval)
+            entry = self.get(request)
+            if entry is not None:
+                return entry
+        return None
+
+    def is_cacheable(self, response) -> bool:
+        if response.status_code != 200 or response.streaming or response.has_header('Set-Cookie'):
+            return False
+        cache_control = response.get('Cache-Control', '').lower()
+        if 'private' in cache_control or 'no-store' in cache_control or 'no-cache' in cache_control:
+            return False
+        return '*' not in self.vary_headers(response)
+
+    @staticmethod
+    def vary_headers(response) -> List[str]:
+        if not response.has_header('Vary'):
+            return []
+        return sorted({header.strip().lower() for header in cc_delim_re.split(response['Vary']) if header.strip()})
+
+    def store(self, request, response, tag_versions: Optional[Dict[str, int]] = None) -> Optional[Dict]:
+        """
+        Cache the response under the tag versions taken before it was computed.
+        """
+        if not self.is_cacheable(response):
+            return None
+
+        body = response.content
+        compressed = len(body) >= self.compress_min_size
+        now = self.clock()
+        entry = {
+            'status': response.status_code,
+            'headers': [
+                (name, value) for name, value in response.items()
+                if name.lower() not in SKIPPED_HEADERS
+            ],
+            'body': zlib.compress(body, 6) if compressed else body,
+            'compressed': compressed,
+            'stored_at': now,
+            'fresh_until': now + self.timeout,
+            'tags': tag_versions or {},
+        }
+
+        base = base_key(request)
+        vary = self.vary_headers(response)
+        self.cache.set(self._vary_key(base), vary, self.timeout + self.stale_timeout)
+        self.cache.set(self._entry_key(base, request, vary), entry, self.timeout + self.stale_timeout)
+        return entry
+
+    def build_response(self, entry: Dict, status: str) -> HttpResponse:
+        body = zlib.decompress(entry['body']) if entry['compressed'] else entry['body']
+        response = HttpResponse(body, status=entry['status'])
+        for name, value in entry['headers']:
+            response[name] = value
+        response['Age'] = str(max(0, int(self.clock() - entry['stored_at'])))
+        response['X-Cache'] = status
+        return response
+
+
+def invalidate_model_tag(sender, **kwargs):
+    tag = model_tag(sender)
+    # Bump after commit so a concurrent request cannot re-cache the old rows
+    transaction.on_commit(lambda: ResponseCache().invalidate_tags(tag))
+
+
+def connect_invalidation_signals() -> None:
+    """Bump a model's tag whenever one of its rows is saved or deleted."""
+    post_save.connect(invalidate_model_tag, dispatch_uid='response_cache_post_save')
+    post_delete.connect(invalidate_model_tag, dispatch_uid='response_cache_post_delete')
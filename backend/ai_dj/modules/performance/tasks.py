@@ -1,11 +1,9 @@
 from celery import shared_task
-from django.core.cache import cache
 from django.utils import timezone
-from django.db.models import F
 import psutil
-import requests
+from .hit_counter import get_hit_counter, get_hit_statistics
+from .metrics_buffer import get_instance_id
 from .models import (
-    CacheableTrackTransition,
     PerformanceMetric,
     ScalingEvent
 )
@@ -13,12 +11,9 @@ from .models import (
 
 @shared_task
 def update_cache_statistics():
-    """Update cache hit statistics for track transitions."""
-    transitions = CacheableTrackTransition.objects.all()
-    for transition in transitions:
-        if cache.get(transition.cache_key):
-            transition.hit_count = F('hit_count') + 1
-            transition.save(update_fields=['hit_count', 'last_accessed'])
+    """Flush this worker's buffered transition hits and report the running totals."""
+    get_hit_counter().flush()
+    return get_hit_statistics()
 
 
 @shared_task
@@ -113,18 +108,6 @@ def trigger_auto_scaling():
         scale_instances(new_instance_count)
 
 
-def get_instance_id():
-    """Get current server instance ID."""
-    try:
-        response = requests.get(
-            'http://169.254.169.254/latest/meta-data/instance-id',
-            timeout=1
-        )
-        return response.text
-    except:
-        return 'local-development'
-
-
 def get_load_balancer_metrics():
     """Get metrics from load balancer."""
     # Implementation depends on your load balancer (e.g., AWS ELB, nginx)
@@ -16,6 +16,7 @@ from .serializers import (
     DeploymentLogSerializer,
     ScalingEventSerializer
 )
+from .hit_counter import get_hit_counter, get_hit_statistics
 from .tasks import (
     update_cache_statistics,
     trigger_auto_scaling,
@@ -37,9 +38,14 @@ class CacheableTrackTransitionViewSet(viewsets.ModelViewSet):
 
     @action(detail=False, methods=['POST'])
     def update_cache_stats(self, request):
-        """Update cache hit statistics."""
+        """
+        Flush this process's buffered hits, have one Celery worker flush its
+        own, and return the running totals. Hits buffered by other processes
+        are written by their own flushers within ``FLUSH_INTERVAL``.
+        """
+        get_hit_counter().flush()
         update_cache_statistics.delay()
-        return Response({'status': 'Cache statistics update initiated'})
+        return Response({'status': 'Cache statistics update initiated', **get_hit_statistics()})
 
     @action(detail=True, methods=['POST'])
     def invalidate_cache(self, request, pk=None):
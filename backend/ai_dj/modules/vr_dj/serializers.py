@@ -1,6 +1,11 @@
+from django.db import transaction
 from rest_framework import serializers
 from .models import VRDJSession, VRDJControl, VRDJEnvironment, VRDJInteraction
 
+# Largest number of controls accepted by one batch_update call
+CONTROL_BATCH_LIMIT = 10000
+CONTROL_BATCH_WRITE_SIZE = 1000
+
 
 class VRDJSessionSerializer(serializers.ModelSerializer):
     class Meta:
@@ -26,6 +31,98 @@ class VRDJControlSerializer(serializers.ModelSerializer):
         return value
 
 
+class VRDJControlBatchItemSerializer(serializers.Serializer):
+    """
+    One control in a batch; ``id`` selects an existing control to update.
+
+    Sessions and ids are plain integers here and are checked for the whole
+    batch at once by ``VRDJControlBatchSerializer``.
+    """
+    id = serializers.IntegerField(required=False)
+    session = serializers.IntegerField()
+    control_type = serializers.ChoiceField(
+        choices=VRDJControl._meta.get_field('control_type').choices
+    )
+    value = serializers.FloatField()
+
+    def validate_value(self, value):
+        if not 0 <= value <= 1:
+            raise serializers.ValidationError(
+                "Control value must be between 0 and 1"
+            )
+        return value
+
+
+class VRDJControlBatchSerializer(serializers.Serializer):
+    """
+    Validates a batch of controls and writes it with one bulk_create and
+    one bulk_update inside a transaction.
+
+    Expects ``sessions`` (the sessions the caller may write to) and
+    ``controls`` (the controls the caller may update) querysets in context.
+    """
+    controls = serializers.ListField(
+        child=VRDJControlBatchItemSerializer(),
+        allow_empty=False,
+        max_length=CONTROL_BATCH_LIMIT
+    )
+
+    def validate_controls(self, controls):
+        session_ids = {item['session'] for item in controls}
+        allowed_sessions = set(
+            self.context['sessions'].filter(id__in=session_ids).values_list('id', flat=True)
+        )
+        control_ids = {item['id'] for item in controls if 'id' in item}
+        existing = self.context['controls'].in_bulk(control_ids) if control_ids else {}
+
+        errors = {}
+        for index, item in enumerate(controls):
+            if item['session'] not in allowed_sessions:
+                errors[index] = {'session': [f"Invalid pk \"{item['session']}\" - object does not exist."]}
+            elif 'id' in item and item['id'] not in existing:
+                errors[index] = {'id': [f"Invalid pk \"{item['id']}\" - object does not exist."]}
+        if errors:
+            raise serializers.ValidationError(errors)
+
+        self.existing_controls = existing
+        return controls
+
+    def create(self, validated_data):
+        """Return the written controls in request order."""
+        controls = []
+        new_controls = []
+        updated_controls = {}
+        # bulk_update builds a CASE per field, so only send fields that changed
+        changed_fields = set()
+        for item in validated_data['controls']:
+            if 'id' in item:
+                control = self.existing_controls[item['id']]
+                updated_controls[control.id] = control
+                if control.session_id != item['session']:
+                    changed_fields.add('session')
+                if control.control_type != item['control_type']:
+                    changed_fields.add('control_type')
+                if control.value != item['value']:
+                    changed_fields.add('value')
+            else:
+                control = VRDJControl()
+                new_controls.append(control)
+            control.session_id = item['session']
+            control.control_type = item['control_type']
+            control.value = item['value']
+            controls.append(control)
+
+        with transaction.atomic():
+            VRDJControl.objects.bulk_create(new_controls, batch_size=CONTROL_BATCH_WRITE_SIZE)
+            if changed_fields:
+                VRDJControl.objects.bulk_update(
+                    updated_controls.values(),
+                    sorted(changed_fields),
+                    batch_size=CONTROL_BATCH_WRITE_SIZE
+                )
+        return controls
+
+
 class VRDJEnvironmentSerializer(serializers.ModelSerializer):
     class Meta:
         model = VRDJEnvironment
@@ -0,0 +1,14 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .models import VRDJInteraction
+from .stats import invalidate_session_stats
+
+
+@receiver(post_save, sender=VRDJInteraction)
+@receiver(post_delete, sender=VRDJInteraction)
+def refresh_session_stats(sender, instance, **kwargs):
+    """Drop the cached statistics of the interaction's session."""
+    session_id = instance.session_id
+    # After commit, so a concurrent request cannot re-cache the old counts
+    transaction.on_commit(lambda: invalidate_session_stats(session_id))
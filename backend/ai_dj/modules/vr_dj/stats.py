@@ -0,0 +1,77 @@
+"""
+Per-session interaction statistics for VR DJ sessions.
+
+Computed with a single GROUP BY query and cached per session until an
+interaction of that session is written (see ``signals``).
+"""
+from typing import Dict, Optional
+
+from django.core.cache import cache
+from django.db.models import Count, Sum
+
+from .models import VRDJInteraction, VRDJSession
+
+STATS_CACHE_KEY = 'vr_dj:session_stats:{session_id}'
+STATS_CACHE_TTL = 300
+
+
+def empty_stats() -> Dict:
+    return {
+        'total_interactions': 0,
+        'interaction_types': {},
+        'average_success_rating': None
+    }
+
+
+def build_session_stats(session_id: int) -> Dict:
+    """
+    Aggregate a session's interactions in the database.
+
+    One row per interaction type carries its count and the sum and count of
+    its success ratings, so totals and the overall average need no second
+    query.
+    """
+    rows = VRDJInteraction.objects.filter(session_id=session_id).order_by().values(
+        'interaction_type'
+    ).annotate(
+        count=Count('id'),
+        rating_sum=Sum('success_rating'),
+        rating_count=Count('success_rating')
+    )
+
+    stats = empty_stats()
+    rating_sum = 0.0
+    rating_count = 0
+    for row in rows:
+        stats['interaction_types'][row['interaction_type']] = row['count']
+        stats['total_interactions'] += row['count']
+        rating_sum += row['rating_sum'] or 0.0
+        rating_count += row['rating_count']
+    if rating_count:
+        stats['average_success_rating'] = rating_sum / rating_count
+    return stats
+
+
+def get_session_stats(session_id: int, user) -> Dict:
+    """
+    Cached statistics for a session, as seen by ``user``.
+
+    Only the session owner sees its interactions; anyone else gets empty
+    statistics, as the owner-scoped interaction queryset would give them.
+    """
+    key = STATS_CACHE_KEY.format(session_id=session_id)
+    entry = cache.get(key)
+    if entry is None:
+        entry = {
+            'owner_id': VRDJSession.objects.filter(id=session_id).values_list('user_id', flat=True).first(),
+            'stats': build_session_stats(session_id)
+        }
+        cache.set(key, entry, STATS_CACHE_TTL)
+    if entry['owner_id'] is None or entry['owner_id'] != user.pk:
+        return empty_stats()
+    return entry['stats']
+
+
+def invalidate_session_stats(session_id: Optional[int]) -> None:
+    if session_id is not None:
+        cache.delete(STATS_CACHE_KEY.format(session_id=session_id))
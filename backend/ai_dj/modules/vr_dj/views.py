@@ -8,8 +8,10 @@ from .serializers import (
     VRDJSessionSerializer,
     VRDJControlSerializer,
     VRDJEnvironmentSerializer,
-    VRDJInteractionSerializer
+    VRDJInteractionSerializer,
+    VRDJControlBatchSerializer
 )
+from .stats import get_session_stats
 
 
 class VRDJSessionViewSet(viewsets.ModelViewSet):
@@ -53,11 +55,17 @@ class VRDJControlViewSet(mixins.CreateModelMixin,
 
     @action(detail=False, methods=['POST'])
     def batch_update(self, request):
-        controls = request.data.get('controls', [])
-        serializer = self.get_serializer(data=controls, many=True)
+        """Create controls, or update those given an ``id``, in one transaction."""
+        serializer = VRDJControlBatchSerializer(
+            data={'controls': request.data.get('controls', [])},
+            context={
+                'sessions': VRDJSession.objects.filter(user=request.user),
+                'controls': self.get_queryset()
+            }
+        )
         serializer.is_valid(raise_exception=True)
-        serializer.save()
-        return Response(serializer.data)
+        controls = serializer.save()
+        return Response(self.get_serializer(controls, many=True).data)
 
 
 class VRDJEnvironmentViewSet(viewsets.ModelViewSet):
@@ -107,26 +115,12 @@ class VRDJInteractionViewSet(mixins.CreateModelMixin,
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        interactions = self.get_queryset().filter(session_id=session_id)
-        stats = {
-            'total_interactions': interactions.count(),
-            'interaction_types': {},
-            'average_success_rating': None
-        }
-
-        # Calculate interaction type distribution
-        for interaction in interactions:
-            interaction_type = interaction.interaction_type
-            stats['interaction_types'][interaction_type] = (
-                stats['interaction_types'].get(interaction_type, 0) + 1
+        try:
+            session_id = int(session_id)
+        except ValueError:
+            return Response(
+                {"error": "session_id must be an integer"},
+                status=status.HTTP_400_BAD_REQUEST
             )
 
-        # Calculate average success rating
-        success_ratings = [
-            i.success_rating for i in interactions
-            if i.success_rating is not None
-        ]
-        if success_ratings:
-            stats['average_success_rating'] = sum(success_ratings) / len(success_ratings)
-
-        return Response(stats)
+        return Response(get_session_stats(session_id, request.user))
@@ -0,0 +1,30 @@
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from .models import AIDJSession, AIDJPlayHistory, AIDJFeedback
+from .metrics import get_metrics_snapshot_engine
+
+
+@receiver(post_save, sender=AIDJPlayHistory)
+def record_play_metrics(sender, instance, created, **kwargs):
+    """Count new plays against the user's cached metrics snapshot."""
+    if not created:
+        return
+    # Only use the genre when the track is already loaded; never query for it
+    genre = instance.track.genre if AIDJPlayHistory.track.is_cached(instance) else None
+    get_metrics_snapshot_engine().record(instance.user_id, 'play', genre=genre)
+
+
+@receiver(post_save, sender=AIDJFeedback)
+def record_feedback_metrics(sender, instance, created, **kwargs):
+    """Count new feedback against the user's cached metrics snapshot."""
+    if created:
+        get_metrics_snapshot_engine().record(instance.user_id, 'feedback', feedback_type=instance.feedback_type)
+
+
+@receiver(post_save, sender=AIDJSession)
+def record_session_metrics(sender, instance, created, **kwargs):
+    """Count new sessions against the user's cached metrics snapshot."""
+    if created:
+        get_metrics_snapshot_engine().record(
+            instance.user_id, 'session', voice_command=bool(instance.last_voice_command)
+        )
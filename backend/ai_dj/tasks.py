@@ -0,0 +1,12 @@
+from celery import shared_task
+from .announcements import presynthesize
+from .models import AIDJSession
+
+
+@shared_task
+def presynthesize_announcements(session_id):
+    """Synthesize a session's common announcements into the announcement cache."""
+    session = AIDJSession.objects.filter(id=session_id).first()
+    if session is None or not session.enable_announcements:
+        return 0
+    return presynthesize(session)
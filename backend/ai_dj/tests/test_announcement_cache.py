@@ -0,0 +1,308 @@
+import base64
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+from unittest import mock, skipUnless
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase, override_settings
+from rest_framework.renderers import JSONRenderer
+from rest_framework.routers import DefaultRouter
+from rest_framework.test import APIRequestFactory, force_authenticate
+from .. import announcements
+from ..announcements import AnnouncementCache, announcement_key, get_voice_params, presynthesize
+from ..models import AIDJSession
+from ..views import AIDJSessionViewSet
+
+User = get_user_model()
+
+RUN_BENCHMARKS = os.getenv('RUN_BENCHMARKS', '').lower() == 'true'
+BENCHMARK_REQUESTS = int(os.getenv('BENCHMARK_REQUESTS', 200))
+BENCHMARK_DISTINCT = int(os.getenv('BENCHMARK_DISTINCT', 20))
+BENCHMARK_TTS_LATENCY = float(os.getenv('BENCHMARK_TTS_LATENCY', 0.15))
+
+router = DefaultRouter()
+router.register(r'sessions', AIDJSessionViewSet, basename='session')
+urlpatterns = router.urls
+
+# Stand-in for google.cloud.texttospeech
+fake_tts = SimpleNamespace(
+    SynthesisInput=lambda text: {'text': text},
+    VoiceSelectionParams=lambda **kwargs: kwargs,
+    AudioConfig=lambda **kwargs: kwargs,
+    SsmlVoiceGender={'FEMALE': 2, 'MALE': 1},
+    AudioEncoding=SimpleNamespace(MP3=2),
+)
+
+
+class FakeTTSClient:
+    """Returns deterministic pseudo-MP3 audio, about 16KB per second of speech."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def synthesize_speech(self, input, voice, audio_config):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.latency)
+        seed = f"{input['text']}|{voice['name']}|{audio_config['speaking_rate']}".encode()
+        frames = max(1, len(input['text']) // 12) * 16000
+        return SimpleNamespace(audio_content=b'ID3' + (seed * (frames // len(seed) + 1))[:frames])
+
+
+class AnnouncementCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.voice = {'language_code': 'en', 'name': 'en-US-Neural2-A', 'gender': 'FEMALE',
+                      'speaking_rate': 1.0, 'pitch': 0.0}
+
+    def test_key_covers_text_voice_and_language(self):
+        key = announcement_key('Welcome!', self.voice)
+
+        self.assertEqual(key, announcement_key('Welcome!', dict(reversed(list(self.voice.items())))))
+        self.assertNotEqual(key, announcement_key('Welcome!!', self.voice))
+        self.assertNotEqual(key, announcement_key('Welcome!', {**self.voice, 'pitch': 2.0}))
+        self.assertNotEqual(key, announcement_key('Welcome!', {**self.voice, 'language_code': 'fr'}))
+
+    def test_concurrent_misses_synthesize_once(self):
+        cache = AnnouncementCache(self.directory)
+        calls = []
+
+        def synthesize(text, voice_params):
+            calls.append(text)
+            time.sleep(0.05)
+            return b'audio'
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(cache.get_or_synthesize('Hi', self.voice, synthesize)))
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(calls, ['Hi'])
+        self.assertEqual(len({path for _, path, _ in results}), 1)
+        self.assertEqual(sum(created for _, _, created in results), 1)
+        with open(results[0][1], 'rb') as audio_file:
+            self.assertEqual(audio_file.read(), b'audio')
+
+    def test_least_recently_used_files_are_evicted(self):
+        cache = AnnouncementCache(self.directory, max_bytes=3000)
+        keys = [announcement_key(f"track {i}", self.voice) for i in range(3)]
+        for age, key in enumerate(keys):
+            path = cache.put(key, b'x' * 1000)
+            os.utime(path, (time.time() - 100 + age, time.time() - 100 + age))
+        cache.get(keys[0])
+
+        cache.put(announcement_key('track 3', self.voice), b'x' * 1000)
+
+        self.assertIsNotNone(cache.get(keys[0]))
+        self.assertIsNone(cache.get(keys[1]))
+        self.assertIsNone(cache.get(keys[2]))
+        self.assertEqual(cache._size, 2000)
+
+
+    def test_opened_audio_survives_eviction(self):
+        cache = AnnouncementCache(self.directory)
+        cache.put('a' * 64, b'ID3audio')
+
+        audio_file = cache.open_audio('a' * 64)
+        os.unlink(cache.path('a' * 64))
+
+        with audio_file:
+            self.assertEqual(audio_file.read(), b'ID3audio')
+        self.assertIsNone(cache.open_audio('a' * 64))
+
+    def test_default_directory_is_outside_the_source_tree(self):
+        with mock.patch.object(announcements.config.ANNOUNCEMENTS, 'CACHE_DIR', ''):
+            with override_settings(MEDIA_ROOT=self.directory):
+                self.assertEqual(AnnouncementCache().directory, os.path.join(self.directory, 'announcement_cache'))
+            with override_settings(MEDIA_ROOT=''):
+                self.assertEqual(
+                    AnnouncementCache().directory, os.path.join(tempfile.gettempdir(), 'announcement_cache')
+                )
+
+
+class AnnouncementViewMixin:
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.cache = AnnouncementCache(directory)
+        self.client_tts = FakeTTSClient()
+        for target, value in [
+            ('ai_dj.announcements.tts', fake_tts),
+            ('ai_dj.announcements.get_announcement_cache', lambda: self.cache),
+            ('ai_dj.announcements.get_tts_client', lambda: self.client_tts),
+            ('ai_dj.views.presynthesize_announcements', mock.Mock()),
+        ]:
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user(username='mc', email='mc@example.com', password='testpass123')
+        self.session = AIDJSession.objects.create(user=self.user, voice_style='energetic')
+
+    def post(self, text, query='', **headers):
+        view = AIDJSessionViewSet.as_view({'post': 'generate_announcement'}, basename='session')
+        request = APIRequestFactory().post(f'/{query}', {'text': text}, format='json', **headers)
+        force_authenticate(request, user=self.user)
+        return view(request, pk=self.session.pk)
+
+
+@override_settings(ROOT_URLCONF=__name__)
+class GenerateAnnouncementTests(AnnouncementViewMixin, TestCase):
+    def test_audio_is_streamed_and_cached(self):
+        first = self.post('Welcome to the party!')
+        second = self.post('Welcome to the party!')
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first['Content-Type'], 'audio/mpeg')
+        audio = b''.join(first.streaming_content)
+        self.assertTrue(audio.startswith(b'ID3'))
+        self.assertEqual(b''.join(second.streaming_content), audio)
+        self.assertEqual(first['ETag'], second['ETag'])
+        self.assertIn(first['ETag'].strip('"'), first['Content-Location'])
+        self.assertEqual(self.client_tts.calls, 1)
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.last_announcement, 'Welcome to the party!')
+
+    def test_matching_etag_is_not_modified(self):
+        etag = self.post('Next up!')['ETag']
+
+        response = self.post('Next up!', HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+        view = AIDJSessionViewSet.as_view({'get': 'announcement_audio'}, basename='session')
+        request = APIRequestFactory().get('/')
+        force_authenticate(request, user=self.user)
+        response = view(request, pk=self.session.pk, audio_key=etag.strip('"'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_base64_encoding_keeps_the_json_response(self):
+        response = self.post('Hands up!', query='?encoding=base64')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['content_type'], 'audio/mpeg')
+        self.assertTrue(base64.b64decode(response.data['audio_content']).startswith(b'ID3'))
+
+    def test_cached_audio_is_served_without_tts(self):
+        self.post('One more tune!')
+
+        with mock.patch('ai_dj.announcements.get_tts_client', return_value=None):
+            cached = self.post('One more tune!')
+            missing = self.post('Something new')
+
+        self.assertEqual(cached.status_code, 200)
+        self.assertEqual(missing.status_code, 503)
+
+    def test_evicted_audio_is_not_found(self):
+        etag = self.post('Bass check!')['ETag']
+        os.unlink(self.cache.path(etag.strip('"')))
+
+        view = AIDJSessionViewSet.as_view({'get': 'announcement_audio'}, basename='session')
+        request = APIRequestFactory().get('/')
+        force_authenticate(request, user=self.user)
+
+        self.assertEqual(view(request, pk=self.session.pk, audio_key=etag.strip('"')).status_code, 404)
+
+    def test_settings_update_queues_presynthesis_after_commit(self):
+        self.session.supported_languages = ['en']
+        self.session.command_mappings = {'next': 'skip'}
+        self.session.announcement_templates = {'en': {'default': 'Stay hydrated!'}}
+        self.session.save()
+        view = AIDJSessionViewSet.as_view({'post': 'update_announcement_settings'}, basename='session')
+        request = APIRequestFactory().post('/', {'enable_announcements': True, 'voice_style': 'calm'}, format='json')
+        force_authenticate(request, user=self.user)
+
+        with mock.patch('ai_dj.views.presynthesize_announcements') as task:
+            task.delay.side_effect = ConnectionError('broker down')
+            with self.captureOnCommitCallbacks() as callbacks:
+                response = view(request, pk=self.session.pk)
+            task.delay.assert_not_called()
+            with self.assertLogs('ai_dj.views', 'ERROR'):
+                for callback in callbacks:
+                    callback()
+
+        self.assertEqual(response.status_code, 200)
+        task.delay.assert_called_once_with(self.session.pk)
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.voice_style, 'calm')
+
+    def test_presynthesize_common_announcements(self):
+        self.session.announcement_templates = {'en': {'default': 'Stay hydrated!', 'next': 'Next up: {track}'}}
+        self.session.save()
+
+        created = presynthesize(self.session, client=self.client_tts)
+
+        self.assertEqual(created, len(announcements.config.ANNOUNCEMENTS.COMMON_ANNOUNCEMENTS) + 1)
+        self.assertEqual(presynthesize(self.session, client=self.client_tts), 0)
+        self.assertIsNotNone(self.cache.get(announcement_key('Stay hydrated!', get_voice_params(self.session))))
+        self.assertEqual(self.post('Stay hydrated!').status_code, 200)
+        self.assertEqual(self.client_tts.calls, created)
+
+
+@skipUnless(RUN_BENCHMARKS, 'Set RUN_BENCHMARKS=true to run benchmarks')
+@override_settings(ROOT_URLCONF=__name__)
+class AnnouncementBenchmark(AnnouncementViewMixin, TestCase):
+    """BENCHMARK_REQUESTS announcements drawn from BENCHMARK_DISTINCT texts."""
+
+    def legacy(self, text):
+        """Synthesis on every call and base64 JSON, as generate_announcement did before."""
+        audio = announcements.synthesize_speech(self.client_tts, text, get_voice_params(self.session))
+        return JSONRenderer().render({
+            'audio_content': base64.b64encode(audio).decode(),
+            'content_type': 'audio/mpeg',
+            'text': text
+        })
+
+    def test_latency_and_bytes(self):
+        self.client_tts.latency = BENCHMARK_TTS_LATENCY
+        texts = [f"Coming up next, track number {i} of tonight's set!" for i in range(BENCHMARK_DISTINCT)]
+        requests = [random.choice(texts) for _ in range(BENCHMARK_REQUESTS)]
+
+        legacy_latency, legacy_bytes = [], 0
+        for text in requests:
+            start = time.perf_counter()
+            legacy_bytes += len(self.legacy(text))
+            legacy_latency.append(time.perf_counter() - start)
+        legacy_calls = self.client_tts.calls
+
+        self.client_tts.calls = 0
+        cached_latency, cached_bytes = [], 0
+        for text in requests:
+            start = time.perf_counter()
+            cached_bytes += len(b''.join(self.post(text).streaming_content))
+            cached_latency.append(time.perf_counter() - start)
+
+        # Clients that keep the audio revalidate it by ETag
+        etags = {text: self.post(text)['ETag'] for text in texts}
+        revalidated_latency = []
+        for text in requests:
+            start = time.perf_counter()
+            self.assertEqual(self.post(text, HTTP_IF_NONE_MATCH=etags[text]).status_code, 304)
+            revalidated_latency.append(time.perf_counter() - start)
+
+        print(
+            f"\n{BENCHMARK_REQUESTS} announcements, {BENCHMARK_DISTINCT} distinct texts, "
+            f"{BENCHMARK_TTS_LATENCY * 1000:.0f}ms TTS latency:\n"
+            f"  legacy: {legacy_calls} syntheses, median {statistics.median(legacy_latency) * 1000:.1f}ms, "
+            f"{legacy_bytes / 1e6:.1f}MB sent\n"
+            f"  cached: {self.client_tts.calls} syntheses, median {statistics.median(cached_latency) * 1000:.1f}ms, "
+            f"{cached_bytes / 1e6:.1f}MB sent ({(1 - cached_bytes / legacy_bytes) * 100:.0f}% fewer bytes)\n"
+            f"  revalidated by ETag: median {statistics.median(revalidated_latency) * 1000:.1f}ms, no audio sent"
+        )
+        self.assertLessEqual(self.client_tts.calls, BENCHMARK_DISTINCT)
+        self.assertLess(cached_bytes, legacy_bytes)
+        self.assertLess(statistics.median(cached_latency), statistics.median(legacy_latency))
@@ -0,0 +1,267 @@
+import os
+import random
+import statistics
+import time
+from unittest import skipUnless
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Avg, Count
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from rest_framework.test import APIRequestFactory, force_authenticate
+from ..models import AIDJSession
+from ..modules.biometrics.aggregator import (
+    GroupStateAggregator, ReadingHistogram, SessionWindow, get_group_state_aggregator
+)
+from ..modules.biometrics.models import BiometricData, GroupEmotionalState, WearableDevice
+from ..modules.biometrics.views import GroupEmotionalStateViewSet
+
+User = get_user_model()
+
+RUN_BENCHMARKS = os.getenv('RUN_BENCHMARKS', '').lower() == 'true'
+BENCHMARK_PARTICIPANTS = int(os.getenv('BENCHMARK_PARTICIPANTS', 5000))
+BENCHMARK_SECONDS = int(os.getenv('BENCHMARK_SECONDS', 360))
+INSERT_BATCH_SIZE = 50_000
+
+MOODS = ['energetic', 'calm', 'stressed', 'focused']
+
+
+def random_sample(device_id):
+    return (
+        device_id, random.randint(50, 190), random.randint(0, 100),
+        random.randint(0, 100), random.randint(0, 100), random.choice(MOODS)
+    )
+
+
+class ReadingHistogramTests(SimpleTestCase):
+    def test_quantiles_are_exact(self):
+        values = [random.randint(40, 200) for _ in range(1001)]
+        histogram = ReadingHistogram(250)
+        for value in values:
+            histogram.add(value)
+
+        self.assertEqual(histogram.median(), statistics.median(values))
+        self.assertEqual(histogram.quantile(0.0), min(values))
+        self.assertEqual(histogram.quantile(1.0), max(values))
+
+    def test_even_count_median_interpolates(self):
+        histogram = ReadingHistogram(100)
+        for value in [10, 20, 30, 40]:
+            histogram.add(value)
+        histogram.remove(40)
+        histogram.add(60)
+
+        self.assertEqual(histogram.median(), 25.0)
+
+
+class SessionWindowTests(SimpleTestCase):
+    def test_old_buckets_expire(self):
+        window = SessionWindow(window_seconds=60, bucket_seconds=5)
+        window.add((1, 60, 10, 10, 10, 'calm'), 1000.0)
+        window.add((2, 180, 90, 90, 90, 'energetic'), 1030.0)
+        window.add((2, 170, 90, 90, 90, 'energetic'), 1070.0)
+
+        snapshot = window.snapshot(1070.0)
+
+        self.assertEqual(len(window), 2)
+        self.assertEqual(snapshot['median_heart_rate'], 175.0)
+        self.assertEqual(snapshot['participant_count'], 1)
+        self.assertEqual(snapshot['dominant_emotion'], 'energetic')
+        self.assertEqual(snapshot['consensus_strength'], 1.0)
+        self.assertIsNone(window.snapshot(2000.0))
+
+    def test_samples_older_than_window_are_ignored(self):
+        window = SessionWindow(window_seconds=60, bucket_seconds=5)
+        window.add((1, 100, 50, 50, 50, 'calm'), 1000.0)
+        window.add((2, 100, 50, 50, 50, 'calm'), 900.0)
+
+        self.assertEqual(len(window), 1)
+
+
+class GroupStateAggregatorTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        get_group_state_aggregator().reset()
+        self.user = User.objects.create_user(username='raver', email='raver@example.com', password='testpass123')
+        self.session = AIDJSession.objects.create(user=self.user)
+        self.devices = [
+            WearableDevice.objects.create(device_id=f"watch_{i}", name=f"Watch {i}", type='garmin')
+            for i in range(5)
+        ]
+        self.now = time.time()
+
+    def create_data(self, device, heart_rate, mood='calm'):
+        return BiometricData.objects.create(
+            device=device, session=self.session, heart_rate=heart_rate,
+            stress_level=20, energy_level=40, movement=30, mood=mood
+        )
+
+    def test_window_is_loaded_from_stored_samples(self):
+        for device, heart_rate in zip(self.devices, [60, 70, 80, 90, 200]):
+            self.create_data(device, heart_rate, mood='energetic' if heart_rate > 75 else 'calm')
+        aggregator = GroupStateAggregator(clock=lambda: self.now)
+
+        with self.assertNumQueries(1):
+            snapshot = aggregator.snapshot(self.session.id)
+        with self.assertNumQueries(0):
+            aggregator.snapshot(self.session.id)
+
+        self.assertEqual(snapshot['median_heart_rate'], 80.0)
+        self.assertEqual(snapshot['participant_count'], 5)
+        self.assertEqual(snapshot['emotion_distribution'], {'energetic': 0.6, 'calm': 0.4})
+        self.assertEqual(aggregator.quantiles(self.session.id, 'heart_rate', [0.0, 1.0]), [60.0, 200.0])
+
+    def test_writes_are_rate_limited(self):
+        clock = [self.now]
+        aggregator = GroupStateAggregator(write_interval=10, clock=lambda: clock[0])
+        self.create_data(self.devices[0], 100)
+
+        states = [aggregator.write_state(self.session.id) for _ in range(5)]
+        clock[0] += 10
+        states.append(aggregator.write_state(self.session.id))
+
+        self.assertEqual(len([state for state in states if state is not None]), 2)
+        self.assertEqual(GroupEmotionalState.objects.filter(session=self.session).count(), 2)
+
+    def test_new_samples_reach_the_window_after_commit(self):
+        aggregator = get_group_state_aggregator()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_data(self.devices[0], 100)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_data(self.devices[1], 120, mood='focused')
+
+        snapshot = aggregator.snapshot(self.session.id)
+
+        self.assertEqual(snapshot['median_heart_rate'], 110.0)
+        self.assertEqual(snapshot['participant_count'], 2)
+        # The first sample wrote a state; the second fell in the same interval
+        self.assertEqual(GroupEmotionalState.objects.filter(session=self.session).count(), 1)
+
+    def test_samples_from_other_processes_are_caught_up(self):
+        clock = [self.now]
+        aggregator = GroupStateAggregator(sync_interval=1, clock=lambda: clock[0])
+        aggregator.add(self.create_data(self.devices[0], 100))
+
+        # Saved by another process: this aggregator never sees the rows directly
+        BiometricData.objects.bulk_create([
+            BiometricData(
+                device=device, session=self.session, heart_rate=140,
+                stress_level=20, energy_level=40, movement=30, mood='focused'
+            )
+            for device in self.devices[1:3]
+        ])
+        local = self.create_data(self.devices[3], 120)
+        aggregator.add(local)
+        self.assertEqual(aggregator.snapshot(self.session.id)['participant_count'], 2)
+
+        clock[0] += 1
+        with self.assertNumQueries(1):
+            snapshot = aggregator.snapshot(self.session.id)
+        aggregator.add(local)
+
+        self.assertEqual(snapshot['participant_count'], 4)
+        self.assertEqual(aggregator.quantiles(self.session.id, 'heart_rate', [0.0, 0.5, 1.0]), [100.0, 130.0, 140.0])
+
+    def test_calculate_group_state_view(self):
+        view = GroupEmotionalStateViewSet.as_view({'post': 'calculate_group_state'})
+        factory = APIRequestFactory()
+
+        def post():
+            request = factory.post('/', {'session_id': self.session.id}, format='json')
+            force_authenticate(request, user=self.user)
+            return view(request)
+
+        missing = post()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_data(self.devices[0], 100)
+        stored = GroupEmotionalState.objects.get(session=self.session)
+        response = post()
+
+        self.assertEqual(missing.status_code, 404)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['median_heart_rate'], 100.0)
+        self.assertEqual(GroupEmotionalState.objects.filter(session=self.session).count(), 1)
+        self.assertEqual(stored.median_heart_rate, 100.0)
+
+
+@skipUnless(RUN_BENCHMARKS, 'Set RUN_BENCHMARKS=true to run benchmarks')
+class GroupStateBenchmark(TransactionTestCase):
+    """BENCHMARK_PARTICIPANTS participants posting at 1 Hz into one session."""
+
+    def setUp(self):
+        cache.clear()
+        user = User.objects.create_user(username='crowd', email='crowd@example.com', password='testpass123')
+        self.session = AIDJSession.objects.create(user=user)
+        self.devices = WearableDevice.objects.bulk_create([
+            WearableDevice(device_id=f"watch_{i}", name=f"Watch {i}", type='garmin')
+            for i in range(BENCHMARK_PARTICIPANTS)
+        ])
+
+    def legacy_group_state(self, session_id):
+        """The per-request aggregation calculate_group_state ran before."""
+        recent_data = BiometricData.objects.filter(session_id=session_id)
+        recent_data.exists()
+        recent_data.aggregate(
+            median_heart_rate=Avg('heart_rate'),
+            median_energy_level=Avg('energy_level'),
+            median_stress_level=Avg('stress_level')
+        )
+        list(recent_data.values('mood').annotate(count=Count('id')).order_by('-count'))
+        return recent_data.values('device').distinct().count()
+
+    def test_crowd(self):
+        # Five minutes of samples in the table for the legacy query
+        rows = BENCHMARK_PARTICIPANTS * 300
+        for offset in range(0, rows, INSERT_BATCH_SIZE):
+            BiometricData.objects.bulk_create([
+                BiometricData(
+                    device_id=self.devices[(offset + i) % BENCHMARK_PARTICIPANTS].id,
+                    session=self.session, heart_rate=random.randint(50, 190),
+                    stress_level=random.randint(0, 100), energy_level=random.randint(0, 100),
+                    movement=random.randint(0, 100), mood=random.choice(MOODS)
+                )
+                for i in range(min(INSERT_BATCH_SIZE, rows - offset))
+            ])
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+        timings = []
+        for _ in range(3):
+            start = time.perf_counter()
+            participants = self.legacy_group_state(self.session.id)
+            timings.append(time.perf_counter() - start)
+        legacy_ms = min(timings) * 1000
+        self.assertEqual(participants, BENCHMARK_PARTICIPANTS)
+
+        # Simulated traffic through the streaming aggregator
+        clock = [1_700_000_000.0]
+        aggregator = GroupStateAggregator(clock=lambda: clock[0])
+        device_ids = [device.id for device in self.devices]
+        add_seconds = snapshot_seconds = 0.0
+        writes = 0
+        for second in range(BENCHMARK_SECONDS):
+            clock[0] += 1
+            samples = [(random_sample(device_id), clock[0]) for device_id in device_ids]
+            start = time.perf_counter()
+            aggregator.extend(self.session.id, samples)
+            add_seconds += time.perf_counter() - start
+
+            start = time.perf_counter()
+            snapshot = aggregator.snapshot(self.session.id)
+            snapshot_seconds += time.perf_counter() - start
+            writes += aggregator.should_write(self.session.id)
+
+        window, _ = aggregator.get_window(self.session.id)
+        total_samples = BENCHMARK_PARTICIPANTS * BENCHMARK_SECONDS
+        print(
+            f"\n{BENCHMARK_PARTICIPANTS} participants at 1 Hz over {BENCHMARK_SECONDS}s:\n"
+            f"  legacy aggregation over {rows} rows: {legacy_ms:.0f}ms per call "
+            f"({legacy_ms * BENCHMARK_PARTICIPANTS / 1000:.0f}s of database time per second if run per post)\n"
+            f"  streaming window: add {add_seconds / total_samples * 1e6:.2f}us per sample "
+            f"({add_seconds / BENCHMARK_SECONDS * 1000:.1f}ms per second of traffic), "
+            f"snapshot {snapshot_seconds / BENCHMARK_SECONDS * 1000:.2f}ms, "
+            f"{len(window)} samples in window, {writes} state writes"
+        )
+        self.assertEqual(snapshot['participant_count'], BENCHMARK_PARTICIPANTS)
+        self.assertLessEqual(writes, BENCHMARK_SECONDS // aggregator.write_interval + 1)
+        self.assertLess(snapshot_seconds / BENCHMARK_SECONDS * 1000, legacy_ms)
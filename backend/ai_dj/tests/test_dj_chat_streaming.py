@@ -0,0 +1,270 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from unittest import mock, skipUnless
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase, TransactionTestCase, override_settings
+from ..models import AIDJSession
+from ..modules.dj_chat import llm
+from ..modules.dj_chat.consumers import DJChatConsumer
+from ..modules.dj_chat.llm import FakeChatProvider, random_music_fact, stream_ai_response
+from ..modules.dj_chat.models import ChatSession, ChatMessage, MusicFact
+from ..modules.dj_chat.routing import websocket_urlpatterns
+
+User = get_user_model()
+
+IN_MEMORY_CHANNEL_LAYERS = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer', 'CONFIG': {'capacity': 10000}}}
+
+RUN_BENCHMARKS = os.getenv('RUN_BENCHMARKS', '').lower() == 'true'
+BENCHMARK_CHATS = int(os.getenv('BENCHMARK_CHATS', 500))
+BENCHMARK_LEGACY_CHATS = int(os.getenv('BENCHMARK_LEGACY_CHATS', 50))
+FIRST_TOKEN_LATENCY = float(os.getenv('BENCHMARK_FIRST_TOKEN_LATENCY', 0.4))
+TOKEN_LATENCY = float(os.getenv('BENCHMARK_TOKEN_LATENCY', 0.02))
+
+
+def create_chat_session(username):
+    user = User.objects.create_user(username=username, email=f"{username}@example.com", password='testpass123')
+    return ChatSession.objects.create(session=AIDJSession.objects.create(user=user), user=user)
+
+
+class StreamingResponseTests(TestCase):
+    def setUp(self):
+        self.chat_session = create_chat_session('chatuser')
+        self.message = ChatMessage.objects.create(
+            session=self.chat_session, content='Play something upbeat', context={}
+        )
+
+    def test_reply_streams_token_by_token(self):
+        provider = FakeChatProvider(reply='Try some funk tonight')
+        result = {}
+
+        async def collect():
+            return [token async for token in stream_ai_response(self.message, [self.message], None, result, provider)]
+
+        tokens = async_to_sync(collect)()
+
+        self.assertEqual(tokens, ['Try', ' some', ' funk', ' tonight'])
+        self.assertEqual(result['message'], 'Try some funk tonight')
+        self.assertEqual(result['suggestions'], ['What else do you like?', 'Want a remix?'])
+
+    def test_suggestions_are_requested_concurrently(self):
+        provider = FakeChatProvider(first_token_delay=0.2)
+        result = {}
+
+        async def collect():
+            async for _ in stream_ai_response(self.message, [self.message], None, result, provider):
+                pass
+
+        start = time.perf_counter()
+        async_to_sync(collect)()
+
+        self.assertEqual(len(provider.calls), 2)
+        self.assertLess(time.perf_counter() - start, 0.35)
+
+    def test_provider_failure_falls_back(self):
+        class BrokenProvider(FakeChatProvider):
+            async def stream_chat(self, messages, max_tokens, temperature=0.7):
+                raise RuntimeError('upstream down')
+                yield
+
+        result = {}
+
+        async def collect():
+            return [token async for token in stream_ai_response(self.message, [], None, result, BrokenProvider())]
+
+        tokens = async_to_sync(collect)()
+
+        self.assertEqual(tokens, [llm.FALLBACK_MESSAGE])
+        self.assertEqual(result['suggestions'], llm.FALLBACK_SUGGESTIONS)
+
+
+@override_settings(OPENAI_API_KEY='test-key')
+class OpenAIChatProviderTests(TestCase):
+    def test_each_event_loop_gets_its_own_client(self):
+        provider = llm.OpenAIChatProvider()
+
+        async def clients():
+            return provider.client, provider.client
+
+        first, again = async_to_sync(clients)()
+        second, _ = async_to_sync(clients)()
+
+        self.assertIs(first, again)
+        self.assertIsNot(first, second)
+        # Clients of loops that have since closed are not kept
+        self.assertLessEqual(len(provider._clients), 1)
+
+
+class RandomMusicFactTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.facts = [
+            MusicFact.objects.create(title=f"Fact {i}", content='...', verified=True) for i in range(3)
+        ]
+        MusicFact.objects.create(title='Unverified', content='...', verified=False)
+
+    def test_fact_is_picked_by_primary_key_from_cached_ids(self):
+        with self.assertNumQueries(2):
+            self.assertIn(random_music_fact(), self.facts)
+
+        with self.assertNumQueries(1) as captured:
+            self.assertIn(random_music_fact(), self.facts)
+        self.assertNotIn('RANDOM', captured.captured_queries[0]['sql'].upper())
+
+    def test_fact_changes_refresh_the_id_list(self):
+        random_music_fact()
+        MusicFact.objects.filter(verified=True).delete()
+        fact = MusicFact.objects.create(title='New', content='...', verified=True)
+
+        self.assertEqual(random_music_fact(), fact)
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class DJChatConsumerTests(TransactionTestCase):
+    def setUp(self):
+        self.chat_session = create_chat_session('chatuser')
+        self.provider = FakeChatProvider(reply='Here comes the bass')
+        patcher = mock.patch.object(llm, 'get_chat_provider', return_value=self.provider)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_reply_is_streamed_then_saved(self):
+        async def run():
+            communicator = WebsocketCommunicator(
+                URLRouter(websocket_urlpatterns), f"/ws/dj_chat/{self.chat_session.id}/"
+            )
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            await communicator.send_json_to({'type': 'chat_message', 'message': 'Hi DJ'})
+
+            events = []
+            while not events or events[-1].get('is_ai') is not True or events[-1]['type'] != 'chat_message':
+                events.append(await communicator.receive_json_from(timeout=5))
+            await communicator.disconnect()
+            return events
+
+        events = async_to_sync(run)()
+
+        self.assertEqual(events[0], {'type': 'chat_message', 'message': 'Hi DJ', 'context': {}, 'is_ai': False})
+        self.assertEqual(events[1]['type'], 'chat_stream_start')
+        tokens = [event['token'] for event in events if event['type'] == 'chat_token']
+        self.assertEqual(''.join(tokens), 'Here comes the bass')
+        self.assertEqual(events[-1]['message'], 'Here comes the bass')
+        self.assertEqual(events[-1]['stream_id'], events[1]['stream_id'])
+        self.assertTrue(ChatMessage.objects.filter(session=self.chat_session, is_ai=True, content='Here comes the bass').exists())
+
+
+@skipUnless(RUN_BENCHMARKS, 'Set RUN_BENCHMARKS=true to run benchmarks')
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class DJChatStreamingBenchmark(TransactionTestCase):
+    """Time-to-first-token and sync thread occupancy for concurrent chats."""
+
+    reply = ' '.join(['word'] * 20)
+
+    def setUp(self):
+        self.sessions = [create_chat_session(f"bench{i}") for i in range(BENCHMARK_CHATS)]
+        self.busy = 0.0
+        self.busy_lock = threading.Lock()
+
+    def timed(self, func):
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                with self.busy_lock:
+                    self.busy += time.perf_counter() - start
+        return wrapper
+
+    def run_chats(self, consumer_class, sessions, is_first_content):
+        application = URLRouter([
+            pattern.__class__(pattern.pattern, consumer_class.as_asgi()) for pattern in websocket_urlpatterns
+        ])
+
+        async def chat(session):
+            communicator = WebsocketCommunicator(application, f"/ws/dj_chat/{session.id}/")
+            await communicator.connect()
+            start = time.perf_counter()
+            await communicator.send_json_to({'type': 'chat_message', 'message': 'Hi DJ'})
+            first_content = None
+            while True:
+                event = await communicator.receive_json_from(timeout=600)
+                if first_content is None and is_first_content(event):
+                    first_content = time.perf_counter() - start
+                if event['type'] == 'chat_message' and event['is_ai']:
+                    break
+            await communicator.disconnect()
+            return first_content
+
+        async def run():
+            started = time.perf_counter()
+            latencies = await asyncio.gather(*(chat(session) for session in sessions))
+            return sorted(latencies), time.perf_counter() - started
+
+        self.busy = 0.0
+        return async_to_sync(run)()
+
+    def report(self, label, latencies, wall):
+        p50 = latencies[len(latencies) // 2] * 1000
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000
+        print(
+            f"{label}: {len(latencies)} chats, first content p50 {p50:.0f}ms p99 {p99:.0f}ms, "
+            f"wall {wall:.1f}s, sync thread busy {self.busy:.2f}s ({self.busy / wall:.0%} of wall time)"
+        )
+
+    def test_concurrent_chats(self):
+        provider = FakeChatProvider(reply=self.reply, first_token_delay=FIRST_TOKEN_LATENCY, token_delay=TOKEN_LATENCY)
+        reply_seconds = FIRST_TOKEN_LATENCY + TOKEN_LATENCY * (len(self.reply.split(' ')) - 1)
+        timed = self.timed
+
+        class BlockingConsumer(DJChatConsumer):
+            """Whole LLM round trip inside database_sync_to_async, as before streaming."""
+
+            async def receive(self, text_data):
+                data = json.loads(text_data)
+                await self.channel_layer.group_send(self.room_group_name, {
+                    'type': 'chat_message', 'message': data['message'], 'context': {}, 'is_ai': False
+                })
+                reply = await self.generate_blocking(data['message'])
+                await self.channel_layer.group_send(self.room_group_name, {
+                    'type': 'chat_message', 'message': reply, 'context': {}, 'is_ai': True
+                })
+
+            @database_sync_to_async
+            def generate_blocking(self, content):
+                def generate():
+                    session = ChatSession.objects.get(id=self.session_id)
+                    ChatMessage.objects.create(session=session, content=content, context={})
+                    time.sleep(reply_seconds)
+                    ChatMessage.objects.create(session=session, content=provider.reply, context={}, is_ai=True)
+                    return provider.reply
+                return timed(generate)()
+
+        def is_ai_message(event):
+            return event['type'] == 'chat_message' and event['is_ai']
+
+        def is_token(event):
+            return event['type'] == 'chat_token'
+
+        print()
+        latencies, wall = self.run_chats(BlockingConsumer, self.sessions[:BENCHMARK_LEGACY_CHATS], is_ai_message)
+        self.report('Blocking consumer (full reply)', latencies, wall)
+        blocking_busy_per_chat = self.busy / len(latencies)
+
+        prepare = DJChatConsumer.__dict__['prepare_response']
+        save = DJChatConsumer.__dict__['save_ai_message']
+        with mock.patch.object(llm, 'get_chat_provider', return_value=provider), \
+                mock.patch.object(prepare, 'func', self.timed(prepare.func)), \
+                mock.patch.object(save, 'func', self.timed(save.func)):
+            latencies, wall = self.run_chats(DJChatConsumer, self.sessions, is_token)
+        self.report('Streaming consumer (first token)', latencies, wall)
+
+        # The sync thread only does database work now, never waits on the model
+        self.assertLess(self.busy / len(latencies), blocking_busy_per_chat / 10)
@@ -0,0 +1,108 @@
+import base64
+import os
+import time
+from unittest import skipUnless
+from cryptography.fernet import Fernet
+from django.test import SimpleTestCase, override_settings
+from ..utils.encryption import (
+    CipherManager, decrypt, decrypt_many, decrypt_voice_commands, encrypt, encrypt_many,
+    encrypt_voice_commands, get_cipher_manager, get_encryption_key
+)
+
+RUN_BENCHMARKS = os.getenv('RUN_BENCHMARKS', '').lower() == 'true'
+BENCHMARK_OPERATIONS = int(os.getenv('BENCHMARK_OPERATIONS', 20000))
+
+OLD_KEY = Fernet.generate_key().decode()
+NEW_KEY = Fernet.generate_key().decode()
+
+
+@override_settings(ENCRYPTION_KEY=NEW_KEY, ENCRYPTION_PREVIOUS_KEYS=[])
+class CipherManagerTests(SimpleTestCase):
+    def test_cipher_is_built_once_per_key_set(self):
+        manager = get_cipher_manager()
+        cipher = manager.cipher
+
+        self.assertIs(manager.cipher, cipher)
+        with override_settings(ENCRYPTION_KEY=OLD_KEY):
+            self.assertIsNot(manager.cipher, cipher)
+
+    @override_settings(ENCRYPTION_KEY=None)
+    def test_generated_key_is_reused(self):
+        self.assertEqual(get_encryption_key(), get_encryption_key())
+        self.assertEqual(decrypt(encrypt('play some jazz')), 'play some jazz')
+
+    def test_previous_keys_decrypt_and_rotate(self):
+        with override_settings(ENCRYPTION_KEY=OLD_KEY):
+            token = encrypt('drop the bass')
+
+        with override_settings(ENCRYPTION_PREVIOUS_KEYS=[OLD_KEY]):
+            self.assertEqual(decrypt(token), 'drop the bass')
+            rotated = get_cipher_manager().rotate(token)
+
+        self.assertEqual(Fernet(NEW_KEY).decrypt(rotated.encode()), b'drop the bass')
+        with self.assertRaises(ValueError):
+            decrypt(token)
+
+    def test_batches_keep_order_and_empty_values(self):
+        values = ['one', '', 'two', None, 'three' * 100]
+        manager = CipherManager(parallel_min_bytes=1, workers=3)
+
+        for parallel in (False, True):
+            tokens = manager.encrypt_many(values, parallel=parallel)
+            self.assertEqual(tokens[1], '')
+            self.assertIsNone(tokens[3])
+            self.assertEqual(manager.decrypt_many(tokens, parallel=parallel), values)
+        self.assertEqual(decrypt_many(encrypt_many(values)), values)
+
+    def test_voice_command_batches(self):
+        tokens = encrypt_voice_commands(['play track 1234 now', 'skip'])
+
+        self.assertEqual(decrypt_voice_commands(tokens), ['play track [REDACTED] now', 'skip'])
+        with self.assertRaises(ValueError):
+            decrypt_voice_commands([encrypt('<script>alert(1)</script>')])
+        with self.assertRaises(ValueError):
+            encrypt_voice_commands(['ok', 42])
+
+
+@skipUnless(RUN_BENCHMARKS, 'Set RUN_BENCHMARKS=true to run benchmarks')
+@override_settings(ENCRYPTION_KEY=NEW_KEY, ENCRYPTION_PREVIOUS_KEYS=[OLD_KEY])
+class EncryptionBenchmark(SimpleTestCase):
+    """Operations per second for BENCHMARK_OPERATIONS voice commands."""
+
+    def rate(self, func, count):
+        start = time.perf_counter()
+        func()
+        return count / (time.perf_counter() - start)
+
+    def test_operations_per_second(self):
+        commands = [f"play something upbeat for the crowd, request number {i}" for i in range(BENCHMARK_OPERATIONS)]
+        tokens = encrypt_many(commands)
+
+        def legacy_encrypt():
+            for command in commands:
+                # A new key lookup and Fernet per call, as before
+                Fernet(get_encryption_key()).encrypt(command.encode()).decode()
+
+        def legacy_decrypt():
+            for token in tokens:
+                Fernet(get_encryption_key()).decrypt(token.encode()).decode()
+
+        rates = {
+            'legacy encrypt': self.rate(legacy_encrypt, len(commands)),
+            'legacy decrypt': self.rate(legacy_decrypt, len(tokens)),
+            'cached encrypt': self.rate(lambda: [encrypt(command) for command in commands], len(commands)),
+            'cached decrypt': self.rate(lambda: [decrypt(token) for token in tokens], len(tokens)),
+            'batched encrypt': self.rate(lambda: encrypt_many(commands, parallel=False), len(commands)),
+            'batched decrypt': self.rate(lambda: decrypt_many(tokens, parallel=False), len(tokens)),
+        }
+        # Large payloads (chat transcripts) through the thread pool
+        transcripts = [base64.b64encode(os.urandom(48 * 1024)).decode() for _ in range(64)]
+        manager = CipherManager(workers=4)
+        rates['64KB serial encrypt'] = self.rate(lambda: manager.encrypt_many(transcripts, parallel=False), len(transcripts))
+        rates['64KB pooled encrypt'] = self.rate(lambda: manager.encrypt_many(transcripts, parallel=True), len(transcripts))
+
+        print(f"\n{BENCHMARK_OPERATIONS} voice commands ({os.cpu_count()} CPU):")
+        for label, rate in rates.items():
+            print(f"  {label}: {rate:,.0f} ops/s")
+        self.assertGreater(rates['batched encrypt'], rates['legacy encrypt'])
+        self.assertGreater(rates['cached decrypt'], rates['legacy decrypt'])
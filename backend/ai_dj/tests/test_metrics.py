@@ -0,0 +1,188 @@
+import itertools
+import os
+import random
+import time
+from datetime import timedelta
+from unittest import mock, skipUnless
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Count
+from django.test import TestCase, TransactionTestCase
+from ..metrics import MetricsCollector, MetricsSnapshotEngine
+from ..models import AIDJSession, AIDJPlayHistory, AIDJFeedback, Track
+
+User = get_user_model()
+
+RUN_BENCHMARKS = os.getenv('RUN_BENCHMARKS', '').lower() == 'true'
+BENCHMARK_ROWS = int(os.getenv('BENCHMARK_METRICS_ROWS', 2_000_000))
+INSERT_BATCH_SIZE = 50_000
+
+
+class MetricsSnapshotTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='metricsuser', email='metrics@example.com', password='testpass123')
+        self.rock = Track.objects.create(title='Rock Track', artist='Artist', genre='rock')
+        self.jazz = Track.objects.create(title='Jazz Track', artist='Artist', genre='jazz')
+        self.untagged = Track.objects.create(title='Untagged Track', artist='Artist')
+
+        for track in [self.rock, self.rock, self.rock, self.jazz, self.untagged]:
+            AIDJPlayHistory.objects.create(user=self.user, track=track)
+        for feedback_type in ['like', 'like', 'like', 'dislike']:
+            AIDJFeedback.objects.create(user=self.user, track=self.rock, feedback_type=feedback_type)
+        AIDJSession.objects.create(user=self.user, mood_settings={'energy': 0.2, 'calm': 1.0})
+        AIDJSession.objects.create(user=self.user, mood_settings={'energy': 0.8}, last_voice_command='play jazz')
+
+        self.engine = MetricsSnapshotEngine(ttl=30)
+
+    def test_snapshot_uses_fixed_query_count(self):
+        with self.assertNumQueries(4):
+            snapshot = self.engine.snapshot(self.user.id)
+
+        self.assertEqual(snapshot['session_metrics']['total_sessions'], 2)
+        self.assertEqual(snapshot['session_metrics']['voice_commands_used'], 1)
+        self.assertEqual(snapshot['playback_metrics']['total_plays'], 5)
+        self.assertEqual(snapshot['playback_metrics']['unique_tracks'], 3)
+        self.assertEqual(
+            snapshot['playback_metrics']['top_genres'][:2],
+            [{'track__genre': 'rock', 'count': 3}, {'track__genre': 'jazz', 'count': 1}]
+        )
+        self.assertEqual(snapshot['feedback_metrics']['total_feedback'], 4)
+        self.assertEqual(snapshot['feedback_metrics']['feedback_ratio']['likes'], 75)
+        self.assertEqual(snapshot['mood_metrics']['mood_preferences'], {'energy': 0.5, 'calm': 1.0})
+
+    def test_query_count_does_not_grow_with_data(self):
+        for _ in range(20):
+            AIDJPlayHistory.objects.create(user=self.user, track=Track.objects.create(title='More', genre='pop'))
+
+        with self.assertNumQueries(4):
+            self.engine.build(self.user.id, timedelta(days=7))
+
+    def test_cached_snapshot_is_served_without_queries(self):
+        self.engine.snapshot(self.user.id)
+
+        with self.assertNumQueries(0):
+            self.engine.snapshot(self.user.id)
+
+    def test_hot_counters_apply_between_snapshots(self):
+        self.engine.snapshot(self.user.id)
+        self.engine.record(self.user.id, 'play', genre='jazz')
+        self.engine.record(self.user.id, 'play', genre='jazz')
+        self.engine.record(self.user.id, 'feedback', feedback_type='dislike')
+        self.engine.record(self.user.id, 'session', voice_command=True)
+
+        with self.assertNumQueries(0):
+            snapshot = self.engine.snapshot(self.user.id)
+
+        self.assertEqual(snapshot['playback_metrics']['total_plays'], 7)
+        self.assertIn({'track__genre': 'jazz', 'count': 3}, snapshot['playback_metrics']['top_genres'])
+        self.assertEqual(snapshot['feedback_metrics']['total_feedback'], 5)
+        self.assertEqual(snapshot['feedback_metrics']['feedback_ratio']['likes'], 60)
+        self.assertEqual(snapshot['session_metrics']['voice_commands_used'], 2)
+
+    def test_deltas_before_snapshot_are_not_double_counted(self):
+        self.engine.record(self.user.id, 'play', genre='rock')
+        self.engine.invalidate(self.user.id)
+
+        snapshot = self.engine.snapshot(self.user.id)
+
+        self.assertEqual(snapshot['playback_metrics']['total_plays'], 5)
+
+    def test_deltas_during_build_are_not_double_counted(self):
+        engine = MetricsSnapshotEngine(ttl=30, clock=itertools.count(1000).__next__)
+        playback_counts = MetricsSnapshotEngine._playback_counts
+
+        def play_during_build(user_id, time_range):
+            AIDJPlayHistory.objects.create(user=self.user, track=self.rock)
+            engine.record(user_id, 'play', genre='rock')
+            return playback_counts(user_id, time_range)
+
+        with mock.patch.object(MetricsSnapshotEngine, '_playback_counts', side_effect=play_during_build):
+            snapshot = engine.snapshot(self.user.id)
+
+        self.assertEqual(snapshot['playback_metrics']['total_plays'], 6)
+
+    def test_collectors_match_snapshot(self):
+        snapshot = self.engine.build(self.user.id)
+
+        self.assertEqual(MetricsCollector.collect_session_metrics(self.user.id), snapshot['session_metrics'])
+        self.assertEqual(MetricsCollector.collect_mood_metrics(self.user.id), snapshot['mood_metrics'])
+        self.assertEqual(MetricsCollector.collect_feedback_metrics(self.user.id)['total_feedback'], 4)
+
+
+@skipUnless(RUN_BENCHMARKS, 'Set RUN_BENCHMARKS=true to run benchmarks')
+class MetricsCollectionBenchmark(TransactionTestCase):
+    """Collection latency over BENCHMARK_METRICS_ROWS play history and feedback rows."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='benchuser', email='bench@example.com', password='testpass123')
+        other = User.objects.create_user(username='otheruser', email='other@example.com', password='testpass123')
+        tracks = Track.objects.bulk_create([
+            Track(title=f"Track {i}", genre=random.choice(['rock', 'jazz', 'pop', 'house', 'ambient', 'funk', None]))
+            for i in range(5000)
+        ])
+        # Half of the rows belong to the measured user
+        for offset in range(0, BENCHMARK_ROWS, INSERT_BATCH_SIZE):
+            size = min(INSERT_BATCH_SIZE, BENCHMARK_ROWS - offset)
+            AIDJPlayHistory.objects.bulk_create([
+                AIDJPlayHistory(user=random.choice([self.user, other]), track=random.choice(tracks))
+                for _ in range(size)
+            ])
+            AIDJFeedback.objects.bulk_create([
+                AIDJFeedback(user=random.choice([self.user, other]), track=random.choice(tracks),
+                             feedback_type=random.choice(['like', 'dislike', 'skip']))
+                for _ in range(size // 4)
+            ])
+        AIDJSession.objects.bulk_create([
+            AIDJSession(user=self.user, mood_settings={'energy': random.random(), 'calm': random.random()},
+                        last_voice_command=random.choice([None, 'next']))
+            for _ in range(5000)
+        ])
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def legacy_collect(self, user_id, time_range):
+        """The per-metric queries MetricsCollector issued before snapshots (minus the
+        average over the nonexistent session duration column)."""
+        cutoff = MetricsSnapshotEngine._since(time_range)
+        sessions = AIDJSession.objects.filter(user_id=user_id, updated_at__gte=cutoff)
+        plays = AIDJPlayHistory.objects.filter(user_id=user_id, played_at__gte=cutoff)
+        feedback = AIDJFeedback.objects.filter(user_id=user_id, created_at__gte=cutoff)
+        total_feedback = feedback.count()
+        return {
+            'sessions': (sessions.count(), sessions.exclude(last_voice_command__isnull=True).count()),
+            'plays': (
+                plays.count(),
+                plays.values('track').distinct().count(),
+                list(plays.values('track__genre').annotate(count=Count('track__genre')).order_by('-count')[:5]),
+            ),
+            'feedback': (total_feedback, feedback.filter(feedback_type='like').count()),
+            'moods': list(sessions.exclude(mood_settings__isnull=True).values_list('mood_settings', flat=True)),
+        }
+
+    def measure(self, func, repeat=5):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+        return min(timings) * 1000
+
+    def test_collection_latency(self):
+        window = timedelta(days=30)
+        engine = MetricsSnapshotEngine(ttl=30)
+
+        with self.assertNumQueries(8):
+            self.legacy_collect(self.user.id, window)
+        legacy_ms = self.measure(lambda: self.legacy_collect(self.user.id, window))
+        snapshot_ms = self.measure(lambda: engine.build(self.user.id, window))
+        engine.snapshot(self.user.id, window)
+        cached_ms = self.measure(lambda: engine.snapshot(self.user.id, window), repeat=100)
+
+        print(
+            f"\nMetrics collection over {BENCHMARK_ROWS} play rows: legacy 8 queries {legacy_ms:.1f}ms, "
+            f"snapshot build 4 queries {snapshot_ms:.1f}ms, cached snapshot {cached_ms:.3f}ms"
+        )
+        self.assertLess(snapshot_ms, legacy_ms)
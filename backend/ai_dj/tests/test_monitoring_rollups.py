@@ -0,0 +1,238 @@
+import os
+import random
+import statistics
+import time
+from datetime import timedelta
+from unittest import skipUnless
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Avg, Max, Min
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+from ..modules.monitoring.models import MetricData, MetricRollup
+from ..modules.monitoring.rollups import (
+    Aggregate, apply_retention, choose_resolution, compact, floor_time, query_aggregates, query_series
+)
+from ..modules.monitoring.views import MetricDataViewSet
+
+User = get_user_model()
+
+RUN_BENCHMARKS = os.getenv('RUN_BENCHMARKS', '').lower() == 'true'
+BENCHMARK_RAW_SAMPLES = int(os.getenv('BENCHMARK_RAW_SAMPLES', 10_000_000))
+BENCHMARK_DAYS = 30
+
+
+def add_samples(samples):
+    """Store ``(metric_type, value, timestamp)`` samples, overriding auto_now_add."""
+    rows = MetricData.objects.bulk_create([
+        MetricData(metric_type=metric_type, value=value) for metric_type, value, _ in samples
+    ])
+    for row, (_, _, timestamp) in zip(rows, samples):
+        MetricData.objects.filter(pk=row.pk).update(timestamp=timestamp)
+
+
+def raw_summary(start, end, metric_type):
+    values = list(MetricData.objects.filter(
+        metric_type=metric_type, timestamp__gte=start, timestamp__lt=end
+    ).values_list('value', flat=True))
+    return len(values), statistics.mean(values), min(values), max(values), statistics.pstdev(values)
+
+
+class AggregateTests(SimpleTestCase):
+    def test_merged_aggregates_match_the_samples(self):
+        values = [random.uniform(0, 500) for _ in range(200)]
+        aggregate = Aggregate()
+        for chunk in (values[:50], values[50:120], values[120:]):
+            aggregate.merge(len(chunk), sum(chunk), sum(v * v for v in chunk), min(chunk), max(chunk))
+
+        self.assertEqual(aggregate.count, 200)
+        self.assertAlmostEqual(aggregate.avg, statistics.mean(values))
+        self.assertAlmostEqual(aggregate.stddev, statistics.pstdev(values))
+        self.assertEqual((aggregate.min, aggregate.max), (min(values), max(values)))
+        self.assertIsNone(Aggregate().avg)
+
+
+class RollupTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        # Two whole days, ending a day ago so every resolution is retained
+        self.start = floor_time(timezone.now(), 'day') - timedelta(days=3)
+        samples = []
+        for minute in range(0, 2 * 24 * 60, 7):
+            timestamp = self.start + timedelta(minutes=minute, seconds=13)
+            samples.append(('response_time', random.uniform(10, 900), timestamp))
+            samples.append(('error_rate', random.uniform(0, 1), timestamp))
+        add_samples(samples)
+        self.end = self.start + timedelta(days=2)
+
+    def test_compaction_builds_every_resolution(self):
+        compacted_until = compact(now=self.end + timedelta(minutes=2))
+
+        self.assertEqual(compacted_until, self.end + timedelta(minutes=1))
+        for resolution, buckets in [('minute', 2 * 24 * 60 // 7 + 1), ('hour', 48), ('day', 2)]:
+            self.assertEqual(
+                MetricRollup.objects.filter(resolution=resolution, metric_type='response_time').count(),
+                buckets
+            )
+        day = MetricRollup.objects.get(resolution='day', metric_type='response_time', bucket_start=self.start)
+        raw = MetricData.objects.filter(
+            metric_type='response_time', timestamp__lt=self.start + timedelta(days=1)
+        ).aggregate(min=Min('value'), max=Max('value'))
+        self.assertEqual((day.min, day.max), (raw['min'], raw['max']))
+
+    def test_compaction_is_incremental_and_idempotent(self):
+        compact(now=self.start + timedelta(hours=5, minutes=30))
+        self.assertFalse(MetricRollup.objects.filter(
+            resolution='minute', bucket_start__gte=self.start + timedelta(hours=5, minutes=29)
+        ).exists())
+        self.assertEqual(MetricRollup.objects.filter(resolution='hour', metric_type='error_rate').count(), 5)
+
+        compact(now=self.end + timedelta(minutes=2))
+        cache.clear()
+        compact(now=self.end + timedelta(minutes=2))
+
+        hours = MetricRollup.objects.filter(resolution='hour', metric_type='error_rate')
+        self.assertEqual(hours.count(), 48)
+        self.assertEqual(sum(hours.values_list('count', flat=True)), 2 * 24 * 60 // 7 + 1)
+
+    def test_queries_combine_rollups_and_raw_tail(self):
+        compact(now=self.start + timedelta(days=1, hours=6, minutes=17))
+
+        for resolution in (None, 'minute', 'hour', 'day'):
+            result = query_aggregates(self.start, self.end, 'response_time', resolution=resolution)
+            summary = result['metrics'][0]
+            count, avg, minimum, maximum, stddev = raw_summary(self.start, self.end, 'response_time')
+            self.assertEqual(summary['count'], count)
+            self.assertAlmostEqual(summary['avg_value'], avg)
+            self.assertEqual((summary['min_value'], summary['max_value']), (minimum, maximum))
+            self.assertAlmostEqual(summary['stddev_value'], stddev, places=6)
+
+        series = query_series(self.start, self.end, 'error_rate')
+        self.assertEqual(series['resolution'], 'hour')
+        self.assertEqual(len(series['series']['error_rate']), 48)
+
+    def test_resolution_follows_range_and_retention(self):
+        now = timezone.now()
+        self.assertEqual(choose_resolution(now - timedelta(hours=1), now), 'minute')
+        self.assertEqual(choose_resolution(now - timedelta(days=3), now), 'hour')
+        self.assertEqual(choose_resolution(now - timedelta(days=60), now), 'day')
+        # Too old for minute rollups, so hours even though they are coarse
+        self.assertEqual(choose_resolution(now - timedelta(days=20), now - timedelta(days=19, hours=23)), 'hour')
+
+    @override_settings(MONITORING_ROLLUPS={'RETENTION': {'raw': 2, 'minute': 2, 'hour': 400, 'day': None}})
+    def test_retention(self):
+        compact(now=self.start + timedelta(days=1, minutes=1))
+
+        deleted = apply_retention(now=self.end + timedelta(hours=12))
+
+        self.assertFalse(MetricRollup.objects.filter(
+            resolution='minute', bucket_start__lt=self.start + timedelta(hours=12)
+        ).exists())
+        self.assertEqual(MetricRollup.objects.filter(resolution='hour').count(), 2 * 24)
+        # Raw rows go only once rolled up
+        self.assertGreater(deleted['raw'], 0)
+        self.assertEqual(MetricData.objects.filter(timestamp__lt=self.start + timedelta(hours=12)).count(), 0)
+        self.assertTrue(MetricData.objects.filter(timestamp__gte=self.start + timedelta(days=1)).exists())
+
+
+class MetricViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='ops', email='ops@example.com', password='testpass123')
+        now = timezone.now()
+        add_samples([('response_time', value, now - timedelta(minutes=minutes)) for minutes, value in [
+            (5, 100.0), (10, 300.0), (90, 5000.0)
+        ]])
+
+    def get(self, action, params=None):
+        view = MetricDataViewSet.as_view({'get': action})
+        request = APIRequestFactory().get('/', params or {})
+        force_authenticate(request, user=self.user)
+        return view(request)
+
+    def test_aggregates_cover_the_last_hour(self):
+        response = self.get('aggregates')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data[0]['metric_type'], 'response_time')
+        self.assertEqual(response.data[0]['avg_value'], 200.0)
+        self.assertEqual(response.data[0]['max_value'], 300.0)
+        self.assertEqual(response.data[0]['count'], 2)
+
+    def test_series(self):
+        response = self.get('series', {'resolution': 'hour'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['resolution'], 'hour')
+        self.assertEqual(sum(bucket['count'] for bucket in response.data['series']['response_time']), 3)
+
+    def test_invalid_parameters(self):
+        for action, params in [
+            ('aggregates', {'start': 'yesterday'}),
+            ('aggregates', {'start': '2030-01-02T00:00:00Z', 'end': '2030-01-01T00:00:00Z'}),
+            ('series', {'resolution': 'week'}),
+        ]:
+            self.assertEqual(self.get(action, params).status_code, 400)
+
+
+@skipUnless(RUN_BENCHMARKS, 'Set RUN_BENCHMARKS=true to run benchmarks')
+class RollupBenchmark(TransactionTestCase):
+    """Dashboard query over BENCHMARK_DAYS days of BENCHMARK_RAW_SAMPLES raw samples."""
+
+    def setUp(self):
+        cache.clear()
+        self.end = floor_time(timezone.now(), 'minute')
+        self.start = self.end - timedelta(days=BENCHMARK_DAYS)
+        step = BENCHMARK_DAYS * 86400 / BENCHMARK_RAW_SAMPLES
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO {MetricData._meta.db_table} (metric_type, value, timestamp, labels)
+                SELECT (ARRAY['request_count', 'response_time', 'error_rate', 'resource_usage', 'user_count'])[1 + i %% 5],
+                       random() * 1000, %s + make_interval(secs => i * %s), '{{}}'
+                FROM generate_series(0, %s - 1) AS i
+                """,
+                [self.start, step, BENCHMARK_RAW_SAMPLES]
+            )
+            cursor.execute(f'ANALYZE {MetricData._meta.db_table}')
+
+    def timed(self, func, repeat=3):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = func()
+            timings.append(time.perf_counter() - start)
+        return result, min(timings)
+
+    def test_thirty_day_query(self):
+        def legacy():
+            return list(MetricData.objects.filter(
+                timestamp__gte=self.start, timestamp__lt=self.end
+            ).values('metric_type').annotate(
+                avg_value=Avg('value'), max_value=Max('value'), min_value=Min('value')
+            ))
+
+        legacy_rows, legacy_seconds = self.timed(legacy)
+
+        start = time.perf_counter()
+        compact(now=self.end + timedelta(minutes=1))
+        compaction_seconds = time.perf_counter() - start
+
+        summary, summary_seconds = self.timed(lambda: query_aggregates(self.start, self.end))
+        series, series_seconds = self.timed(lambda: query_series(self.start, self.end))
+
+        print(
+            f"\n{BENCHMARK_RAW_SAMPLES:,} raw samples over {BENCHMARK_DAYS} days:\n"
+            f"  legacy raw aggregate: {legacy_seconds * 1000:.0f}ms\n"
+            f"  one-off compaction: {compaction_seconds:.1f}s\n"
+            f"  rollup summary ({summary['resolution']}): {summary_seconds * 1000:.1f}ms\n"
+            f"  rollup series ({series['resolution']}, "
+            f"{sum(len(buckets) for buckets in series['series'].values())} buckets): {series_seconds * 1000:.1f}ms"
+        )
+        legacy_totals = {row['metric_type']: row for row in legacy_rows}
+        for metric in summary['metrics']:
+            self.assertAlmostEqual(metric['avg_value'], legacy_totals[metric['metric_type']]['avg_value'], places=6)
+            self.assertEqual(metric['max_value'], legacy_totals[metric['metric_type']]['max_value'])
+        self.assertLess(summary_seconds, legacy_seconds)
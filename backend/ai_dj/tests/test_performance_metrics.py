@@ -0,0 +1,171 @@
+import os
+import time
+from unittest import mock, skipUnless
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase
+from django.http import HttpResponse
+from ..modules.performance import metrics_buffer
+from ..modules.performance.metrics_buffer import MetricsRingBuffer, PerformanceMetricsWriter
+from ..modules.performance.middleware import PerformanceMonitoringMiddleware
+from ..modules.performance.models import PerformanceMetric
+
+RUN_BENCHMARKS = os.getenv('RUN_BENCHMARKS', '').lower() == 'true'
+BENCHMARK_RATE = int(os.getenv('BENCHMARK_REQUEST_RATE', 2000))
+BENCHMARK_SECONDS = int(os.getenv('BENCHMARK_SECONDS', 5))
+
+
+class MetricsRingBufferTests(SimpleTestCase):
+    def test_drops_when_full(self):
+        buffer = MetricsRingBuffer(capacity=3, sample_threshold=1.0)
+        results = [buffer.push(('response_time', i, None)) for i in range(5)]
+
+        self.assertEqual(results, [True, True, True, False, False])
+        self.assertEqual(buffer.dropped, 2)
+        self.assertEqual([item[1] for item in buffer.drain(10)], [0, 1, 2])
+
+    def test_samples_above_threshold(self):
+        buffer = MetricsRingBuffer(capacity=100, sample_threshold=0.5, sample_rate=0.0)
+        for i in range(80):
+            buffer.push(('response_time', i, None))
+
+        self.assertEqual(len(buffer), 50)
+        self.assertEqual(buffer.sampled_out, 30)
+
+    def test_drain_respects_limit(self):
+        buffer = MetricsRingBuffer(capacity=10, sample_threshold=1.0)
+        for i in range(5):
+            buffer.push(('response_time', i, None))
+
+        self.assertEqual(len(buffer.drain(2)), 2)
+        self.assertEqual(len(buffer), 3)
+
+
+class InstanceIdTests(SimpleTestCase):
+    def setUp(self):
+        metrics_buffer._instance_id = None
+        self.addCleanup(setattr, metrics_buffer, '_instance_id', None)
+
+    def test_metadata_endpoint_is_queried_once(self):
+        with mock.patch.dict(os.environ, {'INSTANCE_ID': ''}), \
+                mock.patch.object(metrics_buffer, '_fetch_instance_id', return_value='i-123') as fetch:
+            self.assertEqual(metrics_buffer.get_instance_id(), 'i-123')
+            self.assertEqual(metrics_buffer.get_instance_id(), 'i-123')
+
+        fetch.assert_called_once()
+
+    def test_environment_overrides_metadata(self):
+        with mock.patch.dict(os.environ, {'INSTANCE_ID': 'web-1'}), \
+                mock.patch.object(metrics_buffer, '_fetch_instance_id') as fetch:
+            self.assertEqual(metrics_buffer.get_instance_id(), 'web-1')
+
+        fetch.assert_not_called()
+
+
+class PerformanceMetricsWriterTests(TestCase):
+    def make_writer(self, **kwargs):
+        # flush_interval=0 keeps the background thread off so tests flush explicitly
+        return PerformanceMetricsWriter(flush_interval=0, instance_id='test-instance', **kwargs)
+
+    def test_flush_writes_in_batches(self):
+        writer = self.make_writer(buffer_size=100, batch_size=4, sample_threshold=1.0)
+        for i in range(10):
+            writer.record('response_time', float(i))
+
+        with self.assertNumQueries(3):
+            self.assertEqual(writer.flush(), 10)
+
+        self.assertEqual(PerformanceMetric.objects.count(), 10)
+        self.assertEqual(writer.stats()['batches'], 3)
+        self.assertEqual(len(writer.buffer), 0)
+
+    def test_rows_keep_measurement_time(self):
+        writer = self.make_writer()
+        writer.record('response_time', 12.5)
+        queued_at = writer.buffer._items[0][2]
+        time.sleep(0.01)
+        writer.flush()
+
+        metric = PerformanceMetric.objects.get()
+        self.assertEqual(metric.timestamp, queued_at)
+        self.assertEqual(metric.server_instance, 'test-instance')
+
+    def test_failed_batch_is_counted_as_dropped(self):
+        writer = self.make_writer()
+        writer.record('response_time', 1.0)
+
+        with mock.patch.object(PerformanceMetric.objects, 'bulk_create', side_effect=RuntimeError('db down')):
+            self.assertEqual(writer.flush(), 0)
+
+        self.assertEqual(writer.stats()['dropped'], 1)
+
+
+class PerformanceMonitoringMiddlewareTests(TestCase):
+    def setUp(self):
+        self.writer = PerformanceMetricsWriter(flush_interval=0, instance_id='test-instance')
+        patcher = mock.patch(
+            'ai_dj.modules.performance.middleware.get_metrics_writer', return_value=self.writer
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        health_patcher = mock.patch('ai_dj.modules.performance.middleware.monitor_system_health')
+        self.monitor = health_patcher.start()
+        self.addCleanup(health_patcher.stop)
+
+    def test_request_does_not_touch_database(self):
+        middleware = PerformanceMonitoringMiddleware(lambda request: HttpResponse('ok'))
+
+        with self.assertNumQueries(0):
+            response = middleware(RequestFactory().get('/'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.writer.buffer), 1)
+        self.writer.flush()
+        self.assertEqual(PerformanceMetric.objects.filter(metric_type='response_time').count(), 1)
+
+
+@skipUnless(RUN_BENCHMARKS, 'Set RUN_BENCHMARKS=true to run benchmarks')
+class PerformanceMetricsBenchmark(TransactionTestCase):
+    """Per-request overhead and DB writes/sec for paced traffic at BENCHMARK_RATE req/s."""
+
+    def run_paced(self, middleware):
+        request = RequestFactory().get('/')
+        total = BENCHMARK_RATE * BENCHMARK_SECONDS
+        interval = 1.0 / BENCHMARK_RATE
+        overhead = 0.0
+        start = time.perf_counter()
+        for i in range(total):
+            target = start + i * interval
+            delay = target - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            began = time.perf_counter()
+            middleware(request)
+            overhead += time.perf_counter() - began
+        elapsed = time.perf_counter() - start
+        return total, elapsed, overhead / total * 1e6
+
+    def test_direct_vs_buffered(self):
+        def direct(request):
+            PerformanceMetric.objects.create(
+                metric_type='response_time', value=1.0, server_instance='bench'
+            )
+            return HttpResponse('ok')
+
+        with mock.patch('ai_dj.modules.performance.middleware.monitor_system_health'):
+            total, elapsed, direct_us = self.run_paced(direct)
+            direct_writes = total / elapsed
+
+            writer = PerformanceMetricsWriter(flush_interval=0.5, instance_id='bench')
+            with mock.patch('ai_dj.modules.performance.middleware.get_metrics_writer', return_value=writer):
+                middleware = PerformanceMonitoringMiddleware(lambda request: HttpResponse('ok'))
+                _, elapsed, buffered_us = self.run_paced(middleware)
+            writer.stop()
+
+        stats = writer.stats()
+        print(
+            f"\nPerformance metrics at {BENCHMARK_RATE} req/s for {BENCHMARK_SECONDS}s: "
+            f"direct create {direct_us:.1f}us/request, {direct_writes:.0f} writes/s; "
+            f"buffered {buffered_us:.1f}us/request, {stats['batches'] / elapsed:.1f} writes/s "
+            f"({stats['written']} rows, {stats['sampled_out']} sampled out, {stats['dropped']} dropped)"
+        )
+        self.assertLess(buffered_us, direct_us)
+        self.assertEqual(stats['written'] + stats['sampled_out'] + stats['dropped'], total)
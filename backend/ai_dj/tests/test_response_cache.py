@@ -0,0 +1,322 @@
+import json
+import os
+import pickle
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import skipUnless
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.urls import path
+from rest_framework import generics, serializers
+from ..modules.performance.middleware import CacheMiddleware
+from ..modules.performance.models import PerformanceMetric
+from ..modules.performance.response_cache import ResponseCache, cache_tags, model_tag
+
+User = get_user_model()
+
+RUN_BENCHMARKS = os.getenv('RUN_BENCHMARKS', '').lower() == 'true'
+STORM_CLIENTS = int(os.getenv('BENCHMARK_STORM_CLIENTS', 64))
+STORM_ROUNDS = int(os.getenv('BENCHMARK_STORM_ROUNDS', 20))
+
+
+class CountingView:
+    def __init__(self, body='payload', headers=None, delay=0.0):
+        self.calls = 0
+        self.body = body
+        self.headers = headers or {}
+        self.delay = delay
+        self._lock = threading.Lock()
+
+    def __call__(self, request):
+        with self._lock:
+            self.calls += 1
+            calls = self.calls
+        if self.delay:
+            time.sleep(self.delay)
+        response = HttpResponse(f"{self.body}:{calls}")
+        for name, value in self.headers.items():
+            response[name] = value
+        return response
+
+
+class MetricSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = PerformanceMetric
+        fields = '__all__'
+
+
+class MetricSerializerView(generics.ListAPIView):
+    serializer_class = MetricSerializer
+
+
+class MetricQuerysetView(generics.ListAPIView):
+    def get_queryset(self):
+        return PerformanceMetric.objects.filter(server_instance=self.kwargs['instance'])
+
+
+urlpatterns = [path('metrics/<str:instance>/', MetricQuerysetView.as_view())]
+
+
+@override_settings(ROOT_URLCONF=__name__)
+class CacheMiddlewareTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+        self.user = User.objects.create_user(username='cacheuser', password='testpass123')
+        self.other = User.objects.create_user(username='otheruser', password='testpass123')
+
+    def get(self, path='/api/tracks/', user=None, **extra):
+        request = self.factory.get(path, **extra)
+        request.user = user or AnonymousUser()
+        # What resolving the view would tag it with
+        request.cache_tags = ['tracks']
+        return request
+
+    def test_hit_after_miss(self):
+        view = CountingView()
+        middleware = CacheMiddleware(view)
+
+        first = middleware(self.get())
+        second = middleware(self.get())
+
+        self.assertEqual(first['X-Cache'], 'MISS')
+        self.assertEqual(second['X-Cache'], 'HIT')
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(view.calls, 1)
+
+    def test_query_order_is_normalized(self):
+        view = CountingView()
+        middleware = CacheMiddleware(view)
+
+        middleware(self.get('/api/tracks/?b=2&a=1'))
+        response = middleware(self.get('/api/tracks/?a=1&b=2'))
+
+        self.assertEqual(response['X-Cache'], 'HIT')
+
+    def test_users_do_not_share_entries(self):
+        view = CountingView()
+        middleware = CacheMiddleware(view)
+
+        mine = middleware(self.get(user=self.user))
+        theirs = middleware(self.get(user=self.other))
+        anonymous = middleware(self.get(HTTP_AUTHORIZATION='Bearer abc'))
+
+        self.assertEqual(view.calls, 3)
+        self.assertEqual(len({mine.content, theirs.content, anonymous.content}), 3)
+
+    def test_vary_headers_split_entries(self):
+        view = CountingView(headers={'Vary': 'Accept-Language'})
+        middleware = CacheMiddleware(view)
+
+        middleware(self.get(HTTP_ACCEPT_LANGUAGE='en'))
+        middleware(self.get(HTTP_ACCEPT_LANGUAGE='fr'))
+        english = middleware(self.get(HTTP_ACCEPT_LANGUAGE='en'))
+
+        self.assertEqual(english['X-Cache'], 'HIT')
+        self.assertEqual(view.calls, 2)
+
+    def test_private_and_cookie_responses_are_not_cached(self):
+        for headers in ({'Cache-Control': 'private'}, {'Set-Cookie': 'a=b'}):
+            cache.clear()
+            view = CountingView(headers=headers)
+            middleware = CacheMiddleware(view)
+            middleware(self.get())
+            middleware(self.get())
+            self.assertEqual(view.calls, 2)
+
+    def test_large_bodies_are_stored_compressed(self):
+        body = json.dumps([{'title': 'Track', 'artist': 'Artist'}] * 200)
+        middleware = CacheMiddleware(lambda request: HttpResponse(body))
+
+        middleware(self.get())
+        response_cache = ResponseCache()
+        entry = cache.get(response_cache.entry_key(self.get()))
+
+        self.assertTrue(entry['compressed'])
+        self.assertLess(len(entry['body']), len(body))
+        self.assertEqual(middleware(self.get()).content.decode(), body)
+
+    def test_stale_entry_served_while_one_request_regenerates(self):
+        view = CountingView()
+        middleware = CacheMiddleware(view)
+        middleware(self.get())
+
+        later = time.time() + middleware.response_cache.timeout + 1
+        middleware.response_cache.clock = lambda: later
+        # Another request already holds the regeneration lock
+        self.assertTrue(middleware.response_cache.acquire(self.get()))
+        stale = middleware(self.get())
+        middleware.response_cache.release(self.get())
+        refreshed = middleware(self.get())
+
+        self.assertEqual(stale['X-Cache'], 'STALE')
+        self.assertEqual(refreshed['X-Cache'], 'MISS')
+        self.assertEqual(view.calls, 2)
+
+    def test_model_write_invalidates_tagged_entries(self):
+        view = CountingView()
+        middleware = CacheMiddleware(view)
+        tagged_view = cache_tags('metrics')(lambda request: None)
+        self.assertIn('metrics', middleware.get_cache_tags(tagged_view))
+
+        request = self.get()
+        request.cache_tags = [model_tag(PerformanceMetric)]
+        middleware(request)
+        self.assertEqual(middleware(self.get())['X-Cache'], 'HIT')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            PerformanceMetric.objects.create(metric_type='cpu_usage', value=1.0, server_instance='test')
+
+        self.assertEqual(middleware(self.get())['X-Cache'], 'MISS')
+        self.assertEqual(view.calls, 2)
+
+    def test_write_during_render_invalidates_the_entry(self):
+        """Test that an entry is stamped with the tag versions read before its view ran"""
+        view = CountingView()
+
+        def writing_view(request):
+            # A write to the view's model commits while the response renders
+            middleware.response_cache.invalidate_tags('tracks')
+            return view(request)
+
+        middleware = CacheMiddleware(writing_view)
+        middleware(self.get())
+
+        self.assertEqual(middleware(self.get())['X-Cache'], 'MISS')
+        self.assertEqual(view.calls, 2)
+
+    def test_evicted_tag_versions_do_not_revive_entries(self):
+        """Test that a tag version restarted after eviction never matches older entries"""
+        view = CountingView()
+        middleware = CacheMiddleware(view)
+        middleware(self.get('/api/tracks/'))
+        middleware.response_cache.invalidate_tags('tracks')
+        cache.delete(middleware.response_cache._tag_key('tracks'))
+
+        # Another entry restarts the tag's version
+        middleware(self.get('/api/tracks/?page=2'))
+
+        self.assertEqual(middleware(self.get('/api/tracks/'))['X-Cache'], 'MISS')
+        self.assertEqual(view.calls, 3)
+
+    def test_untagged_views_are_not_cached(self):
+        """Test that responses no write could invalidate are never stored"""
+        view = CountingView()
+        middleware = CacheMiddleware(view)
+        for _ in range(2):
+            request = self.get()
+            request.cache_tags = []
+            self.assertNotIn('X-Cache', middleware(request))
+
+        # Unresolvable paths have no view to take tags from
+        request = self.get('/missing/')
+        del request.cache_tags
+        middleware(request)
+
+        self.assertEqual(view.calls, 3)
+
+    def test_model_tags_fall_back_to_serializer_and_get_queryset(self):
+        middleware = CacheMiddleware(CountingView())
+        tag = model_tag(PerformanceMetric)
+
+        self.assertEqual(middleware.get_cache_tags(MetricSerializerView.as_view()), [tag])
+        self.assertEqual(
+            middleware.get_cache_tags(MetricQuerysetView.as_view(), self.get(), (), {'instance': 'web-1'}),
+            [tag]
+        )
+        self.assertEqual(middleware.get_cache_tags(MetricQuerysetView.as_view(), self.get()), [])
+
+        request = self.get('/metrics/web-1/')
+        del request.cache_tags
+        self.assertEqual(middleware.resolve_cache_tags(request), [tag])
+
+    def test_non_get_requests_bypass_cache(self):
+        view = CountingView()
+        middleware = CacheMiddleware(view)
+        request = self.factory.post('/api/tracks/')
+        request.user = AnonymousUser()
+
+        middleware(request)
+        middleware(request)
+
+        self.assertEqual(view.calls, 2)
+
+
+@skipUnless(RUN_BENCHMARKS, 'Set RUN_BENCHMARKS=true to run benchmarks')
+class ResponseCacheBenchmark(TransactionTestCase):
+    """Hit rate, payload size and p99 latency under concurrent cache-miss storms."""
+
+    def storm(self, middleware, path):
+        factory = RequestFactory()
+
+        def fetch(_):
+            request = factory.get(path)
+            request.user = AnonymousUser()
+            request.cache_tags = ['tracks']
+            start = time.perf_counter()
+            response = middleware(request)
+            return time.perf_counter() - start, response.get('X-Cache', 'MISS')
+
+        with ThreadPoolExecutor(max_workers=STORM_CLIENTS) as pool:
+            return list(pool.map(fetch, range(STORM_CLIENTS)))
+
+    def summarize(self, label, results, view):
+        latencies = sorted(latency for latency, _ in results)
+        hits = sum(1 for _, status in results if status != 'MISS')
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000
+        print(
+            f"\n{label}: {len(results)} requests, hit rate {hits / len(results):.1%}, "
+            f"upstream calls {view.calls}, p99 {p99:.1f}ms"
+        )
+        return hits, p99
+
+    def test_miss_storm(self):
+        cache.clear()
+        body = json.dumps([{'id': i, 'title': f"Track {i}", 'artist': 'Artist', 'bpm': 120} for i in range(300)])
+        headers = {'Content-Type': 'application/json'}
+
+        def run(middleware_factory):
+            view = CountingView(body=body, headers=headers, delay=0.05)
+            middleware = middleware_factory(view)
+            results = []
+            for round_number in range(STORM_ROUNDS):
+                results.extend(self.storm(middleware, f"/api/tracks/?page={round_number}"))
+            return view, results
+
+        def uncached(view):
+            return view
+
+        view, results = run(uncached)
+        self.summarize('No single-flight (every miss computes)', results, view)
+
+        view, results = run(CacheMiddleware)
+        hits, p99 = self.summarize('Single-flight cache', results, view)
+        self.assertEqual(view.calls, STORM_ROUNDS)
+
+        # Stale storm: every entry expired, one refresh per key, everyone else served stale
+        middleware = CacheMiddleware(view)
+        middleware.response_cache.clock = lambda: time.time() + middleware.response_cache.timeout + 1
+        calls_before = view.calls
+        stale_results = []
+        for round_number in range(STORM_ROUNDS):
+            stale_results.extend(self.storm(middleware, f"/api/tracks/?page={round_number}"))
+        stale_latencies = sorted(latency for latency, _ in stale_results)
+        print(
+            f"Stale-while-revalidate storm: refreshes {view.calls - calls_before}, "
+            f"p99 {stale_latencies[int(len(stale_latencies) * 0.99)] * 1000:.1f}ms"
+        )
+        self.assertEqual(view.calls - calls_before, STORM_ROUNDS)
+
+        request = RequestFactory().get('/api/tracks/?page=0')
+        request.user = AnonymousUser()
+        request.cache_tags = ['tracks']
+        entry = cache.get(ResponseCache().entry_key(request))
+        pickled_response = HttpResponse(f"{body}:1", headers=headers)
+        print(
+            f"Payload: pickled HttpResponse {len(pickle.dumps(pickled_response))} bytes, "
+            f"compact entry {len(pickle.dumps(entry))} bytes"
+        )
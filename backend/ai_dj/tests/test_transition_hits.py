@@ -0,0 +1,207 @@
+import os
+import random
+import threading
+import time
+from unittest import mock, skipUnless
+from django.core.cache import cache
+from django.db import connection, connections
+from django.db.models import F, Sum
+from django.contrib.auth import get_user_model
+from django.test import TestCase, TransactionTestCase
+from rest_framework.test import APIRequestFactory, force_authenticate
+from ..modules.monitoring import models as monitoring_models
+from ..modules.monitoring.views import CacheableTrackTransitionViewSet
+from ..modules.performance.hit_counter import (
+    TransitionHitCounter, get_cached_transition, get_hit_statistics, reset_hit_statistics
+)
+from ..modules.performance.models import CacheableTrackTransition
+
+RUN_BENCHMARKS = os.getenv('RUN_BENCHMARKS', '').lower() == 'true'
+BENCHMARK_TRANSITIONS = int(os.getenv('BENCHMARK_TRANSITIONS', 1_000_000))
+BENCHMARK_HITS = int(os.getenv('BENCHMARK_HITS', 20_000))
+
+
+def create_transitions(count):
+    return CacheableTrackTransition.objects.bulk_create([
+        CacheableTrackTransition(
+            source_track=f"track_{i}", target_track=f"track_{i + 1}",
+            transition_params={'type': 'crossfade'}, cache_key=f"transition_{i}"
+        )
+        for i in range(count)
+    ])
+
+
+class TransitionHitCounterTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.transitions = create_transitions(3)
+        self.counter = TransitionHitCounter(flush_interval=0)
+
+    def test_flush_issues_one_update_per_delta(self):
+        for cache_key, hits in [('transition_0', 3), ('transition_1', 3), ('transition_2', 1), ('missing', 2)]:
+            for _ in range(hits):
+                self.counter.record(cache_key)
+        self.assertEqual(self.counter.pending, 9)
+
+        # Savepoint, one UPDATE per distinct delta (3, 1 and 2), release
+        with self.assertNumQueries(5):
+            applied = self.counter.flush()
+
+        self.assertEqual(applied, 7)
+        self.assertEqual(self.counter.pending, 0)
+        self.assertEqual(
+            list(CacheableTrackTransition.objects.order_by('cache_key').values_list('hit_count', flat=True)),
+            [3, 3, 1]
+        )
+        stats = get_hit_statistics()
+        self.assertEqual((stats['hits'], stats['transitions_hit'], stats['unknown_hits'], stats['flushes']), (7, 3, 2, 1))
+        self.assertIsNotNone(stats['last_flush'])
+
+    def test_failed_flush_keeps_hits(self):
+        self.counter.record('transition_0', 4)
+        with mock.patch('django.db.models.query.QuerySet.update', side_effect=Exception('database down')):
+            self.assertEqual(self.counter.flush(), 0)
+        self.assertEqual(self.counter.pending, 4)
+
+        self.counter.flush()
+
+        self.assertEqual(CacheableTrackTransition.objects.get(cache_key='transition_0').hit_count, 4)
+
+    def test_cached_reads_count_hits(self):
+        cache.set('transition_1', {'curve': 'linear'})
+        with mock.patch('ai_dj.modules.performance.hit_counter.get_hit_counter', return_value=self.counter):
+            self.assertEqual(get_cached_transition('transition_1'), {'curve': 'linear'})
+            self.assertIsNone(get_cached_transition('transition_2'))
+
+        self.assertEqual(self.counter.pending, 1)
+
+    def test_monitoring_transition_hits_are_buffered(self):
+        """Test that the monitoring app's increment_hits goes through the counter"""
+        transition = monitoring_models.CacheableTrackTransition.objects.create(
+            source_track='track_0', target_track='track_1',
+            transition_params={'type': 'crossfade'}, cache_key='transition_0'
+        )
+        user = get_user_model().objects.create_user(username='dj', password='testpass123')
+        view = CacheableTrackTransitionViewSet.as_view({'post': 'increment_hits'})
+
+        with mock.patch('ai_dj.modules.monitoring.views.get_hit_counter', return_value=self.counter):
+            for _ in range(3):
+                request = APIRequestFactory().post('/')
+                force_authenticate(request, user=user)
+                self.assertEqual(view(request, pk=transition.pk).status_code, 200)
+        self.counter.record('transition_0')
+        self.counter.flush()
+
+        transition.refresh_from_db()
+        self.assertEqual(transition.hit_count, 3)
+        self.assertEqual(CacheableTrackTransition.objects.get(cache_key='transition_0').hit_count, 1)
+
+    def tearDown(self):
+        reset_hit_statistics()
+
+
+class ConcurrentHitCountingTests(TransactionTestCase):
+    def test_no_hits_are_lost_under_concurrency(self):
+        cache.clear()
+        create_transitions(50)
+        counter = TransitionHitCounter(flush_interval=0, max_pending=10)
+        threads_count, hits_per_thread = 8, 2000
+        recording = threading.Event()
+
+        def record():
+            for i in range(hits_per_thread):
+                counter.record(f"transition_{random.randrange(50)}")
+
+        def flush_repeatedly():
+            try:
+                while not recording.is_set():
+                    counter.flush()
+            finally:
+                connections.close_all()
+
+        flusher = threading.Thread(target=flush_repeatedly)
+        flusher.start()
+        workers = [threading.Thread(target=record) for _ in range(threads_count)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        recording.set()
+        flusher.join()
+        counter.flush()
+
+        total = CacheableTrackTransition.objects.aggregate(total=Sum('hit_count'))['total']
+        self.assertEqual(total, threads_count * hits_per_thread)
+        self.assertEqual(get_hit_statistics()['hits'], threads_count * hits_per_thread)
+        self.assertGreater(get_hit_statistics()['flushes'], 1)
+
+
+@skipUnless(RUN_BENCHMARKS, 'Set RUN_BENCHMARKS=true to run benchmarks')
+class TransitionHitsBenchmark(TransactionTestCase):
+    """BENCHMARK_HITS hits over BENCHMARK_TRANSITIONS stored transitions."""
+
+    def setUp(self):
+        cache.clear()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO {CacheableTrackTransition._meta.db_table}
+                    (source_track, target_track, transition_params, cache_key, hit_count, last_accessed, created_at)
+                SELECT 'track_' || i, 'track_' || (i + 1), '{{}}', 'transition_' || i, 0, now(), now()
+                FROM generate_series(0, %s - 1) AS i
+                """,
+                [BENCHMARK_TRANSITIONS]
+            )
+            cursor.execute(f'ANALYZE {CacheableTrackTransition._meta.db_table}')
+        # 1% of transitions are cached; hits follow a long-tailed popularity
+        self.cached_keys = [f"transition_{i}" for i in random.sample(range(BENCHMARK_TRANSITIONS), BENCHMARK_TRANSITIONS // 100)]
+        cache.set_many({cache_key: {'curve': 'linear'} for cache_key in self.cached_keys}, None)
+        weights = [1 / (rank + 1) for rank in range(len(self.cached_keys))]
+        self.hits = random.choices(self.cached_keys, weights=weights, k=BENCHMARK_HITS)
+
+    def legacy_scan(self):
+        """The table scan update_cache_statistics ran before."""
+        for transition in CacheableTrackTransition.objects.all():
+            if cache.get(transition.cache_key):
+                transition.hit_count = F('hit_count') + 1
+                transition.save(update_fields=['hit_count', 'last_accessed'])
+
+    def test_hits_and_statistics(self):
+        start = time.perf_counter()
+        self.legacy_scan()
+        scan_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for cache_key in self.hits:
+            CacheableTrackTransition.objects.filter(cache_key=cache_key).update(hit_count=F('hit_count') + 1)
+        per_hit_seconds = time.perf_counter() - start
+
+        before = CacheableTrackTransition.objects.aggregate(total=Sum('hit_count'))['total']
+        counter = TransitionHitCounter(flush_interval=0)
+        start = time.perf_counter()
+        for cache_key in self.hits:
+            counter.record(cache_key)
+        record_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        counter.flush()
+        flush_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        stats = get_hit_statistics()
+        stats_seconds = time.perf_counter() - start
+
+        print(
+            f"\n{BENCHMARK_HITS:,} hits over {BENCHMARK_TRANSITIONS:,} transitions "
+            f"({len(set(self.hits)):,} distinct):\n"
+            f"  legacy statistics scan: {scan_seconds:.1f}s\n"
+            f"  per-hit UPDATE: {per_hit_seconds:.1f}s ({per_hit_seconds / BENCHMARK_HITS * 1e6:.0f}us per hit)\n"
+            f"  buffered: record {record_seconds / BENCHMARK_HITS * 1e6:.2f}us per hit, "
+            f"flush {flush_seconds * 1000:.0f}ms\n"
+            f"  incremental statistics read: {stats_seconds * 1e6:.0f}us"
+        )
+        self.assertEqual(stats['hits'], BENCHMARK_HITS)
+        self.assertEqual(
+            CacheableTrackTransition.objects.aggregate(total=Sum('hit_count'))['total'] - before,
+            BENCHMARK_HITS
+        )
+        self.assertLess(record_seconds + flush_seconds, per_hit_seconds)
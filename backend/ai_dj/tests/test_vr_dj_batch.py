@@ -0,0 +1,194 @@
+import os
+import random
+import time
+from unittest import skipUnless
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from rest_framework.test import APIRequestFactory, force_authenticate
+from ..models import AIDJSession
+from ..modules.vr_dj.models import VRDJControl, VRDJInteraction, VRDJSession
+from ..modules.vr_dj.serializers import VRDJControlSerializer
+from ..modules.vr_dj.views import VRDJControlViewSet, VRDJInteractionViewSet
+
+User = get_user_model()
+
+RUN_BENCHMARKS = os.getenv('RUN_BENCHMARKS', '').lower() == 'true'
+BENCHMARK_BATCH_SIZE = int(os.getenv('BENCHMARK_BATCH_SIZE', 10000))
+
+CONTROL_TYPES = ['turntable_left', 'turntable_right', 'crossfader', 'eq_high', 'eq_mid', 'eq_low', 'effect']
+
+
+def create_vr_session(username):
+    user = User.objects.create_user(username=username, email=f"{username}@example.com", password='testpass123')
+    return user, VRDJSession.objects.create(session=AIDJSession.objects.create(user=user), user=user)
+
+
+def control_batch(session, size):
+    return [
+        {'session': session.id, 'control_type': CONTROL_TYPES[i % len(CONTROL_TYPES)], 'value': random.random()}
+        for i in range(size)
+    ]
+
+
+def post_batch(user, controls):
+    view = VRDJControlViewSet.as_view({'post': 'batch_update'})
+    request = APIRequestFactory().post('/', {'controls': controls}, format='json')
+    force_authenticate(request, user=user)
+    return view(request)
+
+
+class ControlBatchUpdateTests(TestCase):
+    def setUp(self):
+        self.user, self.session = create_vr_session('deejay')
+        self.other_user, self.other_session = create_vr_session('intruder')
+
+    def test_batch_is_written_with_constant_queries(self):
+        for size in (10, 500):
+            # Session lookup, then savepoint, one INSERT and release
+            with self.assertNumQueries(4):
+                response = post_batch(self.user, control_batch(self.session, size))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.data), size)
+
+        self.assertEqual(VRDJControl.objects.filter(session=self.session).count(), 510)
+        self.assertTrue(all(item['id'] and item['timestamp'] for item in response.data))
+
+    def test_items_with_id_update_existing_controls(self):
+        existing = VRDJControl.objects.create(session=self.session, control_type='crossfader', value=0.1)
+        controls = [
+            {'id': existing.id, 'session': self.session.id, 'control_type': 'crossfader', 'value': 0.9},
+            {'session': self.session.id, 'control_type': 'eq_low', 'value': 0.5},
+        ]
+
+        response = post_batch(self.user, controls)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['value'] for item in response.data], [0.9, 0.5])
+        existing.refresh_from_db()
+        self.assertEqual(existing.value, 0.9)
+        self.assertEqual(VRDJControl.objects.count(), 2)
+
+    def test_invalid_batch_writes_nothing(self):
+        foreign = VRDJControl.objects.create(session=self.other_session, control_type='crossfader', value=0.1)
+        cases = [
+            [{'session': self.session.id, 'control_type': 'crossfader', 'value': 1.5}],
+            [{'session': self.other_session.id, 'control_type': 'crossfader', 'value': 0.5}],
+            [{'id': foreign.id, 'session': self.session.id, 'control_type': 'crossfader', 'value': 0.5}],
+            [],
+        ]
+
+        for controls in cases:
+            response = post_batch(self.user, control_batch(self.session, 3) + controls if controls else controls)
+            self.assertEqual(response.status_code, 400)
+
+        self.assertEqual(VRDJControl.objects.filter(session=self.session).count(), 0)
+        foreign.refresh_from_db()
+        self.assertEqual(foreign.value, 0.1)
+
+
+class SessionStatsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user, self.session = create_vr_session('deejay')
+        for interaction_type, rating in [
+            ('deck_manipulation', 0.5), ('deck_manipulation', None),
+            ('effect_trigger', 1.0), ('environment_change', 0.0),
+        ]:
+            VRDJInteraction.objects.create(
+                session=self.session, interaction_type=interaction_type, details={}, success_rating=rating
+            )
+
+    def get_stats(self, user):
+        view = VRDJInteractionViewSet.as_view({'get': 'session_stats'})
+        request = APIRequestFactory().get('/', {'session_id': self.session.id})
+        force_authenticate(request, user=user)
+        return view(request)
+
+    def test_stats_are_aggregated_in_the_database_and_cached(self):
+        with self.assertNumQueries(2):
+            response = self.get_stats(self.user)
+        with self.assertNumQueries(0):
+            self.get_stats(self.user)
+
+        self.assertEqual(response.data, {
+            'total_interactions': 4,
+            'interaction_types': {'deck_manipulation': 2, 'effect_trigger': 1, 'environment_change': 1},
+            'average_success_rating': 0.5
+        })
+
+    def test_new_interaction_refreshes_stats(self):
+        self.get_stats(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            VRDJInteraction.objects.create(
+                session=self.session, interaction_type='effect_trigger', details={}, success_rating=1.0
+            )
+
+        response = self.get_stats(self.user)
+
+        self.assertEqual(response.data['total_interactions'], 5)
+        self.assertEqual(response.data['average_success_rating'], 0.625)
+
+    def test_other_users_see_empty_stats(self):
+        other_user, _ = create_vr_session('stranger')
+
+        response = self.get_stats(other_user)
+
+        self.assertEqual(response.data['total_interactions'], 0)
+        self.assertIsNone(response.data['average_success_rating'])
+
+
+@skipUnless(RUN_BENCHMARKS, 'Set RUN_BENCHMARKS=true to run benchmarks')
+class ControlBatchBenchmark(TransactionTestCase):
+    """Throughput of BENCHMARK_BATCH_SIZE-item control batches."""
+
+    def setUp(self):
+        self.user, self.session = create_vr_session('deejay')
+
+    def measure(self, func):
+        queries = []
+
+        def count(execute, sql, params, many, context):
+            queries.append(sql)
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(count):
+            start = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - start
+        return elapsed, len(queries)
+
+    def report(self, label, elapsed, queries):
+        print(
+            f"{label}: {BENCHMARK_BATCH_SIZE} items in {elapsed * 1000:.0f}ms "
+            f"({BENCHMARK_BATCH_SIZE / elapsed:,.0f} items/s), {queries} queries"
+        )
+
+    def test_batch_throughput(self):
+        controls = control_batch(self.session, BENCHMARK_BATCH_SIZE)
+
+        def legacy():
+            serializer = VRDJControlSerializer(data=controls, many=True)
+            serializer.is_valid(raise_exception=True)
+            serializer.save()
+
+        print()
+        legacy_elapsed, legacy_queries = self.measure(legacy)
+        self.report('Row-by-row ListSerializer', legacy_elapsed, legacy_queries)
+
+        bulk_elapsed, bulk_queries = self.measure(lambda: post_batch(self.user, controls))
+        self.report('Bulk create', bulk_elapsed, bulk_queries)
+
+        # Typical update: new values for existing controls
+        updates = [
+            {'id': control_id, 'session': self.session.id, 'control_type': control_type, 'value': random.random()}
+            for control_id, control_type in VRDJControl.objects.filter(
+                session=self.session
+            ).values_list('id', 'control_type')[:BENCHMARK_BATCH_SIZE]
+        ]
+        update_elapsed, update_queries = self.measure(lambda: post_batch(self.user, updates))
+        self.report('Bulk update', update_elapsed, update_queries)
+
+        self.assertLess(bulk_elapsed, legacy_elapsed)
+        self.assertLess(bulk_queries, legacy_queries)
@@ -1,20 +1,139 @@
-from cryptography.fernet import Fernet
+from concurrent.futures import ThreadPoolExecutor
+from cryptography.fernet import Fernet, MultiFernet
 from django.conf import settings
+from typing import List, Optional, Sequence, Tuple
 import base64
+import logging
 import os
 import re
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Batches with at least this many bytes of payload are split across the pool
+PARALLEL_MIN_BYTES = 1024 * 1024
+PARALLEL_CHUNKS = 4
+
+_generated_key = None
+
 
 def get_encryption_key():
     """
     Get or generate the encryption key.
-    Uses the ENCRYPTION_KEY from settings if available, otherwise generates a new one.
+    Uses the ENCRYPTION_KEY from settings if available. Otherwise a random key
+    is generated once per process, so data encrypted without a configured key
+    can only be decrypted by the same process.
     """
+    global _generated_key
     key = getattr(settings, 'ENCRYPTION_KEY', None)
     if not key:
-        key = base64.urlsafe_b64encode(os.urandom(32))
-        # Store the key securely or notify admin to add it to settings
+        if _generated_key is None:
+            _generated_key = base64.urlsafe_b64encode(os.urandom(32))
+            # Store the key securely or notify admin to add it to settings
+            logger.warning("ENCRYPTION_KEY is not set; using a temporary key for this process")
+        key = _generated_key
     return key
 
+
+def get_encryption_keys() -> Tuple:
+    """
+    The current key followed by ENCRYPTION_PREVIOUS_KEYS, which are only
+    used to decrypt data encrypted before a rotation.
+    """
+    previous = getattr(settings, 'ENCRYPTION_PREVIOUS_KEYS', None) or []
+    return (get_encryption_key(), *previous)
+
+
+class CipherManager:
+    """
+    Process-wide ``MultiFernet`` built once per key set.
+
+    The cipher is rebuilt only when the configured keys change, and batches
+    large enough to be worth it are spread over a small thread pool.
+    """
+
+    def __init__(self, parallel_min_bytes: int = PARALLEL_MIN_BYTES, workers: Optional[int] = None):
+        self.parallel_min_bytes = parallel_min_bytes
+        self.workers = workers or min(PARALLEL_CHUNKS, os.cpu_count() or 1)
+        self._keys = None
+        self._cipher = None
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def cipher(self) -> MultiFernet:
+        keys = get_encryption_keys()
+        cipher = self._cipher
+        if cipher is None or keys != self._keys:
+            with self._lock:
+                if self._cipher is None or keys != self._keys:
+                    self._cipher = MultiFernet([Fernet(key) for key in keys])
+                    self._keys = keys
+                cipher = self._cipher
+        return cipher
+
+    def encrypt(self, data: str) -> str:
+        return self.cipher.encrypt(data.encode()).decode()
+
+    def decrypt(self, token: str) -> str:
+        return self.cipher.decrypt(token.encode()).decode()
+
+    def rotate(self, token: str) -> str:
+        """Re-encrypt a token with the current key."""
+        return self.cipher.rotate(token.encode()).decode()
+
+    def encrypt_many(self, values: Sequence[str], parallel: Optional[bool] = None) -> List[str]:
+        """Encrypt a batch; empty values are returned unchanged."""
+        return self._map(self._encrypt_chunk, values, parallel)
+
+    def decrypt_many(self, tokens: Sequence[str], parallel: Optional[bool] = None) -> List[str]:
+        """Decrypt a batch; empty values are returned unchanged."""
+        return self._map(self._decrypt_chunk, tokens, parallel)
+
+    def _encrypt_chunk(self, values: Sequence[str]) -> List[str]:
+        cipher = self.cipher
+        return [cipher.encrypt(value.encode()).decode() if value else value for value in values]
+
+    def _decrypt_chunk(self, tokens: Sequence[str]) -> List[str]:
+        cipher = self.cipher
+        return [cipher.decrypt(token.encode()).decode() if token else token for token in tokens]
+
+    def _map(self, func, values: Sequence[str], parallel: Optional[bool]) -> List[str]:
+        values = list(values)
+        if parallel is None:
+            parallel = self.workers > 1 and sum(len(value) for value in values if value) >= self.parallel_min_bytes
+        if not parallel or len(values) < 2:
+            return func(values)
+
+        size = -(-len(values) // self.workers)
+        chunks = [values[offset:offset + size] for offset in range(0, len(values), size)]
+        results = []
+        for chunk in self._get_executor().map(func, chunks):
+            results.extend(chunk)
+        return results
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='cipher')
+        return self._executor
+
+
+_cipher_manager = None
+_cipher_manager_lock = threading.Lock()
+
+
+def get_cipher_manager() -> CipherManager:
+    """Get the process-wide cipher manager."""
+    global _cipher_manager
+    if _cipher_manager is None:
+        with _cipher_manager_lock:
+            if _cipher_manager is None:
+                _cipher_manager = CipherManager()
+    return _cipher_manager
+
+
 def encrypt(data: str) -> str:
     """
     Encrypt sensitive data using Fernet (symmetric encryption).
@@ -29,9 +148,7 @@ def encrypt(data: str) -> str:
         return data
         
     try:
-        key = get_encryption_key()
-        f = Fernet(key)
-        return f.encrypt(data.encode()).decode()
+        return get_cipher_manager().encrypt(data)
     except Exception as e:
         # Log the error but don't expose encryption details
         logger.error("Encryption error occurred", extra={'error_type': type(e).__name__})
@@ -51,14 +168,47 @@ def decrypt(encrypted_data: str) -> str:
         return encrypted_data
         
     try:
-        key = get_encryption_key()
-        f = Fernet(key)
-        return f.decrypt(encrypted_data.encode()).decode()
+        return get_cipher_manager().decrypt(encrypted_data)
     except Exception as e:
         # Log the error but don't expose encryption details
         logger.error("Decryption error occurred", extra={'error_type': type(e).__name__})
         raise ValueError("Failed to decrypt data")
 
+def encrypt_many(values: Sequence[str], parallel: Optional[bool] = None) -> List[str]:
+    """
+    Encrypt a batch of strings with one cipher lookup.
+    
+    Args:
+        values: The strings to encrypt; empty values are kept as they are
+        parallel: Force or disable the thread pool; by default it is used
+            for batches of at least PARALLEL_MIN_BYTES
+        
+    Returns:
+        list: The encrypted values, in order
+    """
+    try:
+        return get_cipher_manager().encrypt_many(values, parallel)
+    except Exception as e:
+        logger.error("Encryption error occurred", extra={'error_type': type(e).__name__})
+        raise ValueError("Failed to encrypt data")
+
+def decrypt_many(encrypted_values: Sequence[str], parallel: Optional[bool] = None) -> List[str]:
+    """
+    Decrypt a batch of values encrypted using encrypt() or encrypt_many().
+    
+    Args:
+        encrypted_values: The encrypted strings; empty values are kept as they are
+        parallel: Force or disable the thread pool
+        
+    Returns:
+        list: The decrypted values, in order
+    """
+    try:
+        return get_cipher_manager().decrypt_many(encrypted_values, parallel)
+    except Exception as e:
+        logger.error("Decryption error occurred", extra={'error_type': type(e).__name__})
+        raise ValueError("Failed to decrypt data")
+
 def encrypt_voice_command(command: str) -> str:
     """
     Specifically encrypt voice command data with additional validation.
@@ -92,6 +242,35 @@ def decrypt_voice_command(encrypted_command: str) -> str:
         raise ValueError("Invalid voice command format")
     return decrypted
 
+def encrypt_voice_commands(commands: Sequence[str]) -> List[str]:
+    """
+    Sanitize and encrypt a batch of voice commands.
+    
+    Args:
+        commands: The voice commands to encrypt
+        
+    Returns:
+        list: The encrypted commands, in order
+    """
+    if not all(isinstance(command, str) for command in commands):
+        raise ValueError("Voice command must be a string")
+    return encrypt_many([sanitize_voice_command(command) for command in commands])
+
+def decrypt_voice_commands(encrypted_commands: Sequence[str]) -> List[str]:
+    """
+    Decrypt and validate a batch of voice commands.
+    
+    Args:
+        encrypted_commands: The encrypted voice commands
+        
+    Returns:
+        list: The decrypted commands, in order
+    """
+    decrypted = decrypt_many(encrypted_commands)
+    if not all(is_valid_voice_command(command) for command in decrypted):
+        raise ValueError("Invalid voice command format")
+    return decrypted
+
 def sanitize_voice_command(command: str) -> str:
     """
     Remove any potentially sensitive information from voice commands.
@@ -11,14 +11,15 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework import status
 from django.conf import settings
+from django.db import transaction
+from django.http import FileResponse, HttpResponseNotModified
+from . import announcements
+from .tasks import presynthesize_announcements
 import base64
+import logging
 import os
 
-# Try to import Google Cloud Text-to-Speech, but don't fail if it's not available
-try:
-    import google.cloud.texttospeech as tts
-except ImportError:
-    tts = None
+logger = logging.getLogger(__name__)
 
 class UserSpecificPermission(permissions.BasePermission):
     """
@@ -193,44 +194,13 @@ class AIDJSessionViewSet(BaseUserSpecificViewSet):
         """
         Get Google Cloud TTS client
         """
-        if tts is None:
-            return None
-        try:
-            return tts.TextToSpeechClient()
-        except Exception as e:
-            print(f"Error creating TTS client: {e}")
-            return None
+        return announcements.get_tts_client()
 
     def get_voice_params(self, session):
         """
         Get voice parameters based on user preferences
         """
-        # Map language codes to Google Cloud TTS voices
-        voice_map = {
-            'en': {'name': 'en-US-Neural2-A', 'gender': tts.SsmlVoiceGender.FEMALE},
-            'es': {'name': 'es-US-Neural2-A', 'gender': tts.SsmlVoiceGender.FEMALE},
-            'fr': {'name': 'fr-FR-Neural2-A', 'gender': tts.SsmlVoiceGender.FEMALE},
-            'zh': {'name': 'cmn-CN-Neural2-A', 'gender': tts.SsmlVoiceGender.FEMALE},
-            'hi': {'name': 'hi-IN-Neural2-A', 'gender': tts.SsmlVoiceGender.FEMALE},
-        }
-
-        # Get voice settings for the preferred language
-        voice_settings = voice_map.get(session.preferred_language, voice_map['en'])
-        
-        # Adjust speaking rate and pitch based on voice style
-        style_params = {
-            'formal': {'speaking_rate': 0.9, 'pitch': -2.0},
-            'casual': {'speaking_rate': 1.0, 'pitch': 0.0},
-            'energetic': {'speaking_rate': 1.2, 'pitch': 2.0},
-            'calm': {'speaking_rate': 0.8, 'pitch': -1.0},
-        }
-
-        return {
-            'language_code': session.preferred_language,
-            'name': voice_settings['name'],
-            'gender': voice_settings['gender'],
-            **style_params[session.voice_style]
-        }
+        return announcements.get_voice_params(session)
 
     @action(detail=True, methods=['post'])
     def process_voice_command(self, request, pk=None):
@@ -298,10 +268,30 @@ class AIDJSessionViewSet(BaseUserSpecificViewSet):
             "preferred_language": session.preferred_language
         })
 
+    def announcement_response(self, request, session, key, audio_file):
+        """Stream cached announcement audio, honouring If-None-Match."""
+        etag = f'"{key}"'
+        if etag in [tag.strip() for tag in request.headers.get('If-None-Match', '').split(',')]:
+            audio_file.close()
+            response = HttpResponseNotModified()
+        else:
+            response = FileResponse(audio_file, content_type='audio/mpeg')
+        response['ETag'] = etag
+        # The key is a hash of the content, so the audio never changes
+        response['Cache-Control'] = 'private, max-age=31536000, immutable'
+        response['Content-Location'] = self.reverse_action(
+            'announcement-audio', kwargs={'pk': session.pk, 'audio_key': key}
+        )
+        return response
+
     @action(detail=True, methods=['post'])
     def generate_announcement(self, request, pk=None):
         """
         Generate a TTS announcement
+
+        Streams MP3 audio with a content-hash ETag. Identical text in the same
+        voice is served from the announcement cache without synthesis. Pass
+        ``encoding=base64`` for the JSON response with base64 audio.
         """
         session = self.get_object()
         
@@ -319,47 +309,45 @@ class AIDJSessionViewSet(BaseUserSpecificViewSet):
             )
 
         try:
-            client = self.get_tts_client()
-            
-            # Handle case when TTS is not available
-            if client is None:
-                return Response(
-                    {"error": "Text-to-Speech service is not available. Please install google-cloud-texttospeech package."},
-                    status=status.HTTP_503_SERVICE_UNAVAILABLE
-                )
-                
             voice_params = self.get_voice_params(session)
-
-            synthesis_input = tts.SynthesisInput(text=announcement_text)
-            voice = tts.VoiceSelectionParams(
-                language_code=voice_params['language_code'],
-                name=voice_params['name'],
-                ssml_gender=voice_params['gender']
-            )
-            audio_config = tts.AudioConfig(
-                audio_encoding=tts.AudioEncoding.MP3,
-                speaking_rate=voice_params['speaking_rate'],
-                pitch=voice_params['pitch']
-            )
-
-            response = client.synthesize_speech(
-                input=synthesis_input,
-                voice=voice,
-                audio_config=audio_config
-            )
-
-            # Convert audio content to base64 for transmission
-            audio_content = base64.b64encode(response.audio_content).decode()
+            announcement_cache = announcements.get_announcement_cache()
+            key = announcements.announcement_key(announcement_text, voice_params)
+            # Opened rather than looked up, so eviction cannot delete it before it is served
+            audio_file = announcement_cache.open_audio(key)
+
+            if audio_file is None:
+                client = self.get_tts_client()
+
+                # Handle case when TTS is not available
+                if client is None:
+                    return Response(
+                        {"error": "Text-to-Speech service is not available. Please install google-cloud-texttospeech package."},
+                        status=status.HTTP_503_SERVICE_UNAVAILABLE
+                    )
+
+                key, _, _ = announcement_cache.get_or_synthesize(
+                    announcement_text,
+                    voice_params,
+                    lambda text, params: announcements.synthesize_speech(client, text, params)
+                )
+                audio_file = announcement_cache.open_audio(key)
+                if audio_file is None:
+                    raise FileNotFoundError("Announcement audio was evicted before it could be served")
 
             # Update last announcement
             session.last_announcement = announcement_text
             session.save(update_fields=['last_announcement'])
 
-            return Response({
-                "audio_content": audio_content,
-                "content_type": "audio/mpeg",
-                "text": announcement_text
-            })
+            if request.query_params.get('encoding') == 'base64':
+                with audio_file:
+                    audio_content = base64.b64encode(audio_file.read()).decode()
+                return Response({
+                    "audio_content": audio_content,
+                    "content_type": "audio/mpeg",
+                    "text": announcement_text
+                })
+
+            return self.announcement_response(request, session, key, audio_file)
 
         except Exception as e:
             return Response(
@@ -367,6 +355,28 @@ class AIDJSessionViewSet(BaseUserSpecificViewSet):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+    @action(detail=True, methods=['get'], url_path=r'announcements/(?P<audio_key>[0-9a-f]{64})', url_name='announcement-audio')
+    def announcement_audio(self, request, pk=None, audio_key=None):
+        """
+        Stream a previously generated announcement by its ETag
+        """
+        session = self.get_object()
+        audio_file = announcements.get_announcement_cache().open_audio(audio_key)
+        if audio_file is None:
+            return Response(
+                {"error": "Announcement audio not found"},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        return self.announcement_response(request, session, audio_key, audio_file)
+
+    @staticmethod
+    def queue_presynthesis(session_id):
+        """Queue pre-synthesis; the settings are saved even if the broker is down."""
+        try:
+            presynthesize_announcements.delay(session_id)
+        except Exception as e:
+            logger.error(f"Error queueing announcement pre-synthesis for session {session_id}: {str(e)}")
+
     @action(detail=True, methods=['post'])
     def update_announcement_settings(self, request, pk=None):
         """
@@ -381,6 +391,9 @@ class AIDJSessionViewSet(BaseUserSpecificViewSet):
         try:
             session.full_clean()
             session.save()
+            if session.enable_announcements:
+                # Have the common announcements ready in the new voice
+                transaction.on_commit(lambda: self.queue_presynthesis(session.id))
             return Response(self.get_serializer(session).data)
         except Exception as e:
             return Response(
@@ -4,3 +4,18 @@ from django.apps import AppConfig
 class FutureCapabilitiesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'future_capabilities'
+
+    def ready(self):
+        """Register signal handlers."""
+        try:
+            import future_capabilities.signals  # noqa
+        except ImportError:
+            pass
+        # Every process watches the models of the cached viewsets, including
+        # those that only write to them
+        try:
+            import future_capabilities.views  # noqa
+        except ImportError:
+            pass
+        from .cache import watch_cached_views
+        watch_cached_views()
@@ -0,0 +1,414 @@
+"""
+Streaming signal processing for wearable biofeedback.
+
+Raw samples from a wearable arrive at up to a few hundred hertz per signal.
+``BiofeedbackPipeline`` keeps a stream per device and signal type, and
+buffers every message's samples into the stream's current ``WINDOW``
+seconds. When a window is full it goes through filters whose state carries
+over from one window to the next (``scipy.signal.sosfilt``), its features
+are computed, and a ``BiofeedbackWindow`` row with the features and the
+window's raw samples decimated to ``STORED_RATE`` is queued. A background flusher thread writes the queued rows every
+``FLUSH_INTERVAL`` seconds with one ``bulk_create``; raw messages are not
+stored.
+
+Features of every signal are the window's ``mean``, ``std``, ``min`` and
+``max``. In addition:
+
+``ppg`` and ``ecg``
+    Band-passed to the pulse band, beats are detected across window
+    boundaries, and ``heart_rate`` (bpm), ``rmssd`` and ``sdnn`` (ms) are
+    computed over the inter-beat intervals of the last ``HRV_WINDOW``
+    seconds, with ``beats`` in the window.
+
+``eda``
+    Split by a low-pass filter into the slow ``tonic`` level and the
+    ``phasic`` response; skin conductance responses larger than
+    ``SCR_THRESHOLD`` are counted as ``scr_count`` with the largest as
+    ``scr_amplitude``.
+
+A stream starts again, without its partial window, when its sample rate
+changes or a message's timestamp does not follow on from the previous one.
+Timestamps more than ``MAX_CLOCK_SKEW`` seconds from now are refused, and a
+window that cannot be stored is logged and dropped without holding back
+the others.
+"""
+import logging
+import math
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone as dt_timezone
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from scipy import signal as sp_signal
+
+from server.background import BackgroundFlusher
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'FLUSH_INTERVAL': 2.0,
+    # Seconds of signal per feature window
+    'WINDOW': 5.0,
+    # Sample rate the raw samples are stored at
+    'STORED_RATE': 32.0,
+    # Seconds of inter-beat intervals heart rate variability is computed over
+    'HRV_WINDOW': 60.0,
+    # Smallest skin conductance response counted, in microsiemens
+    'SCR_THRESHOLD': 0.01,
+    'SAMPLE_RATE': 256.0,
+    'GAP_TOLERANCE': 0.5,
+    # Largest distance in seconds between a timestamp and now
+    'MAX_CLOCK_SKEW': 86400.0,
+    # Windows kept while the database is unavailable
+    'MAX_PENDING': 100000,
+    'BATCH_SIZE': 500,
+}
+
+# Pulse band (Hz) of the signals beats are detected in
+PULSE_BANDS = {
+    'ppg': (0.5, 8.0),
+    'ecg': (5.0, 30.0),
+}
+EDA_TONIC_CUTOFF = 0.05
+SIGNAL_TYPES = ('ppg', 'ecg', 'eda', 'temperature', 'movement')
+
+# Physiological range of inter-beat intervals, in seconds
+MIN_IBI = 0.3
+MAX_IBI = 2.0
+
+StreamKey = Tuple[int, str]
+
+
+def biofeedback_dsp_setting(name: str):
+    return getattr(settings, 'BIOFEEDBACK_DSP', {}).get(name, DEFAULTS[name])
+
+
+def _optional(value) -> Optional[float]:
+    return None if value is None or not np.isfinite(value) else round(float(value), 4)
+
+
+class _Stream:
+    """Filters, window buffer and beat history of one device's signal."""
+
+    def __init__(self, signal_type: str, sample_rate: float, start: float, window: float,
+                 stored_rate: float, hrv_window: float, scr_threshold: float):
+        self.signal_type = signal_type
+        self.sample_rate = sample_rate
+        self.start = start
+        self.count = 0
+        self.hrv_window = hrv_window
+        self.scr_threshold = scr_threshold
+
+        self.factor = max(1, int(round(sample_rate / stored_rate)))
+        # Whole decimated samples per window
+        self.window_samples = max(1, int(round(window * sample_rate)) // self.factor) * self.factor
+        self.window_start = 0
+        self.filled = 0
+        self.raw = np.empty(self.window_samples)
+
+        nyquist = sample_rate / 2
+        self.filters: Dict[str, np.ndarray] = {}
+        self.states: Dict[str, np.ndarray] = {}
+        if self.factor > 1:
+            self.filters['decimate'] = sp_signal.butter(
+                4, 0.8 * nyquist / self.factor, 'lowpass', fs=sample_rate, output='sos'
+            )
+        self.filtered = None
+        if signal_type in PULSE_BANDS:
+            low, high = PULSE_BANDS[signal_type]
+            self.filters['pulse'] = sp_signal.butter(
+                2, [low, min(high, 0.9 * nyquist)], 'bandpass', fs=sample_rate, output='sos'
+            )
+            self.refractory = max(1, int(MIN_IBI * sample_rate))
+            self.tail = np.empty(0)
+            self.last_beat: Optional[int] = None
+            # (sample index of the beat, interval before it in seconds)
+            self.intervals: 'deque[Tuple[int, float]]' = deque()
+        elif signal_type == 'eda':
+            self.filters['tonic'] = sp_signal.butter(
+                2, EDA_TONIC_CUTOFF, 'lowpass', fs=sample_rate, output='sos'
+            )
+
+    @property
+    def end(self) -> float:
+        """Time just after the last sample received."""
+        return self.start + self.count / self.sample_rate
+
+    def _filter(self, name: str, values: np.ndarray) -> np.ndarray:
+        sos = self.filters[name]
+        state = self.states.get(name)
+        if state is None:
+            # Start settled on the first sample instead of ringing up from zero
+            state = sp_signal.sosfilt_zi(sos) * values[0]
+        output, self.states[name] = sp_signal.sosfilt(sos, values, zi=state)
+        return output
+
+    def push(self, values: np.ndarray) -> List[Dict]:
+        """Buffer samples; returns the windows they completed."""
+        self.count += len(values)
+        windows = []
+        position = 0
+        while position < len(values):
+            take = min(len(values) - position, self.window_samples - self.filled)
+            self.raw[self.filled:self.filled + take] = values[position:position + take]
+            self.filled += take
+            position += take
+            if self.filled == self.window_samples:
+                windows.append(self._complete_window())
+                self.filled = 0
+                self.window_start += self.window_samples
+        return windows
+
+    def _complete_window(self) -> Dict:
+        # Filtering whole windows costs the same per sample as filtering
+        # every message, without the per-call overhead of small messages
+        raw = self.raw
+        features = {
+            'mean': _optional(raw.mean()),
+            'std': _optional(raw.std()),
+            'min': _optional(raw.min()),
+            'max': _optional(raw.max()),
+        }
+        if 'pulse' in self.filters:
+            self.filtered = self._filter('pulse', raw)
+            features.update(self._heart_rate_variability())
+        elif 'tonic' in self.filters:
+            self.filtered = self._filter('tonic', raw)
+            features.update(self._electrodermal_activity())
+
+        # Windows hold whole decimated samples, so every window starts on one
+        smoothed = self._filter('decimate', raw) if 'decimate' in self.filters else raw
+        return {
+            'signal_type': self.signal_type,
+            'start': self.start + self.window_start / self.sample_rate,
+            'duration': self.window_samples / self.sample_rate,
+            'features': features,
+            'sample_rate': self.sample_rate / self.factor,
+            'samples': smoothed[::self.factor].astype('<f4'),
+        }
+
+    def _heart_rate_variability(self) -> Dict:
+        # Beats near the end of the window are left for the next one, where
+        # a higher sample could still follow them
+        data = np.concatenate([self.tail, self.filtered])
+        offset = self.window_start - len(self.tail)
+        limit = len(data) - self.refractory
+        peaks, _ = sp_signal.find_peaks(data, distance=self.refractory, prominence=0.5 * data.std())
+        beats = 0
+        for peak in peaks:
+            if peak >= limit:
+                break
+            index = offset + int(peak)
+            if self.last_beat is not None:
+                if index <= self.last_beat:
+                    continue
+                interval = (index - self.last_beat) / self.sample_rate
+                if MIN_IBI <= interval <= MAX_IBI:
+                    self.intervals.append((index, interval))
+            self.last_beat = index
+            beats += 1
+        self.tail = data[max(limit - self.refractory, 0):].copy()
+
+        horizon = self.window_start + self.window_samples - self.hrv_window * self.sample_rate
+        while self.intervals and self.intervals[0][0] < horizon:
+            self.intervals.popleft()
+        intervals = np.array([interval for _, interval in self.intervals])
+        features = {'beats': beats, 'heart_rate': None, 'rmssd': None, 'sdnn': None}
+        if len(intervals):
+            features['heart_rate'] = _optional(60.0 / intervals.mean())
+        if len(intervals) >= 3:
+            features['rmssd'] = _optional(np.sqrt(np.mean(np.diff(intervals) ** 2)) * 1000)
+            features['sdnn'] = _optional(intervals.std(ddof=1) * 1000)
+        return features
+
+    def _electrodermal_activity(self) -> Dict:
+        tonic = self.filtered
+        phasic = self.raw - tonic
+        _, properties = sp_signal.find_peaks(
+            phasic, prominence=self.scr_threshold, distance=max(1, int(self.sample_rate))
+        )
+        prominences = properties['prominences']
+        return {
+            'tonic': _optional(tonic.mean()),
+            'phasic': _optional(phasic.std()),
+            'scr_count': int(len(prominences)),
+            'scr_amplitude': _optional(prominences.max()) if len(prominences) else 0.0,
+        }
+
+
+class BiofeedbackPipeline(BackgroundFlusher):
+    """
+    Processes wearable signals from consumers and stores their windows.
+    """
+
+    thread_name = 'biofeedback-dsp-flusher'
+
+    def __init__(
+        self,
+        flush_interval: Optional[float] = None,
+        window: Optional[float] = None,
+        stored_rate: Optional[float] = None,
+        hrv_window: Optional[float] = None
+    ):
+        super().__init__()
+        self.flush_interval = flush_interval if flush_interval is not None else biofeedback_dsp_setting('FLUSH_INTERVAL')
+        self.window = window or biofeedback_dsp_setting('WINDOW')
+        self.stored_rate = stored_rate or biofeedback_dsp_setting('STORED_RATE')
+        self.hrv_window = hrv_window or biofeedback_dsp_setting('HRV_WINDOW')
+        self.scr_threshold = biofeedback_dsp_setting('SCR_THRESHOLD')
+        self.sample_rate = biofeedback_dsp_setting('SAMPLE_RATE')
+        self.gap_tolerance = biofeedback_dsp_setting('GAP_TOLERANCE')
+        self.max_clock_skew = biofeedback_dsp_setting('MAX_CLOCK_SKEW')
+        self.max_pending = biofeedback_dsp_setting('MAX_PENDING')
+        self.batch_size = biofeedback_dsp_setting('BATCH_SIZE')
+        self._streams: Dict[StreamKey, _Stream] = {}
+        # (device id, window) waiting to be stored
+        self._pending: List[Tuple[int, Dict]] = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self.samples = 0
+        self.stored = 0
+        self.dropped = 0
+
+    @property
+    def pending(self) -> int:
+        """Windows computed but not yet stored."""
+        return len(self._pending)
+
+    def record(
+        self,
+        device_id: int,
+        signal_type: str,
+        samples,
+        sample_rate: Optional[float] = None,
+        timestamp: Optional[float] = None
+    ) -> List[Dict]:
+        """
+        Process ``samples`` from the device. ``timestamp`` is the Unix time of
+        the first sample. Returns the windows the samples completed, without
+        their decimated samples.
+        """
+        if signal_type not in SIGNAL_TYPES:
+            raise ValueError(f"Unknown signal type: {signal_type}")
+        if samples is None:
+            raise ValueError('Samples are required')
+        try:
+            values = np.asarray(samples, dtype=np.float64).ravel()
+        except (TypeError, ValueError):
+            raise ValueError('Samples must be numbers')
+        if not np.isfinite(values).all():
+            raise ValueError('Samples must be finite')
+        sample_rate = float(sample_rate or self.sample_rate)
+        if sample_rate <= 0:
+            raise ValueError('Sample rate must be positive')
+        if timestamp is not None:
+            try:
+                timestamp = float(timestamp)
+            except (TypeError, ValueError):
+                raise ValueError('Timestamp must be a number')
+            if not math.isfinite(timestamp) or abs(timestamp - time.time()) > self.max_clock_skew:
+                raise ValueError('Timestamp must be a Unix time close to the current time')
+        if not len(values):
+            return []
+
+        self._ensure_running()
+        with self._lock:
+            key = (device_id, signal_type)
+            stream = self._streams.get(key)
+            if stream is not None and (
+                stream.sample_rate != sample_rate
+                or (timestamp is not None and abs(timestamp - stream.end) > self.gap_tolerance)
+            ):
+                stream = None
+            if stream is None:
+                start = timestamp if timestamp is not None else time.time() - len(values) / sample_rate
+                stream = self._streams[key] = _Stream(
+                    signal_type, sample_rate, start, self.window, self.stored_rate,
+                    self.hrv_window, self.scr_threshold
+                )
+            windows = stream.push(values)
+            self.samples += len(values)
+            if windows:
+                self._pending.extend((device_id, window) for window in windows)
+                overflow = len(self._pending) - self.max_pending
+                if overflow > 0:
+                    del self._pending[:overflow]
+                    self.dropped += overflow
+                    logger.warning(f"Dropped {overflow} biofeedback windows waiting to be stored")
+
+        return [{key: value for key, value in window.items() if key != 'samples'} for window in windows]
+
+    def close(self, device_id: int) -> None:
+        """Forget a device's streams, with their partial windows."""
+        with self._lock:
+            for key in [key for key in self._streams if key[0] == device_id]:
+                del self._streams[key]
+
+    def flush(self) -> int:
+        """Store every completed window. Returns the number stored."""
+        from .models import BiofeedbackWindow, WearableDevice
+
+        with self._flush_lock:
+            with self._lock:
+                taken, self._pending = self._pending, []
+            if not taken:
+                return 0
+
+            try:
+                users = dict(WearableDevice.objects.filter(
+                    pk__in={device_id for device_id, _ in taken}
+                ).values_list('pk', 'user_id'))
+            except Exception as e:
+                self._requeue(taken)
+                logger.error(f"Error flushing biofeedback windows: {str(e)}")
+                return 0
+
+            rows, converted, unknown, invalid = [], [], 0, 0
+            for device_id, window in taken:
+                if device_id not in users:
+                    unknown += 1
+                    continue
+                try:
+                    rows.append(BiofeedbackWindow(
+                        user_id=users[device_id],
+                        device_id=device_id,
+                        signal_type=window['signal_type'],
+                        start_time=datetime.fromtimestamp(window['start'], tz=dt_timezone.utc),
+                        duration=window['duration'],
+                        features=window['features'],
+                        sample_rate=window['sample_rate'],
+                        samples=window['samples'].tobytes()
+                    ))
+                except Exception as e:
+                    invalid += 1
+                    logger.error(f"Error converting biofeedback window from device {device_id}: {str(e)}")
+                    continue
+                converted.append((device_id, window))
+
+            try:
+                with transaction.atomic():
+                    BiofeedbackWindow.objects.bulk_create(rows, batch_size=self.batch_size)
+            except Exception as e:
+                self._requeue(converted)
+                logger.error(f"Error flushing biofeedback windows: {str(e)}")
+                rows = []
+
+            self.stored += len(rows)
+            self.dropped += unknown + invalid
+            if unknown:
+                logger.warning(f"Dropped {unknown} biofeedback windows from unknown devices")
+            return len(rows)
+
+    def _requeue(self, taken: List[Tuple[int, Dict]]) -> None:
+        # Nothing was written; put the windows back in front of newer ones
+        with self._lock:
+            self._pending[:0] = taken
+
+
+def get_biofeedback_pipeline() -> BiofeedbackPipeline:
+    """Get the process-wide biofeedback pipeline"""
+    return BiofeedbackPipeline.shared()
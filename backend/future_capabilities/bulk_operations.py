@@ -0,0 +1,334 @@
+"""
+Dependency-aware bulk operations.
+
+``BulkOperation`` applies an operation to a batch of items on a bounded
+thread pool. Items may depend on other items of the batch: an item starts
+as soon as everything it depends on has succeeded, so independent items
+run concurrently while dependency chains keep their order.
+
+The batch is split into subgraphs of items connected by dependencies.
+When an item of a subgraph fails, items of the subgraph that have not
+started are skipped, and those that succeeded are rolled back, dependents
+before their dependencies, in one transaction. Other subgraphs are not
+affected. Items in a dependency cycle fail without being started.
+
+Each operation runs in its own transaction. Per-item progress is reported
+to an optional ``progress`` callback, always from the calling thread, as::
+
+    {"item": 3, "status": "succeeded", "completed": 10, "total": 100}
+
+with ``status`` one of ``succeeded``, ``failed``, ``skipped`` or
+``rolled_back`` and an ``error`` for anything but ``succeeded``.
+
+``install_plugins`` uses it to install plugins for a user, reading each
+plugin's dependencies from ``compatibility['dependencies']`` as a list of
+plugin ids.
+"""
+import logging
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import connections, transaction
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    # Items of one batch processed at the same time
+    'MAX_WORKERS': 8,
+}
+
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+SKIPPED = 'skipped'
+ROLLED_BACK = 'rolled_back'
+
+
+def bulk_operations_setting(name: str):
+    return getattr(settings, 'BULK_OPERATIONS', {}).get(name, DEFAULTS[name])
+
+
+class BulkOperation:
+    """
+    Runs ``operation(item)`` for every item of a batch, respecting the
+    dependencies between them.
+
+    Args:
+        operation: Called with each item; its return value is the item's result
+        dependencies: Called with an item, returns the keys of the items it
+            depends on. Keys that are not in the batch are ignored
+        rollback: Called with an item and its result to undo a successful
+            operation when its subgraph fails
+        key: Identifies an item for ``dependencies``; the item itself by
+            default. Items with the same key fail as duplicates
+        max_workers: Size of the thread pool
+        progress: Called with a progress event for every item
+        atomic: Whether operations and rollbacks run in database transactions
+    """
+
+    def __init__(
+        self,
+        operation: Callable,
+        dependencies: Optional[Callable[..., Iterable[Hashable]]] = None,
+        rollback: Optional[Callable] = None,
+        key: Optional[Callable[..., Hashable]] = None,
+        max_workers: Optional[int] = None,
+        progress: Optional[Callable[[Dict], None]] = None,
+        atomic: bool = True,
+    ):
+        self.operation = operation
+        self.dependencies = dependencies
+        self.rollback = rollback
+        self.key = key or (lambda item: item)
+        self.max_workers = max_workers or bulk_operations_setting('MAX_WORKERS')
+        self.progress = progress
+        self.atomic = atomic
+
+    def run(self, items: Iterable) -> Tuple[List[Dict], List[Dict]]:
+        """
+        Process the batch. Returns ``(successful_items, failed_items)`` in
+        the order of the items, like ``handle_bulk_operation``, with the
+        ``status`` of each failed item.
+        """
+        items = list(items)
+        self._total = len(items)
+        self._completed = 0
+        # index -> (status, result or error)
+        self._outcomes: Dict[int, Tuple[str, object]] = {}
+
+        index: Dict[Hashable, int] = {}
+        for i, item in enumerate(items):
+            # Without dependencies items need no key and may repeat
+            key = self.key(item) if self.dependencies is not None else i
+            if key in index:
+                self._finish(items, i, FAILED, 'Duplicate item')
+            else:
+                index[key] = i
+
+        # Dependencies within the batch, and the subgraph of every item
+        waiting = {i: set() for i in index.values()}
+        dependents: Dict[int, List[int]] = {i: [] for i in waiting}
+        parent = {i: i for i in waiting}
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        for i in waiting:
+            if self.dependencies is None:
+                break
+            # An item depending on itself is a cycle of one
+            for dependency in self.dependencies(items[i]) or ():
+                j = index.get(dependency)
+                if j is None:
+                    continue
+                if j not in waiting[i]:
+                    waiting[i].add(j)
+                    dependents[j].append(i)
+                    parent[find(i)] = find(j)
+        subgraphs = {i: find(i) for i in waiting}
+        failed_subgraphs = set()
+
+        # Items that can never become ready are in or behind a cycle
+        remaining = {i: len(dependencies) for i, dependencies in waiting.items()}
+        queue = deque(i for i, count in remaining.items() if not count)
+        reachable = set()
+        while queue:
+            i = queue.popleft()
+            reachable.add(i)
+            for j in dependents[i]:
+                remaining[j] -= 1
+                if not remaining[j]:
+                    queue.append(j)
+        for i in sorted(set(waiting) - reachable):
+            self._finish(items, i, FAILED, 'Dependency cycle')
+            failed_subgraphs.add(subgraphs[i])
+
+        succeeded: List[int] = []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            running = {}
+
+            def start(i):
+                running[pool.submit(self._apply, items[i])] = i
+
+            for i in sorted(reachable):
+                if not waiting[i] and subgraphs[i] not in failed_subgraphs:
+                    start(i)
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    i = running.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        self._finish(items, i, FAILED, str(e))
+                        failed_subgraphs.add(subgraphs[i])
+                        continue
+                    self._finish(items, i, SUCCEEDED, result)
+                    succeeded.append(i)
+                    for j in dependents[i]:
+                        waiting[j].discard(i)
+                        if not waiting[j] and subgraphs[j] not in failed_subgraphs:
+                            start(j)
+
+        for i in sorted(waiting):
+            if i not in self._outcomes:
+                self._finish(items, i, SKIPPED, 'Skipped after a failure in its dependency group')
+        self._roll_back(items, [i for i in succeeded if subgraphs[i] in failed_subgraphs])
+
+        successful_items, failed_items = [], []
+        for i, item in enumerate(items):
+            status, value = self._outcomes[i]
+            if status == SUCCEEDED:
+                successful_items.append({'item': item, 'result': value})
+            else:
+                failed_items.append({'item': item, 'error': value, 'status': status})
+        return successful_items, failed_items
+
+    def _apply(self, item):
+        try:
+            if not self.atomic:
+                return self.operation(item)
+            with transaction.atomic():
+                return self.operation(item)
+        finally:
+            if self.atomic:
+                # Worker threads have connections of their own
+                connections.close_all()
+
+    def _roll_back(self, items: List, indexes: List[int]) -> None:
+        """Undo successful items, most recent first, in one transaction."""
+        if not indexes:
+            return
+        if self.rollback is None:
+            for i in indexes:
+                self._finish(items, i, ROLLED_BACK, 'Dependency group failed', count=False)
+            return
+        try:
+            if self.atomic:
+                with transaction.atomic():
+                    for i in reversed(indexes):
+                        self.rollback(items[i], self._outcomes[i][1])
+            else:
+                for i in reversed(indexes):
+                    self.rollback(items[i], self._outcomes[i][1])
+        except Exception as e:
+            logger.error(f"Bulk operation rollback failed: {str(e)}")
+            for i in indexes:
+                self._finish(items, i, FAILED, f"Dependency group failed and rollback failed: {str(e)}", count=False)
+            return
+        for i in indexes:
+            self._finish(items, i, ROLLED_BACK, 'Rolled back after a failure in its dependency group', count=False)
+
+    def _finish(self, items: List, i: int, status: str, value, count: bool = True) -> None:
+        self._outcomes[i] = (status, value)
+        if count:
+            self._completed += 1
+        if self.progress is None:
+            return
+        event = {'item': items[i], 'status': status, 'completed': self._completed, 'total': self._total}
+        if status != SUCCEEDED:
+            event['error'] = value
+        try:
+            self.progress(event)
+        except Exception as e:
+            logger.error(f"Bulk operation progress callback failed: {str(e)}")
+
+
+class PluginInstaller:
+    """
+    Installs plugins for one user, as ``PluginViewSet.install`` does, for
+    use with ``BulkOperation``.
+    """
+
+    def __init__(self, user_id: int, plugins: Dict[int, object], installed: Iterable[int] = ()):
+        self.user_id = user_id
+        self.plugins = plugins
+        self.installed = set(installed)
+
+    def dependencies(self, plugin_id: int) -> List[int]:
+        """Dependencies the user has not installed yet."""
+        plugin = self.plugins.get(plugin_id)
+        if plugin is None:
+            return []
+        dependencies = (plugin.compatibility or {}).get('dependencies', [])
+        return [dependency for dependency in dependencies if dependency not in self.installed]
+
+    def install(self, plugin_id: int) -> Dict:
+        from .models import PluginInstallation
+
+        plugin = self.plugins.get(plugin_id)
+        if plugin is None:
+            raise ValueError('Plugin not found')
+        if plugin_id in self.installed:
+            raise ValueError('Plugin already installed')
+        if not plugin.is_certified:
+            raise ValueError('Cannot install uncertified plugin')
+        # Dependencies in the batch were installed before this plugin started
+        missing = [dependency for dependency in self.dependencies(plugin_id) if dependency not in self.plugins]
+        if missing:
+            raise ValueError(f"Missing dependencies: {', '.join(str(dependency) for dependency in missing)}")
+
+        installation = PluginInstallation.objects.create(
+            user_id=self.user_id,
+            plugin=plugin,
+            granted_permissions=plugin.required_permissions
+        )
+        return {
+            'status': 'installed',
+            'installation_id': installation.id
+        }
+
+    def uninstall(self, plugin_id: int, result: Dict) -> None:
+        from .models import PluginInstallation
+
+        PluginInstallation.objects.filter(id=result['installation_id']).delete()
+
+
+def install_plugins(
+    user_id: int,
+    plugin_ids: Iterable,
+    queryset=None,
+    max_workers: Optional[int] = None,
+    progress: Optional[Callable[[Dict], None]] = None,
+) -> Tuple[List[Dict], List[Dict]]:
+    """
+    Install plugins for a user, dependencies first and independent plugins
+    concurrently. ``queryset`` limits the plugins that can be installed.
+
+    Returns ``(successful_items, failed_items)``.
+    """
+    from .models import Plugin, PluginInstallation
+
+    ids = []
+    invalid = []
+    for plugin_id in plugin_ids:
+        try:
+            ids.append(int(plugin_id))
+        except (TypeError, ValueError):
+            invalid.append({'item': plugin_id, 'error': 'Invalid plugin id', 'status': FAILED})
+
+    queryset = Plugin.objects.all() if queryset is None else queryset
+    plugins = queryset.in_bulk(ids)
+    dependency_ids = {
+        dependency
+        for plugin in plugins.values()
+        for dependency in (plugin.compatibility or {}).get('dependencies', [])
+    }
+    installed = PluginInstallation.objects.filter(
+        user_id=user_id,
+        plugin_id__in=set(ids) | dependency_ids
+    ).values_list('plugin_id', flat=True)
+    installer = PluginInstaller(user_id, plugins, installed)
+
+    successful_items, failed_items = BulkOperation(
+        installer.install,
+        dependencies=installer.dependencies,
+        rollback=installer.uninstall,
+        max_workers=max_workers,
+        progress=progress,
+    ).run(ids)
+    return successful_items, invalid + failed_items
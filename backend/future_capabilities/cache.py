@@ -1,9 +1,37 @@
+"""
+Response caching for the future_capabilities viewsets.
+
+Cached responses are invalidated by namespace generations instead of by
+deleting keys. Every model has a generation counter in the cache, and so
+does every user's rows of that model. A cache key includes the current
+generation of the namespaces it was read from. Saving or deleting a row
+bumps its model's generation and its user's generation, so older keys are
+never read again and expire on their own. That takes one cache write per
+change; the rest of the cache is untouched.
+
+Only the models cached responses are read from are watched for changes:
+those of the cached viewsets once the app is ready, and any a view resolves
+at request time when it is first used.
+"""
+import sys
+import threading
+import time
 from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
 from functools import wraps
 from django.conf import settings
+from rest_framework.response import Response
 import hashlib
 import json
 
+GENERATION_KEY = 'cache_generation:{namespace}'
+
+# Views decorated with cached_response, and the models watched for them
+_cached_views = []
+_watched_models = set()
+_watch_lock = threading.Lock()
+
+
 def generate_cache_key(prefix, *args, **kwargs):
     """Generate a unique cache key based on the arguments."""
     key_parts = [prefix]
@@ -14,13 +42,102 @@ def generate_cache_key(prefix, *args, **kwargs):
     key_string = ":".join(key_parts)
     return hashlib.md5(key_string.encode()).hexdigest()
 
-def cached_response(timeout=3600, key_prefix=None):
+def cache_namespace(model, user_id=None):
+    """Namespace of a model's cached responses, or of one user's."""
+    label = model if isinstance(model, str) else model._meta.label_lower
+    if user_id is None:
+        return label
+    return f"{label}:user:{user_id}"
+
+def get_generations(namespaces):
+    """Current generation of each namespace, starting any that are missing."""
+    keys = [GENERATION_KEY.format(namespace=namespace) for namespace in namespaces]
+    generations = cache.get_many(keys)
+    missing = [key for key in keys if key not in generations]
+    if missing:
+        # Seeded from the clock, so a generation that was evicted never
+        # comes back with a number older keys were stored under
+        for key in missing:
+            cache.add(key, time.time_ns(), None)
+        generations.update(cache.get_many(missing))
+    return [generations.get(key) for key in keys]
+
+def bump_generation(namespace):
+    """Invalidate every response cached in a namespace."""
+    key = GENERATION_KEY.format(namespace=namespace)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Not cached from yet, or evicted; the next read starts a new one
+        cache.add(key, time.time_ns(), None)
+
+def invalidate_cache_namespace(model, user_id=None):
+    """Invalidate cached responses read from a model, and from a user's rows of it."""
+    bump_generation(cache_namespace(model))
+    if user_id is not None:
+        bump_generation(cache_namespace(model, user_id))
+
+def _view_models(view):
+    queryset = getattr(view, 'queryset', None)
+    if queryset is None:
+        try:
+            queryset = view.get_queryset()
+        except Exception:
+            queryset = None
+    if queryset is not None:
+        return [queryset.model]
+    serializer_class = getattr(view, 'serializer_class', None)
+    model = getattr(getattr(serializer_class, 'Meta', None), 'model', None)
+    return [model] if model is not None else []
+
+def watch_models(models):
+    """Invalidate cached responses when rows of these models are saved or deleted."""
+    from .signals import invalidate_cached_responses
+
+    for model in models:
+        if model in _watched_models:
+            continue
+        with _watch_lock:
+            if model in _watched_models:
+                continue
+            label = cache_namespace(model)
+            post_save.connect(invalidate_cached_responses, sender=model,
+                              dispatch_uid=f"future_capabilities.invalidate_cached_responses.save:{label}")
+            post_delete.connect(invalidate_cached_responses, sender=model,
+                                dispatch_uid=f"future_capabilities.invalidate_cached_responses.delete:{label}")
+            _watched_models.add(model)
+
+def _view_classes(view_func):
+    owner = sys.modules.get(view_func.__module__)
+    for name in view_func.__qualname__.split('.')[:-1]:
+        owner = getattr(owner, name, None)
+    if not isinstance(owner, type):
+        return []
+    classes = [owner]
+    for cls in classes:
+        classes.extend(cls.__subclasses__())
+    return classes
+
+def watch_cached_views():
+    """Watch the models of every cached view whose class declares them."""
+    for view_func in list(_cached_views):
+        if view_func.cache_models:
+            watch_models(view_func.cache_models)
+            continue
+        for cls in _view_classes(view_func):
+            watch_models(_view_models(cls))
+
+def cached_response(timeout=3600, key_prefix=None, models=None, per_user=False):
     """
     Cache decorator for ViewSet methods.
     
     Args:
         timeout (int): Cache timeout in seconds (default: 1 hour)
         key_prefix (str): Prefix for the cache key
+        models (list): Models the response is read from; the view's model
+            by default
+        per_user (bool): Whether the response only reads the requesting
+            user's rows, so other users' changes keep it cached
     """
     def decorator(func):
         @wraps(func)
@@ -29,54 +146,66 @@ def cached_response(timeout=3600, key_prefix=None):
             if settings.DEBUG:
                 return func(self, request, *args, **kwargs)
 
+            # Without a model there is nothing to invalidate it by
+            view_models = models or _view_models(self)
+            if not view_models:
+                return func(self, request, *args, **kwargs)
+            watch_models(view_models)
+            user_id = request.user.id if per_user else None
+            generations = get_generations([cache_namespace(model, user_id) for model in view_models])
+
             # Generate cache key
             prefix = key_prefix or f"{self.__class__.__name__}:{func.__name__}"
             cache_key = generate_cache_key(
                 prefix,
                 request.user.id,
                 request.query_params.dict(),
-                kwargs
+                kwargs,
+                *generations
             )
 
             # Try to get from cache
             cached_result = cache.get(cache_key)
             if cached_result is not None:
-                return cached_result
+                data, status = cached_result
+                return Response(data, status=status)
 
             # Get fresh result
             result = func(self, request, *args, **kwargs)
             
-            # Cache the result
-            cache.set(cache_key, result, timeout)
+            # Cache the data of successful responses; unrendered responses
+            # cannot be pickled
+            if isinstance(result, Response) and 200 <= result.status_code < 300:
+                cache.set(cache_key, (result.data, result.status_code), timeout)
             return result
+        wrapper.cache_models = models
+        _cached_views.append(wrapper)
         return wrapper
     return decorator
 
-def invalidate_cache_pattern(pattern):
-    """Invalidate all cache keys matching a pattern."""
-    if hasattr(cache, 'delete_pattern'):
-        cache.delete_pattern(pattern)
-    else:
-        # Fallback for cache backends that don't support delete_pattern
-        cache.clear()
-
 class BulkOperationError(Exception):
     """Exception for bulk operation failures."""
     def __init__(self, message, failed_items=None):
         super().__init__(message)
         self.failed_items = failed_items or []
 
-def handle_bulk_operation(items, operation_func):
+def handle_bulk_operation(items, operation_func, max_workers=1):
     """
     Handle bulk operations with proper error tracking.
     
     Args:
         items (list): List of items to process
         operation_func (callable): Function to apply to each item
+        max_workers (int): Items processed concurrently; see
+            ``bulk_operations.BulkOperation`` for dependencies between items
         
     Returns:
         tuple: (successful_items, failed_items)
     """
+    if max_workers > 1:
+        from .bulk_operations import BulkOperation
+        return BulkOperation(operation_func, max_workers=max_workers, atomic=False).run(items)
+
     successful_items = []
     failed_items = []
 
@@ -0,0 +1,400 @@
+"""
+Server-side operational transform for collaborative editing sessions.
+
+``CollaborativeEditingConsumer`` used to bump ``session.version`` with a
+read-modify-write and insert an activity log row per edit, so concurrent
+editors lost edits and every keystroke was a database round trip.
+``CollaborationEngine`` instead keeps each active session's document in
+memory and is the single sequencer for its edits:
+
+- a client sends a batch of operations with the version it last saw;
+- the engine transforms the batch against every batch applied since that
+  version, applies it and assigns the next version, all under the
+  document's lock;
+- the transformed batch is broadcast with its version, and clients
+  transform their unacknowledged operations against it.
+
+Each site has at most one batch in flight: it sends its next batch only
+once the previous one is acknowledged (broadcast back to it with its
+version), and keeps edits made in the meantime for that next batch. A
+batch based on a version older than the site's own last batch would be
+transformed against the edits it already contains, so it is rejected.
+
+A document holds ``fields`` (single values) and ``lists`` (ordered
+items), edited with::
+
+    {"op": "set", "key": "tempo", "value": 128}       # value null removes the field
+    {"op": "insert", "key": "clips", "index": 2, "value": {...}}
+    {"op": "delete", "key": "clips", "index": 0}
+
+Concurrent inserts at the same index and concurrent sets of the same field
+are ordered by the sites (client ids) that sent them, so every replica
+converges to the same document.
+
+Applied batches are logged as ``CollaborationActivityLog`` rows with one
+``bulk_create`` per session every ``FLUSH_INTERVAL`` seconds, and the
+document is snapshotted to ``CollaborationSession.document`` every
+``SNAPSHOT_EVERY`` versions and when its last client leaves. A session is
+loaded from its snapshot plus the logged batches after it. State lives in
+the process that accepted the connection, so all clients of a session
+must be served by one process.
+"""
+import copy
+import logging
+import threading
+from collections import Counter, deque
+from typing import Dict, List, Optional, Set, Tuple
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import transaction
+
+from server.background import BackgroundFlusher
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'FLUSH_INTERVAL': 2.0,
+    # Versions between document snapshots
+    'SNAPSHOT_EVERY': 100,
+    # Applied batches kept for transforming late edits
+    'HISTORY': 1000,
+    # Operations accepted per batch
+    'MAX_OPS': 500,
+}
+
+OPS = ('set', 'insert', 'delete')
+
+Op = Dict
+
+
+class EditRejected(ValueError):
+    """The batch cannot be applied; the client should resync."""
+
+
+def collaboration_setting(name: str):
+    return getattr(settings, 'COLLABORATION', {}).get(name, DEFAULTS[name])
+
+
+def parse_op(op) -> Op:
+    """A validated copy of a client operation."""
+    if not isinstance(op, dict) or op.get('op') not in OPS:
+        raise EditRejected('Operations must be set, insert or delete')
+    key = op.get('key')
+    if not isinstance(key, str) or not key:
+        raise EditRejected('Operations must have a key')
+    if op['op'] == 'set':
+        return {'op': 'set', 'key': key, 'value': op.get('value')}
+    index = op.get('index')
+    if isinstance(index, bool) or not isinstance(index, int) or index < 0:
+        raise EditRejected('List operations must have a non-negative index')
+    if op['op'] == 'insert':
+        return {'op': 'insert', 'key': key, 'index': index, 'value': op.get('value')}
+    return {'op': 'delete', 'key': key, 'index': index}
+
+
+def _shift(op: Op, delta: int) -> Op:
+    return {**op, 'index': op['index'] + delta}
+
+
+def transform(a: Optional[Op], b: Optional[Op], a_site: str, b_site: str) -> Tuple[Optional[Op], Optional[Op]]:
+    """
+    Transform two concurrent operations against each other. Returns
+    ``(a', b')`` such that applying ``b`` then ``a'`` gives the same
+    document as applying ``a`` then ``b'``. ``None`` is an operation that
+    does nothing.
+    """
+    if a is None or b is None or a['key'] != b['key']:
+        return a, b
+    if a['op'] == 'set' or b['op'] == 'set':
+        if a['op'] != b['op']:
+            # Fields and lists are separate namespaces
+            return a, b
+        # The later site wins; a batch from the same site is the later one
+        return (a, None) if a_site >= b_site else (None, b)
+
+    if a['op'] == 'insert' and b['op'] == 'insert':
+        if a['index'] < b['index'] or (a['index'] == b['index'] and a_site < b_site):
+            return a, _shift(b, 1)
+        return _shift(a, 1), b
+    if a['op'] == 'insert':
+        if a['index'] <= b['index']:
+            return a, _shift(b, 1)
+        return _shift(a, -1), b
+    if b['op'] == 'insert':
+        if b['index'] <= a['index']:
+            return _shift(a, 1), b
+        return a, _shift(b, -1)
+    if a['index'] == b['index']:
+        # Both deleted the same item
+        return None, None
+    if a['index'] < b['index']:
+        return a, _shift(b, -1)
+    return _shift(a, -1), b
+
+
+def transform_batches(
+    a_ops: List[Optional[Op]], b_ops: List[Optional[Op]], a_site: str, b_site: str
+) -> Tuple[List[Optional[Op]], List[Optional[Op]]]:
+    """``transform`` for two sequences of operations."""
+    a_out = []
+    for a in a_ops:
+        b_next = []
+        for b in b_ops:
+            a, b = transform(a, b, a_site, b_site)
+            b_next.append(b)
+        b_ops = b_next
+        a_out.append(a)
+    return a_out, b_ops
+
+
+def apply_op(document: Dict, op: Optional[Op]) -> None:
+    """Apply an operation to the document in place."""
+    if op is None:
+        return
+    if op['op'] == 'set':
+        if op['value'] is None:
+            document['fields'].pop(op['key'], None)
+        else:
+            document['fields'][op['key']] = op['value']
+        return
+    items = document['lists'].setdefault(op['key'], [])
+    if op['op'] == 'insert':
+        if op['index'] > len(items):
+            raise EditRejected(f"Insert index {op['index']} is past the end of {op['key']}")
+        items.insert(op['index'], op['value'])
+    else:
+        if op['index'] >= len(items):
+            raise EditRejected(f"Delete index {op['index']} is past the end of {op['key']}")
+        del items[op['index']]
+    if not items:
+        del document['lists'][op['key']]
+
+
+def check_batch(document: Dict, ops: List[Optional[Op]]) -> None:
+    """Raise ``EditRejected`` unless every operation applies, in order."""
+    lengths: Dict[str, int] = {}
+    for op in ops:
+        if op is None or op['op'] == 'set':
+            continue
+        length = lengths.get(op['key'])
+        if length is None:
+            length = len(document['lists'].get(op['key'], ()))
+        if op['index'] > length or (op['op'] == 'delete' and op['index'] == length):
+            raise EditRejected(f"Index {op['index']} is out of range for {op['key']}")
+        lengths[op['key']] = length + (1 if op['op'] == 'insert' else -1)
+
+
+class DocumentState:
+    """The in-memory document of one collaboration session."""
+
+    def __init__(self, session_id: str, document: Dict, version: int, snapshot_version: int, history: int):
+        self.session_id = session_id
+        self.document = document
+        self.version = version
+        self.snapshot_version = snapshot_version
+        self.history: deque = deque(maxlen=history)
+        self.clients: Set[str] = set()
+        # Version of each site's last applied batch
+        self.site_versions: Dict[str, int] = {}
+        # (version, site, user id, operations) not yet logged
+        self.unlogged: List[Tuple[int, str, Optional[int], List[Op]]] = []
+        self.lock = threading.Lock()
+
+    def state(self) -> Dict:
+        return {'version': self.version, 'document': copy.deepcopy(self.document)}
+
+
+class CollaborationEngine(BackgroundFlusher):
+    """
+    Holds active collaboration documents in memory and sequences their
+    edits.
+    """
+
+    thread_name = 'collaboration-flusher'
+
+    def __init__(
+        self,
+        flush_interval: Optional[float] = None,
+        snapshot_every: Optional[int] = None,
+        history: Optional[int] = None
+    ):
+        super().__init__()
+        self.flush_interval = flush_interval if flush_interval is not None else collaboration_setting('FLUSH_INTERVAL')
+        self.snapshot_every = snapshot_every or collaboration_setting('SNAPSHOT_EVERY')
+        self.history = history or collaboration_setting('HISTORY')
+        self.max_ops = collaboration_setting('MAX_OPS')
+        self.documents: Dict[str, DocumentState] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        # batches, operations, rows logged and snapshots saved
+        self.stats: Counter = Counter()
+
+    async def join(self, session_id: str, site: str) -> Dict:
+        """
+        Add a client to the session, loading its document. Returns the
+        current ``version`` and ``document``.
+        """
+        while True:
+            state = self.documents.get(session_id)
+            if state is None:
+                state = await database_sync_to_async(self.load)(session_id)
+            # The last client may have left and unloaded it since
+            with self._lock, state.lock:
+                if self.documents.get(session_id) is state:
+                    state.clients.add(site)
+                    return state.state()
+
+    def load(self, session_id: str) -> DocumentState:
+        """The session's document, loading it when it is not in memory."""
+        state = self.documents.get(session_id)
+        if state is None:
+            loaded = self._load(session_id)
+            with self._lock:
+                state = self.documents.setdefault(session_id, loaded)
+        return state
+
+    def _load(self, session_id: str) -> DocumentState:
+        from .models import CollaborationActivityLog, CollaborationSession
+
+        session = CollaborationSession.objects.get(pk=session_id)
+        snapshot = session.document or {}
+        document = {
+            'fields': snapshot.get('fields', {}),
+            'lists': snapshot.get('lists', {}),
+        }
+        version = snapshot_version = snapshot.get('version', 0)
+        state = DocumentState(str(session_id), document, version, snapshot_version, self.history)
+        logs = CollaborationActivityLog.objects.filter(
+            session_id=session.pk, action_type='edit', version__gt=snapshot_version
+        ).order_by('version').values_list('version', 'action_detail')
+        for log_version, detail in logs:
+            for op in detail.get('ops', []):
+                apply_op(document, op)
+            state.history.append((log_version, detail.get('site', ''), detail.get('ops', [])))
+            state.version = log_version
+        return state
+
+    def submit(
+        self, session_id: str, site: str, base_version: int, ops: List, user_id: Optional[int] = None
+    ) -> Tuple[int, List[Op]]:
+        """
+        Apply a client's batch, made against ``base_version``. Returns the
+        batch's version and its operations as applied, to broadcast.
+        Raises ``EditRejected`` when the batch is invalid or too old, or
+        when the site's previous batch was not yet acknowledged.
+        """
+        if not isinstance(ops, list) or not ops or len(ops) > self.max_ops:
+            raise EditRejected(f"A batch must have 1 to {self.max_ops} operations")
+        parsed = [parse_op(op) for op in ops]
+        state = self.documents.get(session_id)
+        if state is None:
+            raise EditRejected('Not joined to this session')
+
+        with state.lock:
+            if isinstance(base_version, bool) or not isinstance(base_version, int) or base_version > state.version:
+                raise EditRejected('Unknown version')
+            if base_version < state.site_versions.get(site, 0):
+                raise EditRejected('Previous batch is not yet acknowledged')
+            missed = state.version - base_version
+            if missed > len(state.history):
+                raise EditRejected('Version is too old to merge; resync')
+            for back in range(missed, 0, -1):
+                _, other_site, other_ops = state.history[-back]
+                parsed, _ = transform_batches(parsed, other_ops, site, other_site)
+            check_batch(state.document, parsed)
+            for op in parsed:
+                apply_op(state.document, op)
+            applied = [op for op in parsed if op is not None]
+            state.version += 1
+            version = state.version
+            state.history.append((version, site, applied))
+            state.site_versions[site] = version
+            state.unlogged.append((version, site, user_id, applied))
+            snapshot_due = version - state.snapshot_version >= self.snapshot_every
+
+        self.stats['batches'] += 1
+        self.stats['ops'] += len(applied)
+        self._ensure_running()
+        if snapshot_due:
+            self._wakeup.set()
+        return version, applied
+
+    async def leave(self, session_id: str, site: str) -> None:
+        """Remove a client; the last one out saves and unloads the document."""
+        state = self.documents.get(session_id)
+        if state is None:
+            return
+        with state.lock:
+            state.clients.discard(site)
+            state.site_versions.pop(site, None)
+            if state.clients:
+                return
+        await database_sync_to_async(self.flush)([session_id], True)
+        with self._lock, state.lock:
+            if not state.clients and not state.unlogged and self.documents.get(session_id) is state:
+                del self.documents[session_id]
+
+    def flush(self, session_ids: Optional[List[str]] = None, snapshot: bool = False) -> int:
+        """
+        Log unlogged batches and save due snapshots. Returns the number of
+        batches logged.
+        """
+        from .models import CollaborationActivityLog, CollaborationSession
+
+        with self._flush_lock:
+            logged = 0
+            for session_id in session_ids if session_ids is not None else list(self.documents):
+                state = self.documents.get(session_id)
+                if state is None:
+                    continue
+                with state.lock:
+                    batches, state.unlogged = state.unlogged, []
+                    due = snapshot or state.version - state.snapshot_version >= self.snapshot_every
+                    saved = state.state() if due and state.version > state.snapshot_version else None
+                if not batches and saved is None:
+                    continue
+                try:
+                    with transaction.atomic():
+                        CollaborationActivityLog.objects.bulk_create([
+                            CollaborationActivityLog(
+                                session_id=session_id,
+                                user_id=user_id,
+                                created_by=user_id,
+                                action_type='edit',
+                                action_detail={'site': site, 'ops': ops},
+                                version=version
+                            )
+                            for version, site, user_id, ops in batches
+                        ])
+                        update = {}
+                        if batches:
+                            update['version'] = batches[-1][0]
+                        if saved is not None:
+                            update['version'] = saved['version']
+                            update['document'] = {**saved['document'], 'version': saved['version']}
+                        CollaborationSession.objects.filter(pk=session_id).update(**update)
+                except Exception as e:
+                    # Nothing was written; keep the batches for the next flush
+                    with state.lock:
+                        state.unlogged[:0] = batches
+                    logger.error(f"Error saving collaboration session {session_id}: {str(e)}")
+                    continue
+                if saved is not None:
+                    with state.lock:
+                        state.snapshot_version = max(state.snapshot_version, saved['version'])
+                    self.stats['snapshots'] += 1
+                self.stats['rows'] += len(batches)
+                logged += len(batches)
+            return logged
+
+    def stop(self, flush: bool = True) -> None:
+        # Snapshot every document on the way out so a restart replays nothing
+        super().stop(flush=False)
+        if flush:
+            self.flush(snapshot=True)
+
+
+def get_collaboration_engine() -> CollaborationEngine:
+    """Get the process-wide collaboration engine"""
+    return CollaborationEngine.shared()
@@ -1,21 +1,15 @@
 import json
+from abc import ABC, abstractmethod
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from django.core.exceptions import ObjectDoesNotExist
-from .models import (
-    VRSession, 
-    NeuralSignal, 
-    Plugin, 
-    BiofeedbackData,
-    CollaborationSession, 
-    CollaborationActivityLog
-)
-from .serializers import (
-    VRSessionSerializer,
-    NeuralSignalSerializer,
-    PluginSerializer,
-    BiofeedbackDataSerializer
-)
+from .models import CollaborationSession, PluginInstallation
+from .biofeedback_dsp import get_biofeedback_pipeline
+from .collaboration import EditRejected, get_collaboration_engine
+from .control_sync import get_control_sync_engine, group_name as control_group_name
+from .neural_ingest import FULL, OK, get_neural_ingest_buffer
+from .neural_mapping import get_neural_mapping_engine
+from .vr_state import get_vr_state_engine
 
 class BaseAsyncConsumer(AsyncWebsocketConsumer):
     """Base consumer with common functionality."""
@@ -32,11 +26,17 @@ class BaseAsyncConsumer(AsyncWebsocketConsumer):
 
 
 class VRSessionConsumer(BaseAsyncConsumer):
-    """Consumer for VR session real-time updates."""
+    """
+    Consumer for VR session real-time updates.
+
+    Positions are kept in memory by the VR state engine and broadcast to the
+    session in ticks; see ``future_capabilities.vr_state``.
+    """
 
     async def connect(self):
         self.session_id = self.scope['url_route']['kwargs']['session_id']
         self.room_group_name = f'vr_session_{self.session_id}'
+        self.state_engine = get_vr_state_engine()
 
         # Join room group
         await self.channel_layer.group_add(
@@ -45,7 +45,19 @@ class VRSessionConsumer(BaseAsyncConsumer):
         )
         await self.accept()
 
+        user = self.scope.get('user')
+        self.entity, keyframe = await self.state_engine.join(
+            self.session_id,
+            self.channel_layer,
+            self.room_group_name,
+            self.channel_name,
+            user_id=user.id if user is not None and user.is_authenticated else None
+        )
+        await self.send(text_data=keyframe)
+
     async def disconnect(self, close_code):
+        await self.state_engine.leave(self.session_id, self.channel_name)
+
         # Leave room group
         await self.channel_layer.group_discard(
             self.room_group_name,
@@ -71,43 +83,41 @@ class VRSessionConsumer(BaseAsyncConsumer):
         except Exception as e:
             await self.send_error(str(e))
 
-    @database_sync_to_async
-    def update_session_state(self, session_id, state_data):
-        try:
-            session = VRSession.objects.get(id=session_id)
-            serializer = VRSessionSerializer(session, data=state_data, partial=True)
-            if serializer.is_valid():
-                serializer.save()
-                return serializer.data
-            return None
-        except ObjectDoesNotExist:
-            return None
-
     async def update_position(self, data):
-        state_data = await self.update_session_state(self.session_id, {
-            'position': data.get('position'),
-            'rotation': data.get('rotation')
-        })
-        if state_data:
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'broadcast_state',
-                    'state': state_data
-                }
-            )
+        # Broadcast with the session's next tick
+        self.state_engine.update(
+            self.session_id,
+            self.channel_name,
+            data.get('position'),
+            data.get('rotation')
+        )
 
-    async def broadcast_state(self, event):
-        await self.send(text_data=json.dumps(event['state']))
+    async def vr_state(self, event):
+        # Encoded once per tick by the state engine
+        await self.send(text_data=event['text'])
 
 
 class NeuralSignalConsumer(BaseAsyncConsumer):
-    """Consumer for real-time neural signal processing."""
+    """
+    Consumer for real-time neural signal processing.
+
+    Samples are buffered and stored in chunks by the neural ingestion buffer;
+    see ``future_capabilities.neural_ingest``. Instead of echoing each
+    message, the consumer sends a ``backpressure`` message whenever the
+    buffer's state changes, and every time samples are refused.
+
+    For an authenticated user, the latest sample of each message is mapped
+    through their compiled controls (``future_capabilities.neural_mapping``)
+    and sent as a ``control_update``.
+    """
 
     async def connect(self):
         self.device_id = self.scope['url_route']['kwargs']['device_id']
         self.room_name = f'neural_device_{self.device_id}'
-        
+        self.ingest = get_neural_ingest_buffer()
+        self.ingest_state = OK
+        self.mapping_engine = get_neural_mapping_engine()
+
         await self.channel_layer.group_add(
             self.room_name,
             self.channel_name
@@ -125,39 +135,104 @@ class NeuralSignalConsumer(BaseAsyncConsumer):
             data = json.loads(text_data)
             signal_type = data.get('signal_type')
             signal_data = data.get('signal_data')
-            
-            processed_data = await self.process_neural_signal(signal_type, signal_data)
-            await self.send(text_data=json.dumps(processed_data))
-            
+            if not isinstance(signal_data, dict):
+                signal_data = {'samples': signal_data}
+            if not isinstance(signal_data.get('samples'), list):
+                raise ValueError('signal_data must be a list of samples')
+
+            state = self.process_neural_signal(signal_type, signal_data)
+            if state != self.ingest_state or state == FULL:
+                self.ingest_state = state
+                await self.send(text_data=json.dumps({
+                    'type': 'backpressure',
+                    'state': state,
+                    'retry_after': self.ingest.flush_interval
+                }))
+
+            await self.send_control_updates(signal_type, signal_data['samples'])
+
         except json.JSONDecodeError:
             await self.send_error('Invalid JSON format')
         except Exception as e:
             await self.send_error(str(e))
 
-    @database_sync_to_async
     def process_neural_signal(self, signal_type, signal_data):
-        signal = NeuralSignal.objects.create(
-            device_id=self.device_id,
-            signal_type=signal_type,
-            signal_data=signal_data
+        """
+        Buffer the ``samples`` of ``signal_data``, with its optional
+        ``sample_rate``, ``timestamp`` and ``quality``.
+        """
+        return self.ingest.record(
+            int(self.device_id),
+            signal_type,
+            signal_data['samples'],
+            sample_rate=signal_data.get('sample_rate'),
+            timestamp=signal_data.get('timestamp'),
+            quality=signal_data.get('quality')
         )
-        return NeuralSignalSerializer(signal).data
 
+    async def send_control_updates(self, signal_type, samples):
+        user = self.scope.get('user')
+        if not samples or user is None or not user.is_authenticated:
+            return
+        mapping = await self.mapping_engine.aget(user.id)
+        control_updates = mapping.control_updates(signal_type, samples[-1])
+        if control_updates:
+            await self.send(text_data=json.dumps({
+                'type': 'control_update',
+                'signal_type': signal_type,
+                'controls': control_updates
+            }))
+
+
+class ControlStateConsumer(BaseAsyncConsumer, ABC):
+    """
+    Base consumer for control state synchronization.
+
+    Values are coalesced by the control sync engine and broadcast to the
+    scope's clients as sequenced ``state_delta`` messages; see
+    ``future_capabilities.control_sync``. Clients get a ``state_snapshot``
+    when they connect and send ``sync_request`` for another one when they
+    miss a delta.
+    """
+
+    @abstractmethod
+    def get_state_key(self, user):
+        """The control sync scope key of the connection."""
+        pass
 
-class PluginStateConsumer(BaseAsyncConsumer):
-    """Consumer for plugin state synchronization."""
+    def scope_exists(self, state_key):
+        """Whether the scope's values have somewhere to be saved."""
+        return True
 
     async def connect(self):
-        self.plugin_id = self.scope['url_route']['kwargs']['plugin_id']
-        self.room_name = f'plugin_{self.plugin_id}'
-        
+        user = self.scope.get('user')
+        if user is None or not user.is_authenticated:
+            await self.close()
+            return
+        self.sync_engine = get_control_sync_engine()
+        try:
+            state_key = self.get_state_key(user)
+            self.sync_engine.validate_key(state_key)
+        except ValueError:
+            await self.close()
+            return
+        if not await database_sync_to_async(self.scope_exists)(state_key):
+            await self.close()
+            return
+        self.state_key = state_key
+        self.room_name = control_group_name(self.state_key)
+
         await self.channel_layer.group_add(
             self.room_name,
             self.channel_name
         )
         await self.accept()
+        await self.send(text_data=await database_sync_to_async(self.sync_engine.join)(self.state_key))
 
     async def disconnect(self, close_code):
+        if not hasattr(self, 'state_key'):
+            return
+        self.sync_engine.leave(self.state_key)
         await self.channel_layer.group_discard(
             self.room_name,
             self.channel_name
@@ -169,9 +244,9 @@ class PluginStateConsumer(BaseAsyncConsumer):
             action = data.get('action')
             
             if action == 'update_state':
-                await self.update_plugin_state(data)
+                await self.update_state(data)
             elif action == 'sync_request':
-                await self.sync_plugin_state()
+                await self.sync_state()
             else:
                 await self.send_error('Invalid action')
                 
@@ -180,28 +255,55 @@ class PluginStateConsumer(BaseAsyncConsumer):
         except Exception as e:
             await self.send_error(str(e))
 
-    @database_sync_to_async
-    def update_plugin_state(self, data):
-        try:
-            plugin = Plugin.objects.get(id=self.plugin_id)
-            serializer = PluginSerializer(plugin, data=data.get('state'), partial=True)
-            if serializer.is_valid():
-                serializer.save()
-                return serializer.data
-            return None
-        except ObjectDoesNotExist:
-            return None
+    async def update_state(self, data):
+        # Broadcast with the engine's next tick
+        self.sync_engine.update(self.state_key, data.get('state'))
+
+    async def sync_state(self):
+        await self.send(text_data=await database_sync_to_async(self.sync_engine.snapshot)(self.state_key))
+
+    async def control_state(self, event):
+        # Encoded once per delta by the control sync engine
+        await self.send(text_data=event['text'])
+
+
+class PluginStateConsumer(ControlStateConsumer):
+    """Consumer for the parameters of the user's installation of a plugin."""
+
+    def get_state_key(self, user):
+        self.plugin_id = self.scope['url_route']['kwargs']['plugin_id']
+        return ('plugin', user.id, int(self.plugin_id))
+
+    def scope_exists(self, state_key):
+        # Values of a plugin the user has not installed could not be saved
+        _, user_id, plugin_id = state_key
+        return PluginInstallation.objects.filter(user_id=user_id, plugin_id=plugin_id).exists()
 
-    async def broadcast_state(self, event):
-        await self.send(text_data=json.dumps(event['state']))
+
+class DAWControlConsumer(ControlStateConsumer):
+    """Consumer for the user's DAW controls in an environment."""
+
+    def get_state_key(self, user):
+        self.environment = self.scope['url_route']['kwargs']['environment']
+        return ('daw', user.id, self.environment)
 
 
 class BiofeedbackConsumer(BaseAsyncConsumer):
-    """Consumer for real-time biofeedback data processing."""
+    """
+    Consumer for real-time biofeedback data processing.
+
+    Messages are ``{"data_type": "ppg", "data": {"samples": [...],
+    "sample_rate": 256, "timestamp": ...}}``. Samples are processed by the
+    biofeedback pipeline (``future_capabilities.biofeedback_dsp``), which
+    stores derived features and decimated samples per window; whenever a
+    message completes windows their features are sent back as
+    ``biofeedback_features``.
+    """
 
     async def connect(self):
         self.device_id = self.scope['url_route']['kwargs']['device_id']
         self.room_name = f'biofeedback_device_{self.device_id}'
+        self.pipeline = get_biofeedback_pipeline()
         
         await self.channel_layer.group_add(
             self.room_name,
@@ -210,6 +312,7 @@ class BiofeedbackConsumer(BaseAsyncConsumer):
         await self.accept()
 
     async def disconnect(self, close_code):
+        self.pipeline.close(int(self.device_id))
         await self.channel_layer.group_discard(
             self.room_name,
             self.channel_name
@@ -220,30 +323,55 @@ class BiofeedbackConsumer(BaseAsyncConsumer):
             data = json.loads(text_data)
             data_type = data.get('data_type')
             biofeedback_data = data.get('data')
+            if not isinstance(biofeedback_data, dict):
+                biofeedback_data = {'samples': biofeedback_data}
+            if not isinstance(biofeedback_data.get('samples'), list):
+                raise ValueError('data must be a list of samples')
             
-            processed_data = await self.process_biofeedback(data_type, biofeedback_data)
-            await self.send(text_data=json.dumps(processed_data))
+            windows = self.process_biofeedback(data_type, biofeedback_data)
+            if windows:
+                await self.send(text_data=json.dumps({
+                    'type': 'biofeedback_features',
+                    'windows': windows
+                }))
             
         except json.JSONDecodeError:
             await self.send_error('Invalid JSON format')
         except Exception as e:
             await self.send_error(str(e))
 
-    @database_sync_to_async
     def process_biofeedback(self, data_type, biofeedback_data):
-        data = BiofeedbackData.objects.create(
-            device_id=self.device_id,
-            data_type=data_type,
-            data_points=biofeedback_data
+        """
+        Process the ``samples`` of ``biofeedback_data``, with its optional
+        ``sample_rate`` and ``timestamp``. Returns the completed windows.
+        """
+        return self.pipeline.record(
+            int(self.device_id),
+            data_type,
+            biofeedback_data['samples'],
+            sample_rate=biofeedback_data.get('sample_rate'),
+            timestamp=biofeedback_data.get('timestamp')
         )
-        return BiofeedbackDataSerializer(data).data
 
 
 class CollaborativeEditingConsumer(AsyncWebsocketConsumer):
+    """
+    Consumer for collaborative editing sessions.
+
+    Edits are ``{"type": "edit", "edit_data": {"version": n, "ops": [...]}}``
+    where ``version`` is the last version the client has seen. The
+    collaboration engine (``future_capabilities.collaboration``) merges them
+    and every client, including the sender as its acknowledgement, gets the
+    merged operations in an ``edit_made`` with their new version. A client
+    sends its next edit only after that acknowledgement; an edit sent
+    before it is rejected.
+    """
+
     async def connect(self):
         self.session_id = self.scope['url_route']['kwargs']['session_id']
         self.room_group_name = f'session_{self.session_id}'
         self.user = self.scope['user']
+        self.collaboration = get_collaboration_engine()
 
         # Join room group
         await self.channel_layer.group_add(
@@ -277,6 +405,7 @@ class CollaborativeEditingConsumer(AsyncWebsocketConsumer):
             self.room_group_name,
             self.channel_name
         )
+        await self.collaboration.leave(self.session_id, self.channel_name)
 
         # Notify others about user leaving
         await self.channel_layer.group_send(
@@ -305,17 +434,31 @@ class CollaborativeEditingConsumer(AsyncWebsocketConsumer):
                 }
             )
         elif action_type == 'edit':
-            # Handle edits with version control
-            edit_data = data.get('edit_data')
-            version = await self.save_edit(edit_data)
-            
+            # Merge the edit and assign its version in memory
+            edit_data = data.get('edit_data') or {}
+            try:
+                version, ops = self.collaboration.submit(
+                    self.session_id,
+                    self.channel_name,
+                    edit_data.get('version'),
+                    edit_data.get('ops'),
+                    user_id=self.user.id
+                )
+            except EditRejected as e:
+                await self.send(text_data=json.dumps({
+                    'type': 'edit_rejected',
+                    'message': str(e),
+                    'state': await self.get_session_state()
+                }))
+                return
+
             await self.channel_layer.group_send(
                 self.room_group_name,
                 {
                     'type': 'edit_made',
                     'user_id': str(self.user.id),
                     'username': self.user.username,
-                    'edit_data': edit_data,
+                    'edit_data': {'site': self.channel_name, 'ops': ops},
                     'version': version
                 }
             )
@@ -356,37 +499,21 @@ class CollaborativeEditingConsumer(AsyncWebsocketConsumer):
             'username': event['username']
         }))
 
-    @database_sync_to_async
-    def get_session_state(self):
+    async def get_session_state(self):
         try:
-            session = CollaborationSession.objects.get(id=self.session_id)
-            return {
-                'id': str(session.id),
-                'name': session.session_name,
-                'participants': list(session.participant_user_ids),
-                'track_data': session.track_ref,
-                'version': session.version
-            }
+            session = await CollaborationSession.objects.aget(id=self.session_id)
         except ObjectDoesNotExist:
             return None
-
-    @database_sync_to_async
-    def save_edit(self, edit_data):
-        session = CollaborationSession.objects.get(id=self.session_id)
-        
-        # Create activity log
-        CollaborationActivityLog.objects.create(
-            session=session,
-            user_id=self.user.id,
-            action_type='edit',
-            action_detail=edit_data
-        )
-
-        # Update session version
-        session.version += 1
-        session.save()
-
-        return session.version
+        document = await self.collaboration.join(self.session_id, self.channel_name)
+        return {
+            'id': str(session.id),
+            'name': session.session_name,
+            'participants': list(session.participant_user_ids),
+            'track_data': session.track_ref,
+            'site': self.channel_name,
+            'version': document['version'],
+            'document': document['document']
+        }
 
 
 class CommunicationConsumer(AsyncWebsocketConsumer):
@@ -0,0 +1,598 @@
+"""
+Coalesced, delta-synchronized state of DAW controls and plugin parameters.
+
+An automation gesture moves a control dozens of times a second, and every
+movement used to be a database write and a full-state broadcast.
+``ControlSyncEngine`` keeps the values of each scope in memory; a scope is
+the parameters of one user's plugin, or one user's DAW controls in an
+environment. An update only overwrites the latest value of its controls.
+Every ``TICK_INTERVAL`` seconds the controls that changed since the
+previous tick go out to the scope's group as one delta::
+
+    {"type": "state_delta", "seq": 42, "changes": {"cutoff": 0.5125}}
+
+Numbers are rounded to ``PRECISION`` decimals, so jitter below that never
+produces a delta. ``seq`` grows by one with every delta of a scope. Clients
+get a snapshot of every value as of a ``seq`` when they connect, and ask
+for another one whenever the next delta's ``seq`` is not one above the
+last they applied; deltas not above the snapshot's ``seq`` are already in
+it::
+
+    {"type": "state_snapshot", "seq": 42, "state": {"cutoff": 0.5125, "resonance": 0.2}}
+
+Changed values are written every ``PERSIST_INTERVAL`` seconds, so a sweep
+costs the database a bounded number of writes however fast it moves. Each
+scope is written in its own transaction: when the database is unavailable
+its values are written with the next flush, and when a scope's values
+cannot be written at all they are logged and dropped without holding back
+the others. Plugin parameters are saved under ``settings['state']`` of the
+user's ``PluginInstallation``, DAW controls as ``DAWControlState`` rows.
+
+Deltas are sent through the channel layer from a background thread, so
+updates made by HTTP views reach websocket clients too. Each process
+coalesces the updates it receives, but the sent values and ``seq`` of a
+scope are kept in Redis when ``REDIS_URL`` is set, so the websocket and
+HTTP updates of a scope can reach different processes: their deltas share
+one sequence and every snapshot has the values all of them sent. Without
+it they are kept in process memory, and all updates of a scope must reach
+one process.
+"""
+import hashlib
+import json
+import logging
+import math
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.db import InterfaceError, OperationalError, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from server.background import BackgroundFlusher
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    # Seconds updates are coalesced over before their delta is sent
+    'TICK_INTERVAL': 0.05,
+    # Seconds between writes of changed values
+    'PERSIST_INTERVAL': 1.0,
+    # Decimals kept for numeric values
+    'PRECISION': 4,
+    'MAX_CONTROLS': 1024,
+    # Seconds a scope without clients is kept in memory once saved
+    'IDLE_TIMEOUT': 300.0,
+    # Redis holding the sent values and seq of scopes; None keeps them in memory
+    'REDIS_URL': None,
+    # Seconds an unused scope is kept in Redis
+    'STATE_TIMEOUT': 86400,
+}
+
+MAX_NAME_LENGTH = 100
+MAX_TEXT_LENGTH = 256
+# max_length of DAWControlState.control_id and environment
+DAW_MAX_LENGTH = 50
+
+# ('plugin', user_id, plugin_id) or ('daw', user_id, environment)
+ScopeKey = Tuple
+
+_MISSING = object()
+
+
+def control_sync_setting(name: str):
+    return getattr(settings, 'CONTROL_SYNC', {}).get(name, DEFAULTS[name])
+
+
+def encode(payload: Dict) -> str:
+    return json.dumps(payload, separators=(',', ':'))
+
+
+def group_name(key: ScopeKey) -> str:
+    """Channel layer group of a scope's clients."""
+    name = 'control_sync.' + '.'.join(str(part) for part in key)
+    if len(name) < 100 and re.fullmatch(r'[\w.-]+', name, re.ASCII):
+        return name
+    # Group names are limited to 100 ASCII letters, digits, hyphens,
+    # underscores and periods; the digest keeps altered names apart
+    digest = hashlib.sha1(name.encode()).hexdigest()[:16]
+    return f"{re.sub(r'[^A-Za-z0-9_.-]', '_', name)[:80]}.{digest}"
+
+
+class PluginStateStore:
+    """Plugin parameters, under ``settings['state']`` of the user's installation."""
+
+    max_name_length = MAX_NAME_LENGTH
+
+    def validate_key(self, key: ScopeKey) -> None:
+        pass
+
+    def validate(self, name: str, value):
+        if value is None or isinstance(value, bool):
+            return value
+        if isinstance(value, (int, float)):
+            if not math.isfinite(value):
+                raise ValueError(f"{name} must be finite")
+            return value
+        if isinstance(value, str) and len(value) <= MAX_TEXT_LENGTH:
+            return value
+        raise ValueError(f"{name} must be a number, boolean or short string")
+
+    def load(self, key: ScopeKey) -> Dict:
+        from .models import PluginInstallation
+
+        _, user_id, plugin_id = key
+        installation_settings = PluginInstallation.objects.filter(
+            user_id=user_id, plugin_id=plugin_id
+        ).values_list('settings', flat=True).first()
+        return dict((installation_settings or {}).get('state', {}))
+
+    def save(self, changes: Dict[ScopeKey, Dict]) -> int:
+        from .models import PluginInstallation
+
+        condition = Q()
+        for _, user_id, plugin_id in changes:
+            condition |= Q(user_id=user_id, plugin_id=plugin_id)
+        installations = list(PluginInstallation.objects.select_for_update().filter(condition))
+        for installation in installations:
+            current = installation.settings or {}
+            values = changes[('plugin', installation.user_id, installation.plugin_id)]
+            installation.settings = {**current, 'state': {**current.get('state', {}), **values}}
+        PluginInstallation.objects.bulk_update(installations, ['settings'])
+        return len(installations)
+
+
+class DAWControlStore:
+    """DAW controls, as a ``DAWControlState`` row per control."""
+
+    max_name_length = DAW_MAX_LENGTH
+
+    def validate_key(self, key: ScopeKey) -> None:
+        environment = key[2]
+        if not isinstance(environment, str) or not 0 < len(environment) <= DAW_MAX_LENGTH:
+            raise ValueError(f"Environments must have 1 to {DAW_MAX_LENGTH} characters")
+
+    def validate(self, name: str, value):
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+            raise ValueError(f"{name} must be a finite number")
+        if not -1000 <= value <= 1000:
+            raise ValueError('Value must be between -1000 and 1000')
+        return float(value)
+
+    def load(self, key: ScopeKey) -> Dict:
+        from .composition_spaces import DAWControlState
+
+        _, user_id, environment = key
+        # Oldest first, so the latest of duplicate rows wins
+        return dict(DAWControlState.objects.filter(
+            user_id=user_id, environment=environment
+        ).order_by('updated_at').values_list('control_id', 'value'))
+
+    def save(self, changes: Dict[ScopeKey, Dict]) -> int:
+        from .composition_spaces import DAWControlState
+
+        condition = Q()
+        for (_, user_id, environment), values in changes.items():
+            condition |= Q(user_id=user_id, environment=environment, control_id__in=list(values))
+        rows = {
+            (row.user_id, row.environment, row.control_id): row
+            for row in DAWControlState.objects.filter(condition).order_by('updated_at')
+        }
+        now = timezone.now()
+        updated, created = [], []
+        for (_, user_id, environment), values in changes.items():
+            for control_id, value in values.items():
+                row = rows.get((user_id, environment, control_id))
+                if row is None:
+                    created.append(DAWControlState(
+                        user_id=user_id, control_id=control_id, value=value, environment=environment
+                    ))
+                else:
+                    row.value = value
+                    # bulk_update does not apply auto_now
+                    row.updated_at = now
+                    updated.append(row)
+        DAWControlState.objects.bulk_update(updated, ['value', 'updated_at'])
+        DAWControlState.objects.bulk_create(created)
+        return len(updated) + len(created)
+
+
+STORES = {
+    'plugin': PluginStateStore(),
+    'daw': DAWControlStore(),
+}
+
+
+class LocalScopeState:
+    """
+    Sequence and sent values of each scope, in process memory. Only
+    consistent when every update of a scope reaches one process.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # key -> [seq, values]
+        self._scopes: Dict[ScopeKey, list] = {}
+
+    def snapshot(self, key: ScopeKey) -> Optional[Tuple[int, Dict]]:
+        with self._lock:
+            scope = self._scopes.get(key)
+            return None if scope is None else (scope[0], dict(scope[1]))
+
+    def load(self, key: ScopeKey, values: Dict) -> None:
+        with self._lock:
+            self._scopes.setdefault(key, [0, dict(values)])
+
+    def publish(self, key: ScopeKey, changes: Dict) -> Optional[Tuple[int, List[str]]]:
+        with self._lock:
+            scope = self._scopes.get(key)
+            if scope is None:
+                return None
+            changed = [name for name, value in changes.items() if scope[1].get(name, _MISSING) != value]
+            if changed:
+                scope[0] += 1
+                scope[1].update((name, changes[name]) for name in changed)
+            return scope[0], changed
+
+    def values(self, key: ScopeKey, names: Iterable[str]) -> Optional[Dict]:
+        with self._lock:
+            scope = self._scopes.get(key)
+            if scope is None:
+                return None
+            return {name: scope[1][name] for name in names if name in scope[1]}
+
+    def release(self, key: ScopeKey) -> None:
+        with self._lock:
+            self._scopes.pop(key, None)
+
+
+# KEYS: values hash, seq. ARGV: timeout, then control/encoded value pairs.
+# Sets the values that differ and bumps seq once if any did.
+PUBLISH_SCRIPT = """
+if redis.call('EXISTS', KEYS[2]) == 0 then
+    return false
+end
+local changed = {}
+for i = 2, #ARGV, 2 do
+    if redis.call('HGET', KEYS[1], ARGV[i]) ~= ARGV[i + 1] then
+        redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1])
+        changed[#changed + 1] = ARGV[i]
+    end
+end
+local seq
+if #changed > 0 then
+    seq = redis.call('INCR', KEYS[2])
+else
+    seq = tonumber(redis.call('GET', KEYS[2]))
+end
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+redis.call('EXPIRE', KEYS[2], ARGV[1])
+return {seq, changed}
+"""
+
+
+class RedisScopeState:
+    """
+    Sequence and sent values of each scope, shared by every process through
+    Redis: a hash of encoded values and a counter per scope. A delta's values
+    and its ``seq`` are set in one script, and a snapshot reads both in one
+    MULTI, so every process numbers the deltas of a scope from one sequence.
+    Idle scopes expire after ``STATE_TIMEOUT`` seconds and are loaded from
+    the database again.
+    """
+
+    def __init__(self, client, timeout: float):
+        self.client = client
+        self.timeout = int(timeout)
+        self._publish = client.register_script(PUBLISH_SCRIPT)
+
+    def _keys(self, key: ScopeKey) -> Tuple[str, str]:
+        base = f"control_sync:{group_name(key)}"
+        return f"{base}:values", f"{base}:seq"
+
+    def snapshot(self, key: ScopeKey) -> Optional[Tuple[int, Dict]]:
+        values_key, seq_key = self._keys(key)
+        pipe = self.client.pipeline(transaction=True)
+        pipe.get(seq_key)
+        pipe.hgetall(values_key)
+        pipe.expire(values_key, self.timeout)
+        pipe.expire(seq_key, self.timeout)
+        seq, values = pipe.execute()[:2]
+        if seq is None:
+            return None
+        return int(seq), {name: json.loads(value) for name, value in values.items()}
+
+    def load(self, key: ScopeKey, values: Dict) -> None:
+        values_key, seq_key = self._keys(key)
+
+        def create(pipe):
+            # Only one loader wins; the others keep what it loaded
+            if pipe.exists(seq_key):
+                return
+            pipe.multi()
+            pipe.delete(values_key)
+            if values:
+                pipe.hset(values_key, mapping={name: encode(value) for name, value in values.items()})
+                pipe.expire(values_key, self.timeout)
+            pipe.set(seq_key, 0, ex=self.timeout)
+
+        self.client.transaction(create, seq_key)
+
+    def publish(self, key: ScopeKey, changes: Dict) -> Optional[Tuple[int, List[str]]]:
+        args = [self.timeout]
+        for name, value in changes.items():
+            args += [name, encode(value)]
+        result = self._publish(keys=list(self._keys(key)), args=args)
+        if result is None:
+            return None
+        seq, changed = result
+        return int(seq), list(changed)
+
+    def values(self, key: ScopeKey, names: Iterable[str]) -> Optional[Dict]:
+        names = list(names)
+        values_key, seq_key = self._keys(key)
+        pipe = self.client.pipeline(transaction=True)
+        pipe.exists(seq_key)
+        pipe.hmget(values_key, names)
+        exists, values = pipe.execute()
+        if not exists:
+            return None
+        return {name: json.loads(value) for name, value in zip(names, values) if value is not None}
+
+    def release(self, key: ScopeKey) -> None:
+        # Other processes may still use the scope; it expires when idle
+        pass
+
+
+class _Scope:
+    """Updates of one scope that this process has not sent or saved yet."""
+
+    def __init__(self, key: ScopeKey):
+        self.key = key
+        self.group = group_name(key)
+        # Latest value of each control updated here
+        self.values: Dict = {}
+        # Controls updated since the last tick and since the last write
+        self.changed: Set[str] = set()
+        self.unsaved: Set[str] = set()
+        # Controls known to exist, for MAX_CONTROLS
+        self.names: Set[str] = set()
+        self.clients = 0
+        self.used = time.monotonic()
+
+
+class ControlSyncEngine(BackgroundFlusher):
+    """
+    Coalesces control updates, broadcasts them as deltas and writes them
+    at a bounded rate.
+    """
+
+    thread_name = 'control-sync-ticker'
+
+    def __init__(
+        self,
+        tick_interval: Optional[float] = None,
+        persist_interval: Optional[float] = None,
+        precision: Optional[int] = None,
+        channel_layer=None,
+        state=None
+    ):
+        super().__init__()
+        self.tick_interval = tick_interval if tick_interval is not None else control_sync_setting('TICK_INTERVAL')
+        self.persist_interval = persist_interval if persist_interval is not None else control_sync_setting('PERSIST_INTERVAL')
+        self.precision = precision if precision is not None else control_sync_setting('PRECISION')
+        self.max_controls = control_sync_setting('MAX_CONTROLS')
+        self.idle_timeout = control_sync_setting('IDLE_TIMEOUT')
+        self.state = state if state is not None else self._default_state()
+        self._channel_layer = channel_layer
+        self._scopes: Dict[ScopeKey, _Scope] = {}
+        self._lock = threading.Lock()
+        # Keeps deltas of a scope in sequence order
+        self._tick_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._persisted_at = time.monotonic()
+        # updates, deltas, bytes, writes and flushes
+        self.stats: Counter = Counter()
+
+    @staticmethod
+    def _default_state():
+        redis_url = control_sync_setting('REDIS_URL')
+        if redis_url:
+            try:
+                import redis
+                client = redis.Redis.from_url(redis_url, decode_responses=True)
+                client.ping()
+                return RedisScopeState(client, control_sync_setting('STATE_TIMEOUT'))
+            except Exception as e:
+                logger.warning(f"Redis unavailable for control sync state, using process memory: {str(e)}")
+        return LocalScopeState()
+
+    @property
+    def channel_layer(self):
+        if self._channel_layer is None:
+            from channels.layers import get_channel_layer
+
+            self._channel_layer = get_channel_layer()
+        return self._channel_layer
+
+    def _get_scope(self, key: ScopeKey) -> _Scope:
+        scope = self._scopes.get(key)
+        if scope is None:
+            scope = self._scopes[key] = _Scope(key)
+        scope.used = time.monotonic()
+        return scope
+
+    def validate_key(self, key: ScopeKey):
+        """The scope's store; raises ``ValueError`` for an invalid scope."""
+        store = STORES.get(key[0])
+        if store is None:
+            raise ValueError(f"Unknown control scope: {key[0]}")
+        store.validate_key(key)
+        return store
+
+    def update(self, key: ScopeKey, changes) -> int:
+        """
+        Set controls of the scope from a ``{control: value}`` dict; they go
+        out with the next tick. Returns the number of values received.
+        """
+        store = self.validate_key(key)
+        if not isinstance(changes, dict):
+            raise ValueError('State must be an object of control values')
+        values = {}
+        for name, value in changes.items():
+            if not isinstance(name, str) or not 0 < len(name) <= store.max_name_length:
+                raise ValueError(f"Control names must have 1 to {store.max_name_length} characters")
+            value = store.validate(name, value)
+            values[name] = round(value, self.precision) if isinstance(value, float) else value
+
+        self._ensure_running()
+        with self._lock:
+            scope = self._get_scope(key)
+            if len(scope.names | values.keys()) > self.max_controls:
+                raise ValueError(f"A scope can have at most {self.max_controls} controls")
+            # Compared with the sent values when the tick publishes them,
+            # since other processes may have changed them since
+            scope.values.update(values)
+            scope.names.update(values)
+            scope.changed.update(values)
+            scope.unsaved.update(values)
+            self.stats['updates'] += len(values)
+        return len(values)
+
+    def _load(self, key: ScopeKey) -> None:
+        self.state.load(key, STORES[key[0]].load(key))
+
+    def snapshot(self, key: ScopeKey) -> str:
+        """The encoded snapshot of the scope, as of its last delta."""
+        self.validate_key(key)
+        snapshot = self.state.snapshot(key)
+        while snapshot is None:
+            self._load(key)
+            snapshot = self.state.snapshot(key)
+        seq, values = snapshot
+        with self._lock:
+            self._get_scope(key).names.update(values)
+        return encode({'type': 'state_snapshot', 'seq': seq, 'state': values})
+
+    def join(self, key: ScopeKey) -> str:
+        """Count a connected client of the scope. Returns its snapshot."""
+        snapshot = self.snapshot(key)
+        with self._lock:
+            self._get_scope(key).clients += 1
+        return snapshot
+
+    def leave(self, key: ScopeKey) -> None:
+        with self._lock:
+            scope = self._scopes.get(key)
+            if scope is not None:
+                scope.clients = max(scope.clients - 1, 0)
+
+    def _publish(self, key: ScopeKey, changes: Dict) -> Tuple[int, List[str]]:
+        result = self.state.publish(key, changes)
+        while result is None:
+            self._load(key)
+            result = self.state.publish(key, changes)
+        return result
+
+    def tick(self) -> int:
+        """Broadcast the changes of every scope. Returns the number of deltas sent."""
+        with self._tick_lock:
+            pending = []
+            with self._lock:
+                for scope in self._scopes.values():
+                    if scope.changed:
+                        pending.append((scope.key, scope.group, {name: scope.values[name] for name in sorted(scope.changed)}))
+                        scope.changed.clear()
+
+            deltas = []
+            for key, group, changes in pending:
+                try:
+                    seq, changed = self._publish(key, changes)
+                except Exception as e:
+                    with self._lock:
+                        self._get_scope(key).changed.update(changes)
+                    logger.error(f"Error publishing control state of {key}: {str(e)}")
+                    continue
+                if changed:
+                    changes = {name: value for name, value in changes.items() if name in changed}
+                    deltas.append((group, encode({'type': 'state_delta', 'seq': seq, 'changes': changes})))
+
+            channel_layer = self.channel_layer if deltas else None
+            for group, payload in deltas:
+                self.stats['deltas'] += 1
+                self.stats['bytes'] += len(payload)
+                if channel_layer is None:
+                    continue
+                try:
+                    async_to_sync(channel_layer.group_send)(group, {'type': 'control_state', 'text': payload})
+                except Exception as e:
+                    # Clients see the gap in seq and ask for a snapshot
+                    logger.error(f"Error sending control state delta to {group}: {str(e)}")
+            return len(deltas)
+
+    def flush(self) -> int:
+        """Write every changed value. Returns the number of rows written."""
+        with self._flush_lock:
+            taken = {}
+            with self._lock:
+                now = time.monotonic()
+                for key, scope in list(self._scopes.items()):
+                    if scope.unsaved:
+                        taken[key] = (
+                            {name: scope.values[name] for name in scope.unsaved},
+                            scope.unsaved & scope.changed
+                        )
+                        scope.unsaved.clear()
+                    elif not scope.clients and not scope.changed and now - scope.used > self.idle_timeout:
+                        del self._scopes[key]
+                        self.state.release(key)
+            if not taken:
+                return 0
+
+            changes: Dict[str, Dict[ScopeKey, Dict]] = defaultdict(dict)
+            for key, (values, unsent) in taken.items():
+                sent = {}
+                names = values.keys() - unsent
+                try:
+                    # Sent values may have been changed since by another process
+                    sent = (self.state.values(key, names) if names else None) or {}
+                except Exception as e:
+                    logger.error(f"Error reading control state of {key}: {str(e)}")
+                changes[key[0]][key] = {**values, **sent}
+
+            written = 0
+            for kind, scopes in changes.items():
+                for key, values in scopes.items():
+                    try:
+                        with transaction.atomic():
+                            written += STORES[kind].save({key: values})
+                    except (OperationalError, InterfaceError) as e:
+                        # Nothing was written; the latest values are written next time
+                        with self._lock:
+                            self._get_scope(key).unsaved.update(values)
+                        logger.error(f"Error writing control state of {key}: {str(e)}")
+                    except Exception as e:
+                        logger.error(f"Dropped control state of {key} that could not be written: {str(e)}")
+
+            self.stats['writes'] += written
+            self.stats['flushes'] += 1
+            return written
+
+    @property
+    def interval(self) -> float:
+        return self.tick_interval
+
+    def _background_flush(self) -> None:
+        self.tick()
+        if time.monotonic() - self._persisted_at >= self.persist_interval:
+            self._persisted_at = time.monotonic()
+            self.flush()
+
+
+def get_control_sync_engine() -> ControlSyncEngine:
+    """Get the process-wide control sync engine"""
+    return ControlSyncEngine.shared()
@@ -0,0 +1,259 @@
+"""
+Cached JWT identity resolution for websocket connects.
+
+``TokenAuthMiddleware`` used to decode the token and query the user on
+every connect, so a reconnect storm after a deploy meant one user query
+per socket. ``IdentityResolver`` instead:
+
+- verifies each token once per process and keeps its claims, in a bounded
+  LRU, until the token expires;
+- caches a snapshot of the user (``SNAPSHOT_FIELDS``, not the pickled
+  model) in the shared cache under the token's ``jti`` until the token
+  expires, so other processes skip the query too;
+- loads each user at most once at a time per process; concurrent connects
+  from the same user wait for that load.
+
+Cache lookups and user loads requested in the same event loop iteration
+are sent together, so a storm costs one ``get_many`` and one
+``pk__in`` query per batch rather than one round trip per socket.
+
+Snapshots record the user's ``token_version``, and the current version of
+each user is kept in the cache. ``revoke_identities`` bumps it, so every
+snapshot of that user is stale at once and the next connect reloads the
+user. The handlers in ``signals`` revoke when a user is deactivated,
+deleted, logs out or changes password or permissions, so those take effect
+immediately instead of when their tokens expire.
+"""
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from asgiref.sync import sync_to_async
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.db.models import F
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.tokens import AccessToken
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    # Verified tokens kept per process
+    'MAX_TOKENS': 50000,
+}
+
+SNAPSHOT_KEY = 'ws_identity:token:{jti}'
+VERSION_KEY = 'ws_identity:version:{user_id}'
+
+# User fields cached per token; resolved users carry only these
+SNAPSHOT_FIELDS = ('pk', 'username', 'is_active', 'is_staff', 'is_superuser', 'token_version')
+
+# (jti, user id, expiry as a Unix timestamp)
+Claims = Tuple[str, str, float]
+
+
+def identity_setting(name: str):
+    return getattr(settings, 'WEBSOCKET_IDENTITY', {}).get(name, DEFAULTS[name])
+
+
+def user_snapshot(user) -> Dict:
+    """The cached fields of ``user``."""
+    return {field: getattr(user, field) for field in SNAPSHOT_FIELDS}
+
+
+def snapshot_user(snapshot: Dict):
+    """An unsaved user instance carrying a snapshot's fields."""
+    return get_user_model()(**snapshot)
+
+
+class IdentityResolver:
+    """
+    Resolves websocket JWTs to users with as few queries as possible.
+    """
+
+    def __init__(self, max_tokens: Optional[int] = None):
+        self.max_tokens = max_tokens or identity_setting('MAX_TOKENS')
+        self._claims: 'OrderedDict[str, Claims]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._loop = None
+        self.hits = 0
+        self.loads = 0
+
+    def verify(self, token: str) -> Optional[Claims]:
+        """Claims of a valid, unexpired access token, or None."""
+        now = time.time()
+        with self._lock:
+            claims = self._claims.get(token)
+            if claims is not None:
+                if claims[2] > now:
+                    self._claims.move_to_end(token)
+                    return claims
+                del self._claims[token]
+
+        try:
+            access_token = AccessToken(token)
+            claims = (str(access_token['jti']), str(access_token['user_id']), float(access_token['exp']))
+        except (TokenError, KeyError, TypeError, ValueError):
+            return None
+
+        with self._lock:
+            self._claims[token] = claims
+            while len(self._claims) > self.max_tokens:
+                self._claims.popitem(last=False)
+        return claims
+
+    async def resolve(self, token: str):
+        """The token's user, or ``AnonymousUser`` when it does not authenticate."""
+        claims = self.verify(token)
+        if claims is None:
+            return AnonymousUser()
+        jti, user_id, expires_at = claims
+        self._bind_loop()
+
+        snapshot, version = await asyncio.shield(self._lookup(jti, user_id))
+        if snapshot is not None and snapshot['token_version'] == version:
+            self.hits += 1
+            return snapshot_user(snapshot)
+
+        loading = self._loading.get(user_id)
+        if loading is None:
+            snapshot = await asyncio.shield(self._load(user_id, jti, expires_at))
+        else:
+            # Dispatched before this connect arrived; cache its snapshot here
+            snapshot = await asyncio.shield(loading)
+            if snapshot is not None and expires_at > time.time():
+                await cache.aset(SNAPSHOT_KEY.format(jti=jti), snapshot, int(expires_at - time.time()) or 1)
+        return snapshot_user(snapshot) if snapshot is not None else AnonymousUser()
+
+    def _bind_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._lookups: Dict[Tuple[str, str], asyncio.Future] = {}
+            self._loads: Dict[str, asyncio.Future] = {}
+            self._load_tokens: List[Claims] = []
+            self._loading: Dict[str, asyncio.Future] = {}
+
+    def _lookup(self, jti: str, user_id: str) -> asyncio.Future:
+        future = self._lookups.get((jti, user_id))
+        if future is None:
+            if not self._lookups:
+                # Runs after every connect already scheduled in this iteration
+                self._loop.call_soon(self._dispatch_lookups)
+            future = self._lookups[(jti, user_id)] = self._loop.create_future()
+        return future
+
+    def _dispatch_lookups(self) -> None:
+        batch, self._lookups = self._lookups, {}
+        self._loop.create_task(self._complete(batch, self._lookup_many(list(batch))))
+
+    def _load(self, user_id: str, jti: str, expires_at: float) -> asyncio.Future:
+        self._load_tokens.append((jti, user_id, expires_at))
+        future = self._loads.get(user_id)
+        if future is None:
+            if not self._loads:
+                self._loop.call_soon(self._dispatch_loads)
+            future = self._loads[user_id] = self._loop.create_future()
+        return future
+
+    def _dispatch_loads(self) -> None:
+        batch, self._loads = self._loads, {}
+        tokens, self._load_tokens = self._load_tokens, []
+        self._loading.update(batch)
+        task = self._loop.create_task(self._complete(batch, self._load_many(list(batch), tokens)))
+
+        def done(_):
+            for user_id, future in batch.items():
+                if self._loading.get(user_id) is future:
+                    del self._loading[user_id]
+
+        task.add_done_callback(done)
+
+    async def _complete(self, batch: Dict, load) -> None:
+        try:
+            results = await load
+        except Exception as e:
+            logger.error(f"Error resolving websocket identities: {str(e)}")
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for key, future in batch.items():
+            if not future.done():
+                future.set_result(results.get(key))
+
+    async def _lookup_many(self, items: List[Tuple[str, str]]) -> Dict:
+        keys = set()
+        for jti, user_id in items:
+            keys.add(SNAPSHOT_KEY.format(jti=jti))
+            keys.add(VERSION_KEY.format(user_id=user_id))
+        # BaseCache.aget_many awaits aget per key, a thread hop each
+        values = await sync_to_async(cache.get_many)(list(keys))
+        return {
+            (jti, user_id): (
+                values.get(SNAPSHOT_KEY.format(jti=jti)),
+                values.get(VERSION_KEY.format(user_id=user_id))
+            )
+            for jti, user_id in items
+        }
+
+    @database_sync_to_async
+    def _load_many(self, user_ids: List[str], tokens: List[Claims]) -> Dict:
+        self.loads += 1
+        snapshots = {
+            str(user.pk): user_snapshot(user)
+            for user in get_user_model().objects.filter(pk__in=user_ids, is_active=True)
+        }
+        for user_id, snapshot in snapshots.items():
+            # Keep a newer version set by a concurrent revoke
+            cache.add(VERSION_KEY.format(user_id=user_id), snapshot['token_version'], None)
+        now = time.time()
+        for jti, user_id, expires_at in tokens:
+            snapshot = snapshots.get(user_id)
+            if snapshot is not None and expires_at > now:
+                cache.set(SNAPSHOT_KEY.format(jti=jti), snapshot, int(expires_at - now) or 1)
+        return snapshots
+
+
+def revoke_identities(user) -> Optional[int]:
+    """
+    Invalidate every cached websocket identity of ``user``. Returns the new
+    version, or None when the user no longer exists.
+    """
+    User = get_user_model()
+    User.objects.filter(pk=user.pk).update(token_version=F('token_version') + 1)
+    version = User.objects.filter(pk=user.pk).values_list('token_version', flat=True).first()
+    if version is None:
+        forget_identities(user.pk)
+        return None
+    cache.set(VERSION_KEY.format(user_id=user.pk), version, None)
+    user.token_version = version
+    return version
+
+
+def forget_identities(user_id) -> None:
+    """
+    Invalidate every cached websocket identity of a deleted user. Without a
+    version no snapshot matches, and the reload finds no user.
+    """
+    cache.delete(VERSION_KEY.format(user_id=user_id))
+
+
+_resolver = None
+_resolver_lock = threading.Lock()
+
+
+def get_identity_resolver() -> IdentityResolver:
+    """Get the process-wide identity resolver"""
+    global _resolver
+    if _resolver is None:
+        with _resolver_lock:
+            if _resolver is None:
+                _resolver = IdentityResolver()
+    return _resolver
@@ -1,28 +1,18 @@
 from channels.middleware import BaseMiddleware
-from channels.db import database_sync_to_async
 from django.contrib.auth.models import AnonymousUser
-from django.contrib.auth import get_user_model
-from rest_framework_simplejwt.tokens import AccessToken
-from jwt import InvalidTokenError
 import json
 import time
 import logging
 from django.http import JsonResponse
 from django.conf import settings
 from rest_framework import status
-
-User = get_user_model()
+from .identity import get_identity_resolver
 
 logger = logging.getLogger(__name__)
 
-@database_sync_to_async
-def get_user(token_key):
-    try:
-        access_token = AccessToken(token_key)
-        user = User.objects.get(id=access_token['user_id'])
-        return user
-    except (InvalidTokenError, User.DoesNotExist):
-        return AnonymousUser()
+async def get_user(token_key):
+    # Verified once, then served from the identity cache until expiry
+    return await get_identity_resolver().resolve(token_key)
 
 class TokenAuthMiddleware(BaseMiddleware):
     async def __call__(self, scope, receive, send):
@@ -0,0 +1,31 @@
+import django.core.validators
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('future_capabilities', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NeuralSignalChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('signal_type', models.CharField(choices=[('alpha', 'Alpha Waves'), ('beta', 'Beta Waves'), ('gamma', 'Gamma Waves'), ('muscle', 'Muscle Activity')], max_length=50, verbose_name='Signal Type')),
+                ('start_time', models.DateTimeField(verbose_name='Start Time')),
+                ('sample_rate', models.FloatField(validators=[django.core.validators.MinValueValidator(0)], verbose_name='Sample Rate (Hz)')),
+                ('sample_count', models.PositiveIntegerField(verbose_name='Sample Count')),
+                ('samples', models.BinaryField(verbose_name='Samples')),
+                ('signal_quality', models.FloatField(blank=True, null=True, validators=[django.core.validators.MinValueValidator(0), django.core.validators.MaxValueValidator(1)], verbose_name='Mean Signal Quality')),
+                ('device', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='signal_chunks', to='future_capabilities.neuraldevice', verbose_name='Device')),
+            ],
+            options={
+                'verbose_name': 'Neural Signal Chunk',
+                'verbose_name_plural': 'Neural Signal Chunks',
+                'indexes': [models.Index(fields=['device', 'signal_type', 'start_time'], name='idx_signal_chunk_time')],
+            },
+        ),
+    ]
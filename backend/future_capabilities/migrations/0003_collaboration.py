@@ -0,0 +1,52 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('future_capabilities', '0002_neuralsignalchunk'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CollaborationSession',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('session_name', models.CharField(max_length=200, verbose_name='Session Name')),
+                ('participant_user_ids', models.JSONField(default=list, verbose_name='Participant User IDs')),
+                ('moderators', models.JSONField(blank=True, default=list, verbose_name='Moderator User IDs')),
+                ('track_ref', models.JSONField(blank=True, default=dict, verbose_name='Track Reference')),
+                ('session_type', models.CharField(choices=[('private', 'Private'), ('public', 'Public')], default='private', max_length=20, verbose_name='Session Type')),
+                ('active', models.BooleanField(default=True, verbose_name='Active Status')),
+                ('version', models.PositiveIntegerField(default=0, verbose_name='Document Version')),
+                ('document', models.JSONField(blank=True, default=dict, verbose_name='Document Snapshot')),
+                ('created_by', models.IntegerField(blank=True, null=True, verbose_name='Created By')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created At')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Updated At')),
+            ],
+            options={
+                'verbose_name': 'Collaboration Session',
+                'verbose_name_plural': 'Collaboration Sessions',
+                'permissions': [('create_public_session', 'Can create public collaboration sessions'), ('moderate_session', 'Can moderate collaboration sessions')],
+            },
+        ),
+        migrations.CreateModel(
+            name='CollaborationActivityLog',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.IntegerField(blank=True, null=True, verbose_name='User ID')),
+                ('action_type', models.CharField(choices=[('join', 'Join'), ('leave', 'Leave'), ('edit', 'Edit'), ('moderate', 'Moderate')], max_length=20, verbose_name='Action Type')),
+                ('action_detail', models.JSONField(default=dict, verbose_name='Action Detail')),
+                ('version', models.PositiveIntegerField(blank=True, null=True, verbose_name='Document Version')),
+                ('created_by', models.IntegerField(blank=True, null=True, verbose_name='Created By')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created At')),
+                ('session', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='activity_logs', to='future_capabilities.collaborationsession', verbose_name='Session')),
+            ],
+            options={
+                'verbose_name': 'Collaboration Activity Log',
+                'verbose_name_plural': 'Collaboration Activity Logs',
+                'indexes': [models.Index(fields=['session', 'version'], name='idx_collab_log_version')],
+            },
+        ),
+    ]
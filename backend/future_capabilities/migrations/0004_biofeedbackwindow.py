@@ -0,0 +1,32 @@
+import django.core.validators
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('future_capabilities', '0003_collaboration'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BiofeedbackWindow',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.IntegerField(verbose_name='User ID')),
+                ('signal_type', models.CharField(choices=[('ppg', 'Photoplethysmogram'), ('ecg', 'Electrocardiogram'), ('eda', 'Electrodermal Activity'), ('temperature', 'Temperature'), ('movement', 'Movement')], max_length=50, verbose_name='Signal Type')),
+                ('start_time', models.DateTimeField(verbose_name='Start Time')),
+                ('duration', models.FloatField(validators=[django.core.validators.MinValueValidator(0)], verbose_name='Duration (s)')),
+                ('features', models.JSONField(default=dict, verbose_name='Features')),
+                ('sample_rate', models.FloatField(validators=[django.core.validators.MinValueValidator(0)], verbose_name='Stored Sample Rate (Hz)')),
+                ('samples', models.BinaryField(verbose_name='Decimated Samples')),
+                ('device', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='biofeedback_windows', to='future_capabilities.wearabledevice', verbose_name='Device')),
+            ],
+            options={
+                'verbose_name': 'Biofeedback Window',
+                'verbose_name_plural': 'Biofeedback Windows',
+                'indexes': [models.Index(fields=['device', 'signal_type', 'start_time'], name='idx_biofeedback_window_time'), models.Index(fields=['user_id', 'signal_type', 'start_time'], name='idx_biofeedback_window_user')],
+            },
+        ),
+    ]
@@ -4,6 +4,7 @@ from .plugins import *
 from .analytics import *
 from .feedback import *
 from .wearables import *
+from .collaboration import *
 
 __all__ = [
     # VR Models
@@ -14,6 +15,7 @@ __all__ = [
     # Neural Models
     'NeuralDevice',
     'NeuralSignal',
+    'NeuralSignalChunk',
     'NeuralControl',
     
     # Plugin Models
@@ -34,4 +36,9 @@ __all__ = [
     'WearableDevice',
     'BiofeedbackData',
     'BiofeedbackEvent',
+    'BiofeedbackWindow',
+
+    # Collaboration Models
+    'CollaborationSession',
+    'CollaborationActivityLog',
 ]
@@ -0,0 +1,127 @@
+from django.db import models
+from django.utils.translation import gettext_lazy as _
+
+
+class CollaborationSession(models.Model):
+    """
+    Model for real-time collaborative editing sessions.
+    """
+    session_name = models.CharField(
+        max_length=200,
+        verbose_name=_("Session Name")
+    )
+    participant_user_ids = models.JSONField(
+        default=list,
+        verbose_name=_("Participant User IDs")
+    )
+    moderators = models.JSONField(
+        default=list,
+        blank=True,
+        verbose_name=_("Moderator User IDs")
+    )
+    track_ref = models.JSONField(
+        default=dict,
+        blank=True,
+        verbose_name=_("Track Reference")
+    )
+    session_type = models.CharField(
+        max_length=20,
+        choices=[
+            ('private', 'Private'),
+            ('public', 'Public')
+        ],
+        default='private',
+        verbose_name=_("Session Type")
+    )
+    active = models.BooleanField(
+        default=True,
+        verbose_name=_("Active Status")
+    )
+    version = models.PositiveIntegerField(
+        default=0,
+        verbose_name=_("Document Version")
+    )
+    document = models.JSONField(
+        default=dict,
+        blank=True,
+        verbose_name=_("Document Snapshot")
+    )
+    created_by = models.IntegerField(
+        null=True,
+        blank=True,
+        verbose_name=_("Created By")
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name=_("Created At")
+    )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name=_("Updated At")
+    )
+
+    class Meta:
+        verbose_name = _("Collaboration Session")
+        verbose_name_plural = _("Collaboration Sessions")
+        permissions = [
+            ('create_public_session', 'Can create public collaboration sessions'),
+            ('moderate_session', 'Can moderate collaboration sessions')
+        ]
+
+    def __str__(self):
+        return self.session_name
+
+
+class CollaborationActivityLog(models.Model):
+    """
+    Model for logging activity in collaboration sessions.
+    """
+    session = models.ForeignKey(
+        CollaborationSession,
+        on_delete=models.CASCADE,
+        related_name='activity_logs',
+        verbose_name=_("Session")
+    )
+    user_id = models.IntegerField(
+        null=True,
+        blank=True,
+        verbose_name=_("User ID")
+    )
+    action_type = models.CharField(
+        max_length=20,
+        choices=[
+            ('join', 'Join'),
+            ('leave', 'Leave'),
+            ('edit', 'Edit'),
+            ('moderate', 'Moderate')
+        ],
+        verbose_name=_("Action Type")
+    )
+    action_detail = models.JSONField(
+        default=dict,
+        verbose_name=_("Action Detail")
+    )
+    version = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        verbose_name=_("Document Version")
+    )
+    created_by = models.IntegerField(
+        null=True,
+        blank=True,
+        verbose_name=_("Created By")
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name=_("Created At")
+    )
+
+    class Meta:
+        verbose_name = _("Collaboration Activity Log")
+        verbose_name_plural = _("Collaboration Activity Logs")
+        indexes = [
+            models.Index(fields=['session', 'version'], name='idx_collab_log_version')
+        ]
+
+    def __str__(self):
+        return f"{self.get_action_type_display()} in {self.session_id} by {self.user_id}"
@@ -1,3 +1,6 @@
+from datetime import timedelta
+
+import numpy as np
 from django.db import models
 from django.utils.translation import gettext_lazy as _
 from django.core.validators import MinValueValidator, MaxValueValidator
@@ -98,6 +101,66 @@ class NeuralSignal(models.Model):
         return f"{self.get_signal_type_display()} from {self.device.device_name}"
 
 
+class NeuralSignalChunk(models.Model):
+    """
+    Block of consecutive samples from one device and signal type, packed as
+    little-endian float32.
+    """
+    device = models.ForeignKey(
+        NeuralDevice,
+        on_delete=models.CASCADE,
+        related_name='signal_chunks',
+        verbose_name=_("Device")
+    )
+    signal_type = models.CharField(
+        max_length=50,
+        choices=[
+            ('alpha', 'Alpha Waves'),
+            ('beta', 'Beta Waves'),
+            ('gamma', 'Gamma Waves'),
+            ('muscle', 'Muscle Activity')
+        ],
+        verbose_name=_("Signal Type")
+    )
+    start_time = models.DateTimeField(
+        verbose_name=_("Start Time")
+    )
+    sample_rate = models.FloatField(
+        validators=[MinValueValidator(0)],
+        verbose_name=_("Sample Rate (Hz)")
+    )
+    sample_count = models.PositiveIntegerField(
+        verbose_name=_("Sample Count")
+    )
+    samples = models.BinaryField(
+        verbose_name=_("Samples")
+    )
+    signal_quality = models.FloatField(
+        null=True,
+        blank=True,
+        validators=[MinValueValidator(0), MaxValueValidator(1)],
+        verbose_name=_("Mean Signal Quality")
+    )
+
+    class Meta:
+        verbose_name = _("Neural Signal Chunk")
+        verbose_name_plural = _("Neural Signal Chunks")
+        indexes = [
+            models.Index(fields=['device', 'signal_type', 'start_time'], name='idx_signal_chunk_time')
+        ]
+
+    def __str__(self):
+        return f"{self.sample_count} {self.get_signal_type_display()} samples from {self.device_id}"
+
+    @property
+    def end_time(self):
+        return self.start_time + timedelta(seconds=self.sample_count / self.sample_rate)
+
+    def values(self) -> np.ndarray:
+        """The samples as a float32 array."""
+        return np.frombuffer(bytes(self.samples), dtype='<f4')
+
+
 class NeuralControl(models.Model):
     """
     Model for mapping neural signals to music controls.
@@ -1,3 +1,6 @@
+from datetime import timedelta
+
+import numpy as np
 from django.db import models
 from django.utils.translation import gettext_lazy as _
 from django.core.validators import MinValueValidator, MaxValueValidator
@@ -156,3 +159,67 @@ class BiofeedbackEvent(models.Model):
 
     def __str__(self):
         return f"{self.get_event_type_display()} triggered by {self.trigger_data.get_data_type_display()}"
+
+
+class BiofeedbackWindow(models.Model):
+    """
+    Features derived from one window of a wearable's signal, with its raw
+    samples decimated and packed as little-endian float32.
+    """
+    user_id = models.IntegerField(
+        verbose_name=_("User ID")
+    )
+    device = models.ForeignKey(
+        WearableDevice,
+        on_delete=models.CASCADE,
+        related_name='biofeedback_windows',
+        verbose_name=_("Device")
+    )
+    signal_type = models.CharField(
+        max_length=50,
+        choices=[
+            ('ppg', 'Photoplethysmogram'),
+            ('ecg', 'Electrocardiogram'),
+            ('eda', 'Electrodermal Activity'),
+            ('temperature', 'Temperature'),
+            ('movement', 'Movement')
+        ],
+        verbose_name=_("Signal Type")
+    )
+    start_time = models.DateTimeField(
+        verbose_name=_("Start Time")
+    )
+    duration = models.FloatField(
+        validators=[MinValueValidator(0)],
+        verbose_name=_("Duration (s)")
+    )
+    features = models.JSONField(
+        default=dict,
+        verbose_name=_("Features")
+    )
+    sample_rate = models.FloatField(
+        validators=[MinValueValidator(0)],
+        verbose_name=_("Stored Sample Rate (Hz)")
+    )
+    samples = models.BinaryField(
+        verbose_name=_("Decimated Samples")
+    )
+
+    class Meta:
+        verbose_name = _("Biofeedback Window")
+        verbose_name_plural = _("Biofeedback Windows")
+        indexes = [
+            models.Index(fields=['device', 'signal_type', 'start_time'], name='idx_biofeedback_window_time'),
+            models.Index(fields=['user_id', 'signal_type', 'start_time'], name='idx_biofeedback_window_user')
+        ]
+
+    def __str__(self):
+        return f"{self.get_signal_type_display()} window from {self.device_id}"
+
+    @property
+    def end_time(self):
+        return self.start_time + timedelta(seconds=self.duration)
+
+    def values(self) -> np.ndarray:
+        """The decimated samples as a float32 array."""
+        return np.frombuffer(bytes(self.samples), dtype='<f4')
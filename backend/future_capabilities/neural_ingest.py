@@ -0,0 +1,298 @@
+"""
+Micro-batched neural signal ingestion.
+
+BCI streams arrive at hundreds of samples per second per user, far more
+than one row per websocket message can keep up with. ``NeuralIngestBuffer``
+appends incoming samples to an in-memory block per device and signal type;
+a background flusher thread writes the blocks every ``FLUSH_INTERVAL``
+seconds (or as soon as a block reaches ``BLOCK_SAMPLES``) as
+``NeuralSignalChunk`` rows with one ``bulk_create`` per flush. Each chunk
+holds consecutive samples packed as float32 with their start time and
+sample rate, about 4 bytes per sample instead of a JSON row per message.
+
+A message starts a new block when its timestamp does not follow on from
+the previous samples, or, without a timestamp, when it arrives more than
+``GAP_TOLERANCE`` seconds after they should have ended. Timestamps more
+than ``MAX_CLOCK_SKEW`` seconds from now are refused.
+
+A flush packs each block on its own: a block that cannot be stored is
+logged and dropped rather than holding back the rest. Blocks are only
+put back when the write itself fails.
+
+``record`` reports back-pressure: ``'slow'`` once ``HIGH_WATERMARK``
+samples are waiting across all streams, and ``'full'`` when accepting the
+samples would exceed ``MAX_PENDING``, in which case they are refused and
+the client should resend them later.
+"""
+import logging
+import math
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+
+from server.background import BackgroundFlusher
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'FLUSH_INTERVAL': 1.0,
+    # Samples per chunk
+    'BLOCK_SAMPLES': 4096,
+    # Buffered samples at which clients are asked to slow down
+    'HIGH_WATERMARK': 500000,
+    # Buffered samples at which new samples are refused
+    'MAX_PENDING': 2000000,
+    'SAMPLE_RATE': 256.0,
+    'GAP_TOLERANCE': 0.5,
+    # Largest distance in seconds between a timestamp and now
+    'MAX_CLOCK_SKEW': 86400.0,
+    'BATCH_SIZE': 500,
+}
+
+OK = 'ok'
+SLOW = 'slow'
+FULL = 'full'
+
+SIGNAL_TYPES = ('alpha', 'beta', 'gamma', 'muscle')
+
+# (device id, signal type)
+StreamKey = Tuple[int, str]
+
+
+def neural_ingest_setting(name: str):
+    return getattr(settings, 'NEURAL_INGEST', {}).get(name, DEFAULTS[name])
+
+
+class _Block:
+    __slots__ = ('start', 'sample_rate', 'parts', 'count', 'quality_sum', 'quality_count')
+
+    def __init__(self, start: float, sample_rate: float):
+        self.start = start
+        self.sample_rate = sample_rate
+        self.parts: List[np.ndarray] = []
+        self.count = 0
+        self.quality_sum = 0.0
+        self.quality_count = 0
+
+
+class _Stream:
+    __slots__ = ('blocks', 'end', 'sample_rate')
+
+    def __init__(self):
+        self.blocks: List[_Block] = []
+        # Time just after the last sample received, kept across flushes
+        self.end: Optional[float] = None
+        self.sample_rate: Optional[float] = None
+
+
+class NeuralIngestBuffer(BackgroundFlusher):
+    """
+    Collects neural samples from consumers and views and stores them in
+    chunks.
+    """
+
+    thread_name = 'neural-ingest-flusher'
+
+    def __init__(
+        self,
+        flush_interval: Optional[float] = None,
+        block_samples: Optional[int] = None,
+        high_watermark: Optional[int] = None,
+        max_pending: Optional[int] = None
+    ):
+        super().__init__()
+        self.flush_interval = flush_interval if flush_interval is not None else neural_ingest_setting('FLUSH_INTERVAL')
+        self.block_samples = block_samples or neural_ingest_setting('BLOCK_SAMPLES')
+        self.high_watermark = high_watermark or neural_ingest_setting('HIGH_WATERMARK')
+        self.max_pending = max_pending or neural_ingest_setting('MAX_PENDING')
+        self.sample_rate = neural_ingest_setting('SAMPLE_RATE')
+        self.gap_tolerance = neural_ingest_setting('GAP_TOLERANCE')
+        self.max_clock_skew = neural_ingest_setting('MAX_CLOCK_SKEW')
+        self.batch_size = neural_ingest_setting('BATCH_SIZE')
+        self._streams: Dict[StreamKey, _Stream] = {}
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self.stored = 0
+        self.refused = 0
+        self.dropped = 0
+
+    @property
+    def pending(self) -> int:
+        """Samples received but not yet stored."""
+        return self._pending
+
+    @property
+    def state(self) -> str:
+        return SLOW if self._pending >= self.high_watermark else OK
+
+    def record(
+        self,
+        device_id: int,
+        signal_type: str,
+        samples,
+        sample_rate: Optional[float] = None,
+        timestamp: Optional[float] = None,
+        quality: Optional[float] = None
+    ) -> str:
+        """
+        Buffer ``samples`` from the device. ``timestamp`` is the Unix time of
+        the first sample. Returns the back-pressure state; on ``'full'`` the
+        samples were not accepted.
+        """
+        if signal_type not in SIGNAL_TYPES:
+            raise ValueError(f"Unknown signal type: {signal_type}")
+        if samples is None:
+            raise ValueError('Samples are required')
+        try:
+            values = np.asarray(samples, dtype='<f4').ravel()
+        except (TypeError, ValueError):
+            raise ValueError('Samples must be numbers')
+        if not np.isfinite(values).all():
+            raise ValueError('Samples must be finite')
+        sample_rate = float(sample_rate or self.sample_rate)
+        if sample_rate <= 0:
+            raise ValueError('Sample rate must be positive')
+        if timestamp is not None:
+            timestamp = self._number(timestamp, 'Timestamp')
+            if abs(timestamp - time.time()) > self.max_clock_skew:
+                raise ValueError('Timestamp is too far from the current time')
+        if quality is not None:
+            quality = self._number(quality, 'Quality')
+            if not 0 <= quality <= 1:
+                raise ValueError('Quality must be between 0 and 1')
+        count = len(values)
+        if not count:
+            return self.state
+
+        self._ensure_running()
+        with self._lock:
+            if self._pending + count > self.max_pending:
+                self.refused += count
+                return FULL
+
+            stream = self._streams.get((device_id, signal_type))
+            if stream is None:
+                stream = self._streams[(device_id, signal_type)] = _Stream()
+            block = stream.blocks[-1] if stream.blocks else None
+            start = self._start(stream, timestamp, count, sample_rate)
+            if (
+                block is None or start != stream.end or sample_rate != block.sample_rate
+                or block.count >= self.block_samples
+            ):
+                block = _Block(start, sample_rate)
+                stream.blocks.append(block)
+            block.parts.append(values)
+            block.count += count
+            if quality is not None:
+                block.quality_sum += quality * count
+                block.quality_count += count
+            stream.end = start + count / sample_rate
+            stream.sample_rate = sample_rate
+            self._pending += count
+            state = SLOW if self._pending >= self.high_watermark else OK
+            full_block = block.count >= self.block_samples
+
+        if full_block or state != OK:
+            self._wakeup.set()
+        return state
+
+    @staticmethod
+    def _number(value, name: str) -> float:
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"{name} must be a number")
+        if not math.isfinite(value):
+            raise ValueError(f"{name} must be finite")
+        return value
+
+    def _start(self, stream: _Stream, timestamp: Optional[float], count: int, sample_rate: float) -> float:
+        """Start time of new samples, continuing the stream when they follow on."""
+        if stream.end is not None and sample_rate == stream.sample_rate:
+            if timestamp is None:
+                if time.time() - count / sample_rate - stream.end <= self.gap_tolerance:
+                    return stream.end
+            elif abs(timestamp - stream.end) <= 1.5 / sample_rate:
+                return stream.end
+        return timestamp if timestamp is not None else time.time() - count / sample_rate
+
+    def flush(self) -> int:
+        """Store every buffered block. Returns the number of samples stored."""
+        from .models import NeuralDevice, NeuralSignalChunk
+
+        with self._flush_lock:
+            with self._lock:
+                taken = {}
+                for key, stream in self._streams.items():
+                    if stream.blocks:
+                        taken[key], stream.blocks = stream.blocks, []
+            if not taken:
+                return 0
+
+            device_ids = {device_id for device_id, _ in taken}
+            try:
+                known = set(NeuralDevice.objects.filter(pk__in=device_ids).values_list('pk', flat=True))
+            except Exception as e:
+                self._requeue(taken)
+                logger.error(f"Error flushing neural signal chunks: {str(e)}")
+                return 0
+
+            chunks, packed, unknown, invalid = [], {}, 0, 0
+            for (device_id, signal_type), blocks in taken.items():
+                for block in blocks:
+                    if device_id not in known:
+                        unknown += block.count
+                        continue
+                    try:
+                        chunks.append(self._chunk(NeuralSignalChunk, device_id, signal_type, block))
+                    except Exception as e:
+                        invalid += block.count
+                        logger.error(f"Error packing neural signal block from device {device_id}: {str(e)}")
+                        continue
+                    packed.setdefault((device_id, signal_type), []).append(block)
+
+            stored = sum(block.count for blocks in packed.values() for block in blocks)
+            try:
+                with transaction.atomic():
+                    NeuralSignalChunk.objects.bulk_create(chunks, batch_size=self.batch_size)
+            except Exception as e:
+                self._requeue(packed)
+                logger.error(f"Error flushing neural signal chunks: {str(e)}")
+                stored = 0
+
+            with self._lock:
+                self._pending -= stored + unknown + invalid
+            self.stored += stored
+            self.dropped += unknown + invalid
+            if unknown:
+                logger.warning(f"Dropped {unknown} neural samples from unknown devices")
+            return stored
+
+    def _chunk(self, model, device_id: int, signal_type: str, block: _Block):
+        return model(
+            device_id=device_id,
+            signal_type=signal_type,
+            start_time=datetime.fromtimestamp(block.start, tz=dt_timezone.utc),
+            sample_rate=block.sample_rate,
+            sample_count=block.count,
+            samples=np.concatenate(block.parts).tobytes(),
+            signal_quality=block.quality_sum / block.quality_count if block.quality_count else None
+        )
+
+    def _requeue(self, taken: Dict[StreamKey, List[_Block]]) -> None:
+        # Nothing was written; put the blocks back in front of newer ones
+        with self._lock:
+            for key, blocks in taken.items():
+                stream = self._streams[key]
+                stream.blocks[:0] = blocks
+
+
+def get_neural_ingest_buffer() -> NeuralIngestBuffer:
+    """Get the process-wide neural ingestion buffer"""
+    return NeuralIngestBuffer.shared()
@@ -0,0 +1,258 @@
+"""
+Compiled neural control mappings.
+
+A user's active ``NeuralControl`` rows are compiled into one
+``CompiledMapping`` per process: for each signal type, the controls'
+ranges and parameters become NumPy arrays, grouped by mapping function, so
+an array of signal values is mapped to every control's output in a single
+vectorized pass instead of a Python branch per control per value.
+
+Controls are configured through ``mapping_config``::
+
+    {"input_range": {"min": 0, "max": 100}, "output_range": {"min": 0, "max": 1},
+     "fallback_value": 0.5, "threshold": 0.5, "exponent": 2, "points": [[0, 0], [1, 1]]}
+
+Values are normalised to the input range, then mapped with ``linear``,
+``exponential`` (``n ** exponent``), ``logarithmic`` (``log2(n + 1)``),
+``threshold`` or ``custom`` (piecewise linear through ``points``), and
+scaled to the output range. A non-finite result, or a control whose
+configuration is invalid, gives its ``fallback_value``.
+
+Each user's mapping is versioned in the shared cache; saving or deleting
+one of their controls gives it a new version. Processes check the version
+at most every ``CHECK_INTERVAL`` seconds and recompile when it changed.
+"""
+import logging
+import math
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    # Users whose compiled mappings are kept per process
+    'MAX_USERS': 10000,
+    # Seconds a compiled mapping is used before its version is checked again
+    'CHECK_INTERVAL': 1.0,
+}
+
+VERSION_KEY = 'neural_mapping:version:{user_id}'
+
+# Rows are grouped by function in this order; invalid controls come last
+FUNCTIONS = ('linear', 'exponential', 'logarithmic', 'threshold', 'custom', 'invalid')
+
+
+def neural_mapping_setting(name: str):
+    return getattr(settings, 'NEURAL_MAPPING', {}).get(name, DEFAULTS[name])
+
+
+def _range(config: Dict, name: str) -> Tuple[float, float]:
+    value = config.get(name, {'min': 0.0, 'max': 1.0})
+    return float(value['min']), float(value['max'])
+
+
+class _SignalMapping:
+    """Controls of one signal type as arrays, one row per control."""
+
+    def __init__(self, controls: List):
+        rows = []
+        for control in controls:
+            config = control.mapping_config or {}
+            fallback = config.get('fallback_value', 0.0)
+            try:
+                fallback = float(fallback)
+            except (TypeError, ValueError):
+                fallback = 0.0
+            try:
+                in_min, in_max = _range(config, 'input_range')
+                out_min, out_max = _range(config, 'output_range')
+                function = control.mapping_function
+                if function not in FUNCTIONS or in_max == in_min:
+                    raise ValueError(f"Invalid mapping for control {control.name}")
+                points = None
+                if function == 'custom':
+                    points = np.asarray(config['points'], dtype=np.float64)
+                    if points.ndim != 2 or points.shape[1] != 2 or not len(points):
+                        raise ValueError(f"Invalid points for control {control.name}")
+                    points = points[np.argsort(points[:, 0])]
+                row = (
+                    function, in_min, 1.0 / (in_max - in_min), out_min, out_max - out_min,
+                    float(config.get('exponent', 2.0)), float(config.get('threshold', 0.5)), points
+                )
+            except (KeyError, TypeError, ValueError) as e:
+                logger.warning(f"Neural control {control.pk} falls back: {str(e)}")
+                row = ('invalid', 0.0, math.nan, 0.0, 0.0, 0.0, 0.0, None)
+            rows.append((FUNCTIONS.index(row[0]), control, fallback, row))
+        rows.sort(key=lambda item: item[0])
+
+        self.ids = [control.pk for _, control, _, _ in rows]
+        self.names = [control.name for _, control, _, _ in rows]
+        self.parameters = [control.control_parameter for _, control, _, _ in rows]
+        self.fallback = np.array([fallback for _, _, fallback, _ in rows])
+        columns = zip(*(row[1:7] for _, _, _, row in rows))
+        self.in_min, self.in_scale, self.out_min, self.out_span, self.exponent, self.threshold = (
+            np.array(column, dtype=np.float64)[:, None] for column in columns
+        )
+        self.points = [row[7] for _, _, _, row in rows]
+        # [function, first row, end row]
+        self.groups = []
+        for row, (index, _, _, _) in enumerate(rows):
+            if self.groups and self.groups[-1][0] == FUNCTIONS[index]:
+                self.groups[-1][2] = row + 1
+            else:
+                self.groups.append([FUNCTIONS[index], row, row + 1])
+
+    def apply(self, values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Outputs of shape (controls, values), and where fallbacks were used."""
+        mapped = (values[None, :] - self.in_min) * self.in_scale
+        with np.errstate(all='ignore'):
+            for function, start, end in self.groups:
+                rows = slice(start, end)
+                if function == 'exponential':
+                    mapped[rows] = np.power(mapped[rows], self.exponent[rows])
+                elif function == 'logarithmic':
+                    mapped[rows] = np.log2(mapped[rows] + 1)
+                elif function == 'threshold':
+                    block = mapped[rows]
+                    mapped[rows] = np.where(np.isnan(block), np.nan, block >= self.threshold[rows])
+                elif function == 'custom':
+                    for row in range(start, end):
+                        points = self.points[row]
+                        mapped[row] = np.interp(mapped[row], points[:, 0], points[:, 1])
+            outputs = self.out_min + self.out_span * mapped
+        failed = ~np.isfinite(outputs)
+        if failed.any():
+            outputs = np.where(failed, self.fallback[:, None], outputs)
+        return outputs, failed
+
+
+class CompiledMapping:
+    """
+    A user's active neural controls, compiled per signal type.
+    """
+
+    def __init__(self, controls: List):
+        by_type: Dict[str, List] = {}
+        for control in controls:
+            by_type.setdefault(control.signal_type, []).append(control)
+        self.signals = {signal_type: _SignalMapping(group) for signal_type, group in by_type.items()}
+
+    def __len__(self) -> int:
+        return sum(len(mapping.ids) for mapping in self.signals.values())
+
+    def apply(self, signal_type: str, values) -> Tuple[List[int], np.ndarray]:
+        """
+        Map an array of signal values. Returns the control ids and an array
+        of their outputs with a row per control and a column per value.
+        """
+        values = np.asarray(values, dtype=np.float64).ravel()
+        mapping = self.signals.get(signal_type)
+        if mapping is None:
+            return [], np.empty((0, len(values)))
+        return mapping.ids, mapping.apply(values)[0]
+
+    def control_updates(self, signal_type: str, value: float) -> List[Dict]:
+        """Output of every control of the signal type for one value."""
+        mapping = self.signals.get(signal_type)
+        if mapping is None:
+            return []
+        outputs, failed = mapping.apply(np.array([value], dtype=np.float64))
+        updates = []
+        for row, (name, parameter) in enumerate(zip(mapping.names, mapping.parameters)):
+            update = {'control': name, 'parameter': parameter, 'value': float(outputs[row, 0])}
+            if failed[row, 0]:
+                update['fallback_used'] = True
+            updates.append(update)
+        return updates
+
+
+class NeuralMappingEngine:
+    """
+    Keeps users' compiled mappings and recompiles them when their controls
+    change.
+    """
+
+    def __init__(self, max_users: Optional[int] = None, check_interval: Optional[float] = None):
+        self.max_users = max_users or neural_mapping_setting('MAX_USERS')
+        self.check_interval = check_interval if check_interval is not None else neural_mapping_setting('CHECK_INTERVAL')
+        # user id -> (version, compiled mapping, time of the last version check)
+        self._mappings: 'OrderedDict[int, Tuple[str, CompiledMapping, float]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.compiles = 0
+
+    def cached(self, user_id: int) -> Optional[CompiledMapping]:
+        """The user's mapping when it was checked recently, without any I/O."""
+        with self._lock:
+            entry = self._mappings.get(user_id)
+            if entry is not None and time.monotonic() - entry[2] < self.check_interval:
+                self._mappings.move_to_end(user_id)
+                return entry[1]
+        return None
+
+    def get(self, user_id: int) -> CompiledMapping:
+        """The user's compiled mapping, compiling it when it changed."""
+        mapping = self.cached(user_id)
+        if mapping is not None:
+            return mapping
+
+        key = VERSION_KEY.format(user_id=user_id)
+        version = cache.get(key)
+        if version is None:
+            cache.add(key, uuid.uuid4().hex, None)
+            version = cache.get(key)
+        with self._lock:
+            entry = self._mappings.get(user_id)
+        if entry is not None and entry[0] == version:
+            mapping = entry[1]
+        else:
+            mapping = self._compile(user_id)
+        with self._lock:
+            self._mappings[user_id] = (version, mapping, time.monotonic())
+            self._mappings.move_to_end(user_id)
+            while len(self._mappings) > self.max_users:
+                self._mappings.popitem(last=False)
+        return mapping
+
+    async def aget(self, user_id: int) -> CompiledMapping:
+        mapping = self.cached(user_id)
+        if mapping is None:
+            mapping = await database_sync_to_async(self.get)(user_id)
+        return mapping
+
+    def _compile(self, user_id: int) -> CompiledMapping:
+        from .models import NeuralControl
+
+        self.compiles += 1
+        return CompiledMapping(list(NeuralControl.objects.filter(user_id=user_id, is_active=True).order_by('pk')))
+
+    def discard(self, user_id: int) -> None:
+        with self._lock:
+            self._mappings.pop(user_id, None)
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_neural_mapping_engine() -> NeuralMappingEngine:
+    """Get the process-wide neural mapping engine"""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = NeuralMappingEngine()
+    return _engine
+
+
+def invalidate_neural_mappings(user_id: int) -> None:
+    """Make every process recompile the user's mapping."""
+    cache.set(VERSION_KEY.format(user_id=user_id), uuid.uuid4().hex, None)
+    get_neural_mapping_engine().discard(user_id)
@@ -0,0 +1,417 @@
+"""
+Warm worker processes for plugin execution.
+
+Starting a process and importing a plugin for every call costs far more
+than most plugin actions. ``PluginWorkerPool`` keeps ``WORKERS`` worker
+processes running, each with the ``PRELOAD`` entry points already
+imported. A call is sent to an idle worker over a pipe and answered the
+same way.
+
+Plugin entry points are ``"package.module:function"`` (or a dotted path
+to the function), called as ``function(action_type, parameters, settings)``
+with JSON-like arguments. Whatever they return is the call's output. Only
+entry points in the modules (or packages) listed in ``ALLOWED_MODULES``
+are run; anything else is refused before it reaches a worker.
+
+Each worker's address space is limited to ``MEMORY_LIMIT`` megabytes and
+it may not write files. Workers only see the environment variables named
+in ``ENVIRONMENT``, so plugins cannot read the server's secrets from
+``os.environ``. A call that runs longer than ``TIMEOUT`` seconds kills its
+worker. Workers are replaced after ``MAX_CALLS`` calls, when they crash or
+time out, and after a plugin runs out of memory; workers that failed to
+start are retried on the next call. These limits protect the server from
+misbehaving plugins; they are not a security boundary for untrusted code.
+"""
+import atexit
+import importlib
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+from typing import Dict, Iterable, Optional
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'WORKERS': 4,
+    # Calls a worker serves before it is replaced
+    'MAX_CALLS': 1000,
+    # Seconds a call may run
+    'TIMEOUT': 5.0,
+    # Address space of a worker, in megabytes
+    'MEMORY_LIMIT': 512,
+    # Entry points imported when a worker starts
+    'PRELOAD': [],
+    # Modules or packages whose entry points may be run
+    'ALLOWED_MODULES': [],
+    # Environment variables passed to workers
+    'ENVIRONMENT': ['PATH', 'LANG', 'LC_ALL', 'TZ', 'PYTHONPATH'],
+    # Seconds a call waits for an idle worker
+    'ACQUIRE_TIMEOUT': 10.0,
+    'START_METHOD': 'forkserver',
+}
+
+STARTUP_TIMEOUT = 30.0
+
+
+def plugin_runtime_setting(name: str):
+    return getattr(settings, 'PLUGIN_RUNTIME', {}).get(name, DEFAULTS[name])
+
+
+class PluginError(Exception):
+    """A plugin call failed."""
+
+
+class PluginTimeout(PluginError):
+    """A plugin call ran longer than its timeout."""
+
+
+class PluginCrashed(PluginError):
+    """The worker running a plugin call exited."""
+
+
+class PluginNotAllowed(PluginError):
+    """The entry point is not in an allowed module."""
+
+
+def _split(entry_point: str):
+    if ':' in entry_point:
+        module_name, name = entry_point.split(':', 1)
+    else:
+        module_name, _, name = entry_point.rpartition('.')
+    return module_name, name
+
+
+def is_allowed(entry_point, allowed_modules: Iterable[str]) -> bool:
+    """Whether ``entry_point`` is in one of the allowed modules or packages."""
+    if not isinstance(entry_point, str):
+        return False
+    module_name, name = _split(entry_point)
+    if not module_name or not name or not all(part.isidentifier() for part in module_name.split('.')):
+        return False
+    return any(module_name == allowed or module_name.startswith(f"{allowed}.") for allowed in allowed_modules)
+
+
+def _load(entry_point: str):
+    module_name, name = _split(entry_point)
+    function = importlib.import_module(module_name)
+    for attribute in name.split('.'):
+        function = getattr(function, attribute)
+    return function
+
+
+def _limit_resources(memory_limit: Optional[int]) -> None:
+    import resource
+
+    resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
+    resource.setrlimit(resource.RLIMIT_FSIZE, (0, 0))
+    if memory_limit:
+        limit = memory_limit * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def _peak_memory() -> int:
+    import resource
+
+    # Kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _worker_main(conn, preload, memory_limit, environment) -> None:
+    """Serve calls from the pool until told to stop or the pipe closes."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Before any plugin code is imported
+    os.environ.clear()
+    os.environ.update(environment)
+    functions = {}
+    try:
+        for entry_point in preload:
+            functions[entry_point] = _load(entry_point)
+        _limit_resources(memory_limit)
+    except Exception as e:
+        conn.send(('error', f"Worker failed to start: {type(e).__name__}: {str(e)}"))
+        return
+    conn.send(('ready', os.getpid()))
+
+    while True:
+        try:
+            request = conn.recv()
+        except (EOFError, OSError):
+            # The pool's process went away
+            return
+        if request is None:
+            return
+        entry_point, action_type, parameters, plugin_settings = request
+        start = time.perf_counter()
+        recycle = False
+        try:
+            function = functions.get(entry_point)
+            if function is None:
+                function = functions[entry_point] = _load(entry_point)
+            response = ['ok', function(action_type, parameters, plugin_settings)]
+        except MemoryError:
+            response = ['error', 'Plugin exceeded its memory limit']
+            recycle = True
+        except Exception as e:
+            response = ['error', f"{type(e).__name__}: {str(e)}"]
+        metrics = {
+            'execution_time': time.perf_counter() - start,
+            'memory_usage': _peak_memory(),
+        }
+        try:
+            conn.send((*response, metrics, recycle))
+        except Exception as e:
+            conn.send(('error', f"Plugin output could not be sent: {str(e)}", metrics, recycle))
+        if recycle:
+            return
+
+
+class _Worker:
+    __slots__ = ('process', 'conn', 'calls')
+
+    def __init__(self, process, conn):
+        self.process = process
+        self.conn = conn
+        self.calls = 0
+
+
+class PluginWorkerPool:
+    """
+    A pool of warm plugin worker processes shared by the threads of one
+    server process.
+    """
+
+    def __init__(
+        self,
+        workers: Optional[int] = None,
+        max_calls: Optional[int] = None,
+        timeout: Optional[float] = None,
+        memory_limit: Optional[int] = None,
+        preload: Optional[Iterable[str]] = None,
+        start_method: Optional[str] = None,
+        allowed_modules: Optional[Iterable[str]] = None,
+    ):
+        self.workers = workers or plugin_runtime_setting('WORKERS')
+        self.max_calls = max_calls or plugin_runtime_setting('MAX_CALLS')
+        self.timeout = timeout or plugin_runtime_setting('TIMEOUT')
+        self.memory_limit = memory_limit if memory_limit is not None else plugin_runtime_setting('MEMORY_LIMIT')
+        self.preload = list(preload if preload is not None else plugin_runtime_setting('PRELOAD'))
+        self.allowed_modules = list(
+            allowed_modules if allowed_modules is not None else plugin_runtime_setting('ALLOWED_MODULES')
+        )
+        self.environment = plugin_runtime_setting('ENVIRONMENT')
+        self.acquire_timeout = plugin_runtime_setting('ACQUIRE_TIMEOUT')
+        self._context = multiprocessing.get_context(start_method or plugin_runtime_setting('START_METHOD'))
+        # Most recently used first, so busy periods keep the same workers warm
+        self._idle: 'queue.LifoQueue[_Worker]' = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._pid = None
+        self._stopped = False
+        self._starting: list = []
+        # Workers running or being started
+        self._size = 0
+        self._start_error = None
+        self.calls = 0
+        self.started = 0
+        self.recycled = 0
+        self.crashed = 0
+        self.timeouts = 0
+
+    def start(self) -> None:
+        """Start the workers, waiting until they are ready."""
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # Workers started before a fork belong to the parent
+            self._idle = queue.LifoQueue()
+            self._pid = os.getpid()
+            self._stopped = False
+            self._size = 0
+        self._refill(wait=True)
+
+    def _refill(self, wait: bool = False) -> None:
+        """Start workers up to ``workers``, in the background unless ``wait``."""
+        with self._lock:
+            missing = self.workers - self._size
+            if missing <= 0 or self._stopped:
+                return
+            self._size += missing
+            threads = [
+                threading.Thread(target=self._add_worker, name='plugin-worker-start', daemon=True)
+                for _ in range(missing)
+            ]
+            if not wait:
+                self._starting = [starting for starting in self._starting if starting.is_alive()]
+                self._starting.extend(threads)
+        for thread in threads:
+            thread.start()
+        if wait:
+            for thread in threads:
+                thread.join()
+
+    def _spawn(self) -> _Worker:
+        parent_conn, child_conn = self._context.Pipe()
+        environment = {name: os.environ[name] for name in self.environment if name in os.environ}
+        process = self._context.Process(
+            target=_worker_main,
+            args=(child_conn, self.preload, self.memory_limit, environment),
+            name='plugin-worker',
+            daemon=True
+        )
+        process.start()
+        child_conn.close()
+        if not parent_conn.poll(STARTUP_TIMEOUT):
+            process.kill()
+            raise PluginError('Plugin worker did not start')
+        message = parent_conn.recv()
+        if message[0] != 'ready':
+            process.join()
+            raise PluginError(message[1])
+        with self._lock:
+            self.started += 1
+        return _Worker(process, parent_conn)
+
+    def _add_worker(self) -> None:
+        try:
+            worker = self._spawn()
+        except Exception as e:
+            with self._lock:
+                self._size -= 1
+                self._start_error = str(e)
+            logger.error(f"Error starting plugin worker: {e!r}")
+            return
+        if self._stopped:
+            self._retire(worker)
+        else:
+            self._idle.put(worker)
+
+    def _replace(self, worker: _Worker, kill: bool = False) -> None:
+        """Retire a worker and start another in the background."""
+        if kill:
+            worker.process.kill()
+        self._retire(worker)
+        self._refill()
+
+    def _retire(self, worker: _Worker) -> None:
+        with self._lock:
+            self._size -= 1
+        try:
+            if worker.process.is_alive():
+                worker.conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        worker.conn.close()
+        worker.process.join(1.0)
+        if worker.process.is_alive():
+            worker.process.kill()
+            worker.process.join()
+
+    def execute(
+        self,
+        entry_point: str,
+        action_type: str,
+        parameters: Optional[Dict] = None,
+        plugin_settings: Optional[Dict] = None,
+        timeout: Optional[float] = None,
+    ) -> Dict:
+        """
+        Run a plugin action in a worker. Returns its ``output`` and
+        ``performance_metrics``; raises ``PluginError`` when it fails and
+        ``PluginNotAllowed`` when the entry point is not allowed.
+        """
+        if not is_allowed(entry_point, self.allowed_modules):
+            raise PluginNotAllowed(f"Plugin entry point {entry_point!r} is not allowed")
+        self.start()
+        with self._lock:
+            # e.g. every worker failed to import PRELOAD
+            failed = self._size == 0
+        self._refill(wait=failed)
+        if failed and self._size == 0:
+            raise PluginError(f"No plugin worker available: {self._start_error}")
+        try:
+            worker = self._idle.get(timeout=self.acquire_timeout)
+        except queue.Empty:
+            raise PluginError('No plugin worker available')
+
+        timeout = timeout or self.timeout
+        try:
+            worker.conn.send((entry_point, action_type, parameters or {}, plugin_settings or {}))
+            ready = worker.conn.poll(timeout)
+            response = worker.conn.recv() if ready else None
+        except (EOFError, OSError):
+            with self._lock:
+                self.crashed += 1
+            worker.process.join(1.0)
+            self._replace(worker, kill=True)
+            raise PluginCrashed(f"Plugin worker exited with code {worker.process.exitcode}")
+        except Exception:
+            self._replace(worker, kill=True)
+            raise
+        if response is None:
+            with self._lock:
+                self.timeouts += 1
+            self._replace(worker, kill=True)
+            raise PluginTimeout(f"Plugin did not finish within {timeout:g}s")
+
+        worker.calls += 1
+        status, value, metrics, recycle = response
+        recycle = recycle or worker.calls >= self.max_calls
+        with self._lock:
+            self.calls += 1
+            if recycle:
+                self.recycled += 1
+        if recycle or self._stopped:
+            self._replace(worker)
+        else:
+            self._idle.put(worker)
+        if status != 'ok':
+            raise PluginError(value)
+        return {'output': value, 'performance_metrics': metrics}
+
+    def stop(self) -> None:
+        """Stop the idle workers; busy ones stop when their call returns."""
+        self._stopped = True
+        if self._pid != os.getpid():
+            return
+        # Replacements being started retire themselves once ready
+        with self._lock:
+            starting, self._starting = self._starting, []
+        for thread in starting:
+            thread.join(STARTUP_TIMEOUT)
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._retire(worker)
+        self._pid = None
+
+    def stats(self) -> Dict:
+        return {
+            'idle': self._idle.qsize(),
+            'calls': self.calls,
+            'started': self.started,
+            'recycled': self.recycled,
+            'crashed': self.crashed,
+            'timeouts': self.timeouts,
+        }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_plugin_worker_pool() -> PluginWorkerPool:
+    """Get the process-wide plugin worker pool"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = PluginWorkerPool()
+                atexit.register(_pool.stop)
+    return _pool
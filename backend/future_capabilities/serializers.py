@@ -34,6 +34,7 @@ from .models import (
     BiofeedbackEvent,
     NeuralDevice,
     NeuralSignal,
+    NeuralSignalChunk,
     NeuralControl,
 )
 from .models.feedback import FeatureRequest, FeatureRequestVote, FeatureSurvey, SurveyResponse
@@ -727,6 +728,25 @@ class NeuralSignalSerializer(serializers.ModelSerializer):
         return data
 
 
+class NeuralSignalChunkSerializer(serializers.ModelSerializer):
+    device_name = serializers.CharField(source='device.device_name', read_only=True)
+    device_type = serializers.CharField(source='device.device_type', read_only=True)
+    end_time = serializers.DateTimeField(read_only=True)
+    samples = serializers.SerializerMethodField()
+
+    class Meta:
+        model = NeuralSignalChunk
+        fields = [
+            'id', 'device', 'device_name', 'device_type', 'signal_type',
+            'start_time', 'end_time', 'sample_rate', 'sample_count',
+            'signal_quality', 'samples'
+        ]
+        read_only_fields = fields
+
+    def get_samples(self, obj):
+        return obj.values().tolist()
+
+
 class NeuralControlSerializer(serializers.ModelSerializer):
     class Meta:
         model = NeuralControl
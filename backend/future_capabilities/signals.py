@@ -0,0 +1,93 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.signals import user_logged_out
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
+from django.dispatch import receiver
+from .cache import invalidate_cache_namespace
+from .identity import SNAPSHOT_FIELDS, forget_identities, revoke_identities
+from .models.neural import NeuralControl
+from .neural_mapping import invalidate_neural_mappings
+
+User = get_user_model()
+
+# Changes to these fields revoke the user's cached websocket identities
+REVOKING_FIELDS = ('password',) + tuple(field for field in SNAPSHOT_FIELDS if field not in ('pk', 'token_version'))
+
+
+@receiver(post_save, sender=NeuralControl)
+@receiver(post_delete, sender=NeuralControl)
+def refresh_neural_mappings(sender, instance, **kwargs):
+    """Recompile the user's control mappings when one of their controls changes."""
+    user_id = instance.user_id
+    # After commit, so a concurrent compile cannot cache the old controls
+    transaction.on_commit(lambda: invalidate_neural_mappings(user_id))
+
+
+def invalidate_cached_responses(sender, instance, **kwargs):
+    """
+    Invalidate cached responses read from the model of a changed row.
+
+    Connected by ``cache.watch_models`` for the models cached responses
+    are read from, not for every model.
+    """
+    user_id = getattr(instance, 'user_id', None)
+    # After commit, so a concurrent request cannot cache the old rows again
+    transaction.on_commit(lambda: invalidate_cache_namespace(sender, user_id))
+
+
+@receiver(pre_save, sender=User)
+def detect_identity_changes(sender, instance, update_fields=None, **kwargs):
+    """Note whether a user save changes a field their websocket identity depends on."""
+    instance._revokes_identities = False
+    if instance.pk is None:
+        return
+    fields = [field for field in REVOKING_FIELDS if update_fields is None or field in update_fields]
+    if not fields:
+        # e.g. last_login on every login
+        return
+    stored = sender.objects.filter(pk=instance.pk).values('token_version', *fields).first()
+    if stored is None:
+        return
+    # Never write back a version older than a revoke made since this instance was loaded
+    instance.token_version = stored['token_version']
+    instance._revokes_identities = any(stored[field] != getattr(instance, field) for field in fields)
+
+
+@receiver(post_save, sender=User)
+def revoke_changed_identities(sender, instance, **kwargs):
+    """Revoke the cached websocket identities of a deactivated or changed user."""
+    if getattr(instance, '_revokes_identities', False):
+        instance._revokes_identities = False
+        # After commit, so a concurrent connect cannot cache the old row again
+        transaction.on_commit(lambda: revoke_identities(instance))
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+@receiver(m2m_changed, sender=User.user_permissions.through)
+def revoke_regranted_identities(sender, instance, action, reverse, pk_set, **kwargs):
+    """Revoke the cached websocket identities of users whose permissions changed."""
+    # Before a clear, while the cleared users can still be found
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        users = [instance]
+    elif action == 'pre_clear':
+        field = 'groups' if sender is User.groups.through else 'user_permissions'
+        users = list(User.objects.filter(**{field: instance}))
+    else:
+        users = list(User.objects.filter(pk__in=pk_set))
+    transaction.on_commit(lambda: [revoke_identities(user) for user in users])
+
+
+@receiver(post_delete, sender=User)
+def forget_deleted_identities(sender, instance, **kwargs):
+    """Drop the cached websocket identities of a deleted user."""
+    user_id = instance.pk
+    transaction.on_commit(lambda: forget_identities(user_id))
+
+
+@receiver(user_logged_out)
+def revoke_logged_out_identities(sender, request, user, **kwargs):
+    """Revoke the cached websocket identities of a user logging out."""
+    if user is not None and user.is_authenticated:
+        transaction.on_commit(lambda: revoke_identities(user))
@@ -0,0 +1,47 @@
+"""Pure-Python plugins run by the plugin runtime tests."""
+import os
+import time
+
+
+def echo(action_type, parameters, settings):
+    return {'action': action_type, 'parameters': parameters, 'settings': settings, 'pid': os.getpid()}
+
+
+def gain(action_type, parameters, settings):
+    factor = settings.get('gain', 1.0)
+    return [sample * factor for sample in parameters.get('samples', [])]
+
+
+def checksum(action_type, parameters, settings):
+    """Some CPU work, about a millisecond."""
+    total = 0
+    for i in range(parameters.get('rounds', 20000)):
+        total = (total * 31 + i) % 1000003
+    return total
+
+
+def environment(action_type, parameters, settings):
+    return dict(os.environ)
+
+
+def fail(action_type, parameters, settings):
+    raise ValueError('bad parameters')
+
+
+def sleep(action_type, parameters, settings):
+    time.sleep(parameters.get('seconds', 10))
+    return 'woke up'
+
+
+def allocate(action_type, parameters, settings):
+    return len(bytearray(parameters.get('megabytes', 1024) * 1024 * 1024))
+
+
+def crash(action_type, parameters, settings):
+    os._exit(3)
+
+
+def write_file(action_type, parameters, settings):
+    with open(parameters['path'], 'w') as f:
+        f.write('x' * 100)
+    return 'written'
@@ -0,0 +1,227 @@
+import os
+import time
+from unittest import mock, skipUnless
+import numpy as np
+from django.db import connection
+from django.test import TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from ..biofeedback_dsp import BiofeedbackPipeline
+from ..models.wearables import BiofeedbackData, BiofeedbackWindow, WearableDevice
+
+RUN_BENCHMARKS = os.getenv('RUN_BENCHMARKS', '').lower() == 'true'
+BENCHMARK_DEVICES = int(os.getenv('BENCHMARK_DEVICES', 1000))
+BENCHMARK_SECONDS = int(os.getenv('BENCHMARK_SECONDS', 10))
+BENCHMARK_MESSAGE_SAMPLES = int(os.getenv('BENCHMARK_MESSAGE_SAMPLES', 32))
+
+RATE = 256.0
+START = float(round(time.time()) - 3600)
+
+
+def synthetic_ppg(seconds, seed=0, rate=RATE):
+    """Pulses at known beat times over baseline drift and noise. Returns (signal, intervals)."""
+    rng = np.random.default_rng(seed)
+    intervals = 0.8 + 0.05 * np.sin(np.arange(int(seconds / 0.7)) / 3) + rng.normal(0, 0.02, int(seconds / 0.7))
+    beats = np.cumsum(intervals)
+    beats = beats[beats < seconds - 1]
+    t = np.arange(int(seconds * rate)) / rate
+    ppg = np.zeros_like(t)
+    for beat in beats:
+        ppg += np.exp(-0.5 * ((t - beat) / 0.06) ** 2)
+    ppg += 0.3 * np.sin(2 * np.pi * 0.1 * t) + 2.0 + rng.normal(0, 0.03, len(t))
+    return ppg, beats
+
+
+def feed(pipeline, values, size, device_id=1, signal_type='ppg', start=START):
+    windows = []
+    for offset in range(0, len(values), size):
+        windows.extend(pipeline.record(
+            device_id, signal_type, values[offset:offset + size], sample_rate=RATE,
+            timestamp=start + offset / RATE
+        ))
+    return windows
+
+
+class BiofeedbackPipelineTests(TransactionTestCase):
+    def setUp(self):
+        self.pipeline = BiofeedbackPipeline(flush_interval=0, window=5.0, stored_rate=32.0, hrv_window=30.0)
+
+    def test_heart_rate_variability(self):
+        ppg, beats = synthetic_ppg(65)
+
+        windows = feed(self.pipeline, ppg, 32)
+
+        self.assertEqual(len(windows), 13)
+        self.assertEqual([window['start'] for window in windows[:2]], [START, START + 5])
+        features = windows[-1]['features']
+        # Intervals of the last 30 seconds, from the beats the window has seen
+        end = 65 - 5.0 / 5
+        intervals = np.diff(beats[(beats >= 65 - 30 - 0.5) & (beats < end - 0.5)])
+        self.assertAlmostEqual(features['heart_rate'], 60 / intervals.mean(), delta=1.0)
+        self.assertAlmostEqual(features['rmssd'], np.sqrt(np.mean(np.diff(intervals) ** 2)) * 1000, delta=6.0)
+        self.assertAlmostEqual(features['sdnn'], intervals.std(ddof=1) * 1000, delta=6.0)
+        self.assertEqual(sum(window['features']['beats'] for window in windows), len(beats[beats < 64.5]))
+        self.assertNotIn('samples', windows[0])
+
+    def test_results_do_not_depend_on_message_size(self):
+        ppg, _ = synthetic_ppg(20, seed=1)
+        other = BiofeedbackPipeline(flush_interval=0, window=5.0, stored_rate=32.0, hrv_window=30.0)
+
+        small = feed(self.pipeline, ppg, 7)
+        large = feed(other, ppg, 500)
+
+        self.assertEqual([window['features'] for window in small], [window['features'] for window in large])
+        np.testing.assert_allclose(
+            np.concatenate([window['samples'] for _, window in self.pipeline._pending]),
+            np.concatenate([window['samples'] for _, window in other._pending]),
+            rtol=1e-5
+        )
+
+    def test_decimated_samples(self):
+        t = np.arange(int(10 * RATE)) / RATE
+        wave = np.sin(2 * np.pi * 1.0 * t) + np.sin(2 * np.pi * 60 * t)
+
+        windows = feed(self.pipeline, wave, 64, signal_type='movement')
+
+        _, window = self.pipeline._pending[-1]
+        self.assertEqual((window['sample_rate'], len(window['samples'])), (32.0, 160))
+        self.assertEqual(window['samples'].dtype, np.dtype('<f4'))
+        # The 60 Hz component is filtered out instead of aliasing to 4 Hz
+        self.assertAlmostEqual(np.abs(window['samples']).max(), 1.0, delta=0.02)
+        spectrum = np.abs(np.fft.rfft(window['samples']))
+        self.assertEqual(spectrum.argmax(), 5)
+        self.assertLess(spectrum[20], spectrum[5] / 100)
+        self.assertAlmostEqual(windows[-1]['features']['std'], 1.0, delta=0.01)
+
+    def test_electrodermal_activity(self):
+        t = np.arange(int(30 * RATE)) / RATE
+        eda = 2.0 + 0.01 * t
+        responses = [6.0, 10.5, 13.5, 21.0]
+        for onset in responses:
+            after = np.clip(t - onset, 0, None)
+            eda += 0.2 * (np.exp(-after / 4.0) - np.exp(-after / 0.75)) * (t > onset)
+
+        windows = feed(self.pipeline, eda, 32, signal_type='eda')
+
+        counts = [window['features']['scr_count'] for window in windows]
+        self.assertEqual(counts, [0, 1, 2, 0, 1, 0])
+        self.assertAlmostEqual(windows[0]['features']['tonic'], 2.0 + 0.01 * 2.5, delta=0.03)
+        # Slow tails of the responses count as tonic, the responses do not
+        self.assertGreater(windows[4]['features']['tonic'], 2.0 + 0.01 * 22.5)
+        self.assertLess(windows[4]['features']['tonic'], windows[4]['features']['mean'])
+        self.assertGreater(windows[1]['features']['scr_amplitude'], 0.05)
+
+    def test_streams_restart_after_gaps(self):
+        ppg, _ = synthetic_ppg(8)
+        feed(self.pipeline, ppg[:1024], 32)
+        # Four seconds missing: the partial window is dropped
+        windows = feed(self.pipeline, ppg[:1024], 32, start=START + 8)
+        self.assertEqual(windows, [])
+        windows = feed(self.pipeline, ppg[:256], 32, start=START + 12)
+        self.assertEqual([window['start'] for window in windows], [START + 8])
+
+        self.pipeline.close(1)
+        self.assertEqual(feed(self.pipeline, ppg[:256], 32, start=START + 13), [])
+
+        with self.assertRaisesRegex(ValueError, 'Unknown signal type'):
+            self.pipeline.record(1, 'glucose', [1.0])
+        with self.assertRaisesRegex(ValueError, 'finite'):
+            self.pipeline.record(1, 'ppg', [1.0, float('nan')])
+        for timestamp in ['abc', [START], float('inf'), 1e20, START - 2 * 86400]:
+            with self.assertRaisesRegex(ValueError, 'Timestamp'):
+                self.pipeline.record(1, 'ppg', [1.0], timestamp=timestamp)
+
+    def test_flush_stores_windows(self):
+        device = WearableDevice.objects.create(user_id=7, device_name='Band', device_id='band-1', device_type='fitness_tracker')
+        ppg, _ = synthetic_ppg(11)
+        feed(self.pipeline, ppg, 32, device_id=device.pk)
+        feed(self.pipeline, ppg, 32, device_id=device.pk + 1)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.pipeline.flush(), 2)
+
+        self.assertEqual(len([query for query in queries if 'INSERT' in query['sql']]), 1)
+        self.assertEqual((self.pipeline.pending, self.pipeline.dropped), (0, 2))
+        rows = list(BiofeedbackWindow.objects.order_by('start_time'))
+        self.assertEqual([(row.user_id, row.signal_type, row.duration) for row in rows], [(7, 'ppg', 5.0)] * 2)
+        self.assertEqual(rows[0].start_time.timestamp(), START)
+        self.assertEqual(len(rows[1].values()), 160)
+        self.assertIsNotNone(rows[1].features['heart_rate'])
+
+
+    def test_windows_that_cannot_be_converted_are_dropped(self):
+        device = WearableDevice.objects.create(user_id=7, device_name='Band', device_id='band-1', device_type='fitness_tracker')
+        ppg, _ = synthetic_ppg(11)
+        feed(self.pipeline, ppg, 32, device_id=device.pk)
+        _, window = self.pipeline._pending[0]
+        window['samples'] = None
+
+        self.assertEqual(self.pipeline.flush(), 1)
+
+        self.assertEqual((self.pipeline.pending, self.pipeline.dropped), (0, 1))
+        self.assertEqual(BiofeedbackWindow.objects.get().start_time.timestamp(), START + 5)
+
+    def test_failed_flush_keeps_windows(self):
+        device = WearableDevice.objects.create(user_id=7, device_name='Band', device_id='band-1', device_type='fitness_tracker')
+        ppg, _ = synthetic_ppg(6)
+        feed(self.pipeline, ppg, 32, device_id=device.pk)
+
+        with mock.patch.object(BiofeedbackWindow.objects, 'bulk_create', side_effect=RuntimeError('down')):
+            self.assertEqual(self.pipeline.flush(), 0)
+
+        self.assertEqual(self.pipeline.pending, 1)
+        self.assertEqual(self.pipeline.flush(), 1)
+
+
+@skipUnless(RUN_BENCHMARKS, 'Set RUN_BENCHMARKS=true to run benchmarks')
+class BiofeedbackPipelineBenchmark(TransactionTestCase):
+    """BENCHMARK_DEVICES wearables streaming PPG at 256 Hz for BENCHMARK_SECONDS seconds."""
+
+    def test_cpu_and_writes(self):
+        devices = WearableDevice.objects.bulk_create([
+            WearableDevice(user_id=i, device_name=f"Band {i}", device_id=f"band-{i}", device_type='fitness_tracker')
+            for i in range(BENCHMARK_DEVICES)
+        ])
+        ppg, _ = synthetic_ppg(BENCHMARK_SECONDS, seed=2)
+        size = BENCHMARK_MESSAGE_SAMPLES
+        messages = [ppg[offset:offset + size].tolist() for offset in range(0, len(ppg), size)]
+        total_messages = len(messages) * BENCHMARK_DEVICES
+        samples = len(ppg) * BENCHMARK_DEVICES
+
+        # Before: a row written for every message
+        legacy_messages = min(2000, total_messages)
+        start = time.perf_counter()
+        for i in range(legacy_messages):
+            device = devices[i % BENCHMARK_DEVICES]
+            BiofeedbackData.objects.create(
+                user_id=device.user_id, device=device, data_type='heart_rate',
+                value=float(np.mean(messages[i % len(messages)])), unit='raw'
+            )
+        legacy_per_sample = (time.perf_counter() - start) / (legacy_messages * size)
+
+        pipeline = BiofeedbackPipeline(flush_interval=0)
+        start = time.perf_counter()
+        for index, values in enumerate(messages):
+            for device in devices:
+                pipeline.record(device.pk, 'ppg', values, sample_rate=RATE, timestamp=START + index * size / RATE)
+        processing = time.perf_counter() - start
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            stored = pipeline.flush()
+            flushing = time.perf_counter() - start
+
+        per_sample = (processing + flushing) / samples
+        print(
+            f"\n{BENCHMARK_DEVICES:,} devices x {BENCHMARK_SECONDS}s at {RATE:.0f} Hz, "
+            f"{size}-sample messages ({total_messages:,} messages, {samples:,} samples):"
+        )
+        print(
+            f"  row per message: {legacy_per_sample * 1e6:.2f}us per sample, "
+            f"{total_messages / BENCHMARK_SECONDS:,.0f} rows/s"
+        )
+        print(
+            f"  pipeline: {per_sample * 1e6:.2f}us per sample "
+            f"({BENCHMARK_DEVICES * RATE * per_sample:.2f} CPU-s per second of signal), "
+            f"{stored / BENCHMARK_SECONDS:,.0f} rows/s in {len(queries)} queries"
+        )
+        self.assertEqual(stored, BENCHMARK_DEVICES * (BENCHMARK_SECONDS // 5))
+        self.assertLess(per_sample, legacy_per_sample)
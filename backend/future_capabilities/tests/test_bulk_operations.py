@@ -0,0 +1,228 @@
+import os
+import random
+import threading
+import time
+from unittest import skipUnless
+from django.test import TransactionTestCase
+from ..bulk_operations import BulkOperation, install_plugins
+from ..cache import handle_bulk_operation
+from ..models.plugins import Plugin, PluginDeveloper, PluginInstallation
+
+RUN_BENCHMARKS = os.getenv('RUN_BENCHMARKS', '').lower() == 'true'
+BENCHMARK_PLUGINS = int(os.getenv('BENCHMARK_PLUGINS', 100))
+BENCHMARK_LATENCY = float(os.getenv('BENCHMARK_LATENCY', 0.02))
+
+
+class FakeInstaller:
+    """Records installs and uninstalls, with latency and failures injected per item."""
+
+    def __init__(self, graph=None, latency=0.0, failures=()):
+        self.graph = graph or {}
+        self.latency = latency
+        self.failures = set(failures)
+        self.installed = []
+        self.uninstalled = []
+        self.active = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+
+    def dependencies(self, item):
+        return self.graph.get(item, [])
+
+    def install(self, item):
+        with self.lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+            missing = [dependency for dependency in self.dependencies(item) if dependency not in self.installed]
+        try:
+            time.sleep(self.latency(item) if callable(self.latency) else self.latency)
+            if missing:
+                raise AssertionError(f"{item} started before {missing}")
+            if item in self.failures:
+                raise RuntimeError(f"{item} failed")
+            with self.lock:
+                self.installed.append(item)
+            return f"installed {item}"
+        finally:
+            with self.lock:
+                self.active -= 1
+
+    def uninstall(self, item, result):
+        self.uninstalled.append((item, result))
+
+    def operation(self, **kwargs):
+        return BulkOperation(
+            self.install, dependencies=self.dependencies, rollback=self.uninstall, atomic=False, **kwargs
+        )
+
+
+class BulkOperationTests(TransactionTestCase):
+    def test_dependencies_run_first_and_independent_items_concurrently(self):
+        graph = {'synth': ['core'], 'reverb': ['core', 'dsp'], 'dsp': ['core']}
+        installer = FakeInstaller(graph, latency=0.05)
+        events = []
+
+        successful, failed = installer.operation(max_workers=4, progress=events.append).run(
+            ['reverb', 'synth', 'dsp', 'core', 'meter', 'tuner']
+        )
+
+        self.assertEqual(failed, [])
+        self.assertEqual([entry['item'] for entry in successful], ['reverb', 'synth', 'dsp', 'core', 'meter', 'tuner'])
+        self.assertEqual(successful[0]['result'], 'installed reverb')
+        self.assertLess(installer.installed.index('core'), installer.installed.index('dsp'))
+        self.assertLess(installer.installed.index('dsp'), installer.installed.index('reverb'))
+        self.assertIn(installer.peak, (3, 4))
+        self.assertEqual([event['completed'] for event in events], [1, 2, 3, 4, 5, 6])
+        self.assertEqual({event['status'] for event in events}, {'succeeded'})
+        self.assertEqual(events[-1]['total'], 6)
+
+    def test_failed_subgraph_is_rolled_back_and_others_kept(self):
+        graph = {'synth': ['core'], 'reverb': ['dsp'], 'dsp': ['core']}
+        latency = {'core': 0.0, 'synth': 0.0, 'dsp': 0.05}
+        installer = FakeInstaller(graph, latency=lambda item: latency.get(item, 0.0), failures={'dsp'})
+        events = []
+
+        successful, failed = installer.operation(max_workers=4, progress=events.append).run(
+            ['core', 'synth', 'dsp', 'reverb', 'meter']
+        )
+
+        self.assertEqual(successful, [{'item': 'meter', 'result': 'installed meter'}])
+        statuses = {entry['item']: entry['status'] for entry in failed}
+        self.assertEqual(statuses, {'core': 'rolled_back', 'synth': 'rolled_back', 'dsp': 'failed', 'reverb': 'skipped'})
+        self.assertEqual(failed[2]['error'], 'dsp failed')
+        # Dependents are undone before what they depend on
+        self.assertEqual([item for item, _ in installer.uninstalled], ['synth', 'core'])
+        self.assertEqual(installer.uninstalled[1][1], 'installed core')
+        self.assertNotIn('reverb', installer.installed)
+        self.assertEqual(events[-1]['status'], 'rolled_back')
+        self.assertEqual(max(event['completed'] for event in events), 5)
+
+    def test_cycles_and_duplicates_fail_without_running(self):
+        installer = FakeInstaller({'a': ['b'], 'b': ['a'], 'c': ['b'], 'self': ['self']})
+
+        successful, failed = installer.operation().run(['a', 'b', 'c', 'd', 'd', 'self'])
+
+        self.assertEqual(successful, [{'item': 'd', 'result': 'installed d'}])
+        self.assertEqual(
+            [(entry['item'], entry['error']) for entry in failed],
+            [('a', 'Dependency cycle'), ('b', 'Dependency cycle'), ('c', 'Dependency cycle'),
+             ('d', 'Duplicate item'), ('self', 'Dependency cycle')]
+        )
+        self.assertEqual(installer.installed, ['d'])
+
+    def test_failures_from_rollback_are_reported(self):
+        installer = FakeInstaller({'b': ['a']}, failures={'b'})
+
+        def uninstall(item, result):
+            raise RuntimeError('disk full')
+
+        successful, failed = BulkOperation(
+            installer.install, dependencies=installer.dependencies, rollback=uninstall, atomic=False
+        ).run(['a', 'b'])
+
+        self.assertEqual(successful, [])
+        self.assertEqual(failed[0], {'item': 'a', 'error': 'Dependency group failed and rollback failed: disk full', 'status': 'failed'})
+
+    def test_concurrent_handle_bulk_operation(self):
+        installer = FakeInstaller(latency=0.02, failures={3})
+
+        successful, failed = handle_bulk_operation(list(range(8)), installer.install, max_workers=8)
+
+        self.assertEqual([entry['item'] for entry in successful], [0, 1, 2, 4, 5, 6, 7])
+        self.assertEqual(failed, [{'item': 3, 'error': '3 failed', 'status': 'failed'}])
+        self.assertGreater(installer.peak, 1)
+
+
+class InstallPluginsTests(TransactionTestCase):
+    def setUp(self):
+        self.developer = PluginDeveloper.objects.create(user_id=1, company_name='Acme', api_key='key')
+
+    def create_plugin(self, name, dependencies=(), certified=True):
+        return Plugin.objects.create(
+            developer=self.developer, name=name, type='effect', version='1.0', description=name,
+            entry_point=f"acme.{name}", is_certified=certified, required_permissions=['audio'],
+            compatibility={'dependencies': list(dependencies)}
+        )
+
+    def test_installs_with_dependencies(self):
+        core = self.create_plugin('core')
+        dsp = self.create_plugin('dsp', [core.pk])
+        reverb = self.create_plugin('reverb', [dsp.pk, core.pk])
+
+        successful, failed = install_plugins(7, [reverb.pk, str(dsp.pk), core.pk, 'junk'], max_workers=4)
+
+        self.assertEqual(failed, [{'item': 'junk', 'error': 'Invalid plugin id', 'status': 'failed'}])
+        self.assertEqual([entry['item'] for entry in successful], [reverb.pk, dsp.pk, core.pk])
+        installations = PluginInstallation.objects.filter(user_id=7)
+        self.assertEqual(installations.count(), 3)
+        self.assertEqual(installations.get(plugin=reverb).granted_permissions, ['audio'])
+        self.assertEqual(successful[0]['result']['installation_id'], installations.get(plugin=reverb).id)
+
+    def test_failed_dependency_rolls_back_its_group(self):
+        core = self.create_plugin('core')
+        beta = self.create_plugin('beta', [core.pk], certified=False)
+        synth = self.create_plugin('synth', [core.pk])
+        meter = self.create_plugin('meter')
+
+        successful, failed = install_plugins(7, [core.pk, beta.pk, synth.pk, meter.pk])
+
+        self.assertEqual([entry['item'] for entry in successful], [meter.pk])
+        errors = {entry['item']: entry['error'] for entry in failed}
+        self.assertEqual(errors[beta.pk], 'Cannot install uncertified plugin')
+        self.assertEqual(
+            list(PluginInstallation.objects.filter(user_id=7).values_list('plugin_id', flat=True)), [meter.pk]
+        )
+
+    def test_dependencies_outside_the_batch_must_be_installed(self):
+        core = self.create_plugin('core')
+        synth = self.create_plugin('synth', [core.pk])
+        hidden = self.create_plugin('hidden')
+
+        successful, failed = install_plugins(7, [synth.pk, hidden.pk], queryset=Plugin.objects.exclude(pk=hidden.pk))
+
+        self.assertEqual(successful, [])
+        self.assertEqual(
+            [entry['error'] for entry in failed], [f"Missing dependencies: {core.pk}", 'Plugin not found']
+        )
+
+        PluginInstallation.objects.create(user_id=7, plugin=core)
+        successful, failed = install_plugins(7, [synth.pk, core.pk])
+
+        self.assertEqual([entry['item'] for entry in successful], [synth.pk])
+        self.assertEqual(failed, [{'item': core.pk, 'error': 'Plugin already installed', 'status': 'failed'}])
+
+
+@skipUnless(RUN_BENCHMARKS, 'Set RUN_BENCHMARKS=true to run benchmarks')
+class BulkOperationBenchmark(TransactionTestCase):
+    """BENCHMARK_PLUGINS plugins taking BENCHMARK_LATENCY seconds each to install."""
+
+    def test_wall_time_speedup(self):
+        rng = random.Random(46)
+        items = list(range(BENCHMARK_PLUGINS))
+        # Each plugin depends on up to two earlier ones in about a third of cases
+        graph = {
+            item: rng.sample(items[:item], min(item, rng.randint(1, 2)))
+            for item in items if item and rng.random() < 0.3
+        }
+        rng.shuffle(items)
+
+        sequential = FakeInstaller(latency=BENCHMARK_LATENCY)
+        start = time.perf_counter()
+        handle_bulk_operation(sorted(items), sequential.install)
+        sequential_seconds = time.perf_counter() - start
+
+        print(f"\n{BENCHMARK_PLUGINS} plugins, {BENCHMARK_LATENCY * 1000:.0f}ms per install, {len(graph)} with dependencies:")
+        print(f"  sequential: {sequential_seconds:.2f}s")
+        results = {}
+        for workers in (4, 8, 16):
+            installer = FakeInstaller(graph, latency=BENCHMARK_LATENCY)
+            start = time.perf_counter()
+            successful, failed = BulkOperation(
+                installer.install, dependencies=installer.dependencies, rollback=installer.uninstall,
+                max_workers=workers
+            ).run(items)
+            results[workers] = time.perf_counter() - start
+            self.assertEqual((len(successful), failed), (BENCHMARK_PLUGINS, []))
+            print(f"  {workers} workers: {results[workers]:.2f}s ({sequential_seconds / results[workers]:.1f}x)")
+
+        self.assertLess(results[8], sequential_seconds / 3)
@@ -0,0 +1,185 @@
+import os
+import random
+from types import SimpleNamespace
+from unittest import mock, skipUnless
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db.models.signals import post_save
+from django.http import QueryDict
+from django.test import TransactionTestCase
+from rest_framework.response import Response
+from ..cache import (
+    cache_namespace, cached_response, get_generations, invalidate_cache_namespace, watch_cached_views,
+)
+from ..models import VREnvironmentConfig
+from ..models.plugins import PluginDeveloper
+
+RUN_BENCHMARKS = os.getenv('RUN_BENCHMARKS', '').lower() == 'true'
+BENCHMARK_USERS = int(os.getenv('BENCHMARK_USERS', 50))
+BENCHMARK_REQUESTS = int(os.getenv('BENCHMARK_REQUESTS', 20000))
+BENCHMARK_WRITE_RATIO = float(os.getenv('BENCHMARK_WRITE_RATIO', 0.05))
+
+
+def make_request(user_id, **params):
+    query_params = QueryDict(mutable=True)
+    query_params.update(params)
+    return SimpleNamespace(user=SimpleNamespace(id=user_id), query_params=query_params)
+
+
+class DeveloperViewSet:
+    """Stands in for a viewset, counting the requests that reach the database."""
+    queryset = PluginDeveloper.objects.all()
+
+    def __init__(self):
+        self.misses = 0
+
+    @cached_response(timeout=60)
+    def list(self, request):
+        self.misses += 1
+        return Response(sorted(PluginDeveloper.objects.values_list('company_name', flat=True)))
+
+    @cached_response(timeout=60, per_user=True)
+    def mine(self, request):
+        self.misses += 1
+        return Response(sorted(
+            PluginDeveloper.objects.filter(user_id=request.user.id).values_list('company_name', flat=True)
+        ))
+
+    @cached_response(timeout=60)
+    def missing(self, request):
+        self.misses += 1
+        return Response({'error': 'Not found'}, status=404)
+
+
+class EnvironmentViewSet:
+    """Never used, so its model is only watched through its class."""
+    queryset = VREnvironmentConfig.objects.all()
+
+    @cached_response(timeout=60)
+    def list(self, request):
+        return Response([])
+
+
+def create_developer(user_id, name):
+    return PluginDeveloper.objects.create(user_id=user_id, company_name=name, api_key=f"key-{name}")
+
+
+class CachedResponseTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.view = DeveloperViewSet()
+
+    def test_writes_invalidate_the_model_namespace(self):
+        create_developer(1, 'Acme')
+        self.assertEqual(self.view.list(make_request(1)).data, ['Acme'])
+        self.assertEqual(self.view.list(make_request(1)).data, ['Acme'])
+        self.assertEqual(self.view.misses, 1)
+
+        developer = create_developer(2, 'Globex')
+        self.assertEqual(self.view.list(make_request(1)).data, ['Acme', 'Globex'])
+        developer.company_name = 'Initech'
+        developer.save()
+        self.assertEqual(self.view.list(make_request(1)).data, ['Acme', 'Initech'])
+        developer.delete()
+        self.assertEqual(self.view.list(make_request(1)).data, ['Acme'])
+        self.assertEqual(self.view.misses, 4)
+
+    def test_per_user_responses_survive_other_users_writes(self):
+        create_developer(1, 'Acme')
+        self.view.mine(make_request(1))
+        self.view.mine(make_request(2))
+
+        create_developer(2, 'Globex')
+
+        self.assertEqual(self.view.mine(make_request(1)).data, ['Acme'])
+        self.assertEqual(self.view.misses, 2)
+        self.assertEqual(self.view.mine(make_request(2)).data, ['Globex'])
+        self.assertEqual(self.view.misses, 3)
+
+    def test_keys_and_namespaces(self):
+        self.view.list(make_request(1, page='1'))
+        self.view.list(make_request(1, page='2'))
+        self.view.list(make_request(2, page='1'))
+        self.view.list(make_request(1, page='1'))
+        self.assertEqual(self.view.misses, 3)
+
+        # Errors are not cached
+        self.view.missing(make_request(1))
+        self.view.missing(make_request(1))
+        self.assertEqual(self.view.misses, 5)
+
+        namespace = cache_namespace(PluginDeveloper)
+        self.assertEqual(namespace, 'future_capabilities.plugindeveloper')
+        self.assertEqual(cache_namespace(PluginDeveloper, 3), 'future_capabilities.plugindeveloper:user:3')
+        before = get_generations([namespace])
+        invalidate_cache_namespace(PluginDeveloper)
+        self.assertNotEqual(get_generations([namespace]), before)
+        self.view.list(make_request(1, page='1'))
+        self.assertEqual(self.view.misses, 6)
+
+    def test_evicted_generations_do_not_return(self):
+        self.view.list(make_request(1))
+        generation = get_generations([cache_namespace(PluginDeveloper)])[0]
+        cache.delete(f"cache_generation:{cache_namespace(PluginDeveloper)}")
+
+        self.view.list(make_request(1))
+
+        self.assertEqual(self.view.misses, 2)
+        self.assertGreater(get_generations([cache_namespace(PluginDeveloper)])[0], generation)
+
+    def test_only_cached_models_are_watched(self):
+        watch_cached_views()
+        with mock.patch('future_capabilities.signals.invalidate_cache_namespace') as invalidate:
+            post_save.send(sender=VREnvironmentConfig, instance=SimpleNamespace(user_id=3), created=True)
+            invalidate.assert_called_once_with(VREnvironmentConfig, 3)
+
+            invalidate.reset_mock()
+            get_user_model().objects.create_user(username='listener', password='secret')
+            invalidate.assert_not_called()
+
+
+@skipUnless(RUN_BENCHMARKS, 'Set RUN_BENCHMARKS=true to run benchmarks')
+class CachedResponseBenchmark(TransactionTestCase):
+    """BENCHMARK_USERS users reading their own and shared lists, with BENCHMARK_WRITE_RATIO writes."""
+
+    def run_workload(self, on_write):
+        rng = random.Random(48)
+        view = DeveloperViewSet()
+        windows = []
+        reads = misses = 0
+        for i in range(BENCHMARK_REQUESTS):
+            user_id = rng.randrange(BENCHMARK_USERS)
+            if rng.random() < BENCHMARK_WRITE_RATIO:
+                developer = create_developer(user_id, f"developer-{i}")
+                on_write(developer)
+            else:
+                before = view.misses
+                if rng.random() < 0.8:
+                    view.mine(make_request(user_id, page=str(rng.randrange(3))))
+                else:
+                    view.list(make_request(user_id))
+                reads += 1
+                misses += view.misses - before
+            if (i + 1) % (BENCHMARK_REQUESTS // 20) == 0:
+                windows.append(1 - misses / reads)
+                reads = misses = 0
+        return windows
+
+    def test_hit_rate_under_mixed_workload(self):
+        results = {}
+        # Before: a write cleared the whole cache on backends without pattern deletes
+        for label, on_write in (('clear on write', lambda developer: cache.clear()), ('generations', lambda developer: None)):
+            cache.clear()
+            PluginDeveloper.objects.all().delete()
+            results[label] = self.run_workload(on_write)
+
+        print(
+            f"\n{BENCHMARK_USERS} users, {BENCHMARK_REQUESTS:,} requests, "
+            f"{BENCHMARK_WRITE_RATIO:.0%} writes, hit rate per window of {BENCHMARK_REQUESTS // 20:,}:"
+        )
+        for label, windows in results.items():
+            print(
+                f"  {label}: mean {sum(windows) / len(windows):.1%}, "
+                f"min {min(windows):.1%}, max {max(windows):.1%}"
+            )
+        self.assertGreater(min(results['generations']), max(results['clear on write']))
@@ -0,0 +1,354 @@
+import copy
+import os
+import random
+import threading
+import time
+from collections import deque
+from unittest import mock, skipUnless
+from django.db import close_old_connections
+from django.test import TransactionTestCase
+from ..collaboration import (
+    CollaborationEngine,
+    EditRejected,
+    apply_op,
+    transform,
+    transform_batches
+)
+from ..models.collaboration import CollaborationActivityLog, CollaborationSession
+
+RUN_BENCHMARKS = os.getenv('RUN_BENCHMARKS', '').lower() == 'true'
+BENCHMARK_EDITORS = int(os.getenv('BENCHMARK_EDITORS', 20))
+BENCHMARK_EDITS = int(os.getenv('BENCHMARK_EDITS', 100))
+
+KEYS = ['clips', 'tempo', 'markers']
+
+
+def random_op(rng, document):
+    """A random operation that applies to the document."""
+    key = rng.choice(KEYS)
+    if key == 'tempo':
+        return {'op': 'set', 'key': key, 'value': rng.choice([None, rng.randint(60, 180)])}
+    length = len(document['lists'].get(key, []))
+    if length and rng.random() < 0.4:
+        return {'op': 'delete', 'key': key, 'index': rng.randrange(length)}
+    return {'op': 'insert', 'key': key, 'index': rng.randint(0, length), 'value': rng.randint(0, 999)}
+
+
+def random_document(rng):
+    document = {'fields': {}, 'lists': {}}
+    for _ in range(rng.randint(0, 8)):
+        apply_op(document, random_op(rng, document))
+    return document
+
+
+class Client:
+    """An editor's replica, keeping one batch in flight as the consumer protocol expects."""
+
+    def __init__(self, site, state):
+        self.site = site
+        self.document = copy.deepcopy(state['document'])
+        self.version = state['version']
+        self.inflight = None
+        self.buffer = []
+        self.inbox = deque()
+
+    def edit(self, rng):
+        op = random_op(rng, self.document)
+        apply_op(self.document, op)
+        self.buffer.append(op)
+
+    def send(self):
+        ops = [op for op in self.buffer if op is not None]
+        self.buffer = []
+        if self.inflight is not None or not ops:
+            self.buffer = ops
+            return None
+        self.inflight = ops
+        return self.site, self.version, ops
+
+    def receive(self):
+        version, site, ops = self.inbox.popleft()
+        self.version = version
+        if site == self.site:
+            self.inflight = None
+            return
+        if self.inflight is not None:
+            self.inflight, ops = transform_batches(self.inflight, ops, self.site, site)
+        self.buffer, ops = transform_batches(self.buffer, ops, self.site, site)
+        for op in ops:
+            apply_op(self.document, op)
+
+
+def simulate(engine, session_id, rng, editors, steps):
+    """Random interleaving of edits, submissions and deliveries; returns the clients."""
+    clients = [Client(f"site-{i}", engine.load(session_id).state()) for i in range(editors)]
+    submissions = deque()
+
+    def process():
+        site, version, ops = submissions.popleft()
+        version, applied = engine.submit(session_id, site, version, ops)
+        for client in clients:
+            client.inbox.append((version, site, applied))
+
+    for _ in range(steps):
+        client = rng.choice(clients)
+        action = rng.random()
+        if action < 0.4:
+            client.edit(rng)
+        elif action < 0.6:
+            batch = client.send()
+            if batch is not None:
+                submissions.append(batch)
+        elif action < 0.8 and submissions:
+            process()
+        elif client.inbox:
+            client.receive()
+
+    # Let everything settle
+    while True:
+        for client in clients:
+            batch = client.send()
+            if batch is not None:
+                submissions.append(batch)
+        if not submissions and not any(client.inbox for client in clients):
+            break
+        while submissions:
+            process()
+        for client in clients:
+            while client.inbox:
+                client.receive()
+    return clients
+
+
+def create_session():
+    return CollaborationSession.objects.create(session_name='Jam', participant_user_ids=[1, 2])
+
+
+class TransformTests(TransactionTestCase):
+    def test_concurrent_operations_converge(self):
+        rng = random.Random(45)
+        for _ in range(3000):
+            document = random_document(rng)
+            a, b = random_op(rng, document), random_op(rng, document)
+            a_site, b_site = rng.sample(['alice', 'bob', 'carol'], 2)
+
+            a_after_b, b_after_a = transform(a, b, a_site, b_site)
+            left, right = copy.deepcopy(document), copy.deepcopy(document)
+            apply_op(left, b)
+            apply_op(left, a_after_b)
+            apply_op(right, a)
+            apply_op(right, b_after_a)
+
+            self.assertEqual(left, right, (document, a, b, a_site, b_site))
+
+    def test_concurrent_inserts_keep_both_items(self):
+        document = {'fields': {}, 'lists': {'clips': ['kick']}}
+        a = {'op': 'insert', 'key': 'clips', 'index': 1, 'value': 'snare'}
+        b = {'op': 'insert', 'key': 'clips', 'index': 1, 'value': 'hat'}
+
+        a_after_b, _ = transform(a, b, 'alice', 'bob')
+        apply_op(document, b)
+        apply_op(document, a_after_b)
+
+        self.assertEqual(document['lists']['clips'], ['kick', 'snare', 'hat'])
+
+
+class CollaborationEngineTests(TransactionTestCase):
+    def setUp(self):
+        self.session = create_session()
+        self.session_id = str(self.session.pk)
+        self.engine = CollaborationEngine(flush_interval=0, snapshot_every=3)
+
+    def test_random_concurrent_editors_converge(self):
+        for seed in range(30):
+            rng = random.Random(seed)
+            engine = CollaborationEngine(flush_interval=0, history=10000)
+            session_id = str(create_session().pk)
+
+            clients = simulate(engine, session_id, rng, editors=rng.randint(2, 6), steps=300)
+
+            server = engine.load(session_id).state()
+            for client in clients:
+                self.assertEqual(client.document, server['document'], f"seed {seed}, {client.site}")
+                self.assertEqual(client.version, server['version'])
+
+    def test_versions_are_assigned_in_order(self):
+        self.engine.load(self.session_id)
+        ops = [{'op': 'insert', 'key': 'clips', 'index': 0, 'value': 'kick'}]
+
+        versions = [self.engine.submit(self.session_id, f"site-{i}", 0, ops)[0] for i in range(5)]
+
+        self.assertEqual(versions, [1, 2, 3, 4, 5])
+        self.assertEqual(len(self.engine.load(self.session_id).document['lists']['clips']), 5)
+
+    def test_invalid_and_stale_batches_are_rejected(self):
+        engine = CollaborationEngine(flush_interval=0, history=2)
+        engine.load(self.session_id)
+        for i in range(3):
+            engine.submit(self.session_id, 'alice', i, [{'op': 'set', 'key': 'tempo', 'value': 120 + i}])
+
+        for version, ops in [
+            (3, [{'op': 'insert', 'key': 'clips', 'index': 0, 'value': 'kick'},
+                 {'op': 'delete', 'key': 'clips', 'index': 1}]),
+            (3, [{'op': 'move', 'key': 'clips'}]),
+            (3, []),
+            (4, [{'op': 'set', 'key': 'tempo', 'value': 90}]),
+            (0, [{'op': 'set', 'key': 'tempo', 'value': 90}]),
+        ]:
+            with self.assertRaises(EditRejected):
+                engine.submit(self.session_id, 'bob', version, ops)
+
+        state = engine.load(self.session_id).state()
+        self.assertEqual(state, {'version': 3, 'document': {'fields': {'tempo': 122}, 'lists': {}}})
+        with self.assertRaises(EditRejected):
+            engine.submit('other', 'bob', 0, [{'op': 'set', 'key': 'tempo', 'value': 90}])
+
+    def test_a_second_unacknowledged_batch_is_rejected(self):
+        self.engine.load(self.session_id)
+        self.engine.submit(self.session_id, 'alice', 0, [{'op': 'insert', 'key': 'clips', 'index': 0, 'value': 'kick'}])
+        self.engine.submit(self.session_id, 'bob', 0, [{'op': 'set', 'key': 'tempo', 'value': 90}])
+
+        # Made on top of alice's first batch, but sent before its acknowledgement
+        with self.assertRaises(EditRejected):
+            self.engine.submit(self.session_id, 'alice', 0, [{'op': 'delete', 'key': 'clips', 'index': 0}])
+
+        self.assertEqual(self.engine.submit(
+            self.session_id, 'alice', 1, [{'op': 'delete', 'key': 'clips', 'index': 0}]
+        ), (3, [{'op': 'delete', 'key': 'clips', 'index': 0}]))
+        self.assertEqual(self.engine.load(self.session_id).state(), {
+            'version': 3, 'document': {'fields': {'tempo': 90}, 'lists': {}}
+        })
+
+    def test_batches_are_logged_and_snapshotted(self):
+        self.engine.load(self.session_id)
+        for i in range(4):
+            self.engine.submit(
+                self.session_id, 'alice', i, [{'op': 'insert', 'key': 'clips', 'index': i, 'value': i}], user_id=1
+            )
+
+        self.assertEqual(self.engine.flush(), 4)
+
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.version, 4)
+        self.assertEqual(self.session.document, {'fields': {}, 'lists': {'clips': [0, 1, 2, 3]}, 'version': 4})
+        log = CollaborationActivityLog.objects.get(session=self.session, version=2)
+        self.assertEqual(log.action_detail, {'site': 'alice', 'ops': [{'op': 'insert', 'key': 'clips', 'index': 1, 'value': 1}]})
+        self.assertEqual(log.user_id, 1)
+
+    def test_sessions_reload_from_snapshot_and_log(self):
+        self.engine.load(self.session_id)
+        for i in range(5):
+            self.engine.submit(self.session_id, 'alice', i, [{'op': 'insert', 'key': 'clips', 'index': 0, 'value': i}])
+        self.engine.flush()
+        self.assertEqual(CollaborationSession.objects.get(pk=self.session.pk).document['version'], 5)
+
+        self.engine.submit(self.session_id, 'alice', 5, [{'op': 'set', 'key': 'tempo', 'value': 128}])
+        self.engine.flush()
+
+        reloaded = CollaborationEngine(flush_interval=0).load(self.session_id)
+        self.assertEqual(reloaded.state(), self.engine.load(self.session_id).state())
+        # A client one version behind is merged against the replayed batch
+        engine = CollaborationEngine(flush_interval=0)
+        engine.load(self.session_id)
+        self.assertEqual(
+            engine.submit(self.session_id, 'aaron', 5, [{'op': 'set', 'key': 'tempo', 'value': 90}]), (7, [])
+        )
+        self.assertEqual(engine.load(self.session_id).document['fields'], {'tempo': 128})
+
+    async def test_join_reloads_a_document_unloaded_meanwhile(self):
+        load = self.engine.load
+        unloaded = []
+
+        def load_then_unload(session_id):
+            state = load(session_id)
+            if not unloaded:
+                # The last client left while this join was loading
+                unloaded.append(self.engine.documents.pop(session_id))
+            return state
+
+        with mock.patch.object(self.engine, 'load', side_effect=load_then_unload):
+            await self.engine.join(self.session_id, 'alice')
+
+        self.assertIsNot(self.engine.documents[self.session_id], unloaded[0])
+        self.assertEqual(self.engine.documents[self.session_id].clients, {'alice'})
+
+    async def test_last_client_out_saves_and_unloads(self):
+        state = await self.engine.join(self.session_id, 'alice')
+        await self.engine.join(self.session_id, 'bob')
+        self.engine.submit(self.session_id, 'alice', state['version'], [{'op': 'set', 'key': 'tempo', 'value': 128}])
+
+        await self.engine.leave(self.session_id, 'alice')
+        self.assertIn(self.session_id, self.engine.documents)
+        await self.engine.leave(self.session_id, 'bob')
+
+        self.assertNotIn(self.session_id, self.engine.documents)
+        session = await CollaborationSession.objects.aget(pk=self.session.pk)
+        self.assertEqual(session.document, {'fields': {'tempo': 128}, 'lists': {}, 'version': 1})
+
+
+@skipUnless(RUN_BENCHMARKS, 'Set RUN_BENCHMARKS=true to run benchmarks')
+class CollaborationBenchmark(TransactionTestCase):
+    """BENCHMARK_EDITORS editors making BENCHMARK_EDITS single-operation edits each."""
+
+    def legacy(self, session):
+        """A get, log insert and version save per edit from concurrent editors, as save_edit did before."""
+
+        def editor(user_id):
+            try:
+                for i in range(BENCHMARK_EDITS):
+                    current = CollaborationSession.objects.get(id=session.pk)
+                    CollaborationActivityLog.objects.create(
+                        session=current, user_id=user_id, action_type='edit',
+                        action_detail={'op': 'insert', 'key': 'clips', 'index': 0, 'value': i}
+                    )
+                    current.version += 1
+                    current.save()
+            finally:
+                close_old_connections()
+
+        threads = [threading.Thread(target=editor, args=(user_id,)) for user_id in range(BENCHMARK_EDITORS)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - start
+
+    def test_operations_per_second(self):
+        edits = BENCHMARK_EDITORS * BENCHMARK_EDITS
+        legacy_session = create_session()
+        legacy_seconds = self.legacy(legacy_session)
+        legacy_session.refresh_from_db()
+
+        class TimedEngine(CollaborationEngine):
+            seconds = 0.0
+
+            def submit(self, *args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return super().submit(*args, **kwargs)
+                finally:
+                    self.seconds += time.perf_counter() - start
+
+        session_id = str(create_session().pk)
+        engine = TimedEngine(flush_interval=0)
+        # Editors keep typing between deliveries, so most batches are merged against others
+        clients = simulate(engine, session_id, random.Random(45), BENCHMARK_EDITORS, steps=edits * 5 // 2)
+        start = time.perf_counter()
+        engine.flush(snapshot=True)
+        engine_seconds = engine.seconds + time.perf_counter() - start
+
+        state = engine.load(session_id).state()
+        self.assertTrue(all(client.document == state['document'] for client in clients))
+        self.assertEqual(CollaborationActivityLog.objects.filter(session_id=session_id).count(), state['version'])
+        print(f"\n{BENCHMARK_EDITORS} editors:")
+        print(
+            f"  legacy save_edit: {edits / legacy_seconds:,.0f} ops/s, "
+            f"{edits - legacy_session.version:,} of {edits:,} version bumps lost"
+        )
+        print(
+            f"  engine: {engine.stats['ops'] / engine_seconds:,.0f} ops/s merged and logged, "
+            f"{engine.stats['ops']:,} ops in {engine.stats['batches']:,} batches, "
+            f"{engine.stats['rows']:,} log rows, replicas converged"
+        )
+        self.assertGreater(engine.stats['ops'] / engine_seconds, edits / legacy_seconds)
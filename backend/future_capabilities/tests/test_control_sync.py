@@ -0,0 +1,345 @@
+import json
+import math
+import os
+import time
+from unittest import mock, skipUnless
+from asgiref.sync import async_to_sync
+from channels.layers import InMemoryChannelLayer
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.db import OperationalError, connection
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from .. import consumers
+from ..control_sync import STORES, ControlSyncEngine, LocalScopeState, encode, group_name
+from ..models.plugins import Plugin, PluginDeveloper, PluginInstallation
+
+RUN_BENCHMARKS = os.getenv('RUN_BENCHMARKS', '').lower() == 'true'
+BENCHMARK_CONTROLS = int(os.getenv('BENCHMARK_CONTROLS', 10))
+BENCHMARK_RATE = int(os.getenv('BENCHMARK_RATE', 100))
+BENCHMARK_SECONDS = int(os.getenv('BENCHMARK_SECONDS', 2))
+
+
+def create_installation(user_id, name='Filter', state=None):
+    developer, _ = PluginDeveloper.objects.get_or_create(user_id=1, company_name='Acme', api_key='key')
+    plugin = Plugin.objects.create(
+        developer=developer, name=name, type='effect', version='1.0', description=name,
+        entry_point=f"acme.{name}", required_permissions=[], compatibility={}
+    )
+    return PluginInstallation.objects.create(
+        user_id=user_id, plugin=plugin, settings={'theme': 'dark', 'state': state or {}}
+    )
+
+
+class Client:
+    """A client of a scope, applying deltas and resynchronizing on gaps."""
+
+    def __init__(self, engine, layer, key):
+        self.engine = engine
+        self.layer = layer
+        self.key = key
+        self.channel = async_to_sync(layer.new_channel)()
+        async_to_sync(layer.group_add)(group_name(key), self.channel)
+        self.resyncs = 0
+        self.apply(json.loads(engine.join(key)))
+
+    def apply(self, message):
+        if message['type'] == 'state_snapshot':
+            self.seq, self.state = message['seq'], dict(message['state'])
+        elif message['seq'] == self.seq + 1:
+            self.seq = message['seq']
+            self.state.update(message['changes'])
+        elif message['seq'] > self.seq:
+            self.resyncs += 1
+            self.apply(json.loads(self.engine.snapshot(self.key)))
+
+    def receive(self, drop=False):
+        """Every waiting message; with ``drop``, the first is lost."""
+        messages = []
+        while self.channel in self.layer.channels:
+            messages.append(json.loads(async_to_sync(self.layer.receive)(self.channel)['text']))
+        for message in messages[1 if drop else 0:]:
+            self.apply(message)
+        return messages
+
+
+class ControlSyncEngineTests(TransactionTestCase):
+    def setUp(self):
+        self.installation = create_installation(7, state={'mix': 0.5})
+        self.key = ('plugin', 7, self.installation.plugin_id)
+        self.layer = InMemoryChannelLayer()
+        self.engine = ControlSyncEngine(tick_interval=0, persist_interval=0, precision=3, channel_layer=self.layer)
+
+    def test_updates_are_coalesced_into_sequenced_deltas(self):
+        client = Client(self.engine, self.layer, self.key)
+        self.assertEqual((client.seq, client.state), (0, {'mix': 0.5}))
+
+        for value in (0.1, 0.2, 0.3):
+            self.engine.update(self.key, {'cutoff': value, 'bypass': False})
+        self.engine.update(self.key, {'mix': 0.5})
+
+        self.assertEqual(self.engine.tick(), 1)
+        self.assertEqual(client.receive(), [
+            {'type': 'state_delta', 'seq': 1, 'changes': {'bypass': False, 'cutoff': 0.3}}
+        ])
+
+        # Jitter below the precision, and values moved and back, are not sent
+        self.engine.update(self.key, {'cutoff': 0.3001})
+        self.engine.update(self.key, {'mix': 0.7})
+        self.engine.update(self.key, {'mix': 0.5})
+        self.assertEqual(self.engine.tick(), 0)
+
+        self.engine.update(self.key, {'mode': 'notch'})
+        self.engine.tick()
+        client.receive()
+        self.assertEqual(
+            (client.seq, client.state),
+            (2, {'mix': 0.5, 'cutoff': 0.3, 'bypass': False, 'mode': 'notch'})
+        )
+        self.assertEqual(self.engine.stats['updates'], 11)
+
+    def test_clients_resynchronize_after_a_missed_delta(self):
+        client = Client(self.engine, self.layer, self.key)
+        for step in range(3):
+            self.engine.update(self.key, {f"control-{step}": step, 'sweep': step / 10})
+            self.engine.tick()
+
+        # Updates not yet ticked are not in the snapshot; they come with the next delta
+        self.engine.update(self.key, {'sweep': 0.9})
+        client.receive(drop=True)
+        self.engine.tick()
+        client.receive()
+
+        self.assertEqual(client.resyncs, 1)
+        self.assertEqual(client.seq, 4)
+        self.assertEqual(client.state, {'mix': 0.5, 'control-0': 0, 'control-1': 1, 'control-2': 2, 'sweep': 0.9})
+        late = Client(self.engine, self.layer, self.key)
+        self.assertEqual((late.seq, late.state), (client.seq, client.state))
+
+    def test_changed_values_are_written_in_one_batch_per_scope(self):
+        other = create_installation(8, name='Delay')
+        other_key = ('plugin', 8, other.plugin_id)
+        for step in range(50):
+            self.engine.update(self.key, {'cutoff': step / 100})
+            self.engine.update(other_key, {'time': step})
+        # Not installed by this user: nothing to write to
+        self.engine.update(('plugin', 9, other.plugin_id), {'time': 1})
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.engine.flush(), 2)
+
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('UPDATE')]), 2)
+        self.installation.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual(self.installation.settings, {'theme': 'dark', 'state': {'mix': 0.5, 'cutoff': 0.49}})
+        self.assertEqual(other.settings['state'], {'time': 49})
+        self.assertEqual(self.engine.flush(), 0)
+
+        # Stored values are the baseline of a new engine's snapshots
+        engine = ControlSyncEngine(tick_interval=0, channel_layer=self.layer)
+        self.assertEqual(
+            json.loads(engine.snapshot(self.key)),
+            {'type': 'state_snapshot', 'seq': 0, 'state': {'mix': 0.5, 'cutoff': 0.49}}
+        )
+
+    def test_failed_writes_do_not_hold_back_other_scopes(self):
+        other = create_installation(8, name='Delay')
+        other_key = ('plugin', 8, other.plugin_id)
+        self.engine.update(self.key, {'cutoff': 0.1})
+        self.engine.update(other_key, {'time': 1})
+        save = STORES['plugin'].save
+
+        def failing_save(changes, error):
+            if self.key in changes:
+                raise error
+            return save(changes)
+
+        with mock.patch.object(STORES['plugin'], 'save', side_effect=lambda changes: failing_save(changes, OperationalError('down'))):
+            self.assertEqual(self.engine.flush(), 1)
+        other.refresh_from_db()
+        self.assertEqual(other.settings['state'], {'time': 1})
+
+        # Unavailable: kept for the next flush; unwritable: dropped
+        with mock.patch.object(STORES['plugin'], 'save', side_effect=lambda changes: failing_save(changes, ValueError('bad'))):
+            self.assertEqual(self.engine.flush(), 0)
+        self.assertEqual(self.engine.flush(), 0)
+        self.installation.refresh_from_db()
+        self.assertEqual(self.installation.settings['state'], {'mix': 0.5})
+
+    def test_idle_scopes_are_released(self):
+        self.engine.idle_timeout = 0
+        client = Client(self.engine, self.layer, self.key)
+        self.engine.update(self.key, {'cutoff': 0.25})
+        self.engine.tick()
+        self.engine.flush()
+        self.engine.flush()
+        self.assertIn(self.key, self.engine._scopes)
+
+        self.engine.leave(self.key)
+        self.engine.flush()
+
+        self.assertNotIn(self.key, self.engine._scopes)
+        self.assertEqual(json.loads(self.engine.snapshot(self.key))['state'], {'mix': 0.5, 'cutoff': 0.25})
+        client.receive()
+
+    def test_processes_share_the_sequence_and_values_of_a_scope(self):
+        """Engines sharing a scope state act like the workers of one deployment"""
+        state = LocalScopeState()
+        websocket = ControlSyncEngine(tick_interval=0, persist_interval=0, channel_layer=self.layer, state=state)
+        http = ControlSyncEngine(tick_interval=0, persist_interval=0, channel_layer=self.layer, state=state)
+        client = Client(websocket, self.layer, self.key)
+
+        websocket.update(self.key, {'cutoff': 0.5})
+        websocket.tick()
+        http.update(self.key, {'cutoff': 0.7, 'mix': 0.5})
+        http.tick()
+        # Back to the value this process sent last, but not the current one
+        websocket.update(self.key, {'cutoff': 0.5})
+        websocket.tick()
+
+        self.assertEqual(len(client.receive()), 3)
+        self.assertEqual(client.resyncs, 0)
+        self.assertEqual((client.seq, client.state), (3, {'mix': 0.5, 'cutoff': 0.5}))
+        for engine in (websocket, http):
+            self.assertEqual(
+                json.loads(engine.snapshot(self.key)),
+                {'type': 'state_snapshot', 'seq': 3, 'state': {'mix': 0.5, 'cutoff': 0.5}}
+            )
+
+        # The latest value is written, whichever process flushes last
+        websocket.flush()
+        http.flush()
+        self.installation.refresh_from_db()
+        self.assertEqual(self.installation.settings['state'], {'mix': 0.5, 'cutoff': 0.5})
+
+    def test_validation(self):
+        with self.assertRaisesRegex(ValueError, 'Unknown control scope'):
+            self.engine.update(('mixer', 7), {'gain': 1})
+        with self.assertRaisesRegex(ValueError, 'object of control values'):
+            self.engine.update(self.key, [0.5])
+        with self.assertRaisesRegex(ValueError, 'finite'):
+            self.engine.update(self.key, {'cutoff': math.nan})
+        with self.assertRaisesRegex(ValueError, 'short string'):
+            self.engine.update(self.key, {'cutoff': {'nested': 1}})
+        with self.assertRaisesRegex(ValueError, 'Control names'):
+            self.engine.update(self.key, {'x' * 101: 1})
+        with self.assertRaisesRegex(ValueError, 'between -1000 and 1000'):
+            self.engine.update(('daw', 7, 'studio'), {'fader': 1200})
+        # DAWControlState columns hold 50 characters
+        with self.assertRaisesRegex(ValueError, 'Control names must have 1 to 50'):
+            self.engine.update(('daw', 7, 'studio'), {'x' * 51: 1})
+        with self.assertRaisesRegex(ValueError, 'Environments'):
+            self.engine.update(('daw', 7, 'x' * 51), {'fader': 1})
+        with self.assertRaisesRegex(ValueError, 'Environments'):
+            self.engine.snapshot(('daw', 7, ''))
+        self.engine.max_controls = 3
+        with self.assertRaisesRegex(ValueError, 'at most 3 controls'):
+            self.engine.update(self.key, {'a': 1, 'b': 2, 'c': 3, 'd': 4})
+        self.assertEqual(self.engine.tick(), 0)
+
+        self.assertEqual(STORES['daw'].validate('fader', 3), 3.0)
+        self.assertEqual(group_name(('daw', 7, 'studio')), 'control_sync.daw.7.studio')
+        self.assertNotEqual(group_name(('daw', 7, 'main stage')), group_name(('daw', 7, 'main_stage')))
+        self.assertLess(len(group_name(('daw', 7, 'x' * 200))), 100)
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class ControlStateConsumerTests(TransactionTestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='producer', password='testpass123')
+        self.installation = create_installation(self.user.pk, state={'mix': 0.5})
+        engine = ControlSyncEngine(tick_interval=0, persist_interval=0)
+        patcher = mock.patch.object(consumers, 'get_control_sync_engine', return_value=engine)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def connect(self, consumer, **kwargs):
+        async def run():
+            communicator = WebsocketCommunicator(consumer.as_asgi(), '/ws/control/')
+            communicator.scope['user'] = self.user
+            communicator.scope['url_route'] = {'kwargs': kwargs}
+            connected, _ = await communicator.connect()
+            message = await communicator.receive_json_from() if connected else None
+            await communicator.disconnect()
+            return connected, message
+
+        return async_to_sync(run)()
+
+    def test_plugins_must_be_installed(self):
+        connected, snapshot = self.connect(consumers.PluginStateConsumer, plugin_id=self.installation.plugin_id)
+        self.assertTrue(connected)
+        self.assertEqual(snapshot, {'type': 'state_snapshot', 'seq': 0, 'state': {'mix': 0.5}})
+
+        other = create_installation(self.user.pk + 1, name='Delay')
+        self.assertEqual(self.connect(consumers.PluginStateConsumer, plugin_id=other.plugin_id), (False, None))
+
+    def test_environments_must_fit_the_model(self):
+        self.assertEqual(self.connect(consumers.DAWControlConsumer, environment='x' * 51), (False, None))
+
+
+@skipUnless(RUN_BENCHMARKS, 'Set RUN_BENCHMARKS=true to run benchmarks')
+class ControlSyncBenchmark(TransactionTestCase):
+    """BENCHMARK_CONTROLS plugin controls swept by automation at BENCHMARK_RATE Hz for BENCHMARK_SECONDS."""
+
+    def test_automation_sweep(self):
+        installation = create_installation(7)
+        key = ('plugin', 7, installation.plugin_id)
+        layer = InMemoryChannelLayer()
+        group = group_name(key)
+        steps = BENCHMARK_RATE * BENCHMARK_SECONDS
+        sweep = [
+            {f"control-{control}": 0.5 + 0.5 * math.sin(2 * math.pi * 0.5 * step / BENCHMARK_RATE + control)}
+            for step in range(steps) for control in range(BENCHMARK_CONTROLS)
+        ]
+
+        # Before: a save and a full-state broadcast per update
+        state = {}
+        messages = bytes_sent = 0
+        start = time.perf_counter()
+        for changes in sweep:
+            state.update(changes)
+            installation.settings = {**installation.settings, 'state': state}
+            installation.save(update_fields=['settings'])
+            payload = encode(state)
+            async_to_sync(layer.group_send)(group, {'type': 'control_state', 'text': payload})
+            messages += 1
+            bytes_sent += len(payload)
+        legacy = time.perf_counter() - start
+        legacy_writes = len(sweep)
+
+        # Ticks and writes on the sweep's clock instead of wall time
+        engine = ControlSyncEngine(tick_interval=0, persist_interval=0, channel_layer=layer)
+        tick_every = max(1, round(BENCHMARK_RATE * 0.05))
+        persist_every = BENCHMARK_RATE
+        start = time.perf_counter()
+        with CaptureQueriesContext(connection) as queries:
+            for step in range(steps):
+                for control in range(BENCHMARK_CONTROLS):
+                    engine.update(key, sweep[step * BENCHMARK_CONTROLS + control])
+                if (step + 1) % tick_every == 0:
+                    engine.tick()
+                if (step + 1) % persist_every == 0:
+                    engine.flush()
+            engine.tick()
+            engine.flush()
+        synced = time.perf_counter() - start
+
+        print(
+            f"\n{BENCHMARK_CONTROLS} controls swept at {BENCHMARK_RATE} Hz for {BENCHMARK_SECONDS}s "
+            f"({len(sweep):,} updates):"
+        )
+        print(
+            f"  write + full broadcast per update: {messages / BENCHMARK_SECONDS:,.0f} msgs/s, "
+            f"{bytes_sent / BENCHMARK_SECONDS / 1000:,.1f} kB/s, {legacy_writes / BENCHMARK_SECONDS:,.0f} writes/s, "
+            f"{legacy * 1e6 / len(sweep):.1f}us per update"
+        )
+        print(
+            f"  coalesced deltas: {engine.stats['deltas'] / BENCHMARK_SECONDS:,.0f} msgs/s, "
+            f"{engine.stats['bytes'] / BENCHMARK_SECONDS / 1000:,.1f} kB/s, "
+            f"{engine.stats['writes'] / BENCHMARK_SECONDS:,.0f} writes/s "
+            f"({len(queries)} queries), {synced * 1e6 / len(sweep):.1f}us per update"
+        )
+        installation.refresh_from_db()
+        self.assertEqual(installation.settings['state'], json.loads(engine.snapshot(key))['state'])
+        self.assertLessEqual(engine.stats['deltas'], BENCHMARK_SECONDS * 20 + 1)
+        self.assertLess(engine.stats['writes'], legacy_writes / 100)
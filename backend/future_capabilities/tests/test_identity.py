@@ -0,0 +1,208 @@
+import asyncio
+import os
+import statistics
+import time
+from datetime import timedelta
+from unittest import skipUnless
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group, update_last_login
+from django.contrib.auth.signals import user_logged_out
+from django.core.cache import cache
+from django.db import connection
+from django.test import TransactionTestCase, override_settings
+from rest_framework_simplejwt.tokens import AccessToken
+from ..identity import IdentityResolver, revoke_identities
+from ..middleware import TokenAuthMiddleware
+
+User = get_user_model()
+
+RUN_BENCHMARKS = os.getenv('RUN_BENCHMARKS', '').lower() == 'true'
+BENCHMARK_CONNECTS = int(os.getenv('BENCHMARK_CONNECTS', 10000))
+BENCHMARK_DEVICES = int(os.getenv('BENCHMARK_DEVICES', 2))
+
+
+class IdentityResolverTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='raver', password='testpass123')
+        self.resolver = IdentityResolver()
+
+    async def test_tokens_are_verified_and_loaded_once(self):
+        token = str(AccessToken.for_user(self.user))
+
+        users = [await self.resolver.resolve(token) for _ in range(3)]
+
+        self.assertEqual([user.pk for user in users], [self.user.pk] * 3)
+        self.assertEqual((self.resolver.loads, self.resolver.hits), (1, 2))
+        # Other processes share the cached snapshot
+        other = IdentityResolver()
+        self.assertEqual((await other.resolve(token)).username, 'raver')
+        self.assertEqual(other.loads, 0)
+
+    async def test_concurrent_connects_share_one_load(self):
+        other = await User.objects.acreate(username='dj', password='!')
+        tokens = [str(AccessToken.for_user(user)) for user in [self.user, other] * 10]
+
+        users = await asyncio.gather(*(self.resolver.resolve(token) for token in tokens))
+
+        self.assertEqual([user.pk for user in users], [self.user.pk, other.pk] * 10)
+        self.assertEqual(self.resolver.loads, 1)
+        self.assertEqual(len({id(user) for user in users}), len(users))
+
+        users = await asyncio.gather(*(self.resolver.resolve(token) for token in tokens))
+        self.assertEqual((self.resolver.loads, self.resolver.hits), (1, 20))
+
+    async def test_snapshots_cache_only_identity_fields(self):
+        token = str(AccessToken.for_user(self.user))
+        user = await self.resolver.resolve(token)
+
+        jti = AccessToken(token)['jti']
+        self.assertEqual(await cache.aget(f"ws_identity:token:{jti}"), {
+            'pk': self.user.pk, 'username': 'raver', 'is_active': True,
+            'is_staff': False, 'is_superuser': False, 'token_version': 0
+        })
+        self.assertEqual((user.pk, user.username, user.is_authenticated), (self.user.pk, 'raver', True))
+        self.assertEqual(user.password, '')
+
+    async def test_revocation_reloads_the_user(self):
+        token = str(AccessToken.for_user(self.user))
+        await self.resolver.resolve(token)
+
+        # Updates that skip signals are only seen once revoked
+        await User.objects.filter(pk=self.user.pk).aupdate(is_staff=True)
+        self.assertFalse((await self.resolver.resolve(token)).is_staff)
+        await database_sync_to_async(revoke_identities)(self.user)
+
+        self.assertTrue((await self.resolver.resolve(token)).is_staff)
+        self.assertEqual(self.user.token_version, 1)
+
+    async def test_user_changes_revoke_identities(self):
+        token = str(AccessToken.for_user(self.user))
+        await self.resolver.resolve(token)
+
+        # Saves of other fields keep the snapshots
+        await database_sync_to_async(update_last_login)(None, self.user)
+        self.user.language = 'de'
+        await self.user.asave()
+        await self.resolver.resolve(token)
+        self.assertEqual(self.resolver.loads, 1)
+
+        self.user.set_password('newpass456')
+        await self.user.asave()
+        await self.resolver.resolve(token)
+        self.assertEqual(self.resolver.loads, 2)
+
+        group = await Group.objects.acreate(name='djs')
+        await database_sync_to_async(self.user.groups.add)(group)
+        await self.resolver.resolve(token)
+        await database_sync_to_async(group.custom_user_set.clear)()
+        await self.resolver.resolve(token)
+        self.assertEqual(self.resolver.loads, 4)
+
+        self.user.is_active = False
+        await self.user.asave()
+        self.assertFalse((await self.resolver.resolve(token)).is_authenticated)
+
+    async def test_deleted_users_are_anonymous(self):
+        token = str(AccessToken.for_user(self.user))
+        await self.resolver.resolve(token)
+
+        await self.user.adelete()
+
+        self.assertFalse((await self.resolver.resolve(token)).is_authenticated)
+        self.assertFalse((await IdentityResolver().resolve(token)).is_authenticated)
+
+    async def test_logout_revokes_identities(self):
+        token = str(AccessToken.for_user(self.user))
+        await self.resolver.resolve(token)
+
+        await database_sync_to_async(user_logged_out.send)(sender=User, request=None, user=self.user)
+
+        await self.resolver.resolve(token)
+        self.assertEqual(self.resolver.loads, 2)
+
+    async def test_invalid_tokens_are_anonymous(self):
+        expired = AccessToken.for_user(self.user)
+        expired.set_exp(lifetime=-timedelta(seconds=1))
+
+        for token in ['not-a-token', str(expired), str(AccessToken.for_user(self.user))[:-2]]:
+            self.assertFalse((await self.resolver.resolve(token)).is_authenticated)
+        self.assertEqual(self.resolver.loads, 0)
+
+    async def test_middleware_sets_the_scope_user(self):
+        scopes = []
+
+        async def app(scope, receive, send):
+            scopes.append(scope)
+
+        middleware = TokenAuthMiddleware(app)
+        token = str(AccessToken.for_user(self.user))
+        await middleware({'type': 'websocket', 'query_string': f'token={token}'.encode()}, None, None)
+        await middleware({'type': 'websocket', 'query_string': b''}, None, None)
+
+        self.assertEqual(scopes[0]['user'].pk, self.user.pk)
+        self.assertFalse(scopes[1]['user'].is_authenticated)
+
+
+@skipUnless(RUN_BENCHMARKS, 'Set RUN_BENCHMARKS=true to run benchmarks')
+@override_settings(CACHES={'default': {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'OPTIONS': {'MAX_ENTRIES': BENCHMARK_CONNECTS * 2}
+}})
+class ReconnectStormBenchmark(TransactionTestCase):
+    """BENCHMARK_CONNECTS concurrent reconnects, BENCHMARK_DEVICES per user."""
+
+    def setUp(self):
+        cache.clear()
+        users = User.objects.bulk_create([
+            User(username=f"raver{i}", password='!') for i in range(BENCHMARK_CONNECTS // BENCHMARK_DEVICES)
+        ])
+        self.tokens = [str(AccessToken.for_user(user)) for user in users for _ in range(BENCHMARK_DEVICES)]
+
+    def storm(self, resolve):
+        latencies = []
+
+        async def connect(token):
+            start = time.perf_counter()
+            user = await resolve(token)
+            latencies.append(time.perf_counter() - start)
+            return user
+
+        async def reconnect_all():
+            return await asyncio.gather(*(connect(token) for token in self.tokens))
+
+        queries = []
+
+        def count(execute, sql, params, many, context):
+            queries.append(sql)
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(count):
+            start = time.perf_counter()
+            users = async_to_sync(reconnect_all)()
+            seconds = time.perf_counter() - start
+        self.assertTrue(all(user.is_authenticated for user in users))
+        latencies.sort()
+        return len(queries), seconds, statistics.median(latencies), latencies[int(len(latencies) * 0.99)]
+
+    def test_reconnect_storm(self):
+        @database_sync_to_async
+        def legacy(token):
+            """Decode and query per connect, as TokenAuthMiddleware did before."""
+            return User.objects.get(id=AccessToken(token)['user_id'])
+
+        results = {'legacy': self.storm(legacy)}
+        results['cold cache'] = self.storm(IdentityResolver().resolve)
+        # A fresh process after a deploy, with the shared cache still warm
+        results['warm shared cache'] = self.storm(IdentityResolver().resolve)
+
+        print(f"\n{len(self.tokens):,} concurrent reconnects from {len(self.tokens) // BENCHMARK_DEVICES:,} users:")
+        for label, (queries, seconds, median, p99) in results.items():
+            print(
+                f"  {label}: {queries:,} queries, {seconds:.2f}s total, "
+                f"connect latency median {median * 1000:.0f}ms, p99 {p99 * 1000:.0f}ms"
+            )
+        self.assertEqual(results['warm shared cache'][0], 0)
+        self.assertLessEqual(results['cold cache'][0], len(self.tokens) // BENCHMARK_DEVICES)
+        self.assertLess(results['warm shared cache'][1], results['legacy'][1])
@@ -3,8 +3,10 @@ from django.contrib.auth import get_user_model
 from rest_framework.test import APITestCase, APIClient
 from rest_framework import status
 from channels.testing import WebsocketCommunicator
-from ..models.neural import NeuralDevice, NeuralSignal, NeuralControl
+from channels.db import database_sync_to_async
+from ..models.neural import NeuralDevice, NeuralSignal, NeuralSignalChunk, NeuralControl
 from ..consumers import NeuralSignalConsumer
+from ..neural_ingest import get_neural_ingest_buffer
 from ..serializers import NeuralDeviceSerializer
 import json
 
@@ -80,14 +82,16 @@ class NeuralWebSocketTests(TestCase):
         connected, _ = await communicator.connect()
         self.assertTrue(connected)
 
-        # Test sending signal data
+        # Samples are buffered without a reply while there is no back-pressure
         await communicator.send_json_to({
             'signal_type': 'alpha',
-            'signal_data': {'frequency': 10, 'amplitude': 0.5}
+            'signal_data': {'samples': [0.1, 0.2, 0.3], 'sample_rate': 256}
         })
+        self.assertTrue(await communicator.receive_nothing())
 
-        response = await communicator.receive_json_from()
-        self.assertEqual(response['signal_type'], 'alpha')
-        self.assertEqual(response['signal_data']['frequency'], 10)
+        await database_sync_to_async(get_neural_ingest_buffer().flush)()
+        chunk = await NeuralSignalChunk.objects.aget(device=device)
+        self.assertEqual(chunk.signal_type, 'alpha')
+        self.assertEqual(chunk.sample_count, 3)
 
         await communicator.disconnect()
@@ -0,0 +1,199 @@
+import math
+import os
+import time
+from unittest import mock, skipUnless
+import numpy as np
+from django.db import connection
+from django.test import TransactionTestCase
+from ..models.neural import NeuralDevice, NeuralSignal, NeuralSignalChunk
+from ..neural_ingest import FULL, OK, SLOW, NeuralIngestBuffer
+
+RUN_BENCHMARKS = os.getenv('RUN_BENCHMARKS', '').lower() == 'true'
+BENCHMARK_DEVICES = int(os.getenv('BENCHMARK_DEVICES', 20))
+BENCHMARK_RATE = int(os.getenv('BENCHMARK_RATE', 256))
+BENCHMARK_SECONDS = int(os.getenv('BENCHMARK_SECONDS', 10))
+# Samples per websocket message
+BENCHMARK_MESSAGE_SAMPLES = int(os.getenv('BENCHMARK_MESSAGE_SAMPLES', 32))
+
+
+def create_device(user_id=1):
+    return NeuralDevice.objects.create(user_id=user_id, device_name='Headset', device_type='eeg')
+
+
+class NeuralIngestBufferTests(TransactionTestCase):
+    def setUp(self):
+        self.device = create_device()
+        self.buffer = NeuralIngestBuffer(flush_interval=0, block_samples=8)
+
+    def test_contiguous_samples_are_packed_into_chunks(self):
+        start = float(round(time.time()) - 60)
+        self.buffer.record(self.device.pk, 'alpha', [0.5, 1.5, 2.5, 3.5], sample_rate=4, timestamp=start, quality=1.0)
+        self.buffer.record(self.device.pk, 'alpha', [4.5, 5.5], sample_rate=4, timestamp=start + 1, quality=0.5)
+        self.buffer.record(self.device.pk, 'beta', [7.0], sample_rate=4, timestamp=start)
+
+        self.assertEqual(self.buffer.flush(), 7)
+
+        chunk, = NeuralSignalChunk.objects.filter(signal_type='alpha')
+        np.testing.assert_array_equal(chunk.values(), [0.5, 1.5, 2.5, 3.5, 4.5, 5.5])
+        self.assertEqual((chunk.sample_count, chunk.sample_rate), (6, 4.0))
+        self.assertEqual(chunk.start_time.timestamp(), start)
+        self.assertEqual(chunk.end_time.timestamp(), start + 1.5)
+        self.assertAlmostEqual(chunk.signal_quality, 5 / 6)
+        self.assertEqual(len(bytes(chunk.samples)), 6 * 4)
+        self.assertEqual(self.buffer.pending, 0)
+
+    def test_gaps_and_full_blocks_start_new_chunks(self):
+        start = float(round(time.time()) - 60)
+        self.buffer.record(self.device.pk, 'alpha', range(4), sample_rate=4, timestamp=start)
+        # One second missing
+        self.buffer.record(self.device.pk, 'alpha', range(4), sample_rate=4, timestamp=start + 2)
+        self.buffer.record(self.device.pk, 'alpha', range(8), sample_rate=4, timestamp=start + 3)
+        self.buffer.record(self.device.pk, 'alpha', range(2), sample_rate=4, timestamp=start + 5)
+        self.buffer.flush()
+        # Streams continue across flushes
+        self.buffer.record(self.device.pk, 'alpha', range(2), sample_rate=4, timestamp=start + 5.5)
+        self.buffer.flush()
+
+        chunks = NeuralSignalChunk.objects.order_by('start_time', 'pk')
+        self.assertEqual(
+            [(chunk.start_time.timestamp() - start, chunk.sample_count) for chunk in chunks],
+            [(0, 4), (2, 12), (5, 2), (5.5, 2)]
+        )
+
+    def test_untimed_samples_continue_the_stream(self):
+        self.buffer.record(self.device.pk, 'gamma', [1, 2], sample_rate=256)
+        self.buffer.record(self.device.pk, 'gamma', [3, 4], sample_rate=256)
+
+        self.buffer.flush()
+
+        chunk, = NeuralSignalChunk.objects.all()
+        np.testing.assert_array_equal(chunk.values(), [1, 2, 3, 4])
+
+    def test_backpressure(self):
+        buffer = NeuralIngestBuffer(flush_interval=0, high_watermark=10, max_pending=20)
+
+        self.assertEqual(buffer.record(self.device.pk, 'alpha', range(9)), OK)
+        self.assertEqual(buffer.record(self.device.pk, 'alpha', range(9)), SLOW)
+        self.assertEqual(buffer.record(self.device.pk, 'alpha', range(9)), FULL)
+        self.assertEqual((buffer.pending, buffer.refused), (18, 9))
+
+        buffer.flush()
+        self.assertEqual(buffer.record(self.device.pk, 'alpha', range(9)), OK)
+
+    def test_invalid_samples_are_rejected(self):
+        for signal_type, samples in [
+            ('delta', [1]), ('alpha', None), ('alpha', ['a']), ('alpha', [1, float('nan')])
+        ]:
+            with self.assertRaises(ValueError):
+                self.buffer.record(self.device.pk, signal_type, samples)
+        self.assertEqual(self.buffer.pending, 0)
+
+    def test_invalid_timestamps_and_quality_are_rejected(self):
+        now = time.time()
+        for timestamp, quality in [
+            ('abc', None), (math.inf, None), (1e20, None), (now - 2 * 86400, None),
+            (now, 'high'), (now, math.nan), (now, 1.5), (now, -0.1)
+        ]:
+            with self.assertRaises(ValueError):
+                self.buffer.record(self.device.pk, 'alpha', [1], timestamp=timestamp, quality=quality)
+        self.assertEqual(self.buffer.pending, 0)
+
+    def test_failed_flush_keeps_samples(self):
+        start = time.time() - 60
+        self.buffer.record(self.device.pk, 'alpha', [1, 2], timestamp=start)
+        with mock.patch.object(NeuralSignalChunk.objects, 'bulk_create', side_effect=RuntimeError('down')):
+            self.assertEqual(self.buffer.flush(), 0)
+        self.buffer.record(self.device.pk, 'alpha', [3], timestamp=start + 10)
+
+        self.assertEqual(self.buffer.flush(), 3)
+        self.assertEqual(
+            [list(chunk.values()) for chunk in NeuralSignalChunk.objects.order_by('start_time')],
+            [[1, 2], [3]]
+        )
+
+    def test_blocks_that_cannot_be_packed_are_dropped(self):
+        self.buffer.record(self.device.pk, 'alpha', [1, 2])
+        self.buffer.record(self.device.pk, 'beta', [3])
+        chunk = self.buffer._chunk
+
+        def pack(model, device_id, signal_type, block):
+            if signal_type == 'alpha':
+                raise OverflowError('bad block')
+            return chunk(model, device_id, signal_type, block)
+
+        with mock.patch.object(self.buffer, '_chunk', side_effect=pack):
+            self.assertEqual(self.buffer.flush(), 1)
+        self.assertEqual((self.buffer.dropped, self.buffer.pending), (2, 0))
+        self.assertEqual(NeuralSignalChunk.objects.get().signal_type, 'beta')
+        self.assertEqual(self.buffer.flush(), 0)
+
+    def test_unknown_devices_are_dropped(self):
+        self.buffer.record(self.device.pk, 'alpha', [1, 2])
+        self.buffer.record(self.device.pk + 100, 'alpha', [1, 2, 3])
+
+        self.assertEqual(self.buffer.flush(), 2)
+        self.assertEqual((self.buffer.dropped, self.buffer.pending), (3, 0))
+
+    def test_flusher_thread_stores_full_blocks(self):
+        buffer = NeuralIngestBuffer(flush_interval=60, block_samples=4)
+        self.addCleanup(buffer.stop, flush=False)
+
+        buffer.record(self.device.pk, 'alpha', range(4))
+
+        deadline = time.monotonic() + 5
+        while buffer.pending and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(NeuralSignalChunk.objects.get().sample_count, 4)
+
+
+@skipUnless(RUN_BENCHMARKS, 'Set RUN_BENCHMARKS=true to run benchmarks')
+class NeuralIngestBenchmark(TransactionTestCase):
+    """BENCHMARK_DEVICES headsets at BENCHMARK_RATE Hz for BENCHMARK_SECONDS."""
+
+    def setUp(self):
+        self.devices = [create_device(user_id=i) for i in range(BENCHMARK_DEVICES)]
+        rng = np.random.default_rng(43)
+        messages = BENCHMARK_RATE * BENCHMARK_SECONDS // BENCHMARK_MESSAGE_SAMPLES
+        self.messages = [
+            (device.pk, rng.normal(0, 20, BENCHMARK_MESSAGE_SAMPLES).round(3).tolist())
+            for _ in range(messages) for device in self.devices
+        ]
+        self.samples = len(self.messages) * BENCHMARK_MESSAGE_SAMPLES
+
+    def table_size(self, model):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_total_relation_size(%s)', [model._meta.db_table])
+            return cursor.fetchone()[0]
+
+    def test_samples_per_second_and_storage(self):
+        if connection.vendor != 'postgresql':
+            self.skipTest('Storage is measured with pg_total_relation_size')
+        results = {}
+
+        start = time.perf_counter()
+        for device_id, samples in self.messages:
+            # A row per message, as NeuralSignalConsumer did before
+            NeuralSignal.objects.create(
+                device_id=device_id, signal_type='alpha', signal_data=samples, signal_quality=0.9
+            )
+        results['row per message'] = (time.perf_counter() - start, self.table_size(NeuralSignal))
+
+        buffer = NeuralIngestBuffer(flush_interval=0)
+        start = time.perf_counter()
+        for number, (device_id, samples) in enumerate(self.messages, 1):
+            buffer.record(device_id, 'alpha', samples, sample_rate=BENCHMARK_RATE, quality=0.9)
+            if number % (BENCHMARK_DEVICES * BENCHMARK_RATE // BENCHMARK_MESSAGE_SAMPLES) == 0:
+                # The flusher thread's once-a-second flush
+                buffer.flush()
+        buffer.flush()
+        results['micro-batched chunks'] = (time.perf_counter() - start, self.table_size(NeuralSignalChunk))
+        self.assertEqual(buffer.stored, self.samples)
+
+        print(
+            f"\n{BENCHMARK_DEVICES} devices at {BENCHMARK_RATE} Hz for {BENCHMARK_SECONDS}s "
+            f"({self.samples:,} samples in messages of {BENCHMARK_MESSAGE_SAMPLES}):"
+        )
+        for label, (seconds, size) in results.items():
+            print(f"  {label}: {self.samples / seconds:,.0f} samples/s, {size / self.samples:.2f} bytes per sample")
+        self.assertLess(results['micro-batched chunks'][0], results['row per message'][0])
+        self.assertLess(results['micro-batched chunks'][1], results['row per message'][1])
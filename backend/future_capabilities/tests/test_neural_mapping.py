@@ -0,0 +1,180 @@
+import math
+import os
+import statistics
+import time
+from unittest import skipUnless
+import numpy as np
+from django.core.cache import cache
+from django.test import TransactionTestCase
+from ..models.neural import NeuralControl
+from ..neural_mapping import CompiledMapping, NeuralMappingEngine
+
+RUN_BENCHMARKS = os.getenv('RUN_BENCHMARKS', '').lower() == 'true'
+BENCHMARK_CONTROLS = int(os.getenv('BENCHMARK_CONTROLS', 32))
+BENCHMARK_SAMPLES = int(os.getenv('BENCHMARK_SAMPLES', 256))
+BENCHMARK_MESSAGES = int(os.getenv('BENCHMARK_MESSAGES', 1000))
+
+FUNCTIONS = ['linear', 'exponential', 'logarithmic', 'threshold']
+
+
+def create_control(name, mapping_function='linear', user_id=1, signal_type='alpha', **config):
+    return NeuralControl.objects.create(
+        user_id=user_id, name=name, signal_type=signal_type, control_parameter='volume',
+        mapping_function=mapping_function, mapping_config=config
+    )
+
+
+def legacy_map(control, value):
+    """One value through one control, branch by branch, as the views did before."""
+    config = control.mapping_config
+    try:
+        normalized = (value - config['input_range']['min']) / (
+            config['input_range']['max'] - config['input_range']['min']
+        )
+        if control.mapping_function == 'exponential':
+            mapped = normalized ** 2
+        elif control.mapping_function == 'logarithmic':
+            mapped = math.log(normalized + 1) / math.log(2)
+        elif control.mapping_function == 'threshold':
+            mapped = 1.0 if normalized >= 0.5 else 0.0
+        else:
+            mapped = normalized
+        return config['output_range']['min'] + (config['output_range']['max'] - config['output_range']['min']) * mapped
+    except (ValueError, ZeroDivisionError):
+        return config['fallback_value']
+
+
+class CompiledMappingTests(TransactionTestCase):
+    def test_matches_the_per_value_mapping(self):
+        controls = [
+            create_control(
+                f"{function}-{i}", function, input_range={'min': -10 * i, 'max': 50 + i},
+                output_range={'min': i, 'max': 100 - i}, fallback_value=-1.0
+            )
+            for i, function in enumerate(FUNCTIONS * 3)
+        ]
+        values = np.linspace(-60, 80, 57)
+
+        control_ids, outputs = CompiledMapping(controls).apply('alpha', values)
+
+        controls = {control.pk: control for control in controls}
+        self.assertEqual(sorted(control_ids), sorted(controls))
+        for control_id, row in zip(control_ids, outputs):
+            expected = [legacy_map(controls[control_id], value) for value in values]
+            np.testing.assert_allclose(row, expected, err_msg=controls[control_id].mapping_function)
+
+    def test_invalid_configurations_fall_back(self):
+        mapping = CompiledMapping([
+            create_control('flat', input_range={'min': 1, 'max': 1}, fallback_value=0.25),
+            create_control('log', 'logarithmic', input_range={'min': 0, 'max': 1}, fallback_value=0.5),
+            create_control('broken', 'custom', fallback_value=0.75),
+        ])
+
+        updates = {update['control']: update for update in mapping.control_updates('alpha', -3)}
+
+        self.assertEqual(updates['flat'], {'control': 'flat', 'parameter': 'volume', 'value': 0.25, 'fallback_used': True})
+        self.assertEqual((updates['log']['value'], updates['broken']['value']), (0.5, 0.75))
+        self.assertEqual(mapping.control_updates('beta', 1), [])
+
+    def test_custom_curves_and_parameters(self):
+        mapping = CompiledMapping([
+            create_control('curve', 'custom', points=[[1, 0], [0, 0], [0.5, 1]]),
+            create_control('cube', 'exponential', exponent=3, output_range={'min': 0, 'max': 8}),
+            create_control('gate', 'threshold', threshold=0.2),
+        ])
+
+        outputs = {update['control']: update['value'] for update in mapping.control_updates('alpha', 0.25)}
+
+        self.assertEqual(outputs, {'curve': 0.5, 'cube': 0.125, 'gate': 1.0})
+
+
+class NeuralMappingEngineTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.volume = create_control('volume', input_range={'min': 0, 'max': 10})
+        create_control('other user', user_id=2)
+        self.engine = NeuralMappingEngine(check_interval=60)
+
+    def test_compiles_once_until_controls_change(self):
+        self.assertEqual(self.engine.get(1).control_updates('alpha', 5)[0]['value'], 0.5)
+        self.engine.get(1)
+        self.assertEqual((self.engine.compiles, len(self.engine.get(1))), (1, 1))
+
+        # Another process keeps its mapping until its next version check
+        other = NeuralMappingEngine(check_interval=0)
+        other.get(1)
+        self.volume.mapping_config = {'input_range': {'min': 0, 'max': 20}}
+        self.volume.save()
+
+        self.assertEqual(other.get(1).control_updates('alpha', 5)[0]['value'], 0.25)
+        self.assertEqual(other.compiles, 2)
+        self.assertEqual(self.engine.compiles, 1)
+
+    def test_deleted_and_disabled_controls_are_dropped(self):
+        engine = NeuralMappingEngine(check_interval=0)
+        create_control('pitch', user_id=1)
+        self.assertEqual(len(engine.get(1)), 2)
+
+        self.volume.delete()
+        pitch = NeuralControl.objects.get(name='pitch')
+        pitch.is_active = False
+        pitch.save()
+
+        self.assertEqual(len(engine.get(1)), 0)
+
+    async def test_aget_skips_the_thread_hop_when_fresh(self):
+        mapping = await self.engine.aget(1)
+        self.assertIs(self.engine.cached(1), mapping)
+        self.assertIs(await self.engine.aget(1), mapping)
+
+
+@skipUnless(RUN_BENCHMARKS, 'Set RUN_BENCHMARKS=true to run benchmarks')
+class NeuralMappingBenchmark(TransactionTestCase):
+    """BENCHMARK_CONTROLS controls over BENCHMARK_SAMPLES-sample messages."""
+
+    def setUp(self):
+        cache.clear()
+        self.controls = [
+            create_control(
+                f"control-{i}", FUNCTIONS[i % len(FUNCTIONS)], input_range={'min': 0, 'max': 100},
+                output_range={'min': 0, 'max': 127}, fallback_value=0.0
+            )
+            for i in range(BENCHMARK_CONTROLS)
+        ]
+        rng = np.random.default_rng(44)
+        self.messages = [rng.uniform(0, 100, BENCHMARK_SAMPLES) for _ in range(BENCHMARK_MESSAGES)]
+
+    def test_throughput_and_latency(self):
+        def legacy(values):
+            # Controls fetched and mapped value by value per message
+            controls = list(NeuralControl.objects.filter(user_id=1, signal_type='alpha', is_active=True).order_by('pk'))
+            return [[legacy_map(control, value) for value in values.tolist()] for control in controls]
+
+        engine = NeuralMappingEngine()
+
+        def compiled(values):
+            return engine.get(1).apply('alpha', values)[1]
+
+        control_ids, outputs = engine.get(1).apply('alpha', self.messages[0])
+        expected = dict(zip([control.pk for control in self.controls], legacy(self.messages[0])))
+        np.testing.assert_allclose(outputs, [expected[control_id] for control_id in control_ids])
+        results = {}
+        for label, run in (('per value', legacy), ('compiled', compiled)):
+            latencies = []
+            for values in self.messages:
+                start = time.perf_counter()
+                run(values)
+                latencies.append(time.perf_counter() - start)
+            results[label] = (sum(latencies), statistics.median(latencies))
+
+        mapped = BENCHMARK_CONTROLS * BENCHMARK_SAMPLES * BENCHMARK_MESSAGES
+        print(
+            f"\n{BENCHMARK_CONTROLS} controls x {BENCHMARK_SAMPLES} samples per message, "
+            f"{BENCHMARK_MESSAGES:,} messages:"
+        )
+        for label, (seconds, median) in results.items():
+            print(
+                f"  {label}: {mapped / seconds:,.0f} control-samples/s, "
+                f"message latency median {median * 1e6:,.0f}us"
+            )
+        self.assertLess(results['compiled'][0], results['per value'][0] / 10)
@@ -0,0 +1,159 @@
+import os
+import statistics
+import tempfile
+import threading
+import time
+from unittest import skipUnless
+from django.test import SimpleTestCase
+from ..plugin_runtime import PluginCrashed, PluginError, PluginNotAllowed, PluginTimeout, PluginWorkerPool
+
+RUN_BENCHMARKS = os.getenv('RUN_BENCHMARKS', '').lower() == 'true'
+BENCHMARK_CALLS = int(os.getenv('BENCHMARK_CALLS', 2000))
+
+PLUGINS = 'future_capabilities.tests.sample_plugins'
+
+
+class PluginWorkerPoolTests(SimpleTestCase):
+    def setUp(self):
+        self.pool = PluginWorkerPool(
+            workers=2, max_calls=3, timeout=2.0, memory_limit=256, preload=[f"{PLUGINS}:echo"],
+            allowed_modules=['future_capabilities.tests']
+        )
+        self.addCleanup(self.pool.stop)
+
+    def test_runs_plugins_in_warm_workers(self):
+        result = self.pool.execute(f"{PLUGINS}:echo", 'process_audio', {'level': 3}, {'mode': 'fast'})
+
+        self.assertEqual(
+            {key: value for key, value in result['output'].items() if key != 'pid'},
+            {'action': 'process_audio', 'parameters': {'level': 3}, 'settings': {'mode': 'fast'}}
+        )
+        self.assertNotEqual(result['output']['pid'], os.getpid())
+        self.assertGreater(result['performance_metrics']['memory_usage'], 0)
+        self.assertEqual(self.pool.execute(f"{PLUGINS}.gain", 'process_audio', {'samples': [1, 2]}, {'gain': 0.5})['output'], [0.5, 1.0])
+        self.assertEqual(self.pool.stats()['started'], 2)
+
+    def test_workers_are_recycled_after_max_calls(self):
+        pids = [self.pool.execute(f"{PLUGINS}:echo", 'initialize')['output']['pid'] for _ in range(3)]
+        # The most recently used worker serves the next call
+        self.assertEqual(len(set(pids)), 1)
+
+        after = self.pool.execute(f"{PLUGINS}:echo", 'initialize')['output']['pid']
+
+        self.assertNotEqual(after, pids[0])
+        self.assertEqual(self.pool.stats()['recycled'], 1)
+
+    def test_plugin_errors_keep_the_worker(self):
+        with self.assertRaisesRegex(PluginError, 'ValueError: bad parameters'):
+            self.pool.execute(f"{PLUGINS}:fail", 'initialize')
+        with self.assertRaisesRegex(PluginError, 'ModuleNotFoundError'):
+            self.pool.execute('future_capabilities.tests.missing:run', 'initialize')
+
+        self.assertEqual(self.pool.stats()['recycled'], 0)
+        self.assertEqual(self.pool.execute(f"{PLUGINS}:checksum", 'analyze', {'rounds': 10})['output'], 364560)
+
+    def test_timeouts_and_crashes_replace_the_worker(self):
+        start = time.monotonic()
+        with self.assertRaises(PluginTimeout):
+            self.pool.execute(f"{PLUGINS}:sleep", 'initialize', {'seconds': 30}, timeout=0.2)
+        self.assertLess(time.monotonic() - start, 2)
+        with self.assertRaisesRegex(PluginCrashed, 'code 3'):
+            self.pool.execute(f"{PLUGINS}:crash", 'initialize')
+
+        self.assertEqual(self.pool.execute(f"{PLUGINS}:checksum", 'analyze', {'rounds': 10})['output'], 364560)
+        stats = self.pool.stats()
+        self.assertEqual((stats['timeouts'], stats['crashed']), (1, 1))
+        self.assertGreaterEqual(stats['started'], 3)
+
+    def test_resource_limits(self):
+        with self.assertRaisesRegex(PluginError, 'memory limit'):
+            self.pool.execute(f"{PLUGINS}:allocate", 'generate_content', {'megabytes': 1024})
+        self.assertEqual(self.pool.stats()['recycled'], 1)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'out.txt')
+            with self.assertRaisesRegex(PluginError, 'File too large'):
+                self.pool.execute(f"{PLUGINS}:write_file", 'modify_settings', {'path': path})
+
+        self.assertEqual(self.pool.execute(f"{PLUGINS}:allocate", 'generate_content', {'megabytes': 16})['output'], 16 * 1024 * 1024)
+
+    def test_entry_points_outside_allowed_modules_are_refused(self):
+        for entry_point in ['os:system', 'future_capabilities.testsuite:run', 'future_capabilities', ':echo', None, 'x..y:z']:
+            with self.assertRaises(PluginNotAllowed):
+                self.pool.execute(entry_point, 'initialize')
+        self.assertEqual(self.pool.stats()['calls'], 0)
+
+    def test_workers_only_see_allowed_environment(self):
+        os.environ['PLUGIN_RUNTIME_TEST_SECRET'] = 'hunter2'
+        self.addCleanup(os.environ.pop, 'PLUGIN_RUNTIME_TEST_SECRET')
+        pool = PluginWorkerPool(workers=1, allowed_modules=[PLUGINS])
+        self.addCleanup(pool.stop)
+
+        environment = pool.execute(f"{PLUGINS}:environment", 'initialize')['output']
+
+        self.assertNotIn('PLUGIN_RUNTIME_TEST_SECRET', environment)
+        self.assertEqual(environment.get('PATH'), os.environ.get('PATH'))
+
+    def test_workers_that_failed_to_start_are_retried(self):
+        pool = PluginWorkerPool(workers=2, preload=[f"{PLUGINS}:missing"], allowed_modules=[PLUGINS])
+        self.addCleanup(pool.stop)
+
+        with self.assertRaisesRegex(PluginError, 'No plugin worker available.*missing'):
+            pool.execute(f"{PLUGINS}:echo", 'initialize')
+        pool.preload = []
+
+        self.assertEqual(pool.execute(f"{PLUGINS}:echo", 'initialize')['output']['action'], 'initialize')
+        self.assertEqual(pool.stats()['started'], 2)
+
+    def test_stopped_pool_restarts_on_use(self):
+        pid = self.pool.execute(f"{PLUGINS}:echo", 'initialize')['output']['pid']
+        self.pool.stop()
+
+        self.assertEqual(self.pool.stats()['idle'], 0)
+        self.assertNotEqual(self.pool.execute(f"{PLUGINS}:echo", 'initialize')['output']['pid'], pid)
+
+
+@skipUnless(RUN_BENCHMARKS, 'Set RUN_BENCHMARKS=true to run benchmarks')
+class PluginWorkerPoolBenchmark(SimpleTestCase):
+    """Cold (a new worker per call) against warm invocations of sample plugins."""
+
+    def measure(self, pool, entry_point, calls, threads=1):
+        latencies = []
+        lock = threading.Lock()
+
+        def run(count):
+            for _ in range(count):
+                start = time.perf_counter()
+                pool.execute(entry_point, 'process_audio', {'samples': list(range(256)), 'rounds': 20000}, {'gain': 0.5})
+                with lock:
+                    latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        workers = [threading.Thread(target=run, args=(calls // threads,)) for _ in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return len(latencies) / (time.perf_counter() - start), statistics.median(latencies)
+
+    def test_cold_and_warm_invocations(self):
+        cold_calls = max(BENCHMARK_CALLS // 40, 10)
+        print(f"\nPlugin calls (cold: {cold_calls:,}, warm: {BENCHMARK_CALLS:,}):")
+        results = {}
+        for plugin in ('gain', 'checksum'):
+            entry_point = f"{PLUGINS}:{plugin}"
+            runs = (
+                ('cold', PluginWorkerPool(workers=1, max_calls=1, allowed_modules=[PLUGINS]), cold_calls, 1),
+                ('warm', PluginWorkerPool(workers=1, preload=[entry_point], allowed_modules=[PLUGINS]), BENCHMARK_CALLS, 1),
+                ('warm x4', PluginWorkerPool(workers=4, preload=[entry_point], allowed_modules=[PLUGINS]), BENCHMARK_CALLS, 4),
+            )
+            for label, pool, calls, threads in runs:
+                try:
+                    pool.start()
+                    throughput, median = self.measure(pool, entry_point, calls, threads)
+                finally:
+                    pool.stop()
+                results[plugin, label] = median
+                print(f"  {plugin} {label}: {throughput:,.0f} calls/s, median latency {median * 1000:.2f}ms")
+
+        self.assertLess(results['gain', 'warm'], results['gain', 'cold'] / 10)
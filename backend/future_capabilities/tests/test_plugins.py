@@ -93,17 +93,23 @@ class PluginWebSocketTests(TestCase):
             PluginStateConsumer.as_asgi(),
             f"/ws/plugin/{plugin.id}/"
         )
+        communicator.scope['user'] = user
+        communicator.scope['url_route'] = {'kwargs': {'plugin_id': str(plugin.id)}}
         connected, _ = await communicator.connect()
         self.assertTrue(connected)
 
-        # Test updating plugin state
+        snapshot = await communicator.receive_json_from()
+        self.assertEqual(snapshot['type'], 'state_snapshot')
+
+        # Test updating plugin state: it comes back as a delta with the next tick
         await communicator.send_json_to({
             'action': 'update_state',
             'state': {'setting1': 'value1', 'setting2': 'value2'}
         })
 
         response = await communicator.receive_json_from()
-        self.assertIn('setting1', response)
-        self.assertEqual(response['setting1'], 'value1')
+        self.assertEqual(response['type'], 'state_delta')
+        self.assertEqual(response['seq'], snapshot['seq'] + 1)
+        self.assertEqual(response['changes']['setting1'], 'value1')
 
         await communicator.disconnect()
@@ -75,6 +75,8 @@ class VRWebSocketTests(TestCase):
         )
         connected, _ = await communicator.connect()
         self.assertTrue(connected)
+        keyframe = await communicator.receive_json_from()
+        self.assertEqual(keyframe['type'], 'vr_keyframe')
 
         # Test sending position update
         await communicator.send_json_to({
@@ -83,8 +85,9 @@ class VRWebSocketTests(TestCase):
             'rotation': {'x': 0.0, 'y': 90.0, 'z': 0.0}
         })
 
-        response = await communicator.receive_json_from()
-        self.assertIn('position', response)
-        self.assertIn('rotation', response)
+        # Broadcast with the next tick
+        response = await communicator.receive_json_from(timeout=1)
+        self.assertEqual(response['type'], 'vr_delta')
+        self.assertEqual(response['entities'][str(keyframe['entity'])], [1.0, 2.0, 3.0, 0.0, 90.0, 0.0])
 
         await communicator.disconnect()
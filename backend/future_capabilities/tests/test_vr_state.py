@@ -0,0 +1,239 @@
+import asyncio
+import json
+import os
+import random
+import time
+from unittest import skipUnless
+from channels.db import database_sync_to_async
+from channels.layers import InMemoryChannelLayer
+from django.test import TransactionTestCase
+from django.utils import timezone
+from ..models.vr import VREnvironmentConfig, VRSession
+from ..vr_state import VRStateEngine
+
+RUN_BENCHMARKS = os.getenv('RUN_BENCHMARKS', '').lower() == 'true'
+BENCHMARK_USERS = int(os.getenv('BENCHMARK_USERS', 50))
+BENCHMARK_RATE = int(os.getenv('BENCHMARK_RATE', 90))
+BENCHMARK_SECONDS = int(os.getenv('BENCHMARK_SECONDS', 1))
+
+GROUP = 'vr_session_test'
+
+
+async def drain(layer, channel):
+    """Every message waiting on the channel."""
+    messages = []
+    while channel in layer.channels:
+        messages.append(await layer.receive(channel))
+    return messages
+
+
+def create_session():
+    config = VREnvironmentConfig.objects.create(
+        user_id=1, name='Stage', environment_name='Stage', scene_type='concert_hall',
+        lighting_preset='club', interaction_mode='controller'
+    )
+    return VRSession.objects.create(
+        user_id=1, config=config, start_time=timezone.now(), device_type='Quest 3',
+        performance_metrics={'fps': 90}
+    )
+
+
+class VRStateEngineTests(TransactionTestCase):
+    def setUp(self):
+        self.session = create_session()
+        self.session_id = str(self.session.pk)
+        self.layer = InMemoryChannelLayer()
+        self.engine = VRStateEngine(tick_rate=0, persist_interval=0, precision=2)
+
+    async def join(self, user_id):
+        channel = await self.layer.new_channel()
+        await self.layer.group_add(GROUP, channel)
+        entity, keyframe = await self.engine.join(self.session_id, self.layer, GROUP, channel, user_id=user_id)
+        return channel, entity, json.loads(keyframe)
+
+    async def test_ticks_broadcast_only_changes(self):
+        alice, alice_id, _ = await self.join(1)
+        bob, bob_id, _ = await self.join(2)
+        self.engine.update(self.session_id, alice, {'x': 1, 'y': 1.6, 'z': 0}, {'x': 0, 'y': 90, 'z': 0})
+        self.engine.update(self.session_id, alice, {'x': 1.001, 'y': 1.6, 'z': 0.5}, {'x': 0, 'y': 90, 'z': 0})
+
+        self.assertEqual(await self.engine.tick(self.session_id), 2)
+        delta = json.loads((await drain(self.layer, bob))[0]['text'])
+        self.assertEqual(delta['entities'], {str(alice_id): [1.0, 1.6, 0.5, 0.0, 90.0, 0.0]})
+        self.assertEqual(delta['users'], {str(alice_id): '1'})
+
+        # Jitter below the precision is not sent
+        self.engine.update(self.session_id, alice, [1.004, 1.6, 0.5], [0, 90, 0])
+        self.assertEqual(await self.engine.tick(self.session_id), 0)
+
+        self.engine.update(self.session_id, bob, [2, 1.6, 0], [0, 0, 0])
+        await self.engine.tick(self.session_id)
+        await drain(self.layer, alice)
+        carol, _, keyframe = await self.join(3)
+        self.assertEqual(len(keyframe['entities']), 2)
+        self.assertEqual(keyframe['users'][str(bob_id)], '2')
+
+        await self.engine.leave(self.session_id, bob)
+        await self.engine.tick(self.session_id)
+        delta = json.loads((await drain(self.layer, carol))[0]['text'])
+        self.assertEqual((delta['entities'], delta['removed']), ({}, [bob_id]))
+
+    async def test_invalid_poses_are_rejected(self):
+        channel, _, _ = await self.join(1)
+
+        for position in [None, {'x': 1, 'y': 2}, ['1', 2, 3], [1, 2, float('nan')]]:
+            with self.assertRaises(ValueError):
+                self.engine.update(self.session_id, channel, position, [0, 0, 0])
+        with self.assertRaises(ValueError):
+            self.engine.update('other', channel, [0, 0, 0], [0, 0, 0])
+
+    async def test_interest_radius_limits_each_delta(self):
+        self.engine.interest_radius = 5
+        near, near_id, _ = await self.join(1)
+        far, _, _ = await self.join(2)
+        self.engine.update(self.session_id, near, [0, 0, 0], [0, 0, 0])
+        self.engine.update(self.session_id, far, [20, 0, 0], [0, 0, 0])
+        await self.engine.tick(self.session_id)
+        await drain(self.layer, near)
+        await drain(self.layer, far)
+
+        self.engine.update(self.session_id, near, [1, 0, 0], [0, 0, 0])
+        self.assertEqual(await self.engine.tick(self.session_id), 1)
+        self.assertEqual(await drain(self.layer, far), [])
+
+        self.engine.update(self.session_id, far, [3, 0, 0], [0, 0, 0])
+        await self.engine.tick(self.session_id)
+        delta = json.loads((await drain(self.layer, far))[0]['text'])
+        self.assertEqual(delta['entities'][str(near_id)], [1.0, 0.0, 0.0, 0.0, 0.0, 0.0])
+        self.assertEqual(delta['users'][str(near_id)], '1')
+
+        self.engine.update(self.session_id, far, [30, 0, 0], [0, 0, 0])
+        await self.engine.tick(self.session_id)
+        delta = json.loads((await drain(self.layer, far))[0]['text'])
+        self.assertEqual(delta['removed'], [near_id])
+
+    async def test_poses_are_saved_when_clients_leave(self):
+        alice, _, _ = await self.join(1)
+        bob, _, _ = await self.join(2)
+        self.engine.update(self.session_id, alice, [1, 2, 3], [0, 45, 0])
+        self.engine.update(self.session_id, bob, [4, 5, 6], [0, 0, 0])
+
+        await self.engine.leave(self.session_id, alice)
+        self.engine.update(self.session_id, bob, [7, 8, 9], [0, 0, 0])
+        await self.engine.leave(self.session_id, bob)
+
+        session = await VRSession.objects.aget(pk=self.session.pk)
+        self.assertEqual(session.performance_metrics['fps'], 90)
+        self.assertEqual(session.performance_metrics['vr_state']['poses'], {
+            '1': {'position': [1.0, 2.0, 3.0], 'rotation': [0.0, 45.0, 0.0]},
+            '2': {'position': [7.0, 8.0, 9.0], 'rotation': [0.0, 0.0, 0.0]},
+        })
+        self.assertNotIn(self.session_id, self.engine.sessions)
+
+    async def test_tick_task_broadcasts_until_the_session_empties(self):
+        self.engine.tick_rate = 100
+        channel, entity, _ = await self.join(1)
+        state = self.engine.sessions[self.session_id]
+        self.engine.update(self.session_id, channel, [1, 1, 1], [0, 0, 0])
+
+        message = await asyncio.wait_for(self.layer.receive(channel), 1)
+
+        self.assertEqual(json.loads(message['text'])['entities'], {str(entity): [1.0, 1.0, 1.0, 0.0, 0.0, 0.0]})
+        await self.engine.leave(self.session_id, channel)
+        await asyncio.sleep(0)
+        self.assertTrue(state.task.done())
+
+
+@skipUnless(RUN_BENCHMARKS, 'Set RUN_BENCHMARKS=true to run benchmarks')
+class VRStateBenchmark(TransactionTestCase):
+    """BENCHMARK_USERS headsets sending at BENCHMARK_RATE Hz for BENCHMARK_SECONDS."""
+
+    def setUp(self):
+        self.session = create_session()
+        random.seed(41)
+
+    def poses(self):
+        """Per round, each user's pose; a fifth of them stand still."""
+        positions = [[random.uniform(-20, 20), 1.6, random.uniform(-20, 20)] for _ in range(BENCHMARK_USERS)]
+        for _ in range(BENCHMARK_RATE * BENCHMARK_SECONDS):
+            for user, position in enumerate(positions):
+                if user % 5:
+                    position[0] += random.uniform(-0.02, 0.02)
+                    position[2] += random.uniform(-0.02, 0.02)
+            yield [
+                ({'x': x, 'y': y, 'z': z}, {'x': 0.0, 'y': (user * 7.0) % 360, 'z': 0.0})
+                for user, (x, y, z) in enumerate(positions)
+            ]
+
+    async def channels(self, layer):
+        channels = [await layer.new_channel() for _ in range(BENCHMARK_USERS)]
+        for channel in channels:
+            await layer.group_add(GROUP, channel)
+        return channels
+
+    async def legacy(self, layer, channels, rounds):
+        """A get, save and full-state broadcast per update, as VRSessionConsumer did before."""
+
+        @database_sync_to_async
+        def update_session_state(position, rotation):
+            session = VRSession.objects.get(pk=self.session.pk)
+            session.performance_metrics = {**session.performance_metrics, 'position': position, 'rotation': rotation}
+            session.save()
+            return {
+                'id': session.id, 'user_id': session.user_id, 'config': session.config_id,
+                'start_time': session.start_time.isoformat(), 'end_time': None, 'duration': None,
+                'device_type': session.device_type, 'performance_metrics': session.performance_metrics,
+                'position': position, 'rotation': rotation
+            }
+
+        sent = size = 0
+        for poses in rounds:
+            for position, rotation in poses:
+                state = await update_session_state(position, rotation)
+                await layer.group_send(GROUP, {'type': 'broadcast_state', 'state': state})
+            for channel in channels:
+                for message in await drain(layer, channel):
+                    sent += 1
+                    size += len(json.dumps(message['state']))
+        return sent, size
+
+    async def ticked(self, engine, layer, channels, rounds):
+        session_id = str(self.session.pk)
+        for user, channel in enumerate(channels):
+            await engine.join(session_id, layer, GROUP, channel, user_id=user)
+        every = max(1, round(BENCHMARK_RATE / engine.tick_rate))
+        for number, poses in enumerate(rounds, 1):
+            for channel, (position, rotation) in zip(channels, poses):
+                engine.update(session_id, channel, position, rotation)
+            if number % every == 0:
+                await engine.tick(session_id)
+                for channel in channels:
+                    await drain(layer, channel)
+        for channel in channels:
+            await engine.leave(session_id, channel)
+        return engine.stats['messages'], engine.stats['bytes']
+
+    async def test_messages_and_bandwidth(self):
+        updates = BENCHMARK_USERS * BENCHMARK_RATE * BENCHMARK_SECONDS
+        results = {}
+        for label in ('legacy', 'ticked', 'ticked with interest radius 10'):
+            layer = InMemoryChannelLayer(capacity=BENCHMARK_USERS * BENCHMARK_RATE)
+            channels = await self.channels(layer)
+            rounds = list(self.poses())
+            start = time.perf_counter()
+            if label == 'legacy':
+                sent, size = await self.legacy(layer, channels, rounds)
+            else:
+                engine = VRStateEngine(tick_rate=30, persist_interval=0, interest_radius=10 if 'interest' in label else None)
+                sent, size = await self.ticked(engine, layer, channels, rounds)
+            results[label] = (time.perf_counter() - start, sent, size)
+
+        print(f"\n{BENCHMARK_USERS} users at {BENCHMARK_RATE} Hz for {BENCHMARK_SECONDS}s ({updates:,} updates):")
+        for label, (seconds, sent, size) in results.items():
+            print(
+                f"  {label}: {updates / seconds:,.0f} updates/s handled, {sent / BENCHMARK_SECONDS:,.0f} messages/s "
+                f"and {size / BENCHMARK_SECONDS / 1e6:.2f}MB/s broadcast"
+            )
+        self.assertLess(results['ticked'][0], results['legacy'][0])
+        self.assertLess(results['ticked'][2], results['legacy'][2] / 10)
+        self.assertLess(results['ticked with interest radius 10'][2], results['ticked'][2])
@@ -1,14 +1,20 @@
 # views.py for future_capabilities
 # This file contains the viewsets for the future_capabilities app, providing API endpoints for managing various future-oriented features.
 
+from collections import defaultdict
+import numpy as np
 from rest_framework import viewsets, permissions, status
 from rest_framework.response import Response
 from rest_framework.decorators import action
 from django_filters import rest_framework as filters
 from django.db.models import Q, Count, Avg
 from rest_framework.permissions import IsAuthenticated
-from django.db import transaction
 from .cache import cached_response, handle_bulk_operation, BulkOperationError
+from .bulk_operations import install_plugins
+from .control_sync import get_control_sync_engine
+from .neural_ingest import FULL as NEURAL_INGEST_FULL, get_neural_ingest_buffer
+from .neural_mapping import CompiledMapping, get_neural_mapping_engine
+from .plugin_runtime import PluginNotAllowed, PluginTimeout, get_plugin_worker_pool
 from .error_handling import (
     handle_api_error,
     APIError,
@@ -40,6 +46,7 @@ from .models import (
     VRInteractionLog,
     NeuralDevice,
     NeuralSignal,
+    NeuralSignalChunk,
     NeuralControl,
     WearableDevice,
     BiofeedbackData,
@@ -77,6 +84,7 @@ from .serializers import (
     VRInteractionLogSerializer,
     NeuralDeviceSerializer,
     NeuralSignalSerializer,
+    NeuralSignalChunkSerializer,
     NeuralControlSerializer,
     WearableDeviceSerializer,
     BiofeedbackDataSerializer,
@@ -548,17 +556,28 @@ class DAWControlStateViewSet(BaseSecureViewSet):
     def bulk_update(self, request):
         """
         Update multiple control states at once.
+
+        Values are coalesced per control by the control sync engine, sent
+        to the user's clients of each environment as deltas and saved at a
+        bounded rate, so automation can post every movement. Only values are
+        synchronized; ``immersive_mode`` is set by updating a control.
         """
         serializer = self.get_serializer(data=request.data, many=True)
         serializer.is_valid(raise_exception=True)
-        self.perform_bulk_create(serializer)
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
-
-    def perform_bulk_create(self, serializer):
-        """
-        Create multiple control states with user context.
-        """
-        serializer.save(user=self.request.user)
+        if any('immersive_mode' in item for item in serializer.validated_data):
+            return Response(
+                {'error': 'immersive_mode cannot be bulk updated'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        changes = defaultdict(dict)
+        for item in serializer.validated_data:
+            changes[item['environment']][item['control_id']] = item['value']
+        engine = get_control_sync_engine()
+        accepted = sum(
+            engine.update(('daw', request.user.id, environment), values)
+            for environment, values in changes.items()
+        )
+        return Response({'accepted': accepted}, status=status.HTTP_202_ACCEPTED)
 
 
 class VRInteractionLogViewSet(BaseSecureViewSet):
@@ -630,6 +649,7 @@ class NeuralDeviceViewSet(viewsets.ModelViewSet):
 class NeuralSignalViewSet(viewsets.ModelViewSet):
     """
     ViewSet for handling neural signal data with privacy considerations.
+    Listing and retrieving return the stored sample chunks.
     """
     serializer_class = NeuralSignalSerializer
     permission_classes = [IsAuthenticated]
@@ -637,27 +657,76 @@ class NeuralSignalViewSet(viewsets.ModelViewSet):
     @handle_api_error
     @action(detail=False, methods=['post'])
     def bulk_process(self, request):
-        """Process multiple neural signals in bulk."""
-        with transaction.atomic():
-            signals = request.data.get('signals', [])
-            successful_items, failed_items = handle_bulk_operation(
-                signals,
-                lambda signal: self.perform_create(self.get_serializer(data=signal))
+        """
+        Buffer multiple neural signals for chunked storage.
+
+        Each signal has a ``device``, a ``signal_type``, ``signal_data`` (a
+        list of samples, or a dict with ``samples`` and optionally
+        ``sample_rate`` and ``timestamp``) and an optional ``signal_quality``.
+        The response includes the ingestion buffer's back-pressure state.
+        """
+        signals = request.data.get('signals', [])
+        device_ids = {str(signal.get('device')) for signal in signals if isinstance(signal, dict)}
+        devices = {
+            str(device.pk): device
+            for device in NeuralDevice.objects.filter(
+                pk__in=[device_id for device_id in device_ids if device_id.isdigit()],
+                user_id=request.user.id
             )
+        }
+        ingest = get_neural_ingest_buffer()
+
+        def record(signal):
+            device = devices.get(str(signal.get('device')))
+            if device is None:
+                raise ValueError("Unknown neural device")
+            quality = signal.get('signal_quality')
+            # Enforce signal quality checks
+            min_confidence = device.settings.get('safety_thresholds', {}).get('min_confidence', 0.6)
+            if quality is not None and quality < min_confidence:
+                raise ValueError("Signal quality below safety threshold")
+            signal_data = signal.get('signal_data')
+            if not isinstance(signal_data, dict):
+                signal_data = {'samples': signal_data}
+            state = ingest.record(
+                device.pk,
+                signal.get('signal_type'),
+                signal_data.get('samples'),
+                sample_rate=signal_data.get('sample_rate'),
+                timestamp=signal_data.get('timestamp'),
+                quality=quality
+            )
+            if state == NEURAL_INGEST_FULL:
+                raise ValueError("Neural signal buffer is full, retry later")
+            return {'samples': len(signal_data['samples'])}
 
-            return Response({
-                'successful': successful_items,
-                'failed': failed_items
-            }, status=status.HTTP_201_CREATED if not failed_items else status.HTTP_207_MULTI_STATUS)
+        successful_items, failed_items = handle_bulk_operation(signals, record)
+
+        return Response({
+            'successful': successful_items,
+            'failed': failed_items,
+            'backpressure': {'state': ingest.state, 'retry_after': ingest.flush_interval}
+        }, status=status.HTTP_201_CREATED if not failed_items else status.HTTP_207_MULTI_STATUS)
 
     def get_queryset(self):
         # Only return recent signals (last 5 minutes) to limit data exposure
         recent_time = timezone.now() - timedelta(minutes=5)
+        if self.action in ('list', 'retrieve'):
+            # Samples are stored in chunks by the ingestion buffer
+            return NeuralSignalChunk.objects.filter(
+                device__user_id=self.request.user.id,
+                start_time__gte=recent_time
+            ).select_related('device').order_by('-start_time')
         return NeuralSignal.objects.filter(
             user_id=self.request.user.id,
             timestamp__gte=recent_time
         ).select_related('device')
 
+    def get_serializer_class(self):
+        if self.action in ('list', 'retrieve'):
+            return NeuralSignalChunkSerializer
+        return super().get_serializer_class()
+
     def perform_create(self, serializer):
         # Enforce signal quality and privacy checks
         device = serializer.validated_data['device']
@@ -689,30 +758,54 @@ class NeuralControlViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['post'])
     def test_mapping(self, request, pk=None):
         """
-        Test a control mapping with sample data.
+        Test a control mapping with sample data, a ``test_value`` or a list
+        of ``test_values``.
         """
         control = self.get_object()
-        test_value = float(request.data.get('test_value', 0.5))
-        
-        # Apply mapping function
-        if control.mapping_function == 'linear':
-            output = test_value
-        elif control.mapping_function == 'exponential':
-            output = test_value ** 2
-        elif control.mapping_function == 'logarithmic':
-            output = math.log(test_value + 1) / math.log(2)
-        else:  # threshold
-            output = 1.0 if test_value >= 0.5 else 0.0
-            
-        # Scale to output range
-        out_min = control.output_range['min']
-        out_max = control.output_range['max']
-        scaled_output = out_min + (out_max - out_min) * output
-        
-        return Response({
-            'input': test_value,
-            'output': scaled_output,
+        test_values = request.data.get('test_values')
+        if test_values is None:
+            test_values = [request.data.get('test_value', 0.5)]
+        try:
+            test_values = [float(value) for value in test_values]
+        except (TypeError, ValueError):
+            return Response(
+                {'error': 'Test values must be numbers'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        _, outputs = CompiledMapping([control]).apply(control.signal_type, test_values)
+
+        response = {
+            'input': test_values if 'test_values' in request.data else test_values[0],
+            'output': outputs[0].tolist() if 'test_values' in request.data else float(outputs[0, 0]),
             'mapping': control.mapping_function
+        }
+        return Response(response)
+
+    @action(detail=False, methods=['post'])
+    def map_values(self, request):
+        """
+        Map a batch of ``values`` of a ``signal_type`` through all of the
+        user's active controls.
+        """
+        signal_type = request.data.get('signal_type')
+        try:
+            values = np.asarray(request.data.get('values', []), dtype=np.float64)
+        except (TypeError, ValueError):
+            return Response(
+                {'error': 'Values must be numbers'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        mapping = get_neural_mapping_engine().get(request.user.id)
+        control_ids, outputs = mapping.apply(signal_type, values)
+
+        return Response({
+            'signal_type': signal_type,
+            'outputs': {
+                control_id: row.tolist()
+                for control_id, row in zip(control_ids, outputs)
+            }
         })
 
     @action(detail=False, methods=['post'])
@@ -854,16 +947,20 @@ class PluginViewSet(viewsets.ModelViewSet):
     @handle_api_error
     @action(detail=False, methods=['post'])
     def bulk_install(self, request):
-        """Install multiple plugins at once."""
+        """
+        Install multiple plugins at once, dependencies first.
+
+        Plugins that depend on each other are installed or rolled back
+        together; independent plugins are installed concurrently.
+        """
         plugin_ids = request.data.get('plugin_ids', [])
-        
-        def install_plugin(plugin_id):
-            plugin = self.get_object()
-            return self.install(request, pk=plugin_id).data
+        if not isinstance(plugin_ids, list):
+            raise ValidationAPIError('plugin_ids must be a list')
 
-        successful_items, failed_items = handle_bulk_operation(
+        successful_items, failed_items = install_plugins(
+            request.user.id,
             plugin_ids,
-            install_plugin
+            queryset=self.get_queryset()
         )
 
         return Response({
@@ -1042,17 +1139,20 @@ def execute_plugin(request):
     )
     
     try:
-        # Execute plugin action (placeholder for actual execution)
+        # Run the plugin in a warm worker process
+        execution = get_plugin_worker_pool().execute(
+            installation.plugin.entry_point,
+            action_type,
+            parameters,
+            installation.settings
+        )
         result = {
             'success': True,
-            'output': f"Executed {action_type} on {installation.plugin.name}"
+            'output': execution['output']
         }
         
         # Update performance metrics
-        usage_log.performance_metrics = {
-            'execution_time': 0.5,  # Example metric
-            'memory_usage': 1024    # Example metric
-        }
+        usage_log.performance_metrics = execution['performance_metrics']
         usage_log.save()
         
         # Update last used timestamp
@@ -1061,6 +1161,24 @@ def execute_plugin(request):
         
         return Response(result)
         
+    except PluginTimeout as e:
+        usage_log.error_log = str(e)
+        usage_log.save()
+        
+        return Response(
+            {'error': str(e)},
+            status=status.HTTP_504_GATEWAY_TIMEOUT
+        )
+
+    except PluginNotAllowed as e:
+        usage_log.error_log = str(e)
+        usage_log.save()
+
+        return Response(
+            {'error': str(e)},
+            status=status.HTTP_403_FORBIDDEN
+        )
+        
     except Exception as e:
         usage_log.error_log = str(e)
         usage_log.save()
@@ -1119,49 +1237,10 @@ def process_neural_signal(request):
     signal_serializer.is_valid(raise_exception=True)
     signal = signal_serializer.save(user_id=request.user.id)
     
-    # Apply control mappings
-    active_controls = NeuralControl.objects.filter(
-        user_id=request.user.id,
-        signal_type=signal.signal_type,
-        enabled=True
-    )
-    
-    control_updates = []
-    for control in active_controls:
-        try:
-            # Scale and map the signal value
-            input_min = control.input_range['min']
-            input_max = control.input_range['max']
-            normalized_value = (signal.processed_value - input_min) / (input_max - input_min)
-            
-            if control.mapping_function == 'exponential':
-                mapped_value = normalized_value ** 2
-            elif control.mapping_function == 'logarithmic':
-                mapped_value = math.log(normalized_value + 1) / math.log(2)
-            elif control.mapping_function == 'threshold':
-                mapped_value = 1.0 if normalized_value >= 0.5 else 0.0
-            else:  # linear
-                mapped_value = normalized_value
-            
-            out_min = control.output_range['min']
-            out_max = control.output_range['max']
-            final_value = out_min + (out_max - out_min) * mapped_value
-            
-            control_updates.append({
-                'control': control.name,
-                'parameter': control.control_parameter,
-                'value': final_value
-            })
-            
-        except Exception as e:
-            # If any mapping fails, use fallback value
-            control_updates.append({
-                'control': control.name,
-                'parameter': control.control_parameter,
-                'value': control.fallback_value,
-                'fallback_used': True
-            })
-    
+    # Apply the user's compiled control mappings
+    mapping = get_neural_mapping_engine().get(request.user.id)
+    control_updates = mapping.control_updates(signal.signal_type, signal.processed_value)
+
     return Response({
         'signal_id': signal.id,
         'control_updates': control_updates
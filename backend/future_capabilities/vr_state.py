@@ -0,0 +1,318 @@
+"""
+In-memory VR session state broadcast at a fixed tick rate.
+
+``VRSessionConsumer`` hands each ``update_position`` message to the state
+engine, which only overwrites the sender's pose in its session's state.
+A tick task per session runs ``TICK_RATE`` times a second and broadcasts
+the entities whose pose changed since the previous tick, so headsets
+sending at 60-90 Hz cost one small group message per tick instead of a
+database save and a full-state broadcast per update.
+
+Poses are rounded to ``PRECISION`` decimals, so jitter below that is never
+sent, and encoded as ``[x, y, z, rx, ry, rz]`` keyed by a small entity id.
+A client gets a keyframe with every pose when it joins and deltas after::
+
+    {"type": "vr_delta", "tick": 42, "entities": {"3": [1.0, 1.6, -2.25, 0, 90, 0]},
+     "users": {"3": "17"}, "removed": [5]}
+
+``users`` maps entities the client has not seen before to their user ids.
+When ``INTEREST_RADIUS`` is set, each client gets its own delta holding
+only the entities within that distance of its own position.
+
+The last pose of each user is saved under
+``performance_metrics['vr_state']`` of the ``VRSession`` every
+``PERSIST_INTERVAL`` seconds while poses change, and when a client leaves.
+State lives in the process that accepted the connection, so all clients of
+a session must be served by one process.
+"""
+import asyncio
+import json
+import logging
+import math
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Set, Tuple
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    # Broadcasts per second per session
+    'TICK_RATE': 30,
+    # Seconds between saves of a session's poses; 0 saves only on leave
+    'PERSIST_INTERVAL': 30.0,
+    # Decimals kept for positions and rotations
+    'PRECISION': 3,
+    # Only send entities within this distance of each client; None sends all
+    'INTEREST_RADIUS': None,
+}
+
+AXES = ('x', 'y', 'z')
+
+Pose = Tuple[float, float, float, float, float, float]
+
+
+def vr_state_setting(name: str):
+    return getattr(settings, 'VR_STATE', {}).get(name, DEFAULTS[name])
+
+
+def parse_vector(value, name: str) -> Tuple[float, float, float]:
+    """An ``{'x', 'y', 'z'}`` dict or a 3-item list as floats."""
+    if isinstance(value, dict):
+        value = [value.get(axis) for axis in AXES]
+    if not isinstance(value, (list, tuple)) or len(value) != 3:
+        raise ValueError(f"{name} must have x, y and z")
+    for component in value:
+        if isinstance(component, bool) or not isinstance(component, (int, float)) or not math.isfinite(component):
+            raise ValueError(f"{name} must have finite numeric x, y and z")
+    return tuple(float(component) for component in value)
+
+
+def encode(payload: Dict) -> str:
+    return json.dumps(payload, separators=(',', ':'))
+
+
+class SessionState:
+    """Poses and connected clients of one VR session."""
+
+    def __init__(self, session_id: str, channel_layer, group_name: str):
+        self.session_id = session_id
+        self.channel_layer = channel_layer
+        self.group_name = group_name
+        self.clients: Dict[str, int] = {}
+        self.users: Dict[int, str] = {}
+        self.poses: Dict[int, Pose] = {}
+        # Poses as of the last tick
+        self.sent: Dict[int, Pose] = {}
+        self.removed: List[int] = []
+        # Entities each client has been sent, with interest management
+        self.known: Dict[str, Set[int]] = {}
+        self.tick = 0
+        self.next_entity = 1
+        self.task: Optional[asyncio.Task] = None
+        self.changed_since_persist = False
+        self.persisted_at = time.monotonic()
+
+    def snapshot(self) -> Dict:
+        return {
+            'tick': self.tick,
+            'updated_at': timezone.now().isoformat(),
+            'poses': {
+                self.users[entity]: {'position': list(pose[:3]), 'rotation': list(pose[3:])}
+                for entity, pose in self.poses.items()
+            }
+        }
+
+
+class VRStateEngine:
+    """
+    Keeps VR session state in memory and broadcasts it in ticks.
+    """
+
+    def __init__(
+        self,
+        tick_rate: Optional[float] = None,
+        persist_interval: Optional[float] = None,
+        precision: Optional[int] = None,
+        interest_radius: Optional[float] = None
+    ):
+        self.tick_rate = tick_rate if tick_rate is not None else vr_state_setting('TICK_RATE')
+        self.persist_interval = persist_interval if persist_interval is not None else vr_state_setting('PERSIST_INTERVAL')
+        self.precision = precision if precision is not None else vr_state_setting('PRECISION')
+        self.interest_radius = interest_radius if interest_radius is not None else vr_state_setting('INTEREST_RADIUS')
+        self.sessions: Dict[str, SessionState] = {}
+        # updates, ticks, messages and bytes sent
+        self.stats: Counter = Counter()
+
+    async def join(
+        self, session_id: str, channel_layer, group_name: str, channel_name: str, user_id=None
+    ) -> Tuple[int, str]:
+        """
+        Add a client to the session, starting its ticks. Returns the client's
+        entity id and the encoded keyframe to send it.
+        """
+        state = self.sessions.get(session_id)
+        if state is None:
+            state = self.sessions[session_id] = SessionState(session_id, channel_layer, group_name)
+        entity = state.next_entity
+        state.next_entity += 1
+        state.clients[channel_name] = entity
+        state.users[entity] = str(user_id) if user_id is not None else str(entity)
+        if self.interest_radius is not None:
+            state.known[channel_name] = set(state.sent)
+        if self.tick_rate > 0 and (state.task is None or state.task.done()):
+            state.task = asyncio.get_running_loop().create_task(self._run(state))
+
+        return entity, encode({
+            'type': 'vr_keyframe',
+            'tick': state.tick,
+            'entity': entity,
+            'entities': {entity_id: list(pose) for entity_id, pose in state.sent.items()},
+            'users': {entity_id: state.users[entity_id] for entity_id in state.sent}
+        })
+
+    def update(self, session_id: str, channel_name: str, position, rotation) -> None:
+        """Set the client's pose; it goes out with the next tick."""
+        state = self.sessions.get(session_id)
+        if state is None or channel_name not in state.clients:
+            raise ValueError('Not joined to this VR session')
+        digits = self.precision
+        pose = tuple(
+            round(component, digits)
+            for component in parse_vector(position, 'position') + parse_vector(rotation, 'rotation')
+        )
+        entity = state.clients[channel_name]
+        if state.poses.get(entity) != pose:
+            state.poses[entity] = pose
+            state.changed_since_persist = True
+        self.stats['updates'] += 1
+
+    async def leave(self, session_id: str, channel_name: str) -> None:
+        """Remove a client, saving the session's poses."""
+        state = self.sessions.get(session_id)
+        if state is None or channel_name not in state.clients:
+            return
+        # Saved before removal so the leaving user's last pose is kept
+        snapshot = state.snapshot()
+        entity = state.clients.pop(channel_name)
+        state.known.pop(channel_name, None)
+        state.poses.pop(entity, None)
+        if entity in state.sent:
+            # Its removal goes out with the next tick
+            state.removed.append(entity)
+        else:
+            state.users.pop(entity, None)
+
+        if not state.clients:
+            self.sessions.pop(session_id, None)
+            if state.task is not None:
+                state.task.cancel()
+        await self.persist(state, snapshot)
+
+    async def tick(self, session_id: str) -> int:
+        """Broadcast the session's changes. Returns the number of messages sent."""
+        state = self.sessions.get(session_id)
+        return await self._tick(state) if state is not None else 0
+
+    async def _tick(self, state: SessionState) -> int:
+        state.tick += 1
+        self.stats['ticks'] += 1
+        changed = {entity: pose for entity, pose in state.poses.items() if state.sent.get(entity) != pose}
+        removed, state.removed = state.removed, []
+        new = [entity for entity in changed if entity not in state.sent]
+        state.sent.update(changed)
+        for entity in removed:
+            state.sent.pop(entity, None)
+            state.users.pop(entity, None)
+
+        if self.interest_radius is None:
+            if not changed and not removed:
+                return 0
+            payload = encode({
+                'type': 'vr_delta',
+                'tick': state.tick,
+                'entities': {entity: list(pose) for entity, pose in changed.items()},
+                'users': {entity: state.users[entity] for entity in new},
+                'removed': removed
+            })
+            await state.channel_layer.group_send(state.group_name, {'type': 'vr_state', 'text': payload})
+            self._count(len(state.clients), len(payload))
+            return len(state.clients)
+
+        sent = 0
+        for channel_name, entity in list(state.clients.items()):
+            origin = state.sent.get(entity)
+            visible = {
+                other for other, pose in state.sent.items()
+                if origin is None or math.dist(pose[:3], origin[:3]) <= self.interest_radius
+            }
+            known = state.known.get(channel_name, set())
+            entities = {other: list(state.sent[other]) for other in visible if other in changed or other not in known}
+            gone = sorted(known - visible)
+            state.known[channel_name] = visible
+            if not entities and not gone:
+                continue
+            payload = encode({
+                'type': 'vr_delta',
+                'tick': state.tick,
+                'entities': entities,
+                'users': {other: state.users[other] for other in entities if other not in known},
+                'removed': gone
+            })
+            await state.channel_layer.send(channel_name, {'type': 'vr_state', 'text': payload})
+            self._count(1, len(payload))
+            sent += 1
+        return sent
+
+    def _count(self, messages: int, size: int) -> None:
+        self.stats['messages'] += messages
+        self.stats['bytes'] += messages * size
+
+    async def _run(self, state: SessionState) -> None:
+        loop = asyncio.get_running_loop()
+        interval = 1 / self.tick_rate
+        deadline = loop.time()
+        while state.clients:
+            deadline += interval
+            delay = deadline - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                # Fell behind; skip the missed ticks
+                deadline = loop.time()
+                await asyncio.sleep(0)
+            try:
+                await self._tick(state)
+                if (
+                    self.persist_interval > 0 and state.changed_since_persist
+                    and time.monotonic() - state.persisted_at >= self.persist_interval
+                ):
+                    await self.persist(state)
+            except Exception as e:
+                logger.error(f"Error in VR state tick for session {state.session_id}: {str(e)}")
+
+    async def persist(self, state: SessionState, snapshot: Optional[Dict] = None) -> bool:
+        """Save the session's poses to its ``VRSession``."""
+        if not state.changed_since_persist:
+            return False
+        state.changed_since_persist = False
+        state.persisted_at = time.monotonic()
+        try:
+            return await self._save(state.session_id, snapshot or state.snapshot())
+        except Exception as e:
+            state.changed_since_persist = True
+            logger.error(f"Error saving VR state for session {state.session_id}: {str(e)}")
+            return False
+
+    @database_sync_to_async
+    def _save(self, session_id: str, snapshot: Dict) -> bool:
+        from .models import VRSession
+
+        try:
+            session = VRSession.objects.get(pk=int(session_id))
+        except (ValueError, VRSession.DoesNotExist):
+            return False
+        # Users who left keep their last saved pose
+        previous = session.performance_metrics.get('vr_state', {}).get('poses', {})
+        snapshot = {**snapshot, 'poses': {**previous, **snapshot['poses']}}
+        session.performance_metrics = {**session.performance_metrics, 'vr_state': snapshot}
+        session.save(update_fields=['performance_metrics'])
+        return True
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_vr_state_engine() -> VRStateEngine:
+    """Get the process-wide VR state engine"""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = VRStateEngine()
+    return _engine
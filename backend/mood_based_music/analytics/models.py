@@ -25,6 +25,7 @@ class TrackInteraction(models.Model):
         indexes = [
             models.Index(fields=['user', 'track', 'interaction_type']),
             models.Index(fields=['track', 'interaction_type']),
+            models.Index(fields=['track', 'created_at']),
         ]
 
 class MoodAccuracyFeedback(models.Model):
@@ -97,4 +98,34 @@ class ModelImprovementSuggestion(models.Model):
         ordering = ['-created_at']
         indexes = [
             models.Index(fields=['mood', 'current_accuracy']),
-        ] 
\ No newline at end of file
+        ]
+
+
+class TrackInteractionDailyRollup(models.Model):
+    """
+    Pre-aggregated daily interaction counters per track.
+
+    Rows are maintained by the ``rollup_track_interactions`` periodic task so
+    historical analytics ranges never have to touch raw interaction rows.
+    """
+    id = models.BigAutoField(primary_key=True)
+    track = models.ForeignKey(GeneratedMoodTrack, on_delete=models.CASCADE)
+    date = models.DateField()
+    total_count = models.IntegerField(default=0)
+    play_count = models.IntegerField(default=0)
+    skip_count = models.IntegerField(default=0)
+    replay_count = models.IntegerField(default=0)
+    complete_count = models.IntegerField(default=0)
+    play_duration_sum = models.BigIntegerField(default=0)
+    play_duration_count = models.IntegerField(default=0)
+    last_updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-date']
+        constraints = [
+            models.UniqueConstraint(fields=['track', 'date'], name='unique_track_interaction_rollup'),
+        ]
+        indexes = [
+            models.Index(fields=['track', 'date']),
+            models.Index(fields=['date']),
+        ]
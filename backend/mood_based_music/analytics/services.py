@@ -1,20 +1,58 @@
-from django.db.models import Count, Avg, Q, F
+from django.core.cache import cache
+from django.db.models import Count, Avg, Sum, Max, Min, Q, F
+from django.db.models.functions import TruncDate
 from django.utils import timezone
-from datetime import timedelta
+from datetime import date, datetime, time, timedelta
 from django.db import transaction
 from .models import (
     TrackInteraction,
+    TrackInteractionDailyRollup,
     MoodAccuracyFeedback,
     MoodMetrics,
     UserMoodStats,
     ModelImprovementSuggestion
 )
 from ..models import GeneratedMoodTrack, Mood
-from typing import Dict, List, Any
+from ..services.trending_service import get_trending_engine
+from typing import Dict, List, Any, Optional
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Counter columns shared by the raw conditional aggregate and the rollup table
+ROLLUP_COUNTER_FIELDS = (
+    'total_count',
+    'play_count',
+    'skip_count',
+    'replay_count',
+    'complete_count',
+    'play_duration_sum',
+    'play_duration_count',
+)
+ROLLUP_WATERMARK_CACHE_KEY = 'mood_analytics:rollup_watermark'
+ROLLUP_BATCH_SIZE = 5000
+
+
+def _interaction_aggregates() -> Dict[str, Any]:
+    """
+    Conditional aggregates computing every interaction counter in one pass.
+    """
+    played = Q(interaction_type='play')
+    return {
+        'total_count': Count('id'),
+        'play_count': Count('id', filter=played),
+        'skip_count': Count('id', filter=Q(interaction_type='skip')),
+        'replay_count': Count('id', filter=Q(interaction_type='replay')),
+        'complete_count': Count('id', filter=Q(interaction_type='complete')),
+        'play_duration_sum': Sum('duration', filter=played),
+        'play_duration_count': Count('duration', filter=played),
+    }
+
+
+def _start_of_day(day: date) -> datetime:
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
 class MoodAnalyticsService:
     @staticmethod
     def get_track_analytics(track_id: str, user_id: int) -> Dict[str, Any]:
@@ -22,20 +60,30 @@ class MoodAnalyticsService:
         Get comprehensive analytics for a specific track.
         """
         try:
-            track = GeneratedMoodTrack.objects.get(id=track_id)
+            track = GeneratedMoodTrack.objects.select_related(
+                'mood_request__selected_mood'
+            ).get(id=track_id)
             
             # Get interaction metrics
-            interactions = TrackInteraction.objects.filter(track=track)
+            counters = MoodAnalyticsService.get_interaction_counters(track.id)
+            total = max(counters['total_count'], 1)
             metrics = {
-                'play_count': interactions.filter(interaction_type='play').count(),
-                'skip_count': interactions.filter(interaction_type='skip').count(),
-                'completion_rate': interactions.filter(interaction_type='complete').count() / max(interactions.count(), 1),
-                'replay_rate': interactions.filter(interaction_type='replay').count() / max(interactions.count(), 1),
-                'average_play_duration': interactions.filter(interaction_type='play').aggregate(Avg('duration'))['duration__avg'] or 0
+                'play_count': counters['play_count'],
+                'skip_count': counters['skip_count'],
+                'completion_rate': counters['complete_count'] / total,
+                'replay_rate': counters['replay_count'] / total,
+                'average_play_duration': (
+                    counters['play_duration_sum'] / counters['play_duration_count']
+                    if counters['play_duration_count'] else 0
+                )
             }
             
             # Get feedback
             feedback = MoodAccuracyFeedback.objects.filter(track=track)
+            feedback_stats = feedback.aggregate(
+                perceived_intensity=Avg('perceived_intensity'),
+                confidence=Avg('accuracy_rating')
+            )
             
             # Calculate mood accuracy
             mood_accuracy = {
@@ -47,8 +95,8 @@ class MoodAnalyticsService:
                 'perceived': {
                     'mood_id': track.mood_request.selected_mood.id if track.mood_request.selected_mood else None,
                     'mood_name': track.mood_request.selected_mood.name if track.mood_request.selected_mood else None,
-                    'intensity': feedback.aggregate(Avg('perceived_intensity'))['perceived_intensity__avg'] or 0,
-                    'confidence': feedback.aggregate(Avg('accuracy_rating'))['accuracy_rating__avg'] or 0
+                    'intensity': feedback_stats['perceived_intensity'] or 0,
+                    'confidence': feedback_stats['confidence'] or 0
                 }
             }
             
@@ -66,6 +114,129 @@ class MoodAnalyticsService:
             logger.error(f"Error getting track analytics: {str(e)}")
             return None
 
+    @staticmethod
+    def get_interaction_counters(
+        track_id: int,
+        start_date: Optional[date] = None,
+        end_date: Optional[date] = None
+    ) -> Dict[str, int]:
+        """
+        Get interaction counters for a track over an optional date range.
+
+        Days up to the rollup watermark are read from pre-aggregated daily
+        rows; only the days after it are aggregated from raw interactions.
+        """
+        counters = dict.fromkeys(ROLLUP_COUNTER_FIELDS, 0)
+        watermark = MoodAnalyticsService.get_rollup_watermark()
+
+        if watermark is not None and (start_date is None or start_date <= watermark):
+            rollups = TrackInteractionDailyRollup.objects.filter(
+                track_id=track_id,
+                date__lte=min(watermark, end_date) if end_date else watermark
+            )
+            if start_date:
+                rollups = rollups.filter(date__gte=start_date)
+            totals = rollups.aggregate(**{field: Sum(field) for field in ROLLUP_COUNTER_FIELDS})
+            for field in ROLLUP_COUNTER_FIELDS:
+                counters[field] += totals[field] or 0
+
+        raw_start = watermark + timedelta(days=1) if watermark is not None else None
+        if start_date and (raw_start is None or start_date > raw_start):
+            raw_start = start_date
+        if end_date is None or raw_start is None or raw_start <= end_date:
+            interactions = TrackInteraction.objects.filter(track_id=track_id)
+            if raw_start:
+                interactions = interactions.filter(created_at__gte=_start_of_day(raw_start))
+            if end_date:
+                interactions = interactions.filter(
+                    created_at__lt=_start_of_day(end_date + timedelta(days=1))
+                )
+            totals = interactions.aggregate(**_interaction_aggregates())
+            for field in ROLLUP_COUNTER_FIELDS:
+                counters[field] += totals[field] or 0
+
+        return counters
+
+    @staticmethod
+    def get_rollup_watermark() -> Optional[date]:
+        """
+        Get the last day fully covered by interaction rollups.
+        """
+        watermark = cache.get(ROLLUP_WATERMARK_CACHE_KEY)
+        if watermark is None:
+            watermark = TrackInteractionDailyRollup.objects.aggregate(
+                last_date=Max('date')
+            )['last_date']
+            if watermark is not None:
+                cache.set(ROLLUP_WATERMARK_CACHE_KEY, watermark, None)
+        return watermark
+
+    @staticmethod
+    def rollup_interactions(through: Optional[date] = None) -> int:
+        """
+        Incrementally roll raw interactions up into daily per-track rows.
+
+        Picks up from the day after the current watermark and stops at
+        ``through`` (yesterday by default). ``through`` is clamped to
+        yesterday so the current day is never frozen.
+        Returns the number of rollup rows written.
+        """
+        yesterday = timezone.localdate() - timedelta(days=1)
+        through = min(through, yesterday) if through is not None else yesterday
+        watermark = MoodAnalyticsService.get_rollup_watermark()
+
+        if watermark is not None:
+            start = watermark + timedelta(days=1)
+        else:
+            first = TrackInteraction.objects.aggregate(first=Min('created_at'))['first']
+            if first is None:
+                return 0
+            start = timezone.localdate(first)
+
+        if start > through:
+            return 0
+
+        grouped = (
+            TrackInteraction.objects.filter(
+                created_at__gte=_start_of_day(start),
+                created_at__lt=_start_of_day(through + timedelta(days=1))
+            )
+            .annotate(day=TruncDate('created_at'))
+            .values('track_id', 'day')
+            .annotate(**_interaction_aggregates())
+            .order_by()
+        )
+
+        written = 0
+        batch = []
+        with transaction.atomic():
+            for row in grouped.iterator(chunk_size=ROLLUP_BATCH_SIZE):
+                batch.append(TrackInteractionDailyRollup(
+                    track_id=row['track_id'],
+                    date=row['day'],
+                    **{field: row[field] or 0 for field in ROLLUP_COUNTER_FIELDS}
+                ))
+                if len(batch) >= ROLLUP_BATCH_SIZE:
+                    written += MoodAnalyticsService._upsert_rollups(batch)
+                    batch = []
+            if batch:
+                written += MoodAnalyticsService._upsert_rollups(batch)
+
+        cache.set(ROLLUP_WATERMARK_CACHE_KEY, through, None)
+
+        logger.info(f"Rolled up {written} track interaction rows from {start} to {through}")
+        return written
+
+    @staticmethod
+    def _upsert_rollups(rollups: List[TrackInteractionDailyRollup]) -> int:
+        TrackInteractionDailyRollup.objects.bulk_create(
+            rollups,
+            update_conflicts=True,
+            unique_fields=['track', 'date'],
+            update_fields=list(ROLLUP_COUNTER_FIELDS) + ['last_updated']
+        )
+        return len(rollups)
+
     @staticmethod
     def get_user_analytics(user_id: int) -> Dict[str, Any]:
         """
@@ -136,12 +307,19 @@ class MoodAnalyticsService:
         Record a user interaction with a track.
         """
         try:
-            TrackInteraction.objects.create(
+            interaction = TrackInteraction.objects.create(
                 track_id=track_id,
                 user_id=user_id,
                 interaction_type=event['type'],
                 duration=event.get('duration')
             )
+            # Usage only moves blends that are already on the leaderboard
+            transaction.on_commit(
+                lambda: get_trending_engine().record_event(
+                    int(track_id), event['type'],
+                    timestamp=interaction.created_at.timestamp(), only_existing=True
+                )
+            )
             return True
         except Exception as e:
             logger.error(f"Error tracking interaction: {str(e)}")
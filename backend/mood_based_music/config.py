@@ -15,6 +15,11 @@ class MoodConfig:
     CACHE_TTL = int(os.getenv('CACHE_TTL', 3600))  # 1 hour default
     CACHE_PREFIX = 'mood_music:'
     
+    # Provider Orchestration
+    PROVIDER_CHAIN = [name.strip() for name in os.getenv('MOOD_PROVIDER_CHAIN', 'suno,mubert').split(',') if name.strip()]
+    PROVIDER_HEDGE_DELAY = float(os.getenv('PROVIDER_HEDGE_DELAY', 60))  # Seconds before hedging until p95 is known
+    GENERATION_CACHE_TTL = int(os.getenv('GENERATION_CACHE_TTL', 3600))  # 0 disables result caching
+    
     # Rate Limiting
     RATE_LIMIT_TRACKS = int(os.getenv('RATE_LIMIT_TRACKS', 100))  # Tracks per user per day
     RATE_LIMIT_WINDOW = int(os.getenv('RATE_LIMIT_WINDOW', 86400))  # 24 hours in seconds
@@ -26,6 +31,13 @@ class MoodConfig:
     # Analytics
     ANALYTICS_BATCH_SIZE = int(os.getenv('ANALYTICS_BATCH_SIZE', 100))
     ANALYTICS_FLUSH_INTERVAL = int(os.getenv('ANALYTICS_FLUSH_INTERVAL', 300))  # 5 minutes
+    TRENDING_BACKEND = os.getenv('TRENDING_BACKEND', 'redis')  # 'redis' or 'memory'
+    TRENDING_HALF_LIFE_HOURS = float(os.getenv('TRENDING_HALF_LIFE_HOURS', 24))
+    TRENDING_MAX_LIMIT = int(os.getenv('TRENDING_MAX_LIMIT', 100))
+    
+    # Live Sessions
+    SESSION_STATE_BACKEND = os.getenv('SESSION_STATE_BACKEND', 'redis')  # 'redis' or 'memory'
+    SESSION_FLUSH_INTERVAL = float(os.getenv('SESSION_FLUSH_INTERVAL', 5))  # Seconds between DB snapshots
     
     # Security
     ENABLE_RLS = True  # Row Level Security is always enabled in production
@@ -1,7 +1,10 @@
+from functools import partial
+from asgiref.sync import sync_to_async
 from channels.generic.websocket import AsyncJsonWebsocketConsumer
 from channels.db import database_sync_to_async
 from django.core.exceptions import ValidationError
-from .models import MoodRequest
+from .models import MoodRequest, LiveMoodSession, CollaborativeMoodSpace
+from .services.session_state import SessionNotActive, SessionNotSaved, get_session_state_engine
 import logging
 
 logger = logging.getLogger(__name__)
@@ -76,4 +79,152 @@ class MoodGenerationConsumer(AsyncJsonWebsocketConsumer):
             return False
         except Exception as e:
             logger.error(f"Error checking request access: {str(e)}")
-            return False 
\ No newline at end of file
+            return False 
+
+class LiveMoodSessionConsumer(AsyncJsonWebsocketConsumer):
+    """
+    WebSocket consumer for live mood sessions and collaborative mood spaces.
+
+    Session state is read and written through the live session state engine;
+    the database only receives write-behind snapshots. State store calls may
+    reach Redis, so they run in a worker thread rather than on the event loop.
+
+    Membership is checked against the state store on every message, so a
+    user who left (on this or another connection) cannot keep editing. Only
+    the session owner or staff can invite participants and end the session.
+    """
+
+    moderated_messages = ('invite', 'end_session')
+
+    async def connect(self):
+        """
+        Handle WebSocket connection.
+        """
+        try:
+            self.kind = self.scope['url_route']['kwargs']['kind']
+            self.session_id = int(self.scope['url_route']['kwargs']['session_id'])
+            self.user = self.scope["user"]
+            self.engine = get_session_state_engine()
+            self.group_name = self.engine.group_name(self.kind, self.session_id)
+
+            if not await self.load_session():
+                await self.close()
+                return
+
+            await self.channel_layer.group_add(self.group_name, self.channel_name)
+            await self.accept()
+            await self.send_json({
+                'type': 'snapshot',
+                **await sync_to_async(self.engine.get_snapshot, thread_sensitive=False)(self.kind, self.session_id)
+            })
+
+        except Exception as e:
+            logger.error(f"Error in live session connection: {str(e)}")
+            await self.close()
+
+    async def disconnect(self, close_code):
+        """
+        Handle WebSocket disconnection.
+        """
+        try:
+            if not hasattr(self, 'group_name'):
+                return
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+            await database_sync_to_async(self.engine.flush)(self.kind, self.session_id)
+
+        except Exception as e:
+            logger.error(f"Error in live session disconnection: {str(e)}")
+
+    async def receive_json(self, content):
+        """
+        Apply mood updates and participant changes sent by the client.
+        """
+        message_type = content.get('type')
+
+        try:
+            is_participant = await sync_to_async(self.engine.is_participant, thread_sensitive=False)(
+                self.kind, self.session_id, self.user.id
+            )
+        except SessionNotActive:
+            await self.close_with_error('Session has ended')
+            return
+        if not is_participant:
+            await self.close_with_error('You are not a participant of this session')
+            return
+        if message_type in self.moderated_messages and not self.can_moderate:
+            await self.send_json({'type': 'error', 'message': 'Only the session owner can do that'})
+            return
+
+        if message_type == 'update_mood':
+            changes = content.get('changes')
+            if not isinstance(changes, dict) or not changes:
+                await self.send_json({'type': 'error', 'message': 'changes must be a non-empty object'})
+                return
+            call = partial(self.engine.update_mood, self.kind, self.session_id, changes, self.user.id)
+        elif message_type == 'invite' and self.kind == 'space':
+            user_id = content.get('user_id')
+            if not isinstance(user_id, int):
+                await self.send_json({'type': 'error', 'message': 'user_id must be an integer'})
+                return
+            call = partial(self.engine.join, self.kind, self.session_id, user_id)
+        elif message_type == 'leave' and self.kind == 'space':
+            call = partial(self.engine.leave, self.kind, self.session_id, self.user.id)
+        elif message_type == 'end_session' and self.kind == 'live':
+            try:
+                await database_sync_to_async(self.engine.end_session)(self.kind, self.session_id)
+            except SessionNotSaved:
+                await self.send_json({'type': 'error', 'message': 'Session could not be saved, please try again'})
+                return
+            await self.channel_layer.group_send(
+                self.group_name,
+                {'type': 'session_delta', 'delta': {'type': 'session_ended'}}
+            )
+            return
+        else:
+            await self.send_json({'type': 'error', 'message': f"Unsupported message type: {message_type}"})
+            return
+
+        try:
+            delta = await sync_to_async(call, thread_sensitive=False)()
+        except SessionNotActive:
+            await self.close_with_error('Session has ended')
+            return
+
+        await self.engine.publish(self.channel_layer, self.kind, self.session_id, delta)
+        if self.engine.is_flush_due(self.kind, self.session_id):
+            await database_sync_to_async(self.engine.flush)(self.kind, self.session_id)
+        if message_type == 'leave':
+            await self.close()
+
+    async def close_with_error(self, message):
+        await self.send_json({'type': 'error', 'message': message})
+        await self.close()
+
+    async def session_delta(self, event):
+        """
+        Forward session deltas from the channel layer to the client.
+
+        Connections are closed once the session has ended.
+        """
+        await self.send_json(event['delta'])
+        if event['delta']['type'] == 'session_ended':
+            await self.close()
+
+    @database_sync_to_async
+    def load_session(self) -> bool:
+        """
+        Load the session into the engine and check the user may access it.
+        """
+        try:
+            self.engine.ensure_loaded(self.kind, self.session_id)
+        except (LiveMoodSession.DoesNotExist, CollaborativeMoodSpace.DoesNotExist, SessionNotActive):
+            return False
+
+        snapshot = self.engine.get_snapshot(self.kind, self.session_id)
+        if snapshot is None or self.user.id not in snapshot['participants']:
+            return False
+        self.can_moderate = (
+            self.user.is_superuser or self.user.is_staff
+            or self.engine.get_owner_id(self.kind, self.session_id) == self.user.id
+        )
+        return True
@@ -0,0 +1,19 @@
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('mood_based_music', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='collaborativemoodspace',
+            name='owner',
+            field=models.ForeignKey(blank=True, help_text='User who created the mood space and may invite participants.', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='owned_mood_spaces', to=settings.AUTH_USER_MODEL, verbose_name='Owner'),
+        ),
+    ]
@@ -197,6 +197,7 @@ class CollaborativeMoodSpace(models.Model):
     """
     id = models.BigAutoField(primary_key=True)
     space_name = models.TextField(verbose_name=_("Space Name"), help_text=_("Name of the collaborative mood space."))
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, related_name='owned_mood_spaces', verbose_name=_("Owner"), help_text=_("User who created the mood space and may invite participants."))
     participant_ids = ArrayField(models.BigIntegerField(), verbose_name=_("Participant IDs"), help_text=_("Array of user IDs participating in the mood space."))
     combined_mood_state = JSONField(null=True, blank=True, verbose_name=_("Combined Mood State"), help_text=_("JSON object containing the blended mood from all participants."))
     created_at = models.DateTimeField(auto_now_add=True, verbose_name=_("Created At"), help_text=_("Timestamp when the mood space was created."))
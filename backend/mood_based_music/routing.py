@@ -0,0 +1,6 @@
+from django.urls import re_path
+from . import consumers
+
+websocket_urlpatterns = [
+    re_path(r'ws/mood/(?P<kind>live|space)/(?P<session_id>\d+)/$', consumers.LiveMoodSessionConsumer.as_asgi()),
+]
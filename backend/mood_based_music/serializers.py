@@ -152,8 +152,8 @@ class CollaborativeMoodSpaceSerializer(serializers.ModelSerializer):
     """
     class Meta:
         model = CollaborativeMoodSpace
-        fields = ['id', 'space_name', 'participant_ids', 'combined_mood_state', 'created_at']
-        read_only_fields = ['id', 'created_at']
+        fields = ['id', 'space_name', 'owner', 'participant_ids', 'combined_mood_state', 'created_at']
+        read_only_fields = ['id', 'owner', 'created_at']
 
     def validate(self, attrs):
         # Ensure current user is in participant_ids
@@ -10,7 +10,8 @@ from ..models import (
     CollaborativeMoodSpace,
     AdvancedMoodParameter
 )
-from ..ai_providers import get_ai_provider
+from .provider_orchestrator import get_provider_orchestrator
+from .trending_service import get_trending_engine
 import numpy as np
 from datetime import datetime, timedelta
 import logging
@@ -21,7 +22,7 @@ class AdvancedMoodService:
     """Service for handling advanced mood-based music generation features."""
 
     def __init__(self):
-        self.ai_provider = get_ai_provider()
+        self.ai_provider = get_provider_orchestrator()
 
     @transaction.atomic
     async def create_multi_mood_blend(
@@ -80,6 +81,12 @@ class AdvancedMoodService:
             }
         )
 
+        transaction.on_commit(
+            lambda: get_trending_engine().record_event(
+                track.id, 'created', timestamp=track.created_at.timestamp()
+            )
+        )
+
         return track
 
     async def generate_music_with_transitions(self, params: Dict[str, Any]) -> Dict[str, Any]:
@@ -322,7 +329,10 @@ class AdvancedMoodService:
         
     def get_trending_blends(self, limit: int = 10) -> List[Dict[str, Any]]:
         """
-        Get trending multi-mood blends based on user feedback.
+        Get trending multi-mood blends based on decayed usage and feedback.
+        
+        Ranking comes from the incrementally maintained trending leaderboard,
+        so only the top ``limit`` tracks are loaded from the database.
         
         Args:
             limit: Maximum number of blends to return
@@ -330,25 +340,23 @@ class AdvancedMoodService:
         Returns:
             List of trending blends with their metadata
         """
-        from django.db.models import Count, Avg
-        
-        # Find tracks with multi-mood blend type and positive feedback
-        trending = GeneratedMoodTrack.objects.filter(
-            mood_request__parameters__type="multi_mood_blend"
-        ).annotate(
-            feedback_count=Count('moodfeedback'),
-            average_rating=Avg('moodfeedback__rating')
-        ).order_by('-average_rating', '-feedback_count')[:limit]
+        ranked = get_trending_engine().top(limit)
+        tracks = GeneratedMoodTrack.objects.select_related('mood_request').in_bulk(
+            [track_id for track_id, _ in ranked]
+        )
         
         result = []
-        for track in trending:
+        for track_id, score in ranked:
+            track = tracks.get(track_id)
+            if track is None:
+                continue
+            parameters = track.mood_request.parameters or {}
             result.append({
                 "track_id": track.id,
                 "file_url": track.file_url,
-                "moods": track.mood_request.parameters.get("moods", []),
-                "transition_points": track.mood_request.parameters.get("transition_points", []),
-                "average_rating": track.average_rating if hasattr(track, 'average_rating') else 0,
-                "feedback_count": track.feedback_count if hasattr(track, 'feedback_count') else 0
+                "moods": parameters.get("moods", []),
+                "transition_points": parameters.get("transition_points", []),
+                "trending_score": score
             })
             
         return result 
\ No newline at end of file
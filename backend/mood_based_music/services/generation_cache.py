@@ -0,0 +1,167 @@
+"""
+Single-flight deduplication and result caching for mood-based generation.
+
+Requests are keyed by a hash of their canonicalized mood parameters and the
+provider chain. While a request is in flight, identical requests wait on it
+instead of going upstream; completed results are cached for a configurable
+TTL. Users can opt out, in which case their requests bypass both layers.
+"""
+import asyncio
+import concurrent.futures
+import hashlib
+import json
+import threading
+from typing import Any, Dict, Optional
+
+from django.core.cache import cache
+from ..config import MoodConfig
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Request fields that identify the caller rather than the music being generated
+NON_CANONICAL_FIELDS = {'user_id', 'request_id'}
+FLOAT_PRECISION = 3
+
+
+def _canonicalize(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {str(key): _canonicalize(item) for key, item in sorted(value.items(), key=lambda kv: str(kv[0]))}
+    if isinstance(value, (list, tuple)):
+        return [_canonicalize(item) for item in value]
+    if isinstance(value, bool) or value is None:
+        return value
+    if isinstance(value, (int, float)):
+        return round(float(value), FLOAT_PRECISION)
+    if isinstance(value, str):
+        return value.strip().lower()
+    # Decimals and other scalars
+    try:
+        return round(float(value), FLOAT_PRECISION)
+    except (TypeError, ValueError):
+        return str(value)
+
+
+def generation_cache_key(params: Dict[str, Any], provider_key: str) -> str:
+    """
+    Hash normalized generation parameters into a stable cache key.
+    """
+    canonical = _canonicalize({
+        key: value for key, value in params.items() if key not in NON_CANONICAL_FIELDS
+    })
+    payload = json.dumps({'provider': provider_key, 'params': canonical}, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class SingleFlightGenerationCache:
+    """
+    Shares one upstream call between concurrent identical generation requests.
+
+    In-flight calls are tracked with thread-safe futures so requests served
+    from different threads or event loops in the same process still coalesce.
+    If the leading request is cancelled, its followers retry and one of them
+    leads the next upstream call.
+    """
+
+    def __init__(self, ttl: Optional[int] = None, cache_backend=None):
+        self.ttl = ttl if ttl is not None else MoodConfig.GENERATION_CACHE_TTL
+        self.cache = cache_backend or cache
+        self._lock = threading.Lock()
+        self._in_flight: Dict[str, concurrent.futures.Future] = {}
+        self.stats = {'upstream': 0, 'shared': 0, 'cached': 0, 'bypassed': 0}
+
+    def _cache_key(self, key: str) -> str:
+        return f"{MoodConfig.CACHE_PREFIX}generation:{key}"
+
+    async def generate(
+        self,
+        params: Dict[str, Any],
+        provider,
+        provider_key: str,
+        use_cache: bool = True
+    ) -> Dict[str, Any]:
+        """
+        Generate music through the provider, deduplicating identical requests.
+        """
+        if not use_cache:
+            self.stats['bypassed'] += 1
+            return await provider.generate_music(params)
+
+        key = generation_cache_key(params, provider_key)
+        cached = await self.cache.aget(self._cache_key(key))
+        if cached is not None:
+            self.stats['cached'] += 1
+            return dict(cached)
+
+        while True:
+            with self._lock:
+                future = self._in_flight.get(key)
+                is_leader = future is None
+                if is_leader:
+                    future = concurrent.futures.Future()
+                    self._in_flight[key] = future
+
+            if is_leader:
+                return await self._lead(key, future, params, provider)
+
+            self.stats['shared'] += 1
+            try:
+                # Shielded so a cancelled follower does not cancel the shared call
+                return dict(await asyncio.shield(asyncio.wrap_future(future)))
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+                # The leader was cancelled: retry, with one follower taking over
+
+    async def _lead(
+        self,
+        key: str,
+        future: concurrent.futures.Future,
+        params: Dict[str, Any],
+        provider
+    ) -> Dict[str, Any]:
+        try:
+            self.stats['upstream'] += 1
+            result = await provider.generate_music(params)
+        except asyncio.CancelledError:
+            self._forget(key, future)
+            future.cancel()
+            raise
+        except BaseException as e:
+            # Followers see the same failure; nothing is cached
+            self._forget(key, future)
+            future.set_exception(e)
+            raise
+
+        # Followers are released before the cache write, which is best effort
+        future.set_result(result)
+        try:
+            if self.ttl > 0:
+                await self.cache.aset(self._cache_key(key), result, self.ttl)
+        except Exception as e:
+            logger.error(f"Error caching generation result: {str(e)}")
+        finally:
+            self._forget(key, future)
+        return dict(result)
+
+    def _forget(self, key: str, future: concurrent.futures.Future) -> None:
+        with self._lock:
+            if self._in_flight.get(key) is future:
+                del self._in_flight[key]
+
+    async def invalidate(self, params: Dict[str, Any], provider_key: str) -> None:
+        await self.cache.adelete(self._cache_key(generation_cache_key(params, provider_key)))
+
+
+_generation_cache = None
+_generation_cache_lock = threading.Lock()
+
+
+def get_generation_cache() -> SingleFlightGenerationCache:
+    """Get the process-wide single-flight generation cache"""
+    global _generation_cache
+    if _generation_cache is None:
+        with _generation_cache_lock:
+            if _generation_cache is None:
+                _generation_cache = SingleFlightGenerationCache()
+    return _generation_cache
@@ -5,8 +5,10 @@ import asyncio
 import logging
 from typing import Dict, Any, Optional
 from django.utils import timezone
-from ..models import MoodRequest, GeneratedMoodTrack
-from ..ai_providers import get_ai_provider
+from ..config import MoodConfig
+from ..models import MoodRequest, GeneratedMoodTrack, MoodProfile
+from .provider_orchestrator import get_provider_orchestrator
+from .generation_cache import get_generation_cache
 
 logger = logging.getLogger(__name__)
 
@@ -38,22 +40,27 @@ class MoodMusicGenerator:
                 "started_at": timezone.now().isoformat()
             }
             
-            # Get the configured AI provider
-            provider = get_ai_provider()
+            # Get the provider orchestrator (failover and hedging across providers)
+            provider = get_provider_orchestrator()
             
             # Prepare parameters for the AI provider
             params = {
                 "mood": mood_request.mood.to_dict() if hasattr(mood_request, 'mood') and mood_request.mood else {},
                 "intensity": mood_request.intensity,
                 "parameters": mood_request.parameters,
-                "user_id": mood_request.user.id
+                "user_id": mood_request.user_id
             }
             
             # Start background tracking of progress
             asyncio.create_task(self._update_generation_progress(mood_request.id))
             
-            # Generate the music
-            result = await provider.generate_music(params)
+            # Generate the music, sharing identical in-flight and recent requests
+            result = await get_generation_cache().generate(
+                params,
+                provider,
+                provider_key=",".join(MoodConfig.PROVIDER_CHAIN),
+                use_cache=await self._uses_generation_cache(mood_request.user_id)
+            )
             
             # Create the track record
             track = GeneratedMoodTrack.objects.create(
@@ -86,6 +93,18 @@ class MoodMusicGenerator:
             }
             raise
 
+    async def _uses_generation_cache(self, user_id: int) -> bool:
+        """
+        Check whether the user allows shared/cached generation results.
+        
+        Users opt out by setting ``generation_cache`` to false in their
+        mood profile preferences.
+        """
+        preferences = await MoodProfile.objects.filter(
+            user_id=user_id
+        ).values_list('aggregated_preferences', flat=True).afirst()
+        return (preferences or {}).get('generation_cache', True) is not False
+
     def get_generation_status(self, request_id: str) -> Dict[str, Any]:
         """
         Get the current status of a music generation task.
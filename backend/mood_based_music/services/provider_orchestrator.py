@@ -0,0 +1,276 @@
+"""
+Provider orchestration for mood-based music generation.
+
+Wraps several AI providers behind the ``AIProvider`` interface. Each provider
+gets rolling latency/error statistics and a circuit breaker; requests go to
+the first provider in the chain whose circuit admits them and are hedged to
+the next one when the primary runs past its own p95 latency. The first successful result wins and any
+request still in flight is cancelled; the time it had run is kept as a lower
+bound of its latency so slow tails still raise the provider's hedge delay.
+"""
+import asyncio
+import math
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, Optional, Sequence, Tuple
+
+from ..ai_providers import AIProvider, get_ai_provider
+from ..config import MoodConfig
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class AllProvidersFailedError(Exception):
+    """Raised when no provider could serve a generation request."""
+
+
+class ProviderStats:
+    """
+    Rolling latency and error statistics over the last ``window`` calls.
+
+    Cancelled calls are recorded with ``success=None``: their elapsed time
+    counts as a latency sample but not towards the error rate.
+    """
+
+    def __init__(self, window: int = 100):
+        self._calls = deque(maxlen=window)
+
+    def record(self, latency: float, success: Optional[bool]) -> None:
+        self._calls.append((latency, success))
+
+    @property
+    def count(self) -> int:
+        return len(self._calls)
+
+    @property
+    def error_rate(self) -> float:
+        completed = [success for _, success in self._calls if success is not None]
+        if not completed:
+            return 0.0
+        return completed.count(False) / len(completed)
+
+    def latency_percentile(self, percentile: float) -> Optional[float]:
+        latencies = sorted(latency for latency, success in self._calls if success is not False)
+        if not latencies:
+            return None
+        index = min(len(latencies) - 1, max(0, math.ceil(percentile / 100 * len(latencies)) - 1))
+        return latencies[index]
+
+
+class CircuitBreaker:
+    """
+    Closed/open/half-open breaker driven by a provider's rolling error rate.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(
+        self,
+        error_threshold: float = 0.5,
+        min_calls: int = 10,
+        consecutive_failures: int = 5,
+        reset_timeout: float = 30.0,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.error_threshold = error_threshold
+        self.min_calls = min_calls
+        self.consecutive_failures = consecutive_failures
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+
+    def allow_request(self) -> bool:
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN and self.clock() - self._opened_at >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+            self._trial_in_flight = False
+        if self.state == self.HALF_OPEN and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        self._failures = 0
+        self._trial_in_flight = False
+        self.state = self.CLOSED
+
+    def record_failure(self, stats: ProviderStats) -> None:
+        self._failures += 1
+        self._trial_in_flight = False
+        if self.state == self.HALF_OPEN or self._failures >= self.consecutive_failures or (
+            stats.count >= self.min_calls and stats.error_rate >= self.error_threshold
+        ):
+            self.state = self.OPEN
+            self._opened_at = self.clock()
+
+    def release(self) -> None:
+        """Give back a half-open trial slot whose call was cancelled."""
+        self._trial_in_flight = False
+
+
+class ProviderOrchestrator(AIProvider):
+    """
+    Hedged, failure-aware dispatch across an ordered list of providers.
+
+    The orchestrator is shared by every event loop in the process, so each
+    provider's statistics and breaker are only touched under its own lock.
+    """
+
+    def __init__(
+        self,
+        providers: Sequence[Tuple[str, AIProvider]],
+        hedge_percentile: float = 95,
+        default_hedge_delay: Optional[float] = None,
+        min_samples: int = 20,
+        window: int = 100,
+        breaker_factory: Optional[Callable[[], CircuitBreaker]] = None,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        if not providers:
+            raise ValueError("ProviderOrchestrator needs at least one provider")
+        self.providers = list(providers)
+        self.hedge_percentile = hedge_percentile
+        self.default_hedge_delay = (
+            default_hedge_delay if default_hedge_delay is not None else MoodConfig.PROVIDER_HEDGE_DELAY
+        )
+        self.min_samples = min_samples
+        self.clock = clock
+        self.stats = {name: ProviderStats(window) for name, _ in self.providers}
+        breaker_factory = breaker_factory or (lambda: CircuitBreaker(clock=clock))
+        self.breakers = {name: breaker_factory() for name, _ in self.providers}
+        self._locks = {name: threading.Lock() for name, _ in self.providers}
+
+    def hedge_delay(self, name: str) -> float:
+        """Time to wait on a provider before hedging: its p95 once warmed up."""
+        with self._locks[name]:
+            stats = self.stats[name]
+            if stats.count < self.min_samples:
+                return self.default_hedge_delay
+            return stats.latency_percentile(self.hedge_percentile) or self.default_hedge_delay
+
+    def _allow_request(self, name: str) -> bool:
+        with self._locks[name]:
+            return self.breakers[name].allow_request()
+
+    async def _call(self, name: str, provider: AIProvider, params: Dict[str, Any]) -> Dict[str, Any]:
+        start = self.clock()
+        try:
+            result = await provider.generate_music(params)
+        except asyncio.CancelledError:
+            # A hedged request that lost ran at least this long
+            with self._locks[name]:
+                self.stats[name].record(self.clock() - start, None)
+                self.breakers[name].release()
+            raise
+        except Exception:
+            with self._locks[name]:
+                self.stats[name].record(self.clock() - start, False)
+                self.breakers[name].record_failure(self.stats[name])
+            raise
+        with self._locks[name]:
+            self.stats[name].record(self.clock() - start, True)
+            self.breakers[name].record_success()
+        return result
+
+    async def generate_music(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        remaining = list(self.providers)
+        pending: Dict[asyncio.Task, str] = {}
+        errors: Dict[str, Exception] = {}
+        last_launched = None
+
+        def launch() -> bool:
+            # Breakers are consulted lazily so a half-open trial slot is only
+            # claimed by a provider that is actually called
+            nonlocal last_launched
+            while remaining:
+                name, provider = remaining.pop(0)
+                if self._allow_request(name):
+                    pending[asyncio.ensure_future(self._call(name, provider, params))] = name
+                    last_launched = name
+                    return True
+            return False
+
+        if not launch():
+            raise AllProvidersFailedError("All music providers are unavailable (circuits open)")
+
+        try:
+            while pending:
+                done, _ = await asyncio.wait(
+                    pending,
+                    timeout=self.hedge_delay(last_launched) if remaining else None,
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+
+                if not done:
+                    hedged_from = last_launched
+                    if launch():
+                        logger.info(f"Provider {hedged_from} exceeded hedge delay, hedging to {last_launched}")
+                    continue
+
+                for task in done:
+                    name = pending.pop(task)
+                    if task.exception() is None:
+                        result = task.result()
+                        result.setdefault('metadata', {})['served_by'] = name
+                        return result
+                    errors[name] = task.exception()
+                    logger.warning(f"Provider {name} failed: {str(task.exception())}")
+
+                # Fail over immediately when nothing else is still running
+                if not pending:
+                    launch()
+        finally:
+            for task in pending:
+                task.cancel()
+
+        raise AllProvidersFailedError(
+            "All music providers failed: " + "; ".join(f"{name}: {error}" for name, error in errors.items())
+        )
+
+    def _provider_info(self, name: str) -> Dict[str, Any]:
+        with self._locks[name]:
+            return {
+                'name': name,
+                'circuit': self.breakers[name].state,
+                'error_rate': self.stats[name].error_rate,
+                'p95_latency': self.stats[name].latency_percentile(95),
+            }
+
+    async def get_model_info(self) -> Dict[str, Any]:
+        return {
+            'provider': 'orchestrated',
+            'providers': [self._provider_info(name) for name, _ in self.providers]
+        }
+
+
+_orchestrator = None
+_orchestrator_lock = threading.Lock()
+
+
+def get_provider_orchestrator() -> ProviderOrchestrator:
+    """
+    Get the process-wide orchestrator over the configured provider chain.
+
+    Statistics and breaker state are shared by every request in the process.
+    Providers that cannot be constructed (e.g. missing credentials) are skipped.
+    """
+    global _orchestrator
+    if _orchestrator is None:
+        with _orchestrator_lock:
+            if _orchestrator is None:
+                providers = []
+                for name in MoodConfig.PROVIDER_CHAIN:
+                    try:
+                        providers.append((name, get_ai_provider(name)))
+                    except Exception as e:
+                        logger.warning(f"Skipping music provider {name}: {str(e)}")
+                _orchestrator = ProviderOrchestrator(providers)
+    return _orchestrator
@@ -0,0 +1,425 @@
+"""
+Live session state engine for live mood sessions and collaborative mood spaces.
+
+Active session state is held in a state store (Redis hashes/sets, or process
+memory as a fallback) and every participant change or mood update is applied
+there atomically. Deltas are fanned out to participants over the channel
+layer, and the database only receives snapshots write-behind: when a session's
+flush interval elapses, from the periodic flush task, or when the session ends.
+Once a session has ended its state is evicted and further updates raise
+SessionNotActive instead of recreating it; a session whose final snapshot
+cannot be written is kept instead.
+"""
+import json
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from django.utils import timezone
+from ..config import MoodConfig
+from ..models import LiveMoodSession, CollaborativeMoodSpace
+import logging
+
+logger = logging.getLogger(__name__)
+
+SESSION_KINDS = {
+    'live': LiveMoodSession,
+    'space': CollaborativeMoodSpace,
+}
+
+# Field holding the user who may invite participants and end the session
+OWNER_FIELDS = {
+    'live': 'user_id',
+    'space': 'owner_id',
+}
+
+STATE_KEY_PREFIX = f"{MoodConfig.CACHE_PREFIX}live_state:"
+DIRTY_KEY = f"{MoodConfig.CACHE_PREFIX}live_state:dirty"
+
+
+class SessionNotActive(LookupError):
+    """Raised when a session is updated after it has ended or was never loaded."""
+
+
+class SessionNotSaved(RuntimeError):
+    """Raised when a session cannot be ended because its final snapshot was not written."""
+
+
+class InMemorySessionStateStore:
+    """
+    Process-local session state store guarded by a single lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sessions: Dict[str, Dict[str, Any]] = {}
+        self._dirty = set()
+
+    def load(self, key: str, state: Dict[str, Any], participants: List[int]) -> bool:
+        with self._lock:
+            if key in self._sessions:
+                return False
+            self._sessions[key] = {
+                'version': 0,
+                'state': dict(state),
+                'participants': set(participants),
+            }
+            return True
+
+    def exists(self, key: str) -> bool:
+        return key in self._sessions
+
+    def _get(self, key: str) -> Dict[str, Any]:
+        session = self._sessions.get(key)
+        if session is None:
+            raise SessionNotActive(key)
+        return session
+
+    def apply(self, key: str, changes: Dict[str, Any]) -> int:
+        with self._lock:
+            session = self._get(key)
+            session['state'].update(changes)
+            session['version'] += 1
+            self._dirty.add(key)
+            return session['version']
+
+    def add_participant(self, key: str, user_id: int) -> Optional[int]:
+        with self._lock:
+            session = self._get(key)
+            if user_id in session['participants']:
+                return None
+            session['participants'].add(user_id)
+            session['version'] += 1
+            self._dirty.add(key)
+            return session['version']
+
+    def remove_participant(self, key: str, user_id: int) -> Optional[int]:
+        with self._lock:
+            session = self._get(key)
+            if user_id not in session['participants']:
+                return None
+            session['participants'].discard(user_id)
+            session['version'] += 1
+            self._dirty.add(key)
+            return session['version']
+
+    def has_participant(self, key: str, user_id: int) -> bool:
+        with self._lock:
+            return user_id in self._get(key)['participants']
+
+    def snapshot(self, key: str) -> Optional[Tuple[int, Dict[str, Any], List[int]]]:
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                return None
+            return session['version'], dict(session['state']), sorted(session['participants'])
+
+    def take_dirty(self, keys: Optional[List[str]] = None) -> List[str]:
+        with self._lock:
+            taken = [key for key in (keys if keys is not None else list(self._dirty)) if key in self._dirty]
+            self._dirty.difference_update(taken)
+            return taken
+
+    def mark_dirty(self, key: str) -> None:
+        with self._lock:
+            self._dirty.add(key)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._sessions.pop(key, None)
+            self._dirty.discard(key)
+
+
+class RedisSessionStateStore:
+    """
+    Session state kept in Redis so it survives worker restarts.
+
+    Each session uses a hash of JSON-encoded mood parameters, a participant
+    set and a meta hash holding the version counter, whose presence marks
+    the session as loaded. Loads and updates WATCH the meta hash and run in
+    MULTI pipelines, so a session appears with its state and participants
+    already in place, the state change, version bump and dirty flag land
+    together, and nothing is written to a session deleted concurrently.
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    def _keys(self, key: str) -> Tuple[str, str, str]:
+        base = f"{STATE_KEY_PREFIX}{key}"
+        return f"{base}:state", f"{base}:participants", f"{base}:meta"
+
+    def load(self, key: str, state: Dict[str, Any], participants: List[int]) -> bool:
+        state_key, participants_key, meta_key = self._keys(key)
+
+        def create(pipe):
+            # Only one loader wins; the others keep the state it wrote
+            if pipe.exists(meta_key):
+                return False
+            pipe.multi()
+            if state:
+                pipe.hset(state_key, mapping={name: json.dumps(value) for name, value in state.items()})
+            if participants:
+                pipe.sadd(participants_key, *participants)
+            pipe.hset(meta_key, 'version', 0)
+            return True
+
+        return self.client.transaction(create, meta_key, value_from_callable=True)
+
+    def exists(self, key: str) -> bool:
+        return bool(self.client.exists(self._keys(key)[2]))
+
+    def apply(self, key: str, changes: Dict[str, Any]) -> int:
+        state_key, _, meta_key = self._keys(key)
+
+        def update(pipe):
+            if not pipe.exists(meta_key):
+                raise SessionNotActive(key)
+            pipe.multi()
+            pipe.hset(state_key, mapping={name: json.dumps(value) for name, value in changes.items()})
+            pipe.hincrby(meta_key, 'version', 1)
+            pipe.sadd(DIRTY_KEY, key)
+
+        return self.client.transaction(update, meta_key)[1]
+
+    def _change_participants(self, key: str, adding: bool, user_id: int) -> Optional[int]:
+        _, participants_key, meta_key = self._keys(key)
+
+        def update(pipe):
+            if not pipe.exists(meta_key):
+                raise SessionNotActive(key)
+            if bool(pipe.sismember(participants_key, user_id)) == adding:
+                return
+            pipe.multi()
+            (pipe.sadd if adding else pipe.srem)(participants_key, user_id)
+            pipe.hincrby(meta_key, 'version', 1)
+            pipe.sadd(DIRTY_KEY, key)
+
+        # An empty result means there was nothing to change
+        result = self.client.transaction(update, meta_key, participants_key)
+        return result[1] if result else None
+
+    def add_participant(self, key: str, user_id: int) -> Optional[int]:
+        return self._change_participants(key, True, user_id)
+
+    def remove_participant(self, key: str, user_id: int) -> Optional[int]:
+        return self._change_participants(key, False, user_id)
+
+    def has_participant(self, key: str, user_id: int) -> bool:
+        _, participants_key, meta_key = self._keys(key)
+        pipe = self.client.pipeline(transaction=True)
+        pipe.exists(meta_key)
+        pipe.sismember(participants_key, user_id)
+        exists, member = pipe.execute()
+        if not exists:
+            raise SessionNotActive(key)
+        return bool(member)
+
+    def snapshot(self, key: str) -> Optional[Tuple[int, Dict[str, Any], List[int]]]:
+        state_key, participants_key, meta_key = self._keys(key)
+        pipe = self.client.pipeline(transaction=True)
+        pipe.hget(meta_key, 'version')
+        pipe.hgetall(state_key)
+        pipe.smembers(participants_key)
+        version, state, participants = pipe.execute()
+        if version is None:
+            return None
+        return (
+            int(version),
+            {name: json.loads(value) for name, value in state.items()},
+            sorted(int(user_id) for user_id in participants)
+        )
+
+    def take_dirty(self, keys: Optional[List[str]] = None) -> List[str]:
+        if keys is None:
+            keys = list(self.client.smembers(DIRTY_KEY))
+        return [key for key in keys if self.client.srem(DIRTY_KEY, key)]
+
+    def mark_dirty(self, key: str) -> None:
+        self.client.sadd(DIRTY_KEY, key)
+
+    def delete(self, key: str) -> None:
+        pipe = self.client.pipeline(transaction=True)
+        pipe.delete(*self._keys(key))
+        pipe.srem(DIRTY_KEY, key)
+        pipe.execute()
+
+
+class LiveSessionStateEngine:
+    """
+    Holds active session state and persists it to the database write-behind.
+    """
+
+    def __init__(self, store=None, flush_interval: Optional[float] = None, clock=time.monotonic):
+        self.store = store if store is not None else self._default_store()
+        self.flush_interval = (
+            flush_interval if flush_interval is not None else MoodConfig.SESSION_FLUSH_INTERVAL
+        )
+        self.clock = clock
+        self._last_flush: Dict[str, float] = {}
+
+    @staticmethod
+    def _default_store():
+        if MoodConfig.SESSION_STATE_BACKEND == 'redis':
+            try:
+                import redis
+                client = redis.Redis.from_url(MoodConfig.REDIS_URL, decode_responses=True)
+                client.ping()
+                return RedisSessionStateStore(client)
+            except Exception as e:
+                logger.warning(f"Redis unavailable for live session state, using in-memory store: {str(e)}")
+        return InMemorySessionStateStore()
+
+    @staticmethod
+    def session_key(kind: str, session_id: int) -> str:
+        if kind not in SESSION_KINDS:
+            raise ValueError(f"Unsupported session kind: {kind}")
+        return f"{kind}:{session_id}"
+
+    @staticmethod
+    def group_name(kind: str, session_id: int) -> str:
+        return f"live_mood_{kind}_{session_id}"
+
+    def ensure_loaded(self, kind: str, session_id: int) -> None:
+        """
+        Hydrate a session from its last database snapshot if it is not active.
+
+        Raises the model's DoesNotExist if the session is unknown and
+        SessionNotActive if a live session has ended.
+        """
+        key = self.session_key(kind, session_id)
+        if self.store.exists(key):
+            return
+        session = SESSION_KINDS[kind].objects.get(id=session_id)
+        if kind == 'live' and not session.active:
+            raise SessionNotActive(key)
+        if kind == 'live':
+            state, participants = session.current_mood_state or {}, [session.user_id]
+        else:
+            state, participants = session.combined_mood_state or {}, session.participant_ids or []
+        self.store.load(key, state, participants)
+        self._last_flush[key] = self.clock()
+
+    def get_owner_id(self, kind: str, session_id: int) -> Optional[int]:
+        """
+        The user who may invite participants to the session and end it.
+        """
+        return SESSION_KINDS[kind].objects.filter(id=session_id).values_list(OWNER_FIELDS[kind], flat=True).first()
+
+    def is_participant(self, kind: str, session_id: int, user_id: int) -> bool:
+        """
+        Whether the user is a participant. Raises SessionNotActive once the
+        session has ended.
+        """
+        return self.store.has_participant(self.session_key(kind, session_id), user_id)
+
+    def get_snapshot(self, kind: str, session_id: int) -> Optional[Dict[str, Any]]:
+        snapshot = self.store.snapshot(self.session_key(kind, session_id))
+        if snapshot is None:
+            return None
+        version, state, participants = snapshot
+        return {'version': version, 'state': state, 'participants': participants}
+
+    def update_mood(self, kind: str, session_id: int, changes: Dict[str, Any], user_id: int = None) -> Dict[str, Any]:
+        """
+        Merge mood parameter changes into the session and return the delta.
+        """
+        version = self.store.apply(self.session_key(kind, session_id), changes)
+        return {'type': 'mood_update', 'version': version, 'changes': changes, 'user_id': user_id}
+
+    def join(self, kind: str, session_id: int, user_id: int) -> Optional[Dict[str, Any]]:
+        version = self.store.add_participant(self.session_key(kind, session_id), user_id)
+        if version is None:
+            return None
+        return {'type': 'participant_joined', 'version': version, 'user_id': user_id}
+
+    def leave(self, kind: str, session_id: int, user_id: int) -> Optional[Dict[str, Any]]:
+        version = self.store.remove_participant(self.session_key(kind, session_id), user_id)
+        if version is None:
+            return None
+        return {'type': 'participant_left', 'version': version, 'user_id': user_id}
+
+    async def publish(self, channel_layer, kind: str, session_id: int, delta: Optional[Dict[str, Any]]) -> None:
+        """
+        Fan a delta out to every participant connected to the session group.
+        """
+        if delta is None:
+            return
+        await channel_layer.group_send(
+            self.group_name(kind, session_id),
+            {'type': 'session_delta', 'delta': delta}
+        )
+
+    def is_flush_due(self, kind: str, session_id: int) -> bool:
+        key = self.session_key(kind, session_id)
+        return self.clock() - self._last_flush.get(key, 0) >= self.flush_interval
+
+    def flush(self, kind: str = None, session_id: int = None) -> int:
+        """
+        Persist snapshots of dirty sessions to the database.
+
+        Flushes one session when ``kind``/``session_id`` are given, otherwise
+        every dirty session in the store. Returns the number of sessions written.
+        """
+        keys = [self.session_key(kind, session_id)] if kind is not None else None
+        for key in keys or []:
+            self._last_flush[key] = self.clock()
+        written = 0
+        for key in self.store.take_dirty(keys):
+            snapshot = self.store.snapshot(key)
+            if snapshot is None:
+                continue
+            try:
+                self._persist(key, snapshot)
+                written += 1
+            except Exception as e:
+                # Keep the session dirty so the next flush retries it
+                self.store.mark_dirty(key)
+                logger.error(f"Error persisting live session {key}: {str(e)}")
+            self._last_flush[key] = self.clock()
+        return written
+
+    def _persist(self, key: str, snapshot: Tuple[int, Dict[str, Any], List[int]]) -> None:
+        kind, session_id = key.split(':', 1)
+        _, state, participants = snapshot
+        if kind == 'live':
+            LiveMoodSession.objects.filter(id=session_id).update(
+                current_mood_state=state,
+                last_update=timezone.now()
+            )
+        else:
+            CollaborativeMoodSpace.objects.filter(id=session_id).update(
+                combined_mood_state=state,
+                participant_ids=participants
+            )
+
+    def end_session(self, kind: str, session_id: int) -> None:
+        """
+        Persist the final snapshot and evict the session from the store.
+
+        Later updates to the session raise SessionNotActive. Raises
+        SessionNotSaved, and keeps the session active and dirty, if the
+        snapshot could not be written.
+        """
+        key = self.session_key(kind, session_id)
+        self.store.mark_dirty(key)
+        if not self.flush(kind, session_id) and self.store.exists(key):
+            raise SessionNotSaved(key)
+        if kind == 'live':
+            LiveMoodSession.objects.filter(id=session_id).update(active=False)
+        self.store.delete(key)
+        self._last_flush.pop(key, None)
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_session_state_engine() -> LiveSessionStateEngine:
+    """Get the process-wide live session state engine"""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = LiveSessionStateEngine()
+    return _engine
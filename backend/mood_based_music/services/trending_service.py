@@ -0,0 +1,361 @@
+"""
+Incremental trending leaderboard for multi-mood blends.
+
+Scores use forward exponential decay: every event adds
+``weight * 2 ** ((t - epoch) / half_life)`` to the blend's score. Because all
+scores decay by the same factor, ranking never needs per-item updates and the
+stored value only has to be rescaled to read the decayed score at ``now``.
+The reconciliation job rebuilds all scores from the database against a fresh
+epoch, which also keeps the stored magnitudes bounded. A process that finds no
+leaderboard yet builds it the same way on first use.
+
+While a rebuild reads the database, events newer than its epoch are also
+kept in a pending set scored against that epoch, and added to the rebuilt
+scores when they are swapped in; events are timestamped with the creation
+time of their row, so each is counted by the database read or by the pending
+set, never both.
+"""
+import heapq
+import math
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
+from typing import Dict, List, Optional, Tuple
+
+from ..config import MoodConfig
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Relative weight of each event type in the trending score
+EVENT_WEIGHTS = {
+    'created': 1.0,
+    'play': 1.0,
+    'complete': 1.5,
+    'replay': 2.0,
+    'like': 3.0,
+}
+
+LEADERBOARD_KEY = f"{MoodConfig.CACHE_PREFIX}trending_blends"
+EPOCH_KEY = f"{MoodConfig.CACHE_PREFIX}trending_blends:epoch"
+PENDING_KEY = f"{MoodConfig.CACHE_PREFIX}trending_blends:pending"
+REBUILD_EPOCH_KEY = f"{MoodConfig.CACHE_PREFIX}trending_blends:rebuild_epoch"
+# Seconds a crashed rebuild keeps collecting pending events
+REBUILD_TIMEOUT = 3600
+
+# Reads the epoch and increments in one step, so a concurrent swap cannot
+# pair an increment with the wrong epoch
+INCREMENT_SCRIPT = """
+local epoch = redis.call('GET', KEYS[2])
+if not epoch then
+    return -1
+end
+local member = ARGV[1]
+local weight = tonumber(ARGV[2])
+local timestamp = tonumber(ARGV[3])
+local half_life = tonumber(ARGV[4])
+if ARGV[5] == '1' and not redis.call('ZSCORE', KEYS[1], member) then
+    return 0
+end
+redis.call('ZINCRBY', KEYS[1], weight * 2 ^ ((timestamp - tonumber(epoch)) / half_life), member)
+local rebuild_epoch = redis.call('GET', KEYS[3])
+if rebuild_epoch and timestamp > tonumber(rebuild_epoch) then
+    redis.call('ZINCRBY', KEYS[4], weight * 2 ^ ((timestamp - tonumber(rebuild_epoch)) / half_life), member)
+end
+return 1
+"""
+
+
+def growth(timestamp: float, epoch: float, half_life: float) -> float:
+    return math.pow(2.0, (timestamp - epoch) / half_life)
+
+
+class InMemoryTrendingStore:
+    """
+    Process-local sorted leaderboard.
+
+    Scores live in a dict; ordering is kept in a max-heap with lazy deletion so
+    increments cost O(log n) and each top-N entry is popped in O(log n).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._scores: Dict[int, float] = {}
+        self._heap: List[Tuple[float, int]] = []
+        self._epoch: Optional[float] = None
+        self._rebuild_epoch: Optional[float] = None
+        self._pending: Dict[int, float] = {}
+
+    def get_epoch(self) -> Optional[float]:
+        return self._epoch
+
+    def increment(
+        self, member: int, weight: float, timestamp: float, half_life: float, only_existing: bool = False
+    ) -> bool:
+        with self._lock:
+            if self._epoch is None or (only_existing and member not in self._scores):
+                return False
+            score = self._scores.get(member, 0.0) + weight * growth(timestamp, self._epoch, half_life)
+            self._scores[member] = score
+            heapq.heappush(self._heap, (-score, member))
+            if len(self._heap) > 2 * len(self._scores) + 64:
+                self._compact()
+            if self._rebuild_epoch is not None and timestamp > self._rebuild_epoch:
+                self._pending[member] = self._pending.get(member, 0.0) + (
+                    weight * growth(timestamp, self._rebuild_epoch, half_life)
+                )
+            return True
+
+    def top(self, limit: int) -> List[Tuple[int, float]]:
+        with self._lock:
+            result = []
+            seen = set()
+            popped = []
+            while self._heap and len(result) < limit:
+                entry = heapq.heappop(self._heap)
+                neg_score, member = entry
+                if member in seen or self._scores.get(member) != -neg_score:
+                    continue  # Stale entry left behind by a later increment
+                popped.append(entry)
+                seen.add(member)
+                result.append((member, -neg_score))
+            for entry in popped:
+                heapq.heappush(self._heap, entry)
+            return result
+
+    def begin_rebuild(self, epoch: float) -> None:
+        with self._lock:
+            self._rebuild_epoch = epoch
+            self._pending = {}
+
+    def cancel_rebuild(self) -> None:
+        with self._lock:
+            self._rebuild_epoch = None
+            self._pending = {}
+
+    def replace(self, scores: Dict[int, float], epoch: float) -> None:
+        with self._lock:
+            self._scores = dict(scores)
+            if epoch == self._rebuild_epoch:
+                for member, score in self._pending.items():
+                    self._scores[member] = self._scores.get(member, 0.0) + score
+            self._rebuild_epoch = None
+            self._pending = {}
+            self._heap = [(-score, member) for member, score in self._scores.items()]
+            heapq.heapify(self._heap)
+            self._epoch = epoch
+
+    def _compact(self) -> None:
+        self._heap = [(-score, member) for member, score in self._scores.items()]
+        heapq.heapify(self._heap)
+
+
+class RedisTrendingStore:
+    """
+    Leaderboard backed by a Redis sorted set.
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    def get_epoch(self) -> Optional[float]:
+        epoch = self.client.get(EPOCH_KEY)
+        return float(epoch) if epoch is not None else None
+
+    def increment(
+        self, member: int, weight: float, timestamp: float, half_life: float, only_existing: bool = False
+    ) -> bool:
+        result = self.client.eval(
+            INCREMENT_SCRIPT, 4, LEADERBOARD_KEY, EPOCH_KEY, REBUILD_EPOCH_KEY, PENDING_KEY,
+            member, weight, timestamp, half_life, '1' if only_existing else '0'
+        )
+        return result == 1
+
+    def top(self, limit: int) -> List[Tuple[int, float]]:
+        entries = self.client.zrevrange(LEADERBOARD_KEY, 0, limit - 1, withscores=True)
+        return [(int(member), score) for member, score in entries]
+
+    def begin_rebuild(self, epoch: float) -> None:
+        pipe = self.client.pipeline(transaction=True)
+        pipe.delete(PENDING_KEY)
+        pipe.set(REBUILD_EPOCH_KEY, epoch, ex=REBUILD_TIMEOUT)
+        pipe.execute()
+
+    def cancel_rebuild(self) -> None:
+        self.client.delete(REBUILD_EPOCH_KEY, PENDING_KEY)
+
+    def replace(self, scores: Dict[int, float], epoch: float) -> None:
+        staging_key = f"{LEADERBOARD_KEY}:rebuild"
+        rebuild_epoch = self.client.get(REBUILD_EPOCH_KEY)
+        pipe = self.client.pipeline(transaction=True)
+        pipe.delete(staging_key)
+        items = list(scores.items())
+        for start in range(0, len(items), 10000):
+            pipe.zadd(staging_key, dict(items[start:start + 10000]))
+        sources = [staging_key]
+        if rebuild_epoch is not None and float(rebuild_epoch) == epoch:
+            sources.append(PENDING_KEY)
+        # Overwrites the leaderboard, or removes it when both are empty
+        pipe.zunionstore(LEADERBOARD_KEY, sources)
+        pipe.delete(staging_key, PENDING_KEY, REBUILD_EPOCH_KEY)
+        pipe.set(EPOCH_KEY, epoch)
+        pipe.execute()
+
+
+class TrendingBlendEngine:
+    """
+    Maintains exponentially decayed trending scores for multi-mood blends.
+    """
+
+    def __init__(
+        self,
+        store=None,
+        half_life_hours: Optional[float] = None,
+        clock=time.time,
+        rebuild_on_first_use: bool = True
+    ):
+        self.store = store if store is not None else self._default_store()
+        self.half_life = (half_life_hours or MoodConfig.TRENDING_HALF_LIFE_HOURS) * 3600
+        self.clock = clock
+        self.rebuild_on_first_use = rebuild_on_first_use
+        self._rebuild_lock = threading.Lock()
+
+    @staticmethod
+    def _default_store():
+        if MoodConfig.TRENDING_BACKEND == 'redis':
+            try:
+                import redis
+                client = redis.Redis.from_url(MoodConfig.REDIS_URL, decode_responses=True)
+                client.ping()
+                return RedisTrendingStore(client)
+            except Exception as e:
+                logger.warning(f"Redis unavailable for trending blends, using in-memory store: {str(e)}")
+        return InMemoryTrendingStore()
+
+    def _ensure_leaderboard(self) -> float:
+        """The store's epoch, building the leaderboard if there is none yet."""
+        epoch = self.store.get_epoch()
+        if epoch is None:
+            with self._rebuild_lock:
+                epoch = self.store.get_epoch()
+                if epoch is None:
+                    if self.rebuild_on_first_use:
+                        self.rebuild()
+                    else:
+                        self.store.replace({}, self.clock())
+                    epoch = self.store.get_epoch()
+        return epoch
+
+    def _growth(self, timestamp: float, epoch: float) -> float:
+        return growth(timestamp, epoch, self.half_life)
+
+    def record_event(
+        self,
+        track_id: int,
+        event_type: str,
+        timestamp: Optional[float] = None,
+        only_existing: bool = False
+    ) -> bool:
+        """
+        Add a weighted, forward-decayed event to a blend's score.
+
+        ``only_existing`` restricts the update to blends already on the
+        leaderboard, so generic track events can be fed in without first
+        checking whether the track is a blend. ``timestamp`` should be the
+        creation time of the event's row, which keeps a concurrent rebuild
+        from counting it twice.
+
+        Store errors are logged rather than raised, as events are recorded
+        after their rows are committed.
+        """
+        weight = EVENT_WEIGHTS.get(event_type)
+        if not weight:
+            return False
+        timestamp = timestamp if timestamp is not None else self.clock()
+        try:
+            self._ensure_leaderboard()
+            return self.store.increment(
+                track_id, weight, timestamp, self.half_life, only_existing=only_existing
+            )
+        except Exception as e:
+            logger.error(f"Error recording trending event for track {track_id}: {str(e)}")
+            return False
+
+    def top(self, limit: int = 10) -> List[Tuple[int, float]]:
+        """
+        Get the top blends with their scores decayed to the current time.
+        """
+        try:
+            epoch = self._ensure_leaderboard()
+        except Exception as e:
+            logger.error(f"Error building trending leaderboard: {str(e)}")
+            return []
+        decay = self._growth(epoch, self.clock())
+        return [(track_id, score * decay) for track_id, score in self.store.top(limit)]
+
+    def rebuild(self) -> int:
+        """
+        Recompute every blend score from the database against a new epoch.
+
+        Returns the number of blends ranked.
+        """
+        epoch = self.clock()
+        self.store.begin_rebuild(epoch)
+        try:
+            scores = self._read_scores(epoch)
+        except Exception:
+            self.store.cancel_rebuild()
+            raise
+        self.store.replace(scores, epoch)
+        return len(scores)
+
+    def _read_scores(self, epoch: float) -> Dict[int, float]:
+        """Scores of the events up to ``epoch``; later ones are pending in the store."""
+        from ..models import GeneratedMoodTrack, MoodFeedback
+        from ..analytics.models import TrackInteraction
+
+        cutoff = datetime.fromtimestamp(epoch, tz=dt_timezone.utc)
+        scores: Dict[int, float] = {}
+
+        blends = GeneratedMoodTrack.objects.filter(
+            mood_request__parameters__type="multi_mood_blend"
+        )
+        for track_id, created_at in blends.filter(created_at__lte=cutoff).values_list(
+            'id', 'created_at'
+        ).iterator(chunk_size=5000):
+            scores[track_id] = EVENT_WEIGHTS['created'] * self._growth(created_at.timestamp(), epoch)
+
+        interactions = TrackInteraction.objects.filter(
+            track__in=blends,
+            interaction_type__in=list(EVENT_WEIGHTS),
+            created_at__lte=cutoff
+        ).values_list('track_id', 'interaction_type', 'created_at')
+        for track_id, interaction_type, created_at in interactions.iterator(chunk_size=5000):
+            scores[track_id] = scores.get(track_id, 0.0) + (
+                EVENT_WEIGHTS[interaction_type] * self._growth(created_at.timestamp(), epoch)
+            )
+
+        likes = MoodFeedback.objects.filter(
+            generated_track__in=blends,
+            feedback_type='like',
+            created_at__lte=cutoff
+        ).values_list('generated_track_id', 'created_at')
+        for track_id, created_at in likes.iterator(chunk_size=5000):
+            scores[track_id] = scores.get(track_id, 0.0) + (
+                EVENT_WEIGHTS['like'] * self._growth(created_at.timestamp(), epoch)
+            )
+        return scores
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_trending_engine() -> TrendingBlendEngine:
+    """Get the process-wide trending engine"""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = TrendingBlendEngine()
+    return _engine
@@ -0,0 +1,31 @@
+from celery import shared_task
+from .analytics.services import MoodAnalyticsService
+from .services.trending_service import get_trending_engine
+from .services.session_state import get_session_state_engine
+
+
+@shared_task
+def rollup_track_interactions():
+    """
+    Periodic task to roll completed days of track interactions into daily rollups
+    """
+    written = MoodAnalyticsService.rollup_interactions()
+    return f"Wrote {written} track interaction rollups"
+
+
+@shared_task
+def reconcile_trending_blends():
+    """
+    Periodic task to rebuild trending blend scores from the database
+    """
+    ranked = get_trending_engine().rebuild()
+    return f"Rebuilt trending scores for {ranked} blends"
+
+
+@shared_task
+def flush_live_mood_sessions():
+    """
+    Periodic task to persist dirty live session state to the database
+    """
+    written = get_session_state_engine().flush()
+    return f"Persisted {written} live mood sessions"
@@ -0,0 +1,117 @@
+from datetime import timedelta
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+from ..models import Mood, MoodRequest, GeneratedMoodTrack
+from ..analytics.models import TrackInteraction, TrackInteractionDailyRollup
+from ..analytics.services import MoodAnalyticsService
+
+User = get_user_model()
+
+LOCMEM_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+def create_interactions(track, user, interaction_type, count, days_ago=0, duration=None):
+    """Create interactions and backdate them past ``auto_now_add``."""
+    created = TrackInteraction.objects.bulk_create([
+        TrackInteraction(track=track, user=user, interaction_type=interaction_type, duration=duration)
+        for _ in range(count)
+    ])
+    TrackInteraction.objects.filter(id__in=[i.id for i in created]).update(
+        created_at=timezone.now() - timedelta(days=days_ago)
+    )
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class TrackAnalyticsRollupTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+        self.mood = Mood.objects.create(name='Happy', description='Upbeat and joyful')
+        self.mood_request = MoodRequest.objects.create(
+            user=self.user,
+            selected_mood=self.mood,
+            intensity=0.8
+        )
+        self.track = GeneratedMoodTrack.objects.create(mood_request=self.mood_request)
+
+        create_interactions(self.track, self.user, 'play', 4, days_ago=3, duration=100)
+        create_interactions(self.track, self.user, 'skip', 2, days_ago=3)
+        create_interactions(self.track, self.user, 'complete', 3, days_ago=2)
+        create_interactions(self.track, self.user, 'play', 2, days_ago=0, duration=40)
+        create_interactions(self.track, self.user, 'replay', 1, days_ago=0)
+
+    def test_metrics_from_raw_interactions(self):
+        """Test that conditional aggregates match per-type counts"""
+        metrics = MoodAnalyticsService.get_track_analytics(self.track.id, self.user.id)['metrics']
+
+        self.assertEqual(metrics['play_count'], 6)
+        self.assertEqual(metrics['skip_count'], 2)
+        self.assertAlmostEqual(metrics['completion_rate'], 3 / 12)
+        self.assertAlmostEqual(metrics['replay_rate'], 1 / 12)
+        self.assertAlmostEqual(metrics['average_play_duration'], (4 * 100 + 2 * 40) / 6)
+
+    def test_rollups_match_raw_metrics(self):
+        """Test that reading historical days from rollups yields identical metrics"""
+        raw_metrics = MoodAnalyticsService.get_track_analytics(self.track.id, self.user.id)['metrics']
+
+        written = MoodAnalyticsService.rollup_interactions()
+
+        self.assertEqual(written, 2)
+        self.assertEqual(
+            MoodAnalyticsService.get_rollup_watermark(),
+            timezone.localdate() - timedelta(days=1)
+        )
+        rolled_metrics = MoodAnalyticsService.get_track_analytics(self.track.id, self.user.id)['metrics']
+        self.assertEqual(raw_metrics, rolled_metrics)
+
+    def test_rollup_is_incremental(self):
+        """Test that repeated rollups never double count a day"""
+        MoodAnalyticsService.rollup_interactions()
+        self.assertEqual(MoodAnalyticsService.rollup_interactions(), 0)
+
+        # Today is still receiving interactions, so it is never rolled up
+        today = timezone.localdate()
+        self.assertEqual(MoodAnalyticsService.rollup_interactions(through=today), 0)
+        self.assertEqual(MoodAnalyticsService.get_rollup_watermark(), today - timedelta(days=1))
+        self.assertEqual(TrackInteractionDailyRollup.objects.count(), 2)
+
+        create_interactions(self.track, self.user, 'play', 2, days_ago=0)
+        counters = MoodAnalyticsService.get_interaction_counters(self.track.id)
+        self.assertEqual(counters['total_count'], 14)
+        self.assertEqual(counters['play_count'], 8)
+
+    def test_date_range_spanning_rollups_and_raw(self):
+        """Test that a range is split between rollup rows and raw rows"""
+        MoodAnalyticsService.rollup_interactions()
+        today = timezone.localdate()
+
+        counters = MoodAnalyticsService.get_interaction_counters(
+            self.track.id,
+            start_date=today - timedelta(days=2),
+            end_date=today
+        )
+        self.assertEqual(counters['total_count'], 6)
+        self.assertEqual(counters['complete_count'], 3)
+
+        counters = MoodAnalyticsService.get_interaction_counters(
+            self.track.id,
+            end_date=today - timedelta(days=3)
+        )
+        self.assertEqual(counters['total_count'], 6)
+        self.assertEqual(counters['skip_count'], 2)
+
+    def test_track_analytics_query_count(self):
+        """Test that track analytics use a fixed number of queries"""
+        MoodAnalyticsService.rollup_interactions()
+        create_interactions(self.track, self.user, 'skip', 50, days_ago=0)
+
+        # track, rollup aggregate, raw aggregate for today, feedback aggregate
+        with self.assertNumQueries(4):
+            analytics = MoodAnalyticsService.get_track_analytics(self.track.id, self.user.id)
+        self.assertEqual(analytics['metrics']['skip_count'], 52)
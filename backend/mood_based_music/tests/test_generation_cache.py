@@ -0,0 +1,187 @@
+import asyncio
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+from ..services.generation_cache import SingleFlightGenerationCache, generation_cache_key
+
+LOCMEM_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+class FailingCache:
+    """Cache backend whose writes always fail."""
+
+    async def aget(self, key):
+        return None
+
+    async def aset(self, key, value, timeout):
+        raise ConnectionError('cache down')
+
+
+class CountingProvider:
+    """Fake upstream provider that counts calls and can fail on demand."""
+
+    def __init__(self, latency=0.05, fail=False):
+        self.latency = latency
+        self.fail = fail
+        self.calls = 0
+
+    async def generate_music(self, params):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        if self.fail:
+            raise RuntimeError('upstream error')
+        return {'status': 'success', 'audio_url': f"track-{self.calls}.mp3"}
+
+
+def params(**overrides):
+    base = {
+        'mood': {'name': 'Happy', 'energy': 0.8},
+        'intensity': 0.5,
+        'parameters': {'tempo': 'fast'},
+        'user_id': 1,
+    }
+    base.update(overrides)
+    return base
+
+
+class GenerationCacheKeyTests(SimpleTestCase):
+    def test_equivalent_requests_share_a_key(self):
+        """Test that ordering, float noise, case and caller identity are normalized"""
+        first = generation_cache_key(params(), 'suno')
+        second = generation_cache_key({
+            'user_id': 2,
+            'parameters': {'tempo': ' Fast '},
+            'intensity': 0.50000001,
+            'mood': {'energy': 0.8, 'name': 'happy'},
+        }, 'suno')
+
+        self.assertEqual(first, second)
+
+    def test_different_requests_get_different_keys(self):
+        self.assertNotEqual(
+            generation_cache_key(params(), 'suno'),
+            generation_cache_key(params(intensity=0.6), 'suno')
+        )
+        self.assertNotEqual(
+            generation_cache_key(params(), 'suno'),
+            generation_cache_key(params(), 'mubert')
+        )
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class SingleFlightGenerationCacheTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.layer = SingleFlightGenerationCache(ttl=60)
+        self.provider = CountingProvider()
+
+    def _concurrent(self, requests, use_cache=True):
+        async def run():
+            return await asyncio.gather(*[
+                self.layer.generate(request, self.provider, 'suno', use_cache=use_cache)
+                for request in requests
+            ], return_exceptions=True)
+        return async_to_sync(run)()
+
+    def test_concurrent_identical_requests_call_upstream_once(self):
+        """Test that N concurrent identical requests share one upstream call"""
+        results = self._concurrent([params(user_id=n) for n in range(25)])
+
+        self.assertEqual(self.provider.calls, 1)
+        self.assertEqual({result['audio_url'] for result in results}, {'track-1.mp3'})
+        self.assertEqual(self.layer.stats['shared'], 24)
+
+    def test_distinct_requests_are_not_merged(self):
+        self._concurrent([params(intensity=0.1), params(intensity=0.9)])
+
+        self.assertEqual(self.provider.calls, 2)
+
+    def test_completed_results_are_cached(self):
+        """Test that later identical requests are served from the cache"""
+        self._concurrent([params()])
+        results = self._concurrent([params(user_id=7)])
+
+        self.assertEqual(self.provider.calls, 1)
+        self.assertEqual(results[0]['audio_url'], 'track-1.mp3')
+        self.assertEqual(self.layer.stats['cached'], 1)
+
+        async_to_sync(self.layer.invalidate)(params(), 'suno')
+        self._concurrent([params()])
+        self.assertEqual(self.provider.calls, 2)
+
+    def test_opt_out_bypasses_sharing_and_cache(self):
+        """Test that opted-out users always reach the provider"""
+        self._concurrent([params()])
+        self._concurrent([params(), params()], use_cache=False)
+
+        self.assertEqual(self.provider.calls, 3)
+
+    def test_failures_propagate_and_are_not_cached(self):
+        """Test that a failed leader fails its followers without poisoning the cache"""
+        self.provider.fail = True
+        results = self._concurrent([params() for _ in range(5)])
+
+        self.assertEqual(self.provider.calls, 1)
+        self.assertTrue(all(isinstance(result, RuntimeError) for result in results))
+
+        self.provider.fail = False
+        results = self._concurrent([params()])
+        self.assertEqual(self.provider.calls, 2)
+        self.assertEqual(results[0]['status'], 'success')
+
+    def test_cancelled_leader_hands_over_to_a_follower(self):
+        """Test that cancelling the leading request does not cancel its followers"""
+        async def run():
+            leader = asyncio.ensure_future(self.layer.generate(params(), self.provider, 'suno'))
+            await asyncio.sleep(0)
+            followers = [
+                asyncio.ensure_future(self.layer.generate(params(user_id=n), self.provider, 'suno'))
+                for n in range(3)
+            ]
+            await asyncio.sleep(0.01)
+            leader.cancel()
+            results = await asyncio.gather(*followers)
+            return leader.cancelled(), results
+
+        cancelled, results = async_to_sync(run)()
+
+        self.assertTrue(cancelled)
+        self.assertEqual(self.provider.calls, 2)
+        self.assertEqual({result['audio_url'] for result in results}, {'track-2.mp3'})
+
+    def test_cancelled_follower_does_not_cancel_the_leader(self):
+        async def run():
+            leader = asyncio.ensure_future(self.layer.generate(params(), self.provider, 'suno'))
+            await asyncio.sleep(0)
+            follower = asyncio.ensure_future(self.layer.generate(params(), self.provider, 'suno'))
+            await asyncio.sleep(0.01)
+            follower.cancel()
+            return await leader
+
+        self.assertEqual(async_to_sync(run)()['audio_url'], 'track-1.mp3')
+        self.assertEqual(self.provider.calls, 1)
+
+    def test_cache_write_errors_are_not_fatal(self):
+        """Test that a failing cache write still returns the result to everyone"""
+        layer = SingleFlightGenerationCache(ttl=60, cache_backend=FailingCache())
+
+        async def run():
+            return await asyncio.gather(*[
+                layer.generate(params(), self.provider, 'suno') for _ in range(3)
+            ])
+
+        with self.assertLogs('mood_based_music.services.generation_cache', 'ERROR'):
+            results = async_to_sync(run)()
+
+        self.assertEqual([result['audio_url'] for result in results], ['track-1.mp3'] * 3)
+        self.assertEqual(layer._in_flight, {})
+
+    def test_zero_ttl_disables_result_cache(self):
+        layer = SingleFlightGenerationCache(ttl=0)
+
+        async def run():
+            await layer.generate(params(), self.provider, 'suno')
+            await layer.generate(params(), self.provider, 'suno')
+
+        async_to_sync(run)()
+        self.assertEqual(self.provider.calls, 2)
@@ -0,0 +1,302 @@
+from unittest import mock
+from asgiref.sync import async_to_sync
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.contrib.auth import get_user_model
+from ..models import LiveMoodSession, CollaborativeMoodSpace
+from ..routing import websocket_urlpatterns
+from ..services.session_state import (
+    InMemorySessionStateStore, LiveSessionStateEngine, SessionNotActive, SessionNotSaved
+)
+
+User = get_user_model()
+
+IN_MEMORY_CHANNEL_LAYERS = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class LiveSessionStateEngineTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.other = User.objects.create_user(username='testuser2', password='testpass123')
+        self.session = LiveMoodSession.objects.create(
+            user=self.user,
+            session_name='Evening',
+            current_mood_state={'energy': 0.2}
+        )
+        self.space = CollaborativeMoodSpace.objects.create(
+            space_name='Studio',
+            participant_ids=[self.user.id]
+        )
+        self.clock = FakeClock()
+        self.store = InMemorySessionStateStore()
+        self.engine = LiveSessionStateEngine(store=self.store, flush_interval=5, clock=self.clock)
+
+    def test_updates_stay_in_memory_until_flush(self):
+        """Test that mood updates do not touch the database until flushed"""
+        self.engine.ensure_loaded('live', self.session.id)
+
+        with self.assertNumQueries(0):
+            for value in (0.4, 0.6, 0.8):
+                delta = self.engine.update_mood('live', self.session.id, {'energy': value}, self.user.id)
+
+        self.assertEqual(delta['version'], 3)
+        self.assertEqual(self.engine.get_snapshot('live', self.session.id)['state'], {'energy': 0.8})
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.current_mood_state, {'energy': 0.2})
+
+        self.assertEqual(self.engine.flush(), 1)
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.current_mood_state, {'energy': 0.8})
+        self.assertEqual(self.engine.flush(), 0)
+
+    def test_participant_changes_are_versioned(self):
+        """Test that joins and leaves bump the version and persist write-behind"""
+        self.engine.ensure_loaded('space', self.space.id)
+
+        joined = self.engine.join('space', self.space.id, self.other.id)
+        self.assertEqual(joined, {'type': 'participant_joined', 'version': 1, 'user_id': self.other.id})
+        self.assertIsNone(self.engine.join('space', self.space.id, self.other.id))
+        self.engine.update_mood('space', self.space.id, {'valence': 0.7})
+
+        self.engine.flush('space', self.space.id)
+        self.space.refresh_from_db()
+        self.assertEqual(self.space.participant_ids, sorted([self.user.id, self.other.id]))
+        self.assertEqual(self.space.combined_mood_state, {'valence': 0.7})
+
+        left = self.engine.leave('space', self.space.id, self.other.id)
+        self.assertEqual(left['version'], 3)
+        self.engine.flush()
+        self.space.refresh_from_db()
+        self.assertEqual(self.space.participant_ids, [self.user.id])
+
+    def test_flush_interval(self):
+        """Test that a session only becomes due once its interval elapses"""
+        self.engine.ensure_loaded('live', self.session.id)
+        self.assertFalse(self.engine.is_flush_due('live', self.session.id))
+
+        self.clock.now += 5
+        self.assertTrue(self.engine.is_flush_due('live', self.session.id))
+        self.engine.flush('live', self.session.id)
+        self.assertFalse(self.engine.is_flush_due('live', self.session.id))
+
+    def test_end_session_persists_and_evicts(self):
+        """Test that ending a session writes the final snapshot"""
+        self.engine.ensure_loaded('live', self.session.id)
+        self.engine.update_mood('live', self.session.id, {'energy': 0.9})
+
+        self.engine.end_session('live', self.session.id)
+
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.current_mood_state, {'energy': 0.9})
+        self.assertFalse(self.session.active)
+        self.assertIsNone(self.engine.get_snapshot('live', self.session.id))
+
+    def test_end_session_keeps_unsaved_state(self):
+        """Test that a session whose final snapshot fails is not evicted"""
+        self.engine.ensure_loaded('live', self.session.id)
+        self.engine.update_mood('live', self.session.id, {'energy': 0.9})
+
+        with mock.patch.object(self.engine, '_persist', side_effect=RuntimeError('db down')):
+            with self.assertRaises(SessionNotSaved):
+                self.engine.end_session('live', self.session.id)
+
+        self.session.refresh_from_db()
+        self.assertTrue(self.session.active)
+        self.assertEqual(self.engine.get_snapshot('live', self.session.id)['state'], {'energy': 0.9})
+
+        self.engine.end_session('live', self.session.id)
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.current_mood_state, {'energy': 0.9})
+        self.assertFalse(self.session.active)
+
+    def test_updates_after_end_session_are_rejected(self):
+        """Test that an ended session is neither updated nor reloaded"""
+        self.engine.ensure_loaded('live', self.session.id)
+        self.engine.end_session('live', self.session.id)
+
+        with self.assertRaises(SessionNotActive):
+            self.engine.update_mood('live', self.session.id, {'energy': 0.1})
+        with self.assertRaises(SessionNotActive):
+            self.engine.ensure_loaded('live', self.session.id)
+        self.assertFalse(self.store.exists(self.engine.session_key('live', self.session.id)))
+
+    def test_recovery_from_surviving_store(self):
+        """Test that a restarted worker flushes updates left in a shared store"""
+        self.engine.ensure_loaded('live', self.session.id)
+        self.engine.update_mood('live', self.session.id, {'energy': 0.5, 'tempo': 120})
+
+        # The worker dies before flushing; a new engine attaches to the same store
+        del self.engine
+        recovered = LiveSessionStateEngine(store=self.store, flush_interval=5, clock=self.clock)
+
+        self.assertEqual(recovered.flush(), 1)
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.current_mood_state, {'energy': 0.5, 'tempo': 120})
+
+    def test_recovery_from_last_snapshot(self):
+        """Test that losing a process-local store falls back to the last snapshot"""
+        self.engine.ensure_loaded('live', self.session.id)
+        self.engine.update_mood('live', self.session.id, {'energy': 0.5})
+        self.engine.flush()
+        self.engine.update_mood('live', self.session.id, {'energy': 0.9})
+
+        recovered = LiveSessionStateEngine(store=InMemorySessionStateStore(), flush_interval=5, clock=self.clock)
+        recovered.ensure_loaded('live', self.session.id)
+
+        self.assertEqual(recovered.get_snapshot('live', self.session.id)['state'], {'energy': 0.5})
+
+    def test_failed_persist_stays_dirty(self):
+        """Test that a failed snapshot write is retried on the next flush"""
+        self.engine.ensure_loaded('live', self.session.id)
+        self.engine.update_mood('live', self.session.id, {'energy': 0.6})
+
+        with mock.patch.object(self.engine, '_persist', side_effect=RuntimeError('db down')):
+            self.assertEqual(self.engine.flush(), 0)
+
+        self.assertEqual(self.engine.flush(), 1)
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.current_mood_state, {'energy': 0.6})
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class LiveMoodSessionConsumerTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.other = User.objects.create_user(username='testuser2', password='testpass123')
+        self.outsider = User.objects.create_user(username='outsider', password='testpass123')
+        self.space = CollaborativeMoodSpace.objects.create(
+            space_name='Studio',
+            owner=self.user,
+            participant_ids=[self.user.id, self.other.id]
+        )
+        engine = LiveSessionStateEngine(store=InMemorySessionStateStore(), flush_interval=60)
+        patcher = mock.patch('mood_based_music.consumers.get_session_state_engine', return_value=engine)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _communicator(self, user, kind='space', session_id=None):
+        communicator = WebsocketCommunicator(
+            URLRouter(websocket_urlpatterns),
+            f'/ws/mood/{kind}/{session_id or self.space.id}/'
+        )
+        communicator.scope['user'] = user
+        return communicator
+
+    def test_updates_fan_out_to_participants(self):
+        """Test that a mood update reaches every connected participant"""
+        async def scenario():
+            first = self._communicator(self.user)
+            second = self._communicator(self.other)
+            connected, _ = await first.connect()
+            self.assertTrue(connected)
+            await second.connect()
+
+            snapshot = await second.receive_json_from()
+            self.assertEqual(snapshot['type'], 'snapshot')
+            await first.receive_json_from()
+
+            await first.send_json_to({'type': 'update_mood', 'changes': {'energy': 0.7}})
+            for communicator in (first, second):
+                delta = await communicator.receive_json_from()
+                self.assertEqual(delta['changes'], {'energy': 0.7})
+                self.assertEqual(delta['version'], 1)
+
+            await first.disconnect()
+            await second.disconnect()
+
+        async_to_sync(scenario)()
+
+        self.space.refresh_from_db()
+        self.assertEqual(self.space.combined_mood_state, {'energy': 0.7})
+
+    def test_end_session_closes_participants(self):
+        """Test that ending a live session disconnects its clients"""
+        session = LiveMoodSession.objects.create(user=self.user, session_name='Evening')
+
+        async def scenario():
+            first = self._communicator(self.user, 'live', session.id)
+            second = self._communicator(self.user, 'live', session.id)
+            await first.connect()
+            await second.connect()
+            await first.receive_json_from()
+            await second.receive_json_from()
+
+            await first.send_json_to({'type': 'end_session'})
+            for communicator in (first, second):
+                self.assertEqual(await communicator.receive_json_from(), {'type': 'session_ended'})
+                self.assertEqual((await communicator.receive_output())['type'], 'websocket.close')
+
+            late = self._communicator(self.user, 'live', session.id)
+            connected, _ = await late.connect()
+            self.assertFalse(connected)
+
+        async_to_sync(scenario)()
+
+    def test_non_participant_is_rejected(self):
+        """Test that users outside the space cannot connect"""
+        async def scenario():
+            communicator = self._communicator(self.outsider)
+            connected, _ = await communicator.connect()
+            self.assertFalse(connected)
+
+        async_to_sync(scenario)()
+
+    def test_participant_who_left_is_disconnected(self):
+        """Test that leaving closes the socket and other connections lose access"""
+        async def scenario():
+            leaving = self._communicator(self.other)
+            second_tab = self._communicator(self.other)
+            owner = self._communicator(self.user)
+            for communicator in (leaving, second_tab, owner):
+                await communicator.connect()
+                await communicator.receive_json_from()
+
+            await leaving.send_json_to({'type': 'leave'})
+            self.assertEqual((await owner.receive_json_from())['type'], 'participant_left')
+            self.assertEqual((await leaving.receive_output())['type'], 'websocket.close')
+
+            await second_tab.receive_json_from()
+            await second_tab.send_json_to({'type': 'update_mood', 'changes': {'energy': 0.1}})
+            self.assertEqual(
+                await second_tab.receive_json_from(),
+                {'type': 'error', 'message': 'You are not a participant of this session'}
+            )
+            self.assertEqual((await second_tab.receive_output())['type'], 'websocket.close')
+            self.assertTrue(await owner.receive_nothing())
+            await owner.disconnect()
+
+        async_to_sync(scenario)()
+
+    def test_only_the_owner_invites(self):
+        """Test that participants other than the owner cannot invite users"""
+        async def scenario():
+            participant = self._communicator(self.other)
+            owner = self._communicator(self.user)
+            for communicator in (participant, owner):
+                await communicator.connect()
+                await communicator.receive_json_from()
+
+            await participant.send_json_to({'type': 'invite', 'user_id': self.outsider.id})
+            self.assertEqual(
+                await participant.receive_json_from(),
+                {'type': 'error', 'message': 'Only the session owner can do that'}
+            )
+
+            await owner.send_json_to({'type': 'invite', 'user_id': self.outsider.id})
+            for communicator in (participant, owner):
+                delta = await communicator.receive_json_from()
+                self.assertEqual((delta['type'], delta['user_id']), ('participant_joined', self.outsider.id))
+
+            await participant.disconnect()
+            await owner.disconnect()
+
+        async_to_sync(scenario)()
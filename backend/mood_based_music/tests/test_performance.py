@@ -0,0 +1,310 @@
+import asyncio
+import os
+import time
+import random
+from unittest import skipUnless
+from django.core.cache import cache
+from django.db import connection
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.layers import InMemoryChannelLayer
+from django.db.models import Count
+from ..models import Mood, MoodRequest, GeneratedMoodTrack, LiveMoodSession
+from ..analytics.models import TrackInteraction
+from ..analytics.services import MoodAnalyticsService
+from ..services.trending_service import InMemoryTrendingStore, TrendingBlendEngine
+from ..services.session_state import InMemorySessionStateStore, LiveSessionStateEngine
+from ..services.provider_orchestrator import ProviderOrchestrator
+from ..services.generation_cache import SingleFlightGenerationCache
+from ..ai_providers import AIProvider
+
+User = get_user_model()
+
+RUN_BENCHMARKS = os.getenv('RUN_BENCHMARKS', '').lower() == 'true'
+INTERACTION_ROWS = int(os.getenv('BENCHMARK_INTERACTION_ROWS', 10_000_000))
+BLEND_EVENTS = int(os.getenv('BENCHMARK_BLEND_EVENTS', 1_000_000))
+SESSION_UPDATES = int(os.getenv('BENCHMARK_SESSION_UPDATES', 10_000))
+PROVIDER_REQUESTS = int(os.getenv('BENCHMARK_PROVIDER_REQUESTS', 2_000))
+REPLAYED_REQUESTS = int(os.getenv('BENCHMARK_REPLAYED_REQUESTS', 5_000))
+INSERT_BATCH_SIZE = 50_000
+
+
+@skipUnless(RUN_BENCHMARKS, 'Set RUN_BENCHMARKS=true to run benchmarks')
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class MoodAnalyticsBenchmark(TransactionTestCase):
+    """Benchmark track analytics over synthetic interactions spread across 90 days."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='benchuser', password='testpass123')
+        mood = Mood.objects.create(name='Benchmark')
+        mood_request = MoodRequest.objects.create(user=self.user, selected_mood=mood, intensity=0.5)
+        self.track = GeneratedMoodTrack.objects.create(mood_request=mood_request)
+
+        types = ['play', 'skip', 'replay', 'complete']
+        now = timezone.now()
+        for offset in range(0, INTERACTION_ROWS, INSERT_BATCH_SIZE):
+            size = min(INSERT_BATCH_SIZE, INTERACTION_ROWS - offset)
+            TrackInteraction.objects.bulk_create([
+                TrackInteraction(
+                    track=self.track,
+                    user=self.user,
+                    interaction_type=random.choice(types),
+                    duration=random.randint(10, 300)
+                )
+                for _ in range(size)
+            ])
+        # Spread rows over the last 90 days in a single statement
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE {TrackInteraction._meta.db_table} "
+                "SET created_at = %s - (id %% 90) * interval '1 day'",
+                [now]
+            )
+            cursor.execute(f"ANALYZE {TrackInteraction._meta.db_table}")
+
+    def _time(self, func, runs=5):
+        timings = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+        return min(timings)
+
+    def test_raw_vs_rollup_analytics(self):
+        raw = self._time(lambda: MoodAnalyticsService.get_track_analytics(self.track.id, self.user.id))
+
+        start = time.perf_counter()
+        MoodAnalyticsService.rollup_interactions()
+        rollup_build = time.perf_counter() - start
+
+        rolled = self._time(lambda: MoodAnalyticsService.get_track_analytics(self.track.id, self.user.id))
+
+        print(
+            f"\n{INTERACTION_ROWS} interactions: raw {raw * 1000:.1f} ms, "
+            f"rollup {rolled * 1000:.1f} ms ({raw / rolled:.1f}x), "
+            f"initial rollup build {rollup_build:.1f} s"
+        )
+        self.assertLess(rolled, raw)
+
+
+@skipUnless(RUN_BENCHMARKS, 'Set RUN_BENCHMARKS=true to run benchmarks')
+class TrendingBlendsBenchmark(TransactionTestCase):
+    """Benchmark the trending leaderboard against the annotate-and-sort query."""
+
+    blend_count = 5000
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='benchuser', password='testpass123')
+        requests = MoodRequest.objects.bulk_create([
+            MoodRequest(user=self.user, parameters={'type': 'multi_mood_blend', 'moods': []})
+            for _ in range(self.blend_count)
+        ])
+        self.tracks = GeneratedMoodTrack.objects.bulk_create([
+            GeneratedMoodTrack(mood_request=request) for request in requests
+        ])
+        self.events = [
+            (random.choice(self.tracks).id, random.choice(['play', 'replay', 'complete']))
+            for _ in range(BLEND_EVENTS)
+        ]
+        for offset in range(0, BLEND_EVENTS, INSERT_BATCH_SIZE):
+            TrackInteraction.objects.bulk_create([
+                TrackInteraction(track_id=track_id, user=self.user, interaction_type=event_type)
+                for track_id, event_type in self.events[offset:offset + INSERT_BATCH_SIZE]
+            ])
+        with connection.cursor() as cursor:
+            cursor.execute(f"ANALYZE {TrackInteraction._meta.db_table}")
+
+    def test_query_vs_leaderboard(self):
+        start = time.perf_counter()
+        list(
+            GeneratedMoodTrack.objects.filter(mood_request__parameters__type="multi_mood_blend")
+            .annotate(usage_count=Count('trackinteraction'))
+            .order_by('-usage_count')[:10]
+        )
+        query_time = time.perf_counter() - start
+
+        engine = TrendingBlendEngine(store=InMemoryTrendingStore(), half_life_hours=24, rebuild_on_first_use=False)
+        for track in self.tracks:
+            engine.record_event(track.id, 'created')
+        start = time.perf_counter()
+        for track_id, event_type in self.events:
+            engine.record_event(track_id, event_type, only_existing=True)
+        ingest_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for _ in range(1000):
+            engine.top(10)
+        top_time = (time.perf_counter() - start) / 1000
+
+        start = time.perf_counter()
+        engine.rebuild()
+        rebuild_time = time.perf_counter() - start
+
+        print(
+            f"\n{BLEND_EVENTS} blend events: annotate query {query_time * 1000:.1f} ms, "
+            f"leaderboard top-10 {top_time * 1000:.3f} ms, "
+            f"ingest {BLEND_EVENTS / ingest_time:,.0f} events/s, rebuild {rebuild_time:.1f} s"
+        )
+        self.assertLess(top_time, query_time)
+
+
+@skipUnless(RUN_BENCHMARKS, 'Set RUN_BENCHMARKS=true to run benchmarks')
+class LiveSessionStateBenchmark(TransactionTestCase):
+    """Benchmark live session updates with 100 participants per session."""
+
+    participants = 100
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='benchuser', password='testpass123')
+        self.session = LiveMoodSession.objects.create(user=self.user, current_mood_state={})
+
+    def test_orm_vs_engine_updates(self):
+        engine = LiveSessionStateEngine(store=InMemorySessionStateStore(), flush_interval=5)
+        engine.ensure_loaded('live', self.session.id)
+        group = engine.group_name('live', self.session.id)
+
+        def orm_update(i):
+            session = LiveMoodSession.objects.get(id=self.session.id)
+            session.current_mood_state = {**(session.current_mood_state or {}), 'energy': i}
+            session.save()
+            return session.current_mood_state
+
+        async def run(update):
+            layer = InMemoryChannelLayer(capacity=SESSION_UPDATES + 1)
+            for n in range(self.participants):
+                await layer.group_add(group, f"participant.{n}")
+            start = time.perf_counter()
+            for i in range(SESSION_UPDATES):
+                await update(layer, i)
+            return SESSION_UPDATES / (time.perf_counter() - start)
+
+        async def orm_path(layer, i):
+            state = await database_sync_to_async(orm_update)(i)
+            await layer.group_send(group, {'type': 'session_state', 'state': state})
+
+        async def engine_path(layer, i):
+            delta = engine.update_mood('live', self.session.id, {'energy': i}, self.user.id)
+            await engine.publish(layer, 'live', self.session.id, delta)
+            if engine.is_flush_due('live', self.session.id):
+                await database_sync_to_async(engine.flush)('live', self.session.id)
+
+        orm_rate = async_to_sync(run)(orm_path)
+        engine_rate = async_to_sync(run)(engine_path)
+
+        print(
+            f"\n{SESSION_UPDATES} updates, {self.participants} participants: "
+            f"ORM {orm_rate:,.0f} updates/s, engine {engine_rate:,.0f} updates/s "
+            f"({engine_rate * self.participants:,.0f} deliveries/s)"
+        )
+        self.assertGreater(engine_rate, orm_rate)
+
+
+class TailLatencyProvider(AIProvider):
+    """Fake provider: 20 ms typical latency with a 5% tail at 500 ms."""
+
+    def __init__(self, seed):
+        self.random = random.Random(seed)
+
+    async def generate_music(self, params):
+        await asyncio.sleep(0.5 if self.random.random() < 0.05 else 0.02)
+        return {'status': 'success'}
+
+    async def get_model_info(self):
+        return {}
+
+
+@skipUnless(RUN_BENCHMARKS, 'Set RUN_BENCHMARKS=true to run benchmarks')
+class ProviderHedgingBenchmark(SimpleTestCase):
+    """Compare tail latency of a single provider against hedged dispatch."""
+
+    def _latencies(self, provider):
+        async def timed():
+            start = time.perf_counter()
+            await provider.generate_music({})
+            return time.perf_counter() - start
+
+        async def run():
+            latencies = []
+            for offset in range(0, PROVIDER_REQUESTS, 50):
+                latencies += await asyncio.gather(*[timed() for _ in range(min(50, PROVIDER_REQUESTS - offset))])
+            return sorted(latencies)
+
+        return async_to_sync(run)()
+
+    def _percentile(self, latencies, percentile):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * percentile / 100))]
+
+    def test_hedged_tail_latency(self):
+        single = self._latencies(TailLatencyProvider(seed=1))
+        hedged = self._latencies(ProviderOrchestrator(
+            [('primary', TailLatencyProvider(seed=1)), ('secondary', TailLatencyProvider(seed=2))],
+            default_hedge_delay=0.05
+        ))
+
+        for label, latencies in (('single', single), ('hedged', hedged)):
+            print(
+                f"\n{label}: p50 {self._percentile(latencies, 50) * 1000:.0f} ms, "
+                f"p95 {self._percentile(latencies, 95) * 1000:.0f} ms, "
+                f"p99 {self._percentile(latencies, 99) * 1000:.0f} ms"
+            )
+        self.assertLess(self._percentile(hedged, 99), self._percentile(single, 99))
+
+
+class CountingUpstream(AIProvider):
+    def __init__(self):
+        self.calls = 0
+
+    async def generate_music(self, params):
+        self.calls += 1
+        await asyncio.sleep(0.02)
+        return {'status': 'success'}
+
+    async def get_model_info(self):
+        return {}
+
+
+@skipUnless(RUN_BENCHMARKS, 'Set RUN_BENCHMARKS=true to run benchmarks')
+@override_settings(CACHES={'default': {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    'OPTIONS': {'MAX_ENTRIES': 100_000},
+}})
+class GenerationDeduplicationBenchmark(SimpleTestCase):
+    """Replay a Zipf-skewed request mix and count upstream generation calls."""
+
+    distinct_moods = 500
+
+    def _request_mix(self):
+        rng = random.Random(42)
+        weights = [1 / rank for rank in range(1, self.distinct_moods + 1)]
+        moods = rng.choices(range(self.distinct_moods), weights=weights, k=REPLAYED_REQUESTS)
+        return [
+            {'mood': {'name': f"mood-{mood}"}, 'intensity': (mood % 10) / 10, 'user_id': rng.randint(1, 1000)}
+            for mood in moods
+        ]
+
+    def test_upstream_call_reduction(self):
+        cache.clear()
+        requests = self._request_mix()
+        upstream = CountingUpstream()
+        layer = SingleFlightGenerationCache(ttl=3600)
+
+        async def replay():
+            # Requests arrive in bursts of 50 concurrent calls
+            for offset in range(0, len(requests), 50):
+                await asyncio.gather(*[
+                    layer.generate(request, upstream, 'suno')
+                    for request in requests[offset:offset + 50]
+                ])
+
+        async_to_sync(replay)()
+
+        print(
+            f"\n{len(requests)} replayed requests over {self.distinct_moods} moods: "
+            f"{upstream.calls} upstream calls ({1 - upstream.calls / len(requests):.1%} reduction); "
+            f"shared in flight {layer.stats['shared']}, served from cache {layer.stats['cached']}"
+        )
+        self.assertLess(upstream.calls, len(requests))
@@ -0,0 +1,202 @@
+import asyncio
+from asgiref.sync import async_to_sync
+from django.test import SimpleTestCase
+from ..services.provider_orchestrator import (
+    AllProvidersFailedError,
+    CircuitBreaker,
+    ProviderOrchestrator,
+    ProviderStats,
+)
+from ..ai_providers import AIProvider
+
+
+class FakeProvider(AIProvider):
+    """Provider that replays scripted latencies and faults."""
+
+    def __init__(self, name, latencies, failures=()):
+        self.name = name
+        self.latencies = list(latencies)
+        self.failures = set(failures)
+        self.calls = 0
+        self.cancelled = 0
+
+    async def generate_music(self, params):
+        call = self.calls
+        self.calls += 1
+        try:
+            await asyncio.sleep(self.latencies[min(call, len(self.latencies) - 1)])
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if call in self.failures:
+            raise RuntimeError(f"{self.name} failed")
+        return {'status': 'success', 'audio_url': f"{self.name}/{call}.mp3"}
+
+    async def get_model_info(self):
+        return {'provider': self.name}
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def generate(orchestrator, params=None):
+    async def run():
+        result = await orchestrator.generate_music(params or {})
+        # Let cancelled losers unwind before inspecting them
+        await asyncio.sleep(0)
+        return result
+    return async_to_sync(run)()
+
+
+class ProviderStatsTests(SimpleTestCase):
+    def test_percentile_and_error_rate(self):
+        stats = ProviderStats(window=10)
+        for latency in range(1, 11):
+            stats.record(latency, success=latency != 1)
+
+        self.assertEqual(stats.latency_percentile(95), 10)
+        self.assertEqual(stats.latency_percentile(50), 6)
+        self.assertAlmostEqual(stats.error_rate, 0.1)
+
+        stats.record(100, success=True)
+        self.assertEqual(stats.count, 10)
+        self.assertEqual(stats.error_rate, 0)
+
+    def test_cancelled_calls_are_latency_samples(self):
+        stats = ProviderStats()
+        stats.record(1, success=False)
+        stats.record(2, success=True)
+        stats.record(30, success=None)
+
+        self.assertEqual(stats.latency_percentile(95), 30)
+        self.assertAlmostEqual(stats.error_rate, 0.5)
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.stats = ProviderStats()
+        self.breaker = CircuitBreaker(consecutive_failures=3, reset_timeout=10, clock=self.clock)
+
+    def _fail(self, times):
+        for _ in range(times):
+            self.stats.record(1, False)
+            self.breaker.record_failure(self.stats)
+
+    def test_opens_after_consecutive_failures(self):
+        self._fail(2)
+        self.assertTrue(self.breaker.allow_request())
+        self._fail(1)
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(self.breaker.allow_request())
+
+    def test_half_open_allows_single_trial(self):
+        self._fail(3)
+        self.clock.now += 10
+
+        self.assertTrue(self.breaker.allow_request())
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertFalse(self.breaker.allow_request())
+
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_failed_trial_reopens(self):
+        self._fail(3)
+        self.clock.now += 10
+        self.breaker.allow_request()
+
+        self._fail(1)
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(self.breaker.allow_request())
+
+
+class ProviderOrchestratorTests(SimpleTestCase):
+    def test_fast_primary_is_not_hedged(self):
+        primary = FakeProvider('primary', [0.01])
+        secondary = FakeProvider('secondary', [0.01])
+        orchestrator = ProviderOrchestrator(
+            [('primary', primary), ('secondary', secondary)],
+            default_hedge_delay=0.5
+        )
+
+        result = generate(orchestrator)
+
+        self.assertEqual(result['metadata']['served_by'], 'primary')
+        self.assertEqual(secondary.calls, 0)
+
+    def test_slow_primary_is_hedged_and_cancelled(self):
+        primary = FakeProvider('primary', [5])
+        secondary = FakeProvider('secondary', [0.01])
+        orchestrator = ProviderOrchestrator(
+            [('primary', primary), ('secondary', secondary)],
+            default_hedge_delay=0.05
+        )
+
+        result = generate(orchestrator)
+
+        self.assertEqual(result['metadata']['served_by'], 'secondary')
+        self.assertEqual(primary.cancelled, 1)
+        self.assertEqual(orchestrator.breakers['primary'].state, CircuitBreaker.CLOSED)
+        # The cancelled call is kept as a lower bound of the primary's latency
+        self.assertEqual(orchestrator.stats['primary'].count, 1)
+        self.assertGreaterEqual(orchestrator.stats['primary'].latency_percentile(95), 0.05)
+        self.assertEqual(orchestrator.stats['primary'].error_rate, 0)
+
+    def test_hedge_delay_tracks_p95(self):
+        primary = FakeProvider('primary', [0.01])
+        orchestrator = ProviderOrchestrator(
+            [('primary', primary), ('secondary', FakeProvider('secondary', [0.01]))],
+            default_hedge_delay=1,
+            min_samples=5
+        )
+        self.assertEqual(orchestrator.hedge_delay('primary'), 1)
+
+        for latency in (0.1, 0.2, 0.3, 0.4, 2.0):
+            orchestrator.stats['primary'].record(latency, True)
+        self.assertEqual(orchestrator.hedge_delay('primary'), 2.0)
+
+    def test_failure_fails_over_without_waiting(self):
+        primary = FakeProvider('primary', [0.01], failures={0})
+        secondary = FakeProvider('secondary', [0.01])
+        orchestrator = ProviderOrchestrator(
+            [('primary', primary), ('secondary', secondary)],
+            default_hedge_delay=10
+        )
+
+        result = generate(orchestrator)
+
+        self.assertEqual(result['metadata']['served_by'], 'secondary')
+        self.assertAlmostEqual(orchestrator.stats['primary'].error_rate, 1.0)
+
+    def test_open_circuit_skips_provider(self):
+        primary = FakeProvider('primary', [0.01], failures=range(100))
+        secondary = FakeProvider('secondary', [0.01])
+        orchestrator = ProviderOrchestrator(
+            [('primary', primary), ('secondary', secondary)],
+            default_hedge_delay=10,
+            breaker_factory=lambda: CircuitBreaker(consecutive_failures=2, reset_timeout=60)
+        )
+
+        for _ in range(5):
+            self.assertEqual(generate(orchestrator)['metadata']['served_by'], 'secondary')
+
+        self.assertEqual(primary.calls, 2)
+        self.assertEqual(orchestrator.breakers['primary'].state, CircuitBreaker.OPEN)
+
+    def test_all_providers_failing_raises(self):
+        orchestrator = ProviderOrchestrator(
+            [
+                ('primary', FakeProvider('primary', [0.01], failures={0})),
+                ('secondary', FakeProvider('secondary', [0.01], failures={0})),
+            ],
+            default_hedge_delay=10
+        )
+
+        with self.assertRaises(AllProvidersFailedError):
+            generate(orchestrator)
@@ -0,0 +1,224 @@
+from datetime import timedelta
+from unittest import mock
+from django.test import SimpleTestCase, TestCase
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+from ..models import MoodRequest, GeneratedMoodTrack, MoodFeedback
+from ..analytics.models import TrackInteraction
+from ..services.trending_service import InMemoryTrendingStore, TrendingBlendEngine
+from ..views import MoodMusicViewSet
+
+User = get_user_model()
+
+HOUR = 3600
+
+
+class FakeClock:
+    def __init__(self, now=1_700_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class FailingTrendingStore(InMemoryTrendingStore):
+    def increment(self, *args, **kwargs):
+        raise ConnectionError('Redis went away')
+
+
+class TrendingEngineTests(SimpleTestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.engine = TrendingBlendEngine(
+            store=InMemoryTrendingStore(),
+            half_life_hours=1,
+            clock=self.clock,
+            rebuild_on_first_use=False
+        )
+
+    def test_top_orders_by_score(self):
+        """Test that blends are ranked by weighted event totals"""
+        self.engine.record_event(1, 'created')
+        self.engine.record_event(2, 'created')
+        self.engine.record_event(2, 'like')
+        self.engine.record_event(3, 'created')
+        self.engine.record_event(3, 'play')
+
+        ranked = self.engine.top(3)
+        self.assertEqual([track_id for track_id, _ in ranked], [2, 3, 1])
+        self.assertAlmostEqual(ranked[0][1], 4.0)
+        self.assertEqual(len(self.engine.top(2)), 2)
+
+    def test_scores_decay_with_half_life(self):
+        """Test that older events count for half as much per half-life"""
+        self.engine.record_event(1, 'like')
+        self.clock.now += HOUR
+        self.engine.record_event(2, 'created')
+        self.engine.record_event(2, 'play')
+
+        ranked = dict(self.engine.top(2))
+        self.assertAlmostEqual(ranked[1], 1.5)
+        self.assertAlmostEqual(ranked[2], 2.0)
+
+        self.clock.now += HOUR
+        ranked = dict(self.engine.top(2))
+        self.assertAlmostEqual(ranked[1], 0.75)
+        self.assertAlmostEqual(ranked[2], 1.0)
+
+    def test_usage_only_updates_existing_blends(self):
+        """Test that usage events ignore tracks that are not ranked blends"""
+        self.engine.record_event(1, 'created')
+
+        self.assertFalse(self.engine.record_event(99, 'play', only_existing=True))
+        self.assertTrue(self.engine.record_event(1, 'play', only_existing=True))
+        self.assertFalse(self.engine.record_event(1, 'skip'))
+        self.assertEqual(self.engine.top(10), [(1, 2.0)])
+
+    def test_repeated_updates_keep_single_entry(self):
+        """Test that stale heap entries never surface in the top-N"""
+        for _ in range(500):
+            self.engine.record_event(1, 'play')
+            self.engine.record_event(2, 'play')
+        self.engine.record_event(3, 'like')
+
+        ranked = self.engine.top(10)
+        self.assertEqual(sorted(track_id for track_id, _ in ranked), [1, 2, 3])
+        self.assertAlmostEqual(dict(ranked)[1], 500.0)
+
+    def test_store_errors_are_logged(self):
+        """Test that a failing store does not fail the request recording the event"""
+        engine = TrendingBlendEngine(store=FailingTrendingStore(), clock=self.clock, rebuild_on_first_use=False)
+
+        with self.assertLogs('mood_based_music.services.trending_service', 'ERROR'):
+            self.assertFalse(engine.record_event(1, 'like'))
+
+
+class TrendingReconciliationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.clock = FakeClock(timezone.now().timestamp())
+        self.engine = TrendingBlendEngine(
+            store=InMemoryTrendingStore(),
+            half_life_hours=24,
+            clock=self.clock,
+            rebuild_on_first_use=False
+        )
+
+    def _create_track(self, blend=True):
+        request = MoodRequest.objects.create(
+            user=self.user,
+            parameters={'type': 'multi_mood_blend', 'moods': []} if blend else {'type': 'single'}
+        )
+        return GeneratedMoodTrack.objects.create(mood_request=request)
+
+    def test_rebuild_matches_incremental_scores(self):
+        """Test that reconciliation reproduces the incrementally maintained ranking"""
+        popular = self._create_track()
+        quiet = self._create_track()
+        single = self._create_track(blend=False)
+
+        for track in (popular, quiet):
+            self.engine.record_event(track.id, 'created', timestamp=track.created_at.timestamp())
+        for _ in range(3):
+            interaction = TrackInteraction.objects.create(
+                user=self.user, track=popular, interaction_type='play'
+            )
+            self.engine.record_event(popular.id, 'play', timestamp=interaction.created_at.timestamp())
+        feedback = MoodFeedback.objects.create(
+            user=self.user, generated_track=quiet, feedback_type='like'
+        )
+        self.engine.record_event(quiet.id, 'like', timestamp=feedback.created_at.timestamp())
+        TrackInteraction.objects.create(user=self.user, track=single, interaction_type='play')
+
+        incremental = dict(self.engine.top(10))
+
+        self.clock.now = timezone.now().timestamp()
+        rebuilt_engine = TrendingBlendEngine(
+            store=InMemoryTrendingStore(),
+            half_life_hours=24,
+            clock=self.clock
+        )
+        self.assertEqual(rebuilt_engine.rebuild(), 2)
+        rebuilt = dict(rebuilt_engine.top(10))
+
+        self.assertEqual(set(rebuilt), {popular.id, quiet.id})
+        for track_id, score in incremental.items():
+            self.assertAlmostEqual(rebuilt[track_id], score, places=4)
+
+    def test_rebuild_ignores_stale_events(self):
+        """Test that week-old events contribute almost nothing after rebuild"""
+        old = self._create_track()
+        new = self._create_track()
+        GeneratedMoodTrack.objects.filter(id=old.id).update(
+            created_at=timezone.now() - timedelta(days=7)
+        )
+
+        self.clock.now = timezone.now().timestamp()
+        self.engine.rebuild()
+        ranked = self.engine.top(2)
+
+        self.assertEqual(ranked[0][0], new.id)
+        self.assertLess(ranked[1][1], 0.01)
+
+    def test_leaderboard_is_built_on_first_use(self):
+        """Test that a process without a leaderboard builds it from the database"""
+        track = self._create_track()
+        self.clock.now = timezone.now().timestamp()
+        engine = TrendingBlendEngine(store=InMemoryTrendingStore(), half_life_hours=24, clock=self.clock)
+
+        self.assertEqual([track_id for track_id, _ in engine.top(10)], [track.id])
+        self.assertTrue(engine.record_event(track.id, 'play', only_existing=True))
+
+    def test_events_during_rebuild_are_kept(self):
+        """Test that events recorded while a rebuild reads the database survive the swap"""
+        track = self._create_track()
+        self.clock.now = timezone.now().timestamp()
+        self.engine.rebuild()
+        read_scores = self.engine._read_scores
+
+        def read_with_concurrent_events(epoch):
+            scores = read_scores(epoch)
+            # Recorded by another request before the swap: one already read, one newer
+            self.engine.record_event(track.id, 'like', timestamp=epoch - 1)
+            self.engine.record_event(track.id, 'play', timestamp=epoch + 1)
+            return scores
+
+        self.engine._read_scores = read_with_concurrent_events
+        self.clock.now += 10
+        self.engine.rebuild()
+
+        self.clock.now += 1
+        self.assertAlmostEqual(dict(self.engine.top(1))[track.id], 2.0, places=3)
+
+
+class TrendingBlendsViewTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.view = MoodMusicViewSet.as_view({'get': 'trending_blends'})
+
+    def get(self, **params):
+        request = APIRequestFactory().get('/mood-music/trending-blends/', params)
+        force_authenticate(request, user=self.user)
+        return self.view(request)
+
+    @mock.patch('mood_based_music.views.AdvancedMoodService')
+    def test_limit_is_clamped(self, service):
+        """Test that the limit is kept between 1 and the configured maximum"""
+        get_trending_blends = service.return_value.get_trending_blends
+        get_trending_blends.return_value = []
+
+        self.assertEqual(self.get(limit='5000').status_code, 200)
+        get_trending_blends.assert_called_with(limit=100)
+        self.get(limit='0')
+        get_trending_blends.assert_called_with(limit=1)
+        self.get()
+        get_trending_blends.assert_called_with(limit=10)
+
+    @mock.patch('mood_based_music.views.AdvancedMoodService')
+    def test_invalid_limit_is_rejected(self, service):
+        """Test that a non-numeric limit is a client error"""
+        response = self.get(limit='ten')
+
+        self.assertEqual(response.status_code, 400)
+        service.return_value.get_trending_blends.assert_not_called()
@@ -36,7 +36,9 @@ from .serializers import (
     MoodPlaylistSerializer,
 )
 # Import from the modular services package
+from .config import MoodConfig
 from .services import MoodMusicGenerator, AdvancedMoodService
+from .services.trending_service import get_trending_engine
 from asgiref.sync import async_to_sync
 import logging
 from django.db import transaction
@@ -196,6 +198,16 @@ class MoodFeedbackViewSet(UserSpecificViewSet):
     filter_fields = ['feedback_type']
     search_fields = ['feedback_notes']
 
+    def perform_create(self, serializer):
+        feedback = serializer.save(user=self.request.user)
+        if feedback.feedback_type == 'like':
+            transaction.on_commit(
+                lambda: get_trending_engine().record_event(
+                    feedback.generated_track_id, 'like',
+                    timestamp=feedback.created_at.timestamp(), only_existing=True
+                )
+            )
+
 
 class MoodProfileViewSet(UserSpecificViewSet):
     """
@@ -310,6 +322,12 @@ class CollaborativeMoodSpaceViewSet(viewsets.ModelViewSet):
         user_id = self.request.user.id
         return self.queryset.filter(participant_ids__contains=[user_id])
 
+    def perform_create(self, serializer):
+        """
+        Make the creating user the owner of the space.
+        """
+        serializer.save(owner=self.request.user)
+
 
 class AdvancedMoodParameterViewSet(UserSpecificViewSet):
     """
@@ -431,10 +449,17 @@ class MoodMusicViewSet(viewsets.ModelViewSet):
         Get trending multi-mood blends based on user feedback.
         """
         try:
-            service = AdvancedMoodService()
-            trending_blends = service.get_trending_blends(
-                limit=request.query_params.get('limit', 10)
+            limit = int(request.query_params.get('limit', 10))
+        except ValueError:
+            return Response(
+                {'error': 'limit must be an integer'},
+                status=status.HTTP_400_BAD_REQUEST
             )
+        limit = max(1, min(limit, MoodConfig.TRENDING_MAX_LIMIT))
+
+        try:
+            service = AdvancedMoodService()
+            trending_blends = service.get_trending_blends(limit=limit)
             
             return Response(trending_blends)
             
@@ -0,0 +1,97 @@
+"""
+Base class for the in-process buffers that write to the database from a
+background thread.
+
+Subclasses buffer work from request threads and implement ``flush()``; the
+base class owns the flusher thread, which runs every ``interval`` seconds
+(or sooner once ``_wakeup`` is set), restarts after a fork and is stopped,
+with a final flush, when the process exits.
+"""
+import atexit
+import logging
+import os
+import threading
+from abc import ABC, abstractmethod
+
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+_shared_lock = threading.Lock()
+
+
+class BackgroundFlusher(ABC):
+    """
+    Runs ``flush()`` periodically on a daemon thread.
+    """
+
+    thread_name = 'background-flusher'
+
+    def __init__(self):
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._start_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    @property
+    def interval(self) -> float:
+        """Seconds between background flushes; 0 or less disables the thread."""
+        return self.flush_interval
+
+    @classmethod
+    def shared(cls):
+        """Get the process-wide instance of this class, created on first use."""
+        instance = cls.__dict__.get('_shared')
+        if instance is None:
+            with _shared_lock:
+                instance = cls.__dict__.get('_shared')
+                if instance is None:
+                    instance = cls()
+                    cls._shared = instance
+                    atexit.register(instance.stop)
+        return instance
+
+    @abstractmethod
+    def flush(self):
+        """Write what is buffered so far."""
+        pass
+
+    def _background_flush(self) -> None:
+        self.flush()
+
+    def _ensure_running(self) -> None:
+        # Threads do not survive a fork, so a pre-forked worker starts its own
+        if self._pid == os.getpid() or self.interval <= 0:
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name=self.thread_name, daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            if self._stopped.is_set():
+                return
+            try:
+                self._background_flush()
+            except Exception as e:
+                logger.error(f"Error in {self.thread_name}: {str(e)}")
+            finally:
+                close_old_connections()
+
+    def stop(self, flush: bool = True) -> None:
+        """Stop the flusher thread, flushing what is still buffered."""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=5)
+        self._thread = None
+        self._pid = None
+        if flush:
+            self.flush()
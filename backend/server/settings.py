@@ -154,6 +154,8 @@ LOGGING = {
 
 # Encryption Settings
 ENCRYPTION_KEY = os.getenv('ENCRYPTION_KEY', base64.urlsafe_b64encode(os.urandom(32)).decode())
+# Retired keys, comma-separated, still accepted for decryption after a rotation
+ENCRYPTION_PREVIOUS_KEYS = [key for key in os.getenv('ENCRYPTION_PREVIOUS_KEYS', '').split(',') if key]
 
 ROOT_URLCONF = 'backend.urls'
 
@@ -294,6 +296,10 @@ WEBSOCKET_URL = 'ws://localhost:8000/ws'
 # OpenAI Configuration
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY', '')  # Add OpenAI key configuration
 
+# Streaming LLM for the AI DJ chat companion ('openai' or 'fake')
+DJ_CHAT_LLM_PROVIDER = os.getenv('DJ_CHAT_LLM_PROVIDER', 'openai')
+DJ_CHAT_MODEL = os.getenv('DJ_CHAT_MODEL', 'gpt-4')
+
 # Caching Configuration
 CACHES = {
     'default': {
@@ -322,3 +328,113 @@ AUTO_SCALING = {
     'SCALE_UP_MEMORY_THRESHOLD': 85,
     'SCALE_DOWN_MEMORY_THRESHOLD': 40,
 }
+
+# Buffered request metrics (ai_dj.modules.performance.metrics_buffer)
+PERFORMANCE_METRICS = {
+    'BUFFER_SIZE': 20000,
+    'BATCH_SIZE': 500,
+    'FLUSH_INTERVAL': 2.0,
+    'SAMPLE_THRESHOLD': 0.5,
+    'SAMPLE_RATE': 0.1,
+}
+
+# Buffered CacheableTrackTransition hit counts (ai_dj.modules.performance.hit_counter)
+TRANSITION_HITS = {
+    'FLUSH_INTERVAL': 5.0,
+    'MAX_PENDING': 10000,
+    'BATCH_SIZE': 1000,
+}
+
+# Shared GET response cache (ai_dj.modules.performance.response_cache)
+RESPONSE_CACHE = {
+    'TIMEOUT': 300,
+    'STALE_TIMEOUT': 600,
+    'LOCK_TIMEOUT': 30,
+    'MISS_WAIT': 2.0,
+    'COMPRESS_MIN_SIZE': 1024,
+}
+
+# Sliding-window group emotional state (ai_dj.modules.biometrics.aggregator)
+BIOMETRICS_GROUP_STATE = {
+    'WINDOW_SECONDS': 300,
+    'BUCKET_SECONDS': 5,
+    'WRITE_INTERVAL': 10,
+    'SYNC_INTERVAL': 1,
+}
+
+# Metric time-series rollups (ai_dj.modules.monitoring.rollups); run the
+# compact_metric_rollups task every minute and apply_rollup_retention daily
+MONITORING_ROLLUPS = {
+    # Days to keep raw rows and each resolution; None keeps them forever
+    'RETENTION': {'raw': None, 'minute': 14, 'hour': 400, 'day': None},
+    'MIN_BUCKETS': 24,
+    'COMPACTION_DELAY': 60,
+}
+
+# In-memory VR session state broadcast in ticks (future_capabilities.vr_state)
+VR_STATE = {
+    'TICK_RATE': 30,
+    'PERSIST_INTERVAL': 30.0,
+    'PRECISION': 3,
+    'INTEREST_RADIUS': None,
+}
+
+# Cached JWT identities for websocket connects (future_capabilities.identity)
+WEBSOCKET_IDENTITY = {
+    'MAX_TOKENS': 50000,
+}
+
+# Micro-batched neural signal storage (future_capabilities.neural_ingest)
+NEURAL_INGEST = {
+    'FLUSH_INTERVAL': 1.0,
+    'BLOCK_SAMPLES': 4096,
+    'HIGH_WATERMARK': 500000,
+    'MAX_PENDING': 2000000,
+}
+
+# Compiled neural control mappings (future_capabilities.neural_mapping)
+NEURAL_MAPPING = {
+    'MAX_USERS': 10000,
+    'CHECK_INTERVAL': 1.0,
+}
+
+# In-memory collaborative editing documents (future_capabilities.collaboration)
+COLLABORATION = {
+    'FLUSH_INTERVAL': 2.0,
+    'SNAPSHOT_EVERY': 100,
+    'HISTORY': 1000,
+    'MAX_OPS': 500,
+}
+
+# Dependency-aware bulk operations (future_capabilities.bulk_operations)
+BULK_OPERATIONS = {
+    'MAX_WORKERS': 8,
+}
+
+# Warm plugin worker processes (future_capabilities.plugin_runtime)
+PLUGIN_RUNTIME = {
+    'WORKERS': 4,
+    'MAX_CALLS': 1000,
+    'TIMEOUT': 5.0,
+    'MEMORY_LIMIT': 512,
+    'PRELOAD': [],
+    # Packages whose plugin entry points may run; nothing runs until listed
+    'ALLOWED_MODULES': [],
+}
+
+# Streaming biofeedback signal processing (future_capabilities.biofeedback_dsp)
+BIOFEEDBACK_DSP = {
+    'FLUSH_INTERVAL': 2.0,
+    'WINDOW': 5.0,
+    'STORED_RATE': 32.0,
+    'HRV_WINDOW': 60.0,
+}
+
+# Coalesced delta sync of DAW controls and plugin state (future_capabilities.control_sync)
+CONTROL_SYNC = {
+    'TICK_INTERVAL': 0.05,
+    'PERSIST_INTERVAL': 1.0,
+    'PRECISION': 4,
+    # Shared by every worker, so HTTP and websocket updates of a scope agree
+    'REDIS_URL': 'redis://127.0.0.1:6379/1',
+}
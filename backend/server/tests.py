@@ -0,0 +1,87 @@
+import os
+import threading
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from server import background
+from server.background import BackgroundFlusher
+
+
+class RecordingFlusher(BackgroundFlusher):
+    thread_name = 'recording-flusher'
+
+    def __init__(self, flush_interval=60.0, fail=0):
+        super().__init__()
+        self.flush_interval = flush_interval
+        self.fail = fail
+        self.flushes = 0
+        self.flushed = threading.Event()
+
+    def flush(self):
+        self.flushes += 1
+        if self.fail:
+            self.fail -= 1
+            raise RuntimeError('database down')
+        self.flushed.set()
+
+
+class BackgroundFlusherTests(SimpleTestCase):
+    def test_flush_is_abstract(self):
+        with self.assertRaises(TypeError):
+            BackgroundFlusher()
+
+    def test_disabled_without_an_interval(self):
+        flusher = RecordingFlusher(flush_interval=0)
+        flusher._ensure_running()
+        self.assertIsNone(flusher._thread)
+
+    def test_restarts_after_fork(self):
+        flusher = RecordingFlusher()
+        self.addCleanup(flusher.stop, flush=False)
+        flusher._ensure_running()
+        parent = flusher._thread
+        flusher._ensure_running()
+        self.assertIs(flusher._thread, parent)
+
+        child = os.getpid() + 1
+        with mock.patch.object(background.os, 'getpid', return_value=child):
+            flusher._ensure_running()
+        self.assertIsNot(flusher._thread, parent)
+        self.assertTrue(flusher._thread.is_alive())
+        self.assertEqual(flusher._pid, child)
+
+    def test_stop_flushes(self):
+        flusher = RecordingFlusher()
+        flusher._ensure_running()
+        thread = flusher._thread
+        flusher.stop()
+        self.assertFalse(thread.is_alive())
+        self.assertIsNone(flusher._thread)
+        # Only stop() flushes; the thread exits without another run
+        self.assertEqual(flusher.flushes, 1)
+
+        flusher.stop(flush=False)
+        self.assertEqual(flusher.flushes, 1)
+
+    def test_errors_are_logged_and_the_thread_keeps_running(self):
+        flusher = RecordingFlusher(flush_interval=0.01, fail=1)
+        self.addCleanup(flusher.stop, flush=False)
+        with self.assertLogs('server.background', 'ERROR') as logs:
+            flusher._ensure_running()
+            self.assertTrue(flusher.flushed.wait(5))
+        self.assertEqual(logs.output, ['ERROR:server.background:Error in recording-flusher: database down'])
+        self.assertGreaterEqual(flusher.flushes, 2)
+
+    def test_shared_instance_per_class(self):
+        class OtherFlusher(RecordingFlusher):
+            pass
+
+        with mock.patch.object(background.atexit, 'register') as register:
+            shared = RecordingFlusher.shared()
+            self.addCleanup(delattr, RecordingFlusher, '_shared')
+            self.assertIs(RecordingFlusher.shared(), shared)
+            other = OtherFlusher.shared()
+        self.assertIsInstance(other, OtherFlusher)
+        self.assertIsNot(other, shared)
+        register.assert_has_calls([mock.call(shared.stop), mock.call(other.stop)])
@@ -35,6 +35,10 @@ class User(AbstractUser):
         default='en',
         help_text=_('User interface language preference')
     )
+    token_version = models.PositiveIntegerField(
+        default=0,
+        help_text=_('Bumped to revoke cached websocket identities')
+    )
 
 class SubscriptionPlan(models.Model):
     id = models.BigAutoField(primary_key=True)
@@ -3,6 +3,7 @@ from rest_framework.response import Response
 from rest_framework.decorators import action, api_view, permission_classes, throttle_classes
 from rest_framework.permissions import AllowAny
 from django.contrib.auth import get_user_model
+from django.contrib.auth.signals import user_logged_out
 from django.contrib.auth.hashers import make_password
 from rest_framework_simplejwt.tokens import RefreshToken
 from django.db.models import Q
@@ -290,6 +291,9 @@ def login(request):
 def logout(request):
     """Log out a user by clearing their session and auth cookies"""
     try:
+        # Revokes the user's cached websocket identities (future_capabilities.signals)
+        user_logged_out.send(sender=request.user.__class__, request=request, user=request.user)
+
         # Clear Django session
         request.session.flush()
         